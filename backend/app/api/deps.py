@@ -0,0 +1,18 @@
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from app.core.container import Services
+from app.services.shards import check_tenant
+
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
+
+
+def resolve_tenant(tenant: Optional[str]) -> str:
+    """The request's tenant, or a 400 for a name that cannot be one."""
+    try:
+        return check_tenant(tenant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
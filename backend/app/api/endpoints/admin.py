@@ -0,0 +1,163 @@
+import os
+import re
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from app.api.deps import get_services
+from app.core import telemetry
+from app.core.container import Services
+from app.services.embedding import EmbeddingError
+from app.services.ingestion import misplaced_files
+
+router = APIRouter()
+
+
+class ReindexRequest(BaseModel):
+    model: Optional[str] = None  # EMBEDDING_MODEL when not given
+
+
+class ArtifactGCRequest(BaseModel):
+    grace_hours: Optional[float] = None  # ARTIFACT_GC_GRACE_HOURS when not given
+
+
+class CompressionRequest(BaseModel):
+    kind: Optional[str] = "pq"  # "int8", "pq", or "none" to drop compression
+    pca_dim: Optional[int] = None
+    pq_subvectors: Optional[int] = None
+    sample_size: Optional[int] = None
+
+
+@router.get("/status/")
+async def status(request: Request, services: Services = Depends(get_services)):
+    """
+    Healthy as soon as the app serves requests; ``ready`` turns true once
+    startup maintenance and any warm-up are done. ``startup`` has the
+    import, app creation and startup times, and what each service and
+    warm-up step took to load, in milliseconds.
+    """
+    return {
+        "status": "ok",
+        "ready": services.ready,
+        "timestamp": datetime.now().isoformat(),
+        "startup": dict(request.app.state.timings, services=services.load_ms, warmup=services.warmup_ms)
+    }
+
+
+@router.get("/cache/stats")
+async def cache_stats(services: Services = Depends(get_services)):
+    return {
+        "answers": services.answer_cache.stats(),
+        "embeddings": services.embedding_cache.stats(),
+        "rerank": services.rerank_stage.stats()
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus metrics: per-stage and HTTP latency histograms, LLM and
+    context token counts, cache hit rates and queue depths.
+    """
+    # Collectors may ask the embedding server for its queue depth
+    body = await run_in_threadpool(telemetry.REGISTRY.expose)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def profile(profile_id: str, services: Services = Depends(get_services)):
+    """Collapsed stacks sampled during a request sent with ``X-Profile``, for flamegraph.pl or speedscope."""
+    if not re.fullmatch(r"[0-9a-f]{16}", profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    path = os.path.join(services.settings.PROFILE_DIR, f"{profile_id}.folded")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    with open(path) as f:
+        return PlainTextResponse(f.read())
+
+
+@router.get("/admin/admission")
+async def admission_stats(services: Services = Depends(get_services)):
+    """Per pool: requests running and waiting, slot hold time, and requests admitted and turned away."""
+    return services.admission.stats()
+
+
+@router.get("/admin/embedding-server")
+async def embedding_server_stats(services: Services = Depends(get_services)):
+    """Queue depth, batch sizes and timings of the embedding server, when one is used."""
+    embedding_function = services.embedding_function
+    if not hasattr(embedding_function, "stats"):
+        raise HTTPException(status_code=404, detail="Embeddings are computed in-process (EMBEDDING_SERVER is not set)")
+    try:
+        return await run_in_threadpool(embedding_function.stats)
+    except EmbeddingError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@router.get("/admin/vector-index")
+async def vector_index_stats(services: Services = Depends(get_services)):
+    """The default shard's collection, and the index generation and embedding model served."""
+    stats = await run_in_threadpool(lambda: services.vector_store.get_collection_stats())
+    return dict(stats, alias=services.index_alias.to_dict())
+
+
+@router.post("/admin/vector-index/reindex", status_code=202)
+async def reindex(request: ReindexRequest, services: Services = Depends(get_services)):
+    """
+    Queue re-embedding every shard with another model into a new index
+    generation, swapped in when done; queries use the current one until then.
+    Unless EMBEDDING_MODEL names the same model, the next start re-indexes
+    back to it.
+    """
+    model = request.model or services.settings.EMBEDDING_MODEL
+    if model == services.index_alias.model:
+        raise HTTPException(status_code=400, detail=f"The index already serves {model} embeddings")
+    running = services.unfinished_job("reindex")
+    if running is not None:
+        raise HTTPException(status_code=409, detail=f"Re-index job {running['job_id']} is still running")
+    job = services.job_queue.submit("reindex", {"model": model})
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@router.get("/admin/shards")
+async def shard_stats(services: Services = Depends(get_services)):
+    """Shard placement, the open shards' stats, and files waiting to be moved by a rebalance."""
+    stats = await run_in_threadpool(services.shard_router.stats)
+    stats["misplaced_files"] = len(misplaced_files(services))
+    return stats
+
+
+@router.post("/admin/shards/rebalance", status_code=202)
+async def rebalance_shards(services: Services = Depends(get_services)):
+    """Queue moving files to the shards the current VECTOR_SHARDS placement puts them in."""
+    job = services.job_queue.submit("shard_rebalance", {})
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@router.get("/admin/artifacts")
+async def artifact_stats(services: Services = Depends(get_services)):
+    """Number and size of the stored extraction artifacts."""
+    return await run_in_threadpool(services.artifacts.stats)
+
+
+@router.post("/admin/artifacts/gc", status_code=202)
+async def collect_artifacts(request: ArtifactGCRequest, services: Services = Depends(get_services)):
+    """Queue deleting the artifacts of deleted files, superseded versions, and the least recently used beyond ARTIFACT_MAX_MB."""
+    payload = {} if request.grace_hours is None else {"grace_hours": request.grace_hours}
+    job = services.job_queue.submit("artifact_gc", payload)
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@router.post("/admin/vector-index/compression", status_code=202)
+async def train_vector_compression(request: CompressionRequest, services: Services = Depends(get_services)):
+    """Queue (re)training of the compressed vector codes; poll the returned job for the resulting layout."""
+    if services.settings.VECTOR_BACKEND != "mmap":
+        raise HTTPException(status_code=400, detail="Compression needs VECTOR_BACKEND=mmap")
+    if request.kind not in ("int8", "pq", "none", None):
+        raise HTTPException(status_code=400, detail=f"Unknown compression: {request.kind}")
+    job = services.job_queue.submit("vector_compression", request.dict())
+    return {"job_id": job["job_id"], "status": job["status"]}
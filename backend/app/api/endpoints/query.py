@@ -1,35 +1,200 @@
-from fastapi import APIRouter
+import asyncio
+import json
+import time
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.services import embedding, vector_store, llm_interface
-from fastapi.responses import JSONResponse
+
+from app.api.deps import get_services, resolve_tenant
+from app.core import telemetry
+from app.core.container import Services
+from app.services.llm_interface import LLMError
+from app.services.retrieval import QueryFilters
 
 router = APIRouter()
 
-# Request model for type safety
-class QueryRequest(BaseModel):
-    query: str
+SYSTEM_PROMPT = "You are a helpful assistant that provides detailed answers with citations."
+
+
+class Query(BaseModel):
+    question: str
+    filters: Optional[QueryFilters] = None
+    tenant: Optional[str] = None
+
+
+class QueryBatch(BaseModel):
+    queries: List[Query]
+    generate: bool = True  # False: retrieval only, no LLM answers
+
+
+def cache_answer(services: Services, question: str, retrieval: dict, answer: str) -> None:
+    services.answer_cache.put(
+        question,
+        retrieval["chunk_ids"],
+        answer,
+        retrieval["sources"],
+        retrieval["file_ids"],
+        embedding=retrieval["embedding"],
+        scope=retrieval["tenant"]
+    )
+
+
+def build_prompt(question: str, context: str) -> str:
+    return f"""
+    Answer based on this context. Cite the passages you use by their number, e.g. [1]:
+
+    {context}
+
+    Question: {question}
+    """
+
+
+def report_timings(retrieval: dict, started: float, **extra) -> dict:
+    """Per-stage timings in milliseconds, plus the reranker that ran."""
+    timings = dict(retrieval["timings"], **extra)
+    timings["total_ms"] = (time.perf_counter() - started) * 1000
+    timings = {stage: round(ms, 2) for stage, ms in timings.items()}
+    timings["reranker"] = retrieval["rerank"]["reranker"]
+    return timings
+
+
+async def answer_query(services: Services, question: str, retrieval: dict, started: float) -> dict:
+    cached = services.answer_cache.get(question, retrieval["chunk_ids"], retrieval["embedding"], scope=retrieval["tenant"])
+    if cached is not None:
+        return {
+            "answer": cached["answer"],
+            "sources": retrieval["sources"],
+            "cache": cached["tier"],
+            "timings": report_timings(retrieval, started)
+        }
+
+    try:
+        with telemetry.span("llm") as llm:
+            answer = await services.llm.generate_response(
+                build_prompt(question, retrieval["context"]),
+                system_prompt=SYSTEM_PROMPT,
+                max_tokens=services.settings.LLM_MAX_TOKENS
+            )
+        cache_answer(services, question, retrieval, answer)
+    except LLMError as e:
+        answer = f"Error: {str(e)}"
+
+    return {
+        "answer": answer,
+        "sources": retrieval["sources"],
+        "cache": None,
+        "timings": report_timings(retrieval, started, llm_ms=llm.ms)
+    }
+
 
 @router.post("/query/")
-async def query_rag(request: QueryRequest):  # Uses Pydantic model
+async def query_rag(query: Query, services: Services = Depends(get_services)):
+    tenant = resolve_tenant(query.tenant)
     try:
-        query_text = request.query  # Access via model
-        query_emb = embedding.generate_embeddings([query_text])[0]
-        results = vector_store.query_embeddings(query_emb)
-        context = "\n".join([res["text"] for res in results])
-        prompt = f"Context:\n{context}\n\nQuestion: {query_text}\nAnswer:"
-        answer = llm_interface.generate_response(prompt)
-        
-        response_data = {
-            "answer": answer,
-            "sources": results
-        }
-        print("Backend Response:", response_data)  # Debug log
-        return JSONResponse(content=response_data, status_code=200)
+        started = time.perf_counter()
+        retrieval = await run_in_threadpool(
+            services.retriever.retrieve_context, query.question, filters=query.filters, tenant=tenant
+        )
+        return await answer_query(services, query.question, retrieval, started)
     except Exception as e:
-        print("Error in /query:", str(e))  # Debug log
-        return JSONResponse(...)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/query/batch")
+async def query_rag_batch(batch: QueryBatch, services: Services = Depends(get_services)):
+    """
+    Answer many questions at once.
+
+    Retrieval for the whole batch shares one embedding call and one vector
+    query per distinct filter; LLM calls then run concurrently, bounded by
+    the LLM client. Results come back in request order.
+    """
+    if len(batch.queries) > services.settings.QUERY_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {services.settings.QUERY_BATCH_MAX} queries per batch")
+    if not batch.queries:
+        return {"results": []}
+    tenants = [resolve_tenant(query.tenant) for query in batch.queries]
+    try:
+        started = time.perf_counter()
+        questions = [query.question for query in batch.queries]
+        retrievals = await run_in_threadpool(
+            services.retriever.retrieve_contexts, questions, filters=[query.filters for query in batch.queries], tenants=tenants
+        )
+        if not batch.generate:
+            return {
+                "results": [
+                    {"sources": retrieval["sources"], "context": retrieval["context"], "timings": report_timings(retrieval, started)}
+                    for retrieval in retrievals
+                ]
+            }
+        results = await asyncio.gather(*(
+            answer_query(services, question, retrieval, started) for question, retrieval in zip(questions, retrievals)
+        ))
+        return {"results": list(results)}
     except Exception as e:
-        return JSONResponse(
-            content={"error": str(e)},
-            status_code=500
-        )
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/query/stream")
+async def query_rag_stream(query: Query, services: Services = Depends(get_services)):
+    """
+    Stream the answer as server-sent events.
+
+    A ``sources`` event is sent as soon as retrieval finishes, followed by
+    one ``token`` event per completion delta and a final ``done`` (or
+    ``error``) event carrying the per-stage timings.
+    """
+    started = time.perf_counter()
+    tenant = resolve_tenant(query.tenant)
+    try:
+        retrieval = await run_in_threadpool(
+            services.retriever.retrieve_context, query.question, filters=query.filters, tenant=tenant
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    cached = services.answer_cache.get(query.question, retrieval["chunk_ids"], retrieval["embedding"], scope=retrieval["tenant"])
+
+    async def events():
+        yield _sse("sources", retrieval["sources"])
+        if cached is not None:
+            yield _sse("token", cached["answer"])
+            yield _sse("done", {"cache": cached["tier"], "timings": report_timings(retrieval, started)})
+            return
+        tokens = []
+        first_token_ms = None
+        try:
+            with telemetry.span("llm") as llm:
+                async for token in services.llm.stream_response(
+                    build_prompt(query.question, retrieval["context"]),
+                    system_prompt=SYSTEM_PROMPT,
+                    max_tokens=services.settings.LLM_MAX_TOKENS
+                ):
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - llm.started) * 1000
+                        telemetry.record("llm_first_token", first_token_ms / 1000)
+                    tokens.append(token)
+                    yield _sse("token", token)
+        except LLMError as e:
+            yield _sse("error", str(e))
+            return
+        cache_answer(services, query.question, retrieval, "".join(tokens))
+        timings = report_timings(
+            retrieval,
+            started,
+            llm_first_token_ms=first_token_ms or 0.0,
+            llm_ms=llm.ms
+        )
+        yield _sse("done", {"cache": None, "timings": timings})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,28 +1,243 @@
-# app/api/endpoints/upload.py
+import os
+import threading
+from typing import Optional
 
-from fastapi import APIRouter
-from app.services import pdf_processor, video_processor  # Absolute import
-from fastapi import UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from app.api.deps import get_services, resolve_tenant
+from app.core.container import Services
+from app.services import dedup, uploads
+from app.services.jobs import QUEUED, UNFINISHED_STATES, new_job_id
+
 router = APIRouter()
 
-@router.post("/upload/")
-async def upload_file(file: UploadFile = File(...)):
-    try:
-        # Your processing logic
-        return JSONResponse(
-            content={"message": "File processed successfully"},
-            status_code=200
+# Held from claiming an upload's hash until its job is queued, so another
+# upload of the same bytes never finds the claim without its job
+_queue_lock = threading.Lock()
+
+# The form the upload endpoints parse themselves, for the API docs
+UPLOAD_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "tenant": {"type": "string"}
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+class ResumableUploadRequest(BaseModel):
+    filename: str
+    kind: str
+    size: int
+    tenant: Optional[str] = None
+
+
+def _queue_upload(
+    services: Services, kind: str, label: str, filename: str, tmp_path: str, file_hash: str, tenant: str
+) -> JSONResponse:
+    """
+    Store an upload under its content hash and queue it for ingestion.
+
+    Re-uploading identical bytes to the same tenant returns the existing
+    file_id (and its job) without parsing or embedding anything again,
+    unless the earlier ingestion failed. New files are placed in one of
+    the tenant's shards.
+
+    The ingest job's id is recorded in the registry along with the claim
+    (or in place of the failed job's), so of concurrent uploads of the
+    same bytes exactly one queues a job and the others report it.
+    """
+    content_hash, file_hash = file_hash, dedup.tenant_hash(file_hash, tenant)
+    with _queue_lock:
+        job_id = new_job_id()
+        record, created = services.file_registry.claim(
+            file_hash,
+            filename,
+            kind,
+            tenant=tenant,
+            shard=services.shard_router.place(tenant, dedup.file_id_for(file_hash)),
+            content_hash=content_hash,
+            job_id=job_id
         )
+        file_id = record["file_id"]
+
+        if not created:
+            previous = services.job_queue.get(record["job_id"]) if record["job_id"] else None
+            if previous is None or previous["status"] == "failed":
+                # Retry the ingestion, unless another upload of the same bytes just did
+                created = services.file_registry.replace_job(file_hash, record["job_id"], job_id)
+                if not created:
+                    record = services.file_registry.get(file_hash) or record
+                    previous = services.job_queue.get(record["job_id"]) if record["job_id"] else None
+        if not created:
+            os.unlink(tmp_path)
+            return JSONResponse(
+                content={
+                    "message": f"{label} already uploaded",
+                    "file_id": file_id,
+                    "job_id": record["job_id"],
+                    # The other upload may not have queued its job yet
+                    "status": previous["status"] if previous is not None else QUEUED,
+                    "duplicate": True
+                },
+                status_code=200
+            )
+
+        file_path = os.path.join(services.settings.UPLOAD_DIR, f"{file_id}.{uploads.EXTENSIONS[kind]}")
+        os.replace(tmp_path, file_path)
+
+        job = services.job_queue.submit(kind, {
+            "file_path": file_path,
+            "filename": filename,
+            "file_id": file_id,
+            "tenant": tenant,
+            "shard": record["shard"],
+            "content_hash": content_hash
+        }, job_id=job_id)
+    return JSONResponse(
+        content={
+            "message": f"{label} queued for processing",
+            "file_id": file_id,
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "duplicate": False
+        },
+        status_code=202
+    )
+
+
+async def _receive_upload(services: Services, request: Request, kind: str, label: str) -> JSONResponse:
+    """
+    Stream a multipart upload to disk as it arrives. A declared length
+    over the limit is rejected before the body is read; otherwise the
+    type is checked on the first bytes and the size on every chunk.
+    """
+    max_bytes = services.max_upload_bytes[kind]
+    try:
+        uploads.check_content_length(request.headers.get("content-length"), max_bytes)
+        form = uploads.MultipartFile(request.headers.get("content-type", ""), request.stream())
+        tmp_path, file_hash, _ = await uploads.stream_to_disk(form.chunks(), services.settings.UPLOAD_DIR, kind, max_bytes)
+        try:
+            tenant = resolve_tenant(form.fields.get("tenant") or None)
+        except HTTPException:
+            os.unlink(tmp_path)
+            raise
+        return _queue_upload(services, kind, label, form.filename, tmp_path, file_hash, tenant)
+
+    except HTTPException:
+        raise
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
-        return JSONResponse(
-            content={"error": str(e)},
-            status_code=500
-        )
-async def upload_file(file: UploadFile = File(...)):
-    if file.filename.endswith(".pdf"):
-        return await pdf_processor.process_pdf(file)
-    elif file.filename.endswith(".mp4"):
-        return await video_processor.process_video(file)
-    else:
-        return {"error": "Unsupported file type."}
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/upload/pdf/", openapi_extra=UPLOAD_FORM)
+async def upload_pdf(request: Request, services: Services = Depends(get_services)):
+    return await _receive_upload(services, request, "pdf", "PDF")
+
+
+@router.post("/upload/video/", openapi_extra=UPLOAD_FORM)
+async def upload_video(request: Request, services: Services = Depends(get_services)):
+    return await _receive_upload(services, request, "video", "Video")
+
+
+@router.post("/uploads/")
+async def create_upload(request: ResumableUploadRequest, services: Services = Depends(get_services)):
+    """Start a resumable upload; send chunks with PUT /uploads/{upload_id}?offset=N."""
+    tenant = resolve_tenant(request.tenant)
+    try:
+        return services.resumable_uploads.create(request.filename, request.kind, request.size, tenant=tenant)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, services: Services = Depends(get_services)):
+    try:
+        session = services.resumable_uploads.get(upload_id)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+
+@router.put("/uploads/{upload_id}")
+async def append_upload(upload_id: str, offset: int, request: Request, services: Services = Depends(get_services)):
+    try:
+        return await services.resumable_uploads.append(upload_id, offset, request.stream())
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, services: Services = Depends(get_services)):
+    """Abandon a resumable upload and delete the bytes received so far."""
+    try:
+        discarded = services.resumable_uploads.discard(upload_id)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if not discarded:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"upload_id": upload_id, "status": "aborted"}
+
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, services: Services = Depends(get_services)):
+    try:
+        session, part_path = services.resumable_uploads.complete(upload_id)
+        file_hash = await run_in_threadpool(dedup.hash_file, part_path)
+        label = "PDF" if session["kind"] == "pdf" else "Video"
+        tenant = session.get("tenant") or dedup.DEFAULT_TENANT
+        return _queue_upload(services, session["kind"], label, session["filename"], part_path, file_hash, tenant)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, services: Services = Depends(get_services)):
+    job = services.job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("payload", None)
+    return job
+
+
+@router.delete("/files/{file_id}")
+async def delete_file(file_id: str, tenant: Optional[str] = None, services: Services = Depends(get_services)):
+    """
+    Remove one of the tenant's files, its chunks (shared chunks only lose
+    this source) and cached answers built on it. Another tenant's file is
+    not found.
+    """
+    tenant = resolve_tenant(tenant)
+    record = services.file_registry.get_by_file_id(file_id)
+    if record is None or record["tenant"] != tenant:
+        raise HTTPException(status_code=404, detail="File not found")
+    job = services.job_queue.get(record["job_id"]) if record["job_id"] else None
+    if job is not None and job["status"] in UNFINISHED_STATES:
+        raise HTTPException(status_code=409, detail="File is still being ingested")
+
+    result = await run_in_threadpool(services.shard_router.store(record["shard"]).delete_file, file_id)
+    services.file_registry.remove(record["file_hash"])
+    file_path = os.path.join(services.settings.UPLOAD_DIR, f"{file_id}.{uploads.EXTENSIONS[record['kind']]}")
+    if os.path.exists(file_path):
+        os.unlink(file_path)
+    services.answer_cache.invalidate_file(file_id)
+    # Its extraction artifacts go once no other file has the same content
+    services.job_queue.submit("artifact_gc", {})
+    return dict(result, file_id=file_id)
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import telemetry
+from app.core.config import Settings
+from app.services.admission import AdmissionController, Rejected
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+TIMEOUT_HEADER = b"x-request-timeout-ms"
+
+
+def pipeline_of(path: str) -> str:
+    if path.startswith("/query"):
+        return "query"
+    if path.startswith("/upload"):
+        return "upload"
+    return "http"
+
+
+def admission_class(method: str, path: str) -> Optional[Tuple[str, int]]:
+    """The admission pool and priority of a request, or None for requests admitted as they come."""
+    if method != "POST" and not (method == "PUT" and path.startswith("/uploads/")):
+        return None
+    if path.startswith("/query/batch"):
+        return "query", 1
+    if path.startswith("/query"):
+        return "query", 0
+    if path.startswith("/upload"):
+        return "ingest", 0
+    return None
+
+
+def client_key(scope: Scope) -> str:
+    """Who a request counts against: its API key or bearer token (hashed), else its address."""
+    headers = dict(scope["headers"])
+    credential = headers.get(b"x-api-key")
+    if credential is None and headers.get(b"authorization", b"").lower().startswith(b"bearer "):
+        credential = headers[b"authorization"][7:]
+    if credential:
+        return "key:" + hashlib.sha1(credential).hexdigest()
+    client = scope.get("client")
+    return f"addr:{client[0]}" if client else "addr:unknown"
+
+
+class AdmissionMiddleware:
+    """
+    Applies the rate limits and concurrency slots of ``controller`` to
+    queries and uploads before their bodies are read, so requests waiting
+    for a slot hold no upload or context in memory. The slot is held until
+    the response (streamed ones included) has been sent. Clients can wait
+    less than the pool's timeout with an ``X-Request-Timeout-Ms`` header.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        admission = admission_class(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if admission is None:
+            await self.app(scope, receive, send)
+            return
+
+        pool, priority = admission
+        try:
+            self.controller.check_rate(pool, client_key(scope))
+            started = await self.controller.acquire(pool, priority, timeout=self._timeout(scope))
+        except Rejected as e:
+            response = JSONResponse(
+                {"detail": str(e), "reason": e.reason},
+                status_code=e.status_code,
+                headers={"Retry-After": e.retry_after_header}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(pool, started)
+
+    @staticmethod
+    def _timeout(scope: Scope) -> Optional[float]:
+        for name, value in scope["headers"]:
+            if name == TIMEOUT_HEADER:
+                try:
+                    return max(float(value), 0.0) / 1000
+                except ValueError:
+                    return None
+        return None
+
+
+class TelemetryMiddleware:
+    """
+    Runs every HTTP request inside a trace and records its latency.
+
+    Spans recorded while the request is handled (including in the
+    threadpool and while a streamed response is sent) land in the trace,
+    which is logged when the request takes longer than ``TRACE_SLOW_MS``.
+    Responses carry the trace id in ``X-Trace-Id``.
+
+    With ``PROFILE_INTERVAL_MS`` set, a request sent with an ``X-Profile``
+    header is sampled for its whole duration; the collapsed stacks are
+    written to ``PROFILE_DIR/<trace id>.folded`` and served by
+    ``/admin/profiles/<trace id>``.
+    """
+
+    def __init__(self, app: ASGIApp, settings: Settings):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.settings.PROFILE_INTERVAL_MS > 0 and any(
+            name == PROFILE_HEADER for name, _ in scope["headers"]
+        )
+        status = {"code": 500}
+        started = time.perf_counter()
+        with telemetry.trace(
+            pipeline_of(scope["path"]), slow_ms=self.settings.TRACE_SLOW_MS, method=scope["method"], path=scope["path"]
+        ) as current:
+            profiler = telemetry.SamplingProfiler(self.settings.PROFILE_INTERVAL_MS / 1000).start() if profile else None
+
+            async def send_with_headers(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    status["code"] = message["status"]
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-trace-id", current.trace_id.encode()))
+                    if profiler is not None:
+                        headers.append((b"x-profile-id", current.trace_id.encode()))
+                    message = dict(message, headers=headers)
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_headers)
+            finally:
+                current.attrs["status"] = status["code"]
+                # The matched route template keeps the label set bounded
+                route = scope.get("route")
+                telemetry.HTTP_SECONDS.labels(
+                    scope["method"], getattr(route, "path", "unmatched"), str(status["code"])
+                ).observe(time.perf_counter() - started)
+                if profiler is not None:
+                    self._save_profile(current.trace_id, profiler.stop())
+
+    def _save_profile(self, profile_id: str, folded: str) -> None:
+        try:
+            os.makedirs(self.settings.PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(self.settings.PROFILE_DIR, f"{profile_id}.folded"), "w") as f:
+                f.write(folded)
+        except OSError as e:
+            logger.warning(f"Could not save profile {profile_id}: {e}")
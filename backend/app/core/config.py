@@ -1,13 +1,160 @@
 # backend/app/core/config.py
 
+import json
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class Settings:
-    VECTOR_DB_DIR = os.getenv("VECTOR_DB_DIR", "data/vector_db")
+    # Model loading at startup: "background" (serve at once, load in a
+    # thread), "blocking" (load before serving) or "off" (first request)
+    WARMUP = os.getenv("WARMUP", "background")
+
+    # The app has always stored its collection in ./chroma_db
+    VECTOR_DB_DIR = os.getenv("VECTOR_DB_DIR", "chroma_db")
     WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
     EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
 
+    # Embedding service
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+    EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+    EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3")
+    EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "500000"))
+    # Embedding server: "" embeds in each API process; "spawn" starts (or
+    # reuses) one server process shared by all workers; "connect" uses one
+    # started with python -m app.services.embedding_server
+    EMBEDDING_SERVER = os.getenv("EMBEDDING_SERVER", "")
+    EMBEDDING_SOCKET = os.getenv("EMBEDDING_SOCKET", "data/embedding.sock")
+    EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+
+    # Ingestion
+    UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+    JOBS_DIR = os.getenv("JOBS_DIR", "data/jobs")
+    # Finished jobs are forgotten (and their files deleted) after this
+    # long, oldest first beyond JOB_RETENTION_COUNT; 0 keeps them
+    JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "168"))
+    JOB_RETENTION_COUNT = int(os.getenv("JOB_RETENTION_COUNT", "1000"))
+    FILE_REGISTRY_PATH = os.getenv("FILE_REGISTRY_PATH", "data/files.sqlite3")
+    # Resumable uploads left unfinished this long are deleted; 0 keeps them
+    UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+    MAX_PDF_MB = int(os.getenv("MAX_PDF_MB", "200"))
+    MAX_VIDEO_MB = int(os.getenv("MAX_VIDEO_MB", "4096"))
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+    INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(os.cpu_count() or 2)))
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+    PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+    TRANSCRIBE_BACKEND = os.getenv("TRANSCRIBE_BACKEND", "whisper")
+    TRANSCRIBE_WINDOW_SECONDS = float(os.getenv("TRANSCRIBE_WINDOW_SECONDS", "30"))
+    # Visual indexing of videos: frames are sampled at this budget, frames
+    # within VIDEO_FRAME_HASH_DISTANCE bits of the last keyframe's perceptual
+    # hash are skipped and the rest read by the OCR backend ("tesseract" or
+    # "stub"); 0 frames per minute indexes the audio only
+    VIDEO_FRAMES_PER_MINUTE = float(os.getenv("VIDEO_FRAMES_PER_MINUTE", "12"))
+    VIDEO_FRAME_HASH_DISTANCE = int(os.getenv("VIDEO_FRAME_HASH_DISTANCE", "10"))
+    OCR_BACKEND = os.getenv("OCR_BACKEND", "tesseract")
+    OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "eng")
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+
+    # Vector store
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # chroma | mmap
+    VECTOR_COLLECTION = os.getenv("VECTOR_COLLECTION", "multimodal_rag")
+    VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")  # mmap only: float32 | float16 | int8
+    VECTOR_IVF_THRESHOLD = int(os.getenv("VECTOR_IVF_THRESHOLD", "50000"))
+    VECTOR_IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+    # Compressed scans (mmap only), trained from POST /admin/vector-index/compression
+    VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "10"))
+    VECTOR_PQ_SUBVECTORS = int(os.getenv("VECTOR_PQ_SUBVECTORS", "48"))
+    VECTOR_COMPRESSION_SAMPLE = int(os.getenv("VECTOR_COMPRESSION_SAMPLE", "65536"))
+    # Tenant sharding: every tenant gets its own shard; tenants listed here are
+    # split over that many, e.g. {"acme": 4}. Changing a count queues a rebalance
+    VECTOR_SHARDS = json.loads(os.getenv("VECTOR_SHARDS", "{}"))
+    VECTOR_SHARD_WORKERS = int(os.getenv("VECTOR_SHARD_WORKERS", "8"))
+
+    # Vector store writes
+    VECTOR_BATCH_SIZE = int(os.getenv("VECTOR_BATCH_SIZE", "0"))  # 0: the client's max batch size
+    VECTOR_WRITE_JOURNAL = os.getenv("VECTOR_WRITE_JOURNAL", "data/vector_writes.jsonl")
+    VECTOR_WRITE_BUFFER_SIZE = int(os.getenv("VECTOR_WRITE_BUFFER_SIZE", "1024"))
+    VECTOR_WRITE_BUFFER_SECONDS = float(os.getenv("VECTOR_WRITE_BUFFER_SECONDS", "2"))
+
+    # Re-indexing: when EMBEDDING_MODEL differs from the model the index alias
+    # serves, startup queues re-embedding the stored chunks into a new index
+    # generation; queries use the current one until it is swapped in. With an
+    # embedding server, another model's is at EMBEDDING_SOCKET plus a suffix
+    VECTOR_INDEX_ALIAS = os.getenv("VECTOR_INDEX_ALIAS", "data/vector_index.json")
+    REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", "256"))
+    REINDEX_MAX_CHUNKS_PER_S = float(os.getenv("REINDEX_MAX_CHUNKS_PER_S", "500"))  # 0: unthrottled
+    REINDEX_MAX_PAUSE_MS = float(os.getenv("REINDEX_MAX_PAUSE_MS", "1000"))  # per batch, while queries run
+    REINDEX_RETIRE_SECONDS = float(os.getenv("REINDEX_RETIRE_SECONDS", "60"))
+
+    # Extraction artifacts: page text and tables and transcripts, keyed by
+    # the file's content hash and the extractor version, so ingesting the
+    # same content again skips parsing and transcription
+    ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "data/artifacts")
+    ARTIFACT_BLOCK_RECORDS = int(os.getenv("ARTIFACT_BLOCK_RECORDS", "64"))
+    ARTIFACT_MAX_MB = float(os.getenv("ARTIFACT_MAX_MB", "0"))  # 0: no cap
+    ARTIFACT_GC_GRACE_HOURS = float(os.getenv("ARTIFACT_GC_GRACE_HOURS", "24"))
+
+    # Admission control: queries (interactive before /query/batch) and
+    # uploads each get their own concurrency slots and a bounded wait queue;
+    # requests that cannot get a slot in time are turned away with 503 and
+    # clients (by X-API-Key, bearer token or address) over their rate with
+    # 429, both with Retry-After. Rates are per second; 0 turns a limit off
+    ADMISSION_QUERY_CONCURRENCY = int(os.getenv("ADMISSION_QUERY_CONCURRENCY", "16"))
+    ADMISSION_QUERY_QUEUE = int(os.getenv("ADMISSION_QUERY_QUEUE", "64"))
+    ADMISSION_QUERY_TIMEOUT_MS = float(os.getenv("ADMISSION_QUERY_TIMEOUT_MS", "10000"))
+    ADMISSION_INGEST_CONCURRENCY = int(os.getenv("ADMISSION_INGEST_CONCURRENCY", "4"))
+    ADMISSION_INGEST_QUEUE = int(os.getenv("ADMISSION_INGEST_QUEUE", "16"))
+    ADMISSION_INGEST_TIMEOUT_MS = float(os.getenv("ADMISSION_INGEST_TIMEOUT_MS", "30000"))
+    RATE_LIMIT_QUERY_PER_S = float(os.getenv("RATE_LIMIT_QUERY_PER_S", "0"))
+    RATE_LIMIT_QUERY_BURST = float(os.getenv("RATE_LIMIT_QUERY_BURST", "20"))
+    RATE_LIMIT_INGEST_PER_S = float(os.getenv("RATE_LIMIT_INGEST_PER_S", "0"))
+    RATE_LIMIT_INGEST_BURST = float(os.getenv("RATE_LIMIT_INGEST_BURST", "10"))
+    RATE_LIMIT_CLIENTS = int(os.getenv("RATE_LIMIT_CLIENTS", "10000"))
+    # Ingest jobs pause up to this long before each batch while queries run
+    INGEST_YIELD_MS = float(os.getenv("INGEST_YIELD_MS", "200"))
+
+    # LLM
+    DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+    LLM_API_URL = os.getenv("LLM_API_URL", "https://api.deepseek.com/v1/chat/completions")
+    LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-chat")
+    LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "2000"))
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    # Longest wait before a retry, whatever Retry-After asks for
+    LLM_MAX_BACKOFF = float(os.getenv("LLM_MAX_BACKOFF", "10"))
+
+    # Answer cache
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+    ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+    ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+    # Hybrid retrieval
+    LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "data/lexical_index")
+    LEXICAL_COMPACT_EVERY = int(os.getenv("LEXICAL_COMPACT_EVERY", "50000"))
+    HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "64"))
+
+    # Reranking
+    RERANKER = os.getenv("RERANKER", "cross-encoder")
+    RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+    RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+    RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "100000"))
+    RERANK_LATENCY_BUDGET_MS = float(os.getenv("RERANK_LATENCY_BUDGET_MS", "300"))
+
+    # Context packing
+    CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+    CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+    # Telemetry
+    TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))  # Log the spans of slower requests and jobs
+    # Sampling interval for requests sent with an X-Profile header; 0: profiling off
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "0"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+
 settings = Settings()
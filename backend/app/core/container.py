@@ -0,0 +1,521 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from app.core import telemetry
+from app.core.config import Settings
+from app.services import chunking, dedup, ingestion, uploads
+from app.services.admission import AdmissionController, PoolLimits, RateLimiter
+from app.services.answer_cache import AnswerCache
+from app.services.artifacts import ArtifactStore
+from app.services.context_builder import ContextBuilder
+from app.services.embedding import CachedBatchingEmbeddingFunction, EmbeddingCache, EmbeddingError, LocalEmbeddingFunction
+from app.services.embedding_server import RemoteEmbeddingFunction, ensure_server
+from app.services.jobs import UNFINISHED_STATES, JobQueue, JobStore
+from app.services.lexical_index import BM25Index
+from app.services.llm_interface import LLMInterface
+from app.services.reindex import LEGACY_EMBEDDING_MODEL, IndexAlias
+from app.services.reranker import RerankStage, get_reranker
+from app.services.retrieval import Retriever
+from app.services.shards import IndexVersion, ShardRouter
+from app.services.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+
+class _lazy:
+    """
+    A service built on first access, once, and cached on the instance.
+
+    The build time is recorded in ``Services.load_ms``. Once built the
+    value sits in the instance ``__dict__``, which shadows this
+    (non-data) descriptor, so later lookups are plain attribute reads.
+    """
+
+    def __init__(self, build: Callable[["Services"], Any]):
+        self.build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+
+    def __get__(self, services: "Services", owner=None) -> Any:
+        if services is None:
+            return self
+        # Re-entrant: building one service may build the ones it needs
+        with services._lock:
+            if self.name not in services.__dict__:
+                started = time.perf_counter()
+                services.__dict__[self.name] = self.build(services)
+                services.load_ms[self.name] = round((time.perf_counter() - started) * 1000, 2)
+        return services.__dict__[self.name]
+
+
+class Services:
+    """
+    Every service the API uses, wired from one ``Settings``.
+
+    Nothing is opened or loaded when this is created: each service is
+    built the first time something asks for it, and models load on their
+    first call, so a process that only answers ``/status/`` never imports
+    chromadb or sentence-transformers. ``start`` queues the maintenance
+    jobs the stored data needs and ``warm_up`` loads the models ahead of
+    the first request.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.load_ms: Dict[str, float] = {}
+        self.warmup_ms: Dict[str, float] = {}
+        self.ready = False
+        self._lock = threading.RLock()
+        # Embedding functions of models other than the served one, by model
+        self._embedding_functions: Dict[str, CachedBatchingEmbeddingFunction] = {}
+        # Work put off by ``later`` and not yet run, by timer
+        self._deferred: Dict[threading.Timer, Callable[[], Any]] = {}
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+
+    def built(self, name: str) -> bool:
+        return name in self.__dict__
+
+    def later(self, seconds: float, fn: Callable[[], Any]) -> None:
+        """Run ``fn`` on a timer thread after ``seconds``; ``close`` runs it at once if it is still waiting."""
+        def run() -> None:
+            with self._lock:
+                if self._deferred.pop(timer, None) is None:
+                    return
+            try:
+                fn()
+            except Exception:
+                logger.exception(f"Deferred {getattr(fn, '__name__', fn)} failed")
+
+        timer = threading.Timer(seconds, run)
+        timer.daemon = True
+        with self._lock:
+            self._deferred[timer] = fn
+        timer.start()
+
+    @property
+    def max_upload_bytes(self) -> Dict[str, int]:
+        return {
+            "pdf": self.settings.MAX_PDF_MB * 1024 * 1024,
+            "video": self.settings.MAX_VIDEO_MB * 1024 * 1024
+        }
+
+    # Storage and search
+
+    @_lazy
+    def embedding_cache(self) -> EmbeddingCache:
+        return EmbeddingCache(self.settings.EMBEDDING_CACHE_PATH, max_entries=self.settings.EMBEDDING_CACHE_SIZE)
+
+    @_lazy
+    def index_alias(self) -> IndexAlias:
+        """The index generation served and its embedding model (see ``reindex``)."""
+        settings = self.settings
+        # Vectors stored before the alias existed came from the model the app hard-coded then
+        stored = os.path.isdir(settings.VECTOR_DB_DIR) and bool(os.listdir(settings.VECTOR_DB_DIR))
+        return IndexAlias(settings.VECTOR_INDEX_ALIAS, LEGACY_EMBEDDING_MODEL if stored else settings.EMBEDDING_MODEL)
+
+    @_lazy
+    def embedding_function(self) -> CachedBatchingEmbeddingFunction:
+        """The model of the index generation served, in this process or behind the shared embedding server."""
+        return self._embedding_function(self.index_alias.model)
+
+    def embedding_function_for(self, model_name: str) -> CachedBatchingEmbeddingFunction:
+        """The served embedding function, or one for another model, e.g. the one being re-indexed to."""
+        with self._lock:
+            if model_name == self.embedding_function.model_name:
+                return self.embedding_function
+            if model_name not in self._embedding_functions:
+                self._embedding_functions[model_name] = self._embedding_function(model_name)
+            return self._embedding_functions[model_name]
+
+    def use_embedding_function(self, embedding_function: CachedBatchingEmbeddingFunction) -> Optional[CachedBatchingEmbeddingFunction]:
+        """Make ``embedding_function`` the served one, after a re-index; returns the one it replaces."""
+        with self._lock:
+            previous = self.__dict__.get("embedding_function")
+            self._embedding_functions.pop(embedding_function.model_name, None)
+            self.__dict__["embedding_function"] = embedding_function
+            return previous
+
+    def _embedding_function(self, model_name: str) -> CachedBatchingEmbeddingFunction:
+        settings = self.settings
+        if settings.EMBEDDING_SERVER not in ("", "spawn", "connect"):
+            raise ValueError(f"Unknown EMBEDDING_SERVER: {settings.EMBEDDING_SERVER}. Available: spawn, connect")
+        if not settings.EMBEDDING_SERVER:
+            return LocalEmbeddingFunction(
+                model_name=model_name,
+                cache=self.embedding_cache,
+                batch_size=settings.EMBEDDING_BATCH_SIZE
+            )
+        socket_path = os.path.abspath(settings.EMBEDDING_SOCKET)
+        if model_name != settings.EMBEDDING_MODEL:
+            # One server per model; the configured model's keeps the configured path
+            socket_path += "." + hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:8]
+        return RemoteEmbeddingFunction(
+            socket_path,
+            model_name,
+            cache=self.embedding_cache,
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            spawn=partial(
+                ensure_server,
+                socket_path,
+                model_name,
+                max_batch=settings.EMBEDDING_BATCH_SIZE,
+                max_wait_ms=settings.EMBEDDING_MAX_WAIT_MS
+            ) if settings.EMBEDDING_SERVER == "spawn" else None
+        )
+
+    @_lazy
+    def lexical_index(self) -> BM25Index:
+        return BM25Index(self.settings.LEXICAL_INDEX_DIR, compact_every=self.settings.LEXICAL_COMPACT_EVERY)
+
+    @_lazy
+    def file_registry(self) -> dedup.FileRegistry:
+        return dedup.FileRegistry(self.settings.FILE_REGISTRY_PATH)
+
+    def collection_name(self, shard: str, generation: int) -> str:
+        """
+        A shard's collection in an index generation. The default tenant's
+        single shard in generation 0 is the collection the app used before
+        sharding and re-indexing.
+        """
+        name = self.settings.VECTOR_COLLECTION
+        if shard != dedup.DEFAULT_TENANT:
+            name = f"{name}.{shard}"
+        return f"{name}.v{generation}" if generation else name
+
+    def _open_store(self, shard: str, index: IndexVersion, **options) -> VectorStore:
+        settings = self.settings
+        return VectorStore(
+            settings.VECTOR_DB_DIR,
+            collection_name=self.collection_name(shard, index.generation),
+            embedding_function=index.embedding_function,
+            batch_size=settings.VECTOR_BATCH_SIZE or None,
+            backend=settings.VECTOR_BACKEND,
+            backend_options={
+                "dtype": settings.VECTOR_DTYPE,
+                "ivf_threshold": settings.VECTOR_IVF_THRESHOLD,
+                "nprobe": settings.VECTOR_IVF_NPROBE,
+                "rescore_factor": settings.VECTOR_RESCORE_FACTOR
+            } if settings.VECTOR_BACKEND == "mmap" else None,
+            generation=index.generation,
+            dimension=index.dimension,
+            **options
+        )
+
+    def open_shard(self, shard: str) -> VectorStore:
+        """
+        Open one vector store shard, in the index generation served, with
+        its own lexical index and write buffer.
+
+        The default tenant's single shard has the lexical index and journal
+        the app used before sharding.
+        """
+        settings = self.settings
+        legacy = shard == dedup.DEFAULT_TENANT
+        journal = settings.VECTOR_WRITE_JOURNAL
+        if not legacy:
+            base, extension = os.path.splitext(journal)
+            journal = f"{base}.{shard}{extension}"
+        store = self._open_store(
+            shard,
+            self.shard_router.index,
+            lexical_index=self.lexical_index if legacy else BM25Index(
+                f"{settings.LEXICAL_INDEX_DIR}.{shard}", compact_every=settings.LEXICAL_COMPACT_EVERY
+            )
+        )
+        store.enable_buffer(
+            journal,
+            max_items=settings.VECTOR_WRITE_BUFFER_SIZE,
+            max_delay=settings.VECTOR_WRITE_BUFFER_SECONDS
+        )
+        return store
+
+    def open_shadow(self, shard: str, index: IndexVersion) -> VectorStore:
+        """
+        A shard's collection in a generation being built, written to
+        directly; promotion moves the collection into the shard's live
+        store. A leftover collection of an abandoned re-index to another
+        model is replaced.
+        """
+        return self._open_store(shard, index, replace_mismatched=True)
+
+    @_lazy
+    def shard_router(self) -> ShardRouter:
+        return ShardRouter(
+            self.open_shard,
+            placement=self.settings.VECTOR_SHARDS,
+            known_shards=self.file_registry.shards,
+            max_workers=self.settings.VECTOR_SHARD_WORKERS,
+            index=self.index_alias.index(self.embedding_function)
+        )
+
+    @_lazy
+    def vector_store(self) -> VectorStore:
+        """The default tenant's original shard, which holds everything stored before sharding."""
+        return self.shard_router.store(dedup.DEFAULT_TENANT)
+
+    @_lazy
+    def lexical_executor(self) -> ThreadPoolExecutor:
+        """Lexical searches run here while the request thread embeds and queries the vector store."""
+        return ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical")
+
+    @_lazy
+    def rerank_stage(self) -> RerankStage:
+        settings = self.settings
+        return RerankStage(
+            get_reranker(settings.RERANKER, settings.RERANK_MODEL, settings.RERANK_BATCH_SIZE),
+            batch_size=settings.RERANK_BATCH_SIZE,
+            cache_size=settings.RERANK_CACHE_SIZE,
+            latency_budget_ms=settings.RERANK_LATENCY_BUDGET_MS
+        )
+
+    @_lazy
+    def context_builder(self) -> ContextBuilder:
+        return ContextBuilder(
+            max_tokens=self.settings.CONTEXT_MAX_TOKENS,
+            duplicate_threshold=self.settings.CONTEXT_DUPLICATE_THRESHOLD
+        )
+
+    @_lazy
+    def retriever(self) -> Retriever:
+        settings = self.settings
+        return Retriever(
+            self.shard_router,
+            self.file_registry,
+            self.rerank_stage,
+            self.context_builder,
+            self.lexical_executor,
+            n_candidates=settings.HYBRID_CANDIDATES,
+            rrf_k=settings.RRF_K,
+            rerank_candidates=settings.RERANK_CANDIDATES
+        )
+
+    # Answers
+
+    @_lazy
+    def answer_cache(self) -> AnswerCache:
+        return AnswerCache(
+            max_entries=self.settings.ANSWER_CACHE_SIZE,
+            ttl=self.settings.ANSWER_CACHE_TTL,
+            similarity=self.settings.ANSWER_CACHE_SIMILARITY
+        )
+
+    @_lazy
+    def llm(self) -> LLMInterface:
+        settings = self.settings
+        return LLMInterface(
+            api_key=settings.DEEPSEEK_API_KEY,
+            base_url=settings.LLM_API_URL,
+            model=settings.LLM_MODEL,
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            max_retries=settings.LLM_MAX_RETRIES,
+            timeout=settings.LLM_TIMEOUT
+        )
+
+    # Ingestion
+
+    @_lazy
+    def chunker(self) -> chunking.Chunker:
+        return chunking.Chunker(
+            max_tokens=self.settings.CHUNK_MAX_TOKENS,
+            overlap_tokens=self.settings.CHUNK_OVERLAP_TOKENS
+        )
+
+    @_lazy
+    def admission(self) -> AdmissionController:
+        settings = self.settings
+        return AdmissionController(
+            {
+                "query": PoolLimits(
+                    settings.ADMISSION_QUERY_CONCURRENCY, settings.ADMISSION_QUERY_QUEUE, settings.ADMISSION_QUERY_TIMEOUT_MS / 1000
+                ),
+                "ingest": PoolLimits(
+                    settings.ADMISSION_INGEST_CONCURRENCY, settings.ADMISSION_INGEST_QUEUE, settings.ADMISSION_INGEST_TIMEOUT_MS / 1000
+                )
+            },
+            rate_limits={
+                "query": RateLimiter(settings.RATE_LIMIT_QUERY_PER_S, settings.RATE_LIMIT_QUERY_BURST, settings.RATE_LIMIT_CLIENTS),
+                "ingest": RateLimiter(settings.RATE_LIMIT_INGEST_PER_S, settings.RATE_LIMIT_INGEST_BURST, settings.RATE_LIMIT_CLIENTS)
+            }
+        )
+
+    @_lazy
+    def artifacts(self) -> ArtifactStore:
+        return ArtifactStore(self.settings.ARTIFACT_DIR, block_records=self.settings.ARTIFACT_BLOCK_RECORDS)
+
+    @_lazy
+    def job_queue(self) -> JobQueue:
+        queue = JobQueue(
+            JobStore(self.settings.JOBS_DIR),
+            max_workers=self.settings.INGEST_WORKERS,
+            max_processes=self.settings.INGEST_PROCESSES,
+            retention_seconds=self.settings.JOB_RETENTION_HOURS * 3600,
+            max_finished=self.settings.JOB_RETENTION_COUNT
+        )
+        ingestion.register_jobs(queue, self)
+        return queue
+
+    @_lazy
+    def resumable_uploads(self) -> uploads.ResumableUploads:
+        return uploads.ResumableUploads(
+            os.path.join(self.settings.UPLOAD_DIR, "partial"),
+            self.max_upload_bytes,
+            ttl_seconds=self.settings.UPLOAD_SESSION_TTL_HOURS * 3600
+        )
+
+    # Lifecycle
+
+    def start(self, warm_up: bool = True) -> None:
+        """
+        Resume interrupted jobs and queue the maintenance the stored data
+        needs, then (with ``warm_up``) load the models. Opens the default
+        shard, so the app runs this off the event loop.
+        """
+        started = time.perf_counter()
+        job_queue = self.job_queue
+        job_queue.resume()
+        # An interrupted backfill has already indexed something and is resumed above
+        if len(self.lexical_index) == 0 and self.vector_store.count() > 0:
+            job_queue.submit("lexical_backfill", {})
+        # VECTOR_SHARDS changed since files were placed
+        if ingestion.misplaced_files(self) and self.unfinished_job("shard_rebalance") is None:
+            job_queue.submit("shard_rebalance", {})
+        # EMBEDDING_MODEL changed, or replaced collections were left behind
+        alias = self.index_alias
+        if (alias.model != self.settings.EMBEDDING_MODEL or alias.retired) and self.unfinished_job("reindex") is None:
+            if alias.model != self.settings.EMBEDDING_MODEL:
+                logger.warning(f"Serving {alias.model} embeddings until they are re-indexed with {self.settings.EMBEDDING_MODEL}")
+            job_queue.submit("reindex", {"model": self.settings.EMBEDDING_MODEL})
+        # Artifacts of files deleted while the app was down, and writes a crash left unfinished
+        if self.unfinished_job("artifact_gc") is None:
+            job_queue.submit("artifact_gc", {})
+        # Resumable uploads abandoned while the app was down; ``create`` sweeps again as it runs
+        self.resumable_uploads.sweep()
+        self.warmup_ms["start"] = round((time.perf_counter() - started) * 1000, 2)
+        if warm_up:
+            self.warm_up()
+        self.ready = True
+
+    def unfinished_job(self, kind: str) -> Optional[Dict[str, Any]]:
+        """A job of ``kind`` that is queued or running, if any."""
+        for job in self.job_queue.store.load_all():
+            if job.get("kind") == kind and job.get("status") in UNFINISHED_STATES:
+                return job
+        return None
+
+    def warm_up(self) -> None:
+        """Load the embedding and rerank models now rather than on the first request."""
+        steps = (
+            ("embedding_model", getattr(self.embedding_function, "load", None)),
+            ("index_dimension", self._record_dimension),
+            ("reranker", self.rerank_stage.warm_up)
+        )
+        for name, step in steps:
+            if step is None:
+                continue
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                # The first request retries, and reports the error if it still fails
+                logger.warning(f"Warm-up of {name} failed: {e}")
+            self.warmup_ms[name] = round((time.perf_counter() - started) * 1000, 2)
+
+    def _record_dimension(self) -> None:
+        """Note the served model's embedding dimension in the index alias, if it is not there yet."""
+        if self.index_alias.dimension is None:
+            dimension = len(self.embedding_function(["dimension probe"])[0])
+            self.index_alias.set_dimension(dimension)
+            self.shard_router.index.dimension = dimension
+
+    def metrics(self) -> Iterator[Tuple[str, str, str, telemetry.Samples]]:
+        """
+        Metric families read from the services at scrape time, for
+        ``telemetry.REGISTRY``. Services never built are left out rather
+        than built for a scrape.
+        """
+        hits: telemetry.Samples = []
+        misses: telemetry.Samples = []
+        for cache, service in (("answer", "answer_cache"), ("embedding", "embedding_cache"), ("rerank", "rerank_stage")):
+            if not self.built(service):
+                continue
+            stats = getattr(self, service).stats()
+            if cache == "answer":
+                hit_count = stats["hits_exact"] + stats["hits_semantic"]
+            else:
+                hit_count = stats["hits"]
+            hits.append(({"cache": cache}, hit_count))
+            misses.append(({"cache": cache}, stats["misses"]))
+        yield "rag_cache_hits_total", "counter", "Cache lookups answered from the cache", hits
+        yield "rag_cache_misses_total", "counter", "Cache lookups that missed", misses
+        yield "rag_cache_hit_ratio", "gauge", "Hits over lookups since start", [
+            (labels, hit / (hit + miss) if hit + miss else 0.0)
+            for (labels, hit), (_, miss) in zip(hits, misses)
+        ]
+
+        if self.built("job_queue"):
+            yield "rag_jobs", "gauge", "Jobs submitted or resumed since start, by kind and status", [
+                ({"kind": kind, "status": status}, count)
+                for (kind, status), count in sorted(self.job_queue.counts().items())
+            ]
+        if self.built("shard_router"):
+            yield "rag_write_buffer_rows", "gauge", "Chunks waiting in a shard's write buffer", [
+                ({"shard": shard}, len(store.buffer))
+                for shard, store in sorted(self.shard_router.open_stores().items()) if store.buffer is not None
+            ]
+        if self.built("admission"):
+            admission = self.admission
+            yield "rag_admission_active", "gauge", "Requests holding an admission slot", [
+                ({"pool": name}, pool.active) for name, pool in admission.pools.items()
+            ]
+            yield "rag_admission_waiting", "gauge", "Requests waiting for an admission slot", [
+                ({"pool": name}, pool.waiting) for name, pool in admission.pools.items()
+            ]
+            yield "rag_admission_admitted_total", "counter", "Requests given an admission slot", [
+                ({"pool": name}, admission.admitted[name]) for name in admission.pools
+            ]
+            yield "rag_admission_rejected_total", "counter", "Requests turned away, by reason", [
+                ({"pool": pool, "reason": reason}, count) for (pool, reason), count in sorted(admission.rejected.items())
+            ]
+        if self.built("llm"):
+            yield "rag_llm_requests_in_flight", "gauge", "LLM calls holding a concurrency slot", [({}, self.llm.in_flight)]
+            yield "rag_llm_requests_waiting", "gauge", "LLM calls waiting for a concurrency slot", [({}, self.llm.waiting)]
+        if self.built("embedding_function") and hasattr(self.embedding_function, "stats"):
+            try:
+                stats = self.embedding_function.stats()
+            except EmbeddingError:
+                stats = None
+            if stats is not None:
+                yield "rag_embedding_server_queue_depth", "gauge", "Requests queued at the embedding server", [
+                    ({}, stats["queue_depth"])
+                ]
+
+    async def close(self) -> None:
+        """Stop whatever was started; services never built are left alone."""
+        if self.built("job_queue"):
+            self.job_queue.shutdown()
+        with self._lock:
+            deferred, self._deferred = self._deferred, {}
+        for timer, fn in deferred.items():
+            timer.cancel()
+            fn()
+        if self.built("lexical_executor"):
+            self.lexical_executor.shutdown()
+        if self.built("shard_router"):
+            self.shard_router.close()
+        embedding_functions = list(self._embedding_functions.values())
+        if self.built("embedding_function"):
+            embedding_functions.append(self.embedding_function)
+        for embedding_function in embedding_functions:
+            if hasattr(embedding_function, "close"):
+                embedding_function.close()
+        if self.built("llm"):
+            await self.llm.aclose()
+        if self.built("embedding_cache"):
+            # Work still winding down may read it; only the pending recency is written
+            self.embedding_cache.flush()
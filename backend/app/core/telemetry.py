@@ -0,0 +1,399 @@
+"""
+Metrics, per-stage timing spans and a sampling profiler.
+
+Metrics follow the Prometheus data model and text exposition format
+without the client library: counters, gauges and histograms live in the
+module-level ``REGISTRY``, and collectors registered with it read values
+owned by services (cache hits, queue depths) at scrape time.
+
+Spans time one pipeline stage each. Every span is observed in the
+``rag_stage_seconds`` histogram and, inside a ``trace``, appended to that
+trace, which is logged as one JSON line when it is slower than its
+threshold.
+"""
+import json
+import logging
+import math
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans range from sub-millisecond lookups to long transcriptions
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# (labels, value) pairs of one metric family
+Samples = List[Tuple[Dict[str, str], float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> Any:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._child())
+        return child
+
+    def _child(self) -> Any:
+        raise NotImplementedError
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for key, child in sorted(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            yield from child.samples(self.name, labels)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+    def samples(self, name: str, labels: Dict[str, str]):
+        yield name, labels, self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self) -> _Value:
+        return _Value()
+
+    def samples(self):
+        for name, labels, value in super().samples():
+            yield f"{name}_total", labels, value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _child(self) -> _Value:
+        return _Value()
+
+
+class _Buckets:
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name: str, labels: Dict[str, str]):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(list(self.bounds) + [math.inf], counts):
+            cumulative += count
+            yield f"{name}_bucket", dict(labels, le=_format_value(bound)), cumulative
+        yield f"{name}_sum", labels, total
+        yield f"{name}_count", labels, cumulative
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        """(count, sum) of the observations per label values."""
+        return {key: (sum(child.counts), child.sum) for key, child in list(self._children.items())}
+
+
+class Registry:
+    """Metrics plus collectors, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Samples]]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collect: Callable[[], Iterable[Tuple[str, str, str, Samples]]]) -> None:
+        """``collect()`` yields (name, type, help, samples) families when scraped."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def unregister_collector(self, collect: Callable) -> None:
+        with self._lock:
+            if collect in self._collectors:
+                self._collectors.remove(collect)
+
+    def expose(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collect in collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                # One failing source must not take the whole scrape down
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds", "Duration of one pipeline stage", ("pipeline", "stage")
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "rag_http_request_seconds", "HTTP request duration until the last byte is sent", ("method", "route", "status")
+)
+LLM_TOKENS = REGISTRY.counter(
+    "rag_llm_tokens", "LLM tokens as reported by the API; streams without usage count one completion token per delta", ("kind",)
+)
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "rag_context_tokens", "Tokens in the packed context sent to the LLM", (),
+    buckets=(64, 128, 256, 512, 1024, 1536, 2048, 4096, 8192)
+)
+
+
+# Spans
+
+_trace: ContextVar[Optional["Trace"]] = ContextVar("rag_trace", default=None)
+
+
+class Span:
+    __slots__ = ("stage", "pipeline", "attrs", "started", "ms")
+
+    def __init__(self, stage: str, pipeline: str, attrs: Dict[str, Any]):
+        self.stage = stage
+        self.pipeline = pipeline
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.ms = 0.0
+
+
+class Trace:
+    """The spans of one request or job, with its own id."""
+
+    def __init__(self, pipeline: str, **attrs: Any):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.pipeline = pipeline
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        entry = {"stage": span.stage, "start_ms": round((span.started - self.started) * 1000, 2), "ms": round(span.ms, 2)}
+        entry.update(span.attrs)
+        with self._lock:
+            self.spans.append(entry)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda entry: entry["start_ms"])
+        return dict(
+            self.attrs,
+            trace_id=self.trace_id,
+            pipeline=self.pipeline,
+            total_ms=round((time.perf_counter() - self.started) * 1000, 2),
+            spans=spans
+        )
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def trace(pipeline: str, slow_ms: Optional[float] = None, **attrs: Any) -> Iterator[Trace]:
+    """
+    Collect the spans run in this context (including threadpool calls,
+    which copy it) and log them as one JSON line when the trace takes at
+    least ``slow_ms``; None never logs.
+    """
+    current = Trace(pipeline, **attrs)
+    token = _trace.set(current)
+    try:
+        yield current
+    finally:
+        _trace.reset(token)
+        if slow_ms is not None and (time.perf_counter() - current.started) * 1000 >= slow_ms:
+            logger.info(json.dumps(current.to_dict()))
+
+
+@contextmanager
+def span(stage: str, pipeline: Optional[str] = None, **attrs: Any) -> Iterator[Span]:
+    """
+    Time a stage. ``pipeline`` defaults to the current trace's; threads
+    that do not inherit the context (executors, buffer flushes) pass it.
+    ``span.ms`` holds the duration once the block exits.
+    """
+    current = _trace.get()
+    timed = Span(stage, pipeline or (current.pipeline if current else "background"), attrs)
+    try:
+        yield timed
+    finally:
+        timed.ms = (time.perf_counter() - timed.started) * 1000
+        STAGE_SECONDS.labels(timed.pipeline, stage).observe(timed.ms / 1000)
+        if current is not None:
+            current.add(timed)
+
+
+def record(stage: str, seconds: float, pipeline: Optional[str] = None, **attrs: Any) -> None:
+    """A span measured elsewhere, e.g. accumulated over a stream; it is taken to end now."""
+    current = _trace.get()
+    timed = Span(stage, pipeline or (current.pipeline if current else "background"), attrs)
+    timed.started -= seconds
+    timed.ms = seconds * 1000
+    STAGE_SECONDS.labels(timed.pipeline, stage).observe(seconds)
+    if current is not None:
+        current.add(timed)
+
+
+class TimedIterator:
+    """Wraps an iterator and adds up the time spent producing its items."""
+
+    def __init__(self, iterable: Iterable[Any]):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self) -> "TimedIterator":
+        return self
+
+    def __next__(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+# Profiling
+
+# Stacks whose innermost frame is in one of these files are threads
+# waiting for work, not doing any
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "thread.py", "base_events.py")
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every busy thread every ``interval`` seconds.
+
+    Idle threads (blocked in a queue, lock or selector) are skipped, so
+    the profile shows where the request's work went: on the event loop
+    and in the threadpool. Other requests running at the same time show
+    up as well. ``stop`` returns collapsed stacks (``frame;frame count``
+    per line), the input of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self._stacks: "_Tally[str]" = _Tally()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == me or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
@@ -1,218 +1,73 @@
-import os
-import uuid
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional
-import chromadb
-from chromadb.utils import embedding_functions
-import PyPDF2
-from moviepy.editor import VideoFileClip
-import speech_recognition as sr
-from tempfile import NamedTemporaryFile
-from datetime import datetime
-import requests
+import time
 
-app = FastAPI()
+_import_started = time.perf_counter()
 
-# Configuration
-UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+import logging
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
 
-# Initialize ChromaDB with DeepSeek embeddings
-client = chromadb.PersistentClient(path="chroma_db")
-deepseek_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="deepseek-ai/deepseek-embedding")
-collection = client.get_or_create_collection(
-    name="multimodal_rag",
-    embedding_function=deepseek_ef
-)
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 
-class Query(BaseModel):
-    question: str
+from app.api.endpoints import admin, query, upload
+from app.api.middleware import AdmissionMiddleware, TelemetryMiddleware
+from app.core import telemetry
+from app.core.config import Settings, settings as default_settings
+from app.core.container import Services
 
-class DocumentResponse(BaseModel):
-    text: str
-    metadata: dict
+IMPORT_MS = (time.perf_counter() - _import_started) * 1000
+WARMUP_MODES = ("background", "blocking", "off")
 
-class VideoResponse(BaseModel):
-    text: str
-    metadata: dict
+logger = logging.getLogger(__name__)
 
-# DeepSeek API Config
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")  # Set your API key in environment variables
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 
-@app.post("/upload/pdf/")
-async def upload_pdf(file: UploadFile = File(...)):
-    try:
-        file_id = str(uuid.uuid4())
-        file_path = os.path.join(UPLOAD_FOLDER, f"{file_id}.pdf")
-        
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
-        
-        with open(file_path, "rb") as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            documents = []
-            metadatas = []
-            ids = []
-            
-            for page_num, page in enumerate(pdf_reader.pages):
-                text = page.extract_text()
-                if text.strip():
-                    doc_id = f"{file_id}_page_{page_num + 1}"
-                    documents.append(text)
-                    metadatas.append({
-                        "source": file.filename,
-                        "page": page_num + 1,
-                        "type": "pdf",
-                        "file_id": file_id
-                    })
-                    ids.append(doc_id)
-            
-            if documents:
-                collection.add(
-                    documents=documents,
-                    metadatas=metadatas,
-                    ids=ids
-                )
-        
-        return {"message": "PDF processed successfully", "file_id": file_id}
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+def create_app(settings: Settings = default_settings, services: Optional[Services] = None) -> FastAPI:
+    """
+    Build the API: mount the routers and attach the services wired from
+    ``settings``.
+
+    Nothing heavy happens here or at startup: services are built on first
+    use. ``WARMUP`` decides when startup maintenance and model loading
+    run: ``background`` (the default) serves ``/status/`` at once and
+    loads in a thread, ``blocking`` loads before the app accepts requests,
+    and ``off`` leaves the models to the first request.
+    """
+    started = time.perf_counter()
+    if settings.WARMUP not in WARMUP_MODES:
+        raise ValueError(f"Unknown WARMUP: {settings.WARMUP}. Available: {', '.join(WARMUP_MODES)}")
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        startup_started = time.perf_counter()
+        services = app.state.services
+        telemetry.REGISTRY.register_collector(services.metrics)
+        warm_up = settings.WARMUP != "off"
+        if settings.WARMUP == "blocking":
+            await run_in_threadpool(services.start, warm_up)
+        else:
+            threading.Thread(target=services.start, args=(warm_up,), name="startup", daemon=True).start()
+        app.state.timings["startup_ms"] = round((time.perf_counter() - startup_started) * 1000, 2)
+        logger.info(f"API started: {app.state.timings}")
+        try:
+            yield
+        finally:
+            telemetry.REGISTRY.unregister_collector(services.metrics)
+            await services.close()
 
-@app.post("/upload/video/")
-async def upload_video(file: UploadFile = File(...)):
-    try:
-        file_id = str(uuid.uuid4())
-        file_path = os.path.join(UPLOAD_FOLDER, f"{file_id}.mp4")
-        
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
-        
-        video = VideoFileClip(file_path)
-        audio = video.audio
-        
-        with NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
-            audio_path = temp_audio.name
-            audio.write_audiofile(audio_path, codec='pcm_s16le')
-        
-        recognizer = sr.Recognizer()
-        with sr.AudioFile(audio_path) as source:
-            audio_data = recognizer.record(source)
-            try:
-                text = recognizer.recognize_google(audio_data)
-            except sr.UnknownValueError:
-                text = ""
-        
-        os.unlink(audio_path)
-        video.close()
-        
-        if text:
-            chunks = [text[i:i+1000] for i in range(0, len(text), 1000)]
-            documents = []
-            metadatas = []
-            ids = []
-            
-            for i, chunk in enumerate(chunks):
-                doc_id = f"{file_id}_chunk_{i + 1}"
-                documents.append(chunk)
-                metadatas.append({
-                    "source": file.filename,
-                    "timestamp": f"{i * 10}:00",
-                    "type": "video",
-                    "file_id": file_id
-                })
-                ids.append(doc_id)
-            
-            collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-        
-        return {"message": "Video processed successfully", "file_id": file_id}
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    app = FastAPI(lifespan=lifespan)
+    app.state.services = services or Services(settings)
+    app.state.timings = {"import_ms": round(IMPORT_MS, 2)}
+    for module in (upload, query, admin):
+        app.include_router(module.router)
+    # Added last, telemetry runs outermost and also times the requests admission turns away
+    app.add_middleware(AdmissionMiddleware, controller=app.state.services.admission)
+    app.add_middleware(TelemetryMiddleware, settings=settings)
 
-@app.post("/query/")
-async def query_rag(query: Query):
-    try:
-        results = collection.query(
-            query_texts=[query.question],
-            n_results=5
-        )
-        
-        context = ""
-        sources = []
-        
-        for doc, metadata in zip(results['documents'][0], results['metadatas'][0]):
-            context += f"Source ({metadata['type']} from {metadata['source']}): {doc}\n\n"
-            
-            if metadata['type'] == "pdf":
-                sources.append({
-                    "type": "pdf",
-                    "source": metadata['source'],
-                    "page": metadata['page'],
-                    "file_id": metadata['file_id'],
-                    "content": doc[:200] + "..."
-                })
-            else:
-                sources.append({
-                    "type": "video",
-                    "source": metadata['source'],
-                    "timestamp": metadata['timestamp'],
-                    "file_id": metadata['file_id'],
-                    "content": doc[:200] + "..."
-                })
-        
-        answer = get_deepseek_response(query.question, context)
-        
-        return {
-            "answer": answer,
-            "sources": sources
-        }
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    app.state.timings["create_app_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return app
 
-def get_deepseek_response(question: str, context: str) -> str:
-    """Get response directly from DeepSeek API"""
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    prompt = f"""
-    Answer based on this context (cite sources exactly as shown):
-    
-    {context}
-    
-    Question: {question}
-    """
-    
-    data = {
-        "model": "deepseek-chat",
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant that provides detailed answers with citations."},
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.7,
-        "max_tokens": 2000
-    }
-    
-    try:
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=data)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
-    except Exception as e:
-        return f"Error: {str(e)}"
 
-@app.get("/status/")
-async def status():
-    return {"status": "ok", "timestamp": datetime.now().isoformat()}
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+
+class Rejected(Exception):
+    """A request turned away; the client should retry after ``retry_after`` seconds."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, tokens: float = 1.0) -> float:
+        """
+        Take ``tokens`` if the bucket holds them.
+
+        Returns:
+            0 when taken, else the seconds until the bucket will hold them
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    A token bucket per client; the ``max_clients`` most recently seen are
+    kept (a client evicted meanwhile starts again with a full bucket).
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def check(self, client: str) -> float:
+        """0 if ``client`` may go ahead, else the seconds until it may."""
+        if self.rate <= 0:
+            return 0.0
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.take()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+@dataclass
+class PoolLimits:
+    concurrency: int
+    queue_size: int
+    timeout: float  # Longest wait for a slot, in seconds
+
+
+class _Pool:
+    """Concurrency slots of one kind of work, and the requests waiting for them by priority."""
+
+    def __init__(self, name: str, limits: PoolLimits):
+        self.name = name
+        self.limits = limits
+        self.active = 0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.waiting = 0
+        # Moving average of how long a request holds a slot
+        self.hold_seconds: Optional[float] = None
+
+    def expected_wait(self, ahead: int) -> float:
+        """Seconds until a slot frees for a request with ``ahead`` requests queued before it."""
+        if self.hold_seconds is None:
+            return 0.0
+        return (ahead // self.limits.concurrency + 1) * self.hold_seconds
+
+    def ahead_of(self, priority: int) -> int:
+        return sum(1 for p, _, future in self.waiters if p <= priority and not future.done())
+
+
+class AdmissionController:
+    """
+    Decides which requests run now, which wait and which are turned away.
+
+    Every kind of work (queries, uploads) has its own pool of concurrency
+    slots, so a burst of uploads cannot take the slots queries need. A
+    request finding its pool full waits in a bounded queue, where lower
+    ``priority`` values are served first (interactive queries before
+    batches). It is rejected at once with 503 when the queue is full or
+    the wait, estimated from how long requests have been holding slots,
+    would outlast its deadline, and with 503 when the deadline passes
+    while it waits. Clients are also rate limited per API key (429).
+    """
+
+    def __init__(self, pools: Dict[str, PoolLimits], rate_limits: Optional[Dict[str, RateLimiter]] = None):
+        self.pools = {name: _Pool(name, limits) for name, limits in pools.items()}
+        self.rate_limits = rate_limits or {}
+        self._order = itertools.count()
+        self.admitted: Counter = Counter()
+        # (pool, reason) -> requests turned away
+        self.rejected: Counter = Counter()
+
+    def check_rate(self, pool: str, client: str) -> None:
+        limiter = self.rate_limits.get(pool)
+        retry_after = limiter.check(client) if limiter is not None else 0.0
+        if retry_after:
+            self.rejected[(pool, "rate_limited")] += 1
+            raise Rejected(429, "rate_limited", retry_after, f"Rate limit exceeded for {pool} requests")
+
+    async def acquire(self, pool_name: str, priority: int = 0, timeout: Optional[float] = None) -> float:
+        """
+        Wait for a slot in ``pool_name`` for at most ``timeout`` seconds
+        (the pool's limit if shorter or not given).
+
+        Returns:
+            The time the slot was taken, to pass to ``release``
+
+        Raises:
+            Rejected: No slot can be had in time
+        """
+        pool = self.pools[pool_name]
+        timeout = pool.limits.timeout if timeout is None else min(timeout, pool.limits.timeout)
+        if pool.active < pool.limits.concurrency and not pool.waiting:
+            return self._admit(pool)
+
+        expected = pool.expected_wait(pool.ahead_of(priority))
+        if pool.waiting >= pool.limits.queue_size:
+            self.rejected[(pool_name, "queue_full")] += 1
+            raise Rejected(503, "queue_full", expected, f"Too many {pool_name} requests waiting")
+        if expected > timeout:
+            self.rejected[(pool_name, "deadline")] += 1
+            raise Rejected(503, "deadline", expected, f"A {pool_name} slot is not expected to free up in time")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(pool.waiters, (priority, next(self._order), future))
+        pool.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self.rejected[(pool_name, "timeout")] += 1
+                raise Rejected(503, "timeout", pool.expected_wait(pool.waiting), f"Timed out waiting for a {pool_name} slot")
+        except asyncio.CancelledError:
+            # The client went away; a slot granted meanwhile goes to the next waiter
+            if not future.cancel():
+                pool.active -= 1
+                self._grant(pool)
+            raise
+        finally:
+            pool.waiting -= 1
+        return future.result()
+
+    def _admit(self, pool: _Pool) -> float:
+        pool.active += 1
+        self.admitted[pool.name] += 1
+        return time.monotonic()
+
+    def release(self, pool_name: str, started: float) -> None:
+        pool = self.pools[pool_name]
+        held = time.monotonic() - started
+        pool.hold_seconds = held if pool.hold_seconds is None else 0.8 * pool.hold_seconds + 0.2 * held
+        pool.active -= 1
+        self._grant(pool)
+
+    def _grant(self, pool: _Pool) -> None:
+        while pool.waiters and pool.active < pool.limits.concurrency:
+            _, _, future = heapq.heappop(pool.waiters)
+            if not future.done():
+                future.set_result(self._admit(pool))
+
+    def busy(self, pool_name: str) -> bool:
+        """Whether requests of ``pool_name`` are running or waiting."""
+        pool = self.pools[pool_name]
+        return pool.active > 0 or pool.waiting > 0
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            name: {
+                "active": pool.active,
+                "waiting": pool.waiting,
+                "concurrency": pool.limits.concurrency,
+                "queue_size": pool.limits.queue_size,
+                "hold_ms": round(pool.hold_seconds * 1000, 2) if pool.hold_seconds is not None else None,
+                "admitted": self.admitted[name],
+                "rejected": {reason: count for (p, reason), count in self.rejected.items() if p == name},
+                "clients": len(self.rate_limits[name]) if name in self.rate_limits else 0
+            }
+            for name, pool in self.pools.items()
+        }
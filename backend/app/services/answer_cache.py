@@ -0,0 +1,200 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+EXACT = "exact"
+SEMANTIC = "semantic"
+
+# The scope (tenant) and chunk ids an answer was generated from
+ContextKey = Tuple[str, FrozenSet[str]]
+
+
+def normalize_question(question: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", question.lower()).strip().rstrip("?.!").strip()
+
+
+class _Entry:
+    __slots__ = ("answer", "sources", "embedding", "context_key", "file_ids", "expires_at")
+
+    def __init__(self, answer, sources, embedding, context_key, file_ids, expires_at):
+        self.answer = answer
+        self.sources = sources
+        self.embedding = embedding
+        self.context_key = context_key
+        self.file_ids = file_ids
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    """
+    Two-tier cache of LLM answers.
+
+    Answers are only reused within the ``scope`` (the tenant) they were
+    generated for, and when the retrieved context is the same set of
+    chunk ids as then; chunk ids come from the text, so two tenants
+    storing the same passage share them. Within that context, the
+    exact tier matches the normalized question and the semantic tier
+    matches any cached question whose embedding has cosine similarity of
+    at least ``similarity``. Entries expire after ``ttl`` seconds, the
+    least recently used are evicted beyond ``max_entries``, and
+    everything built from a file is dropped when that file is
+    re-ingested or deleted.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, similarity: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries: "OrderedDict[Tuple[str, ContextKey], _Entry]" = OrderedDict()
+        self._by_context: Dict[ContextKey, Set[Tuple[str, ContextKey]]] = {}
+        self._by_file: Dict[str, Set[Tuple[str, ContextKey]]] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits_exact": 0,
+            "hits_semantic": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0
+        }
+
+    @staticmethod
+    def _unit(embedding: Optional[Iterable[float]]) -> Optional[np.ndarray]:
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _remove(self, key: Tuple[str, ContextKey]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        siblings = self._by_context.get(entry.context_key)
+        if siblings is not None:
+            siblings.discard(key)
+            if not siblings:
+                del self._by_context[entry.context_key]
+        for file_id in entry.file_ids:
+            keys = self._by_file.get(file_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_file[file_id]
+
+    def _live(self, key: Tuple[str, ContextKey], now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            self._stats["expirations"] += 1
+            return None
+        return entry
+
+    def get(
+        self,
+        question: str,
+        chunk_ids: Iterable[str],
+        embedding: Optional[Iterable[float]] = None,
+        scope: str = ""
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Look up an answer for ``question`` over the retrieved ``chunk_ids``
+        of ``scope``.
+
+        Returns:
+            {"answer", "sources", "tier"} on a hit, otherwise None
+        """
+        context_key = (scope, frozenset(chunk_ids))
+        key = (normalize_question(question), context_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            tier = EXACT
+            if entry is None:
+                tier = SEMANTIC
+                key, entry = self._semantic_match(context_key, self._unit(embedding), now)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats[f"hits_{tier}"] += 1
+            return {"answer": entry.answer, "sources": entry.sources, "tier": tier}
+
+    def _semantic_match(self, context_key, query: Optional[np.ndarray], now: float):
+        if query is None:
+            return None, None
+        best_key, best_entry, best_score = None, None, self.similarity
+        for key in list(self._by_context.get(context_key, ())):
+            entry = self._live(key, now)
+            # Entries embedded with another model (before a re-index) never match
+            if entry is None or entry.embedding is None or entry.embedding.shape != query.shape:
+                continue
+            score = float(np.dot(query, entry.embedding))
+            if score >= best_score:
+                best_key, best_entry, best_score = key, entry, score
+        return best_key, best_entry
+
+    def put(
+        self,
+        question: str,
+        chunk_ids: Iterable[str],
+        answer: str,
+        sources: List[Dict[str, Any]],
+        file_ids: Iterable[str],
+        embedding: Optional[Iterable[float]] = None,
+        scope: str = ""
+    ) -> None:
+        context_key = (scope, frozenset(chunk_ids))
+        key = (normalize_question(question), context_key)
+        entry = _Entry(
+            answer,
+            sources,
+            self._unit(embedding),
+            context_key,
+            frozenset(file_ids),
+            time.monotonic() + self.ttl
+        )
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._by_context.setdefault(context_key, set()).add(key)
+            for file_id in entry.file_ids:
+                self._by_file.setdefault(file_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def invalidate_file(self, file_id: str) -> int:
+        """
+        Drop every answer whose context included chunks from ``file_id``.
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            keys = list(self._by_file.get(file_id, ()))
+            for key in keys:
+                self._remove(key)
+            self._stats["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+            self._by_file.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["hits_exact"] + stats["hits_semantic"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits_exact"] + stats["hits_semantic"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import uuid
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RAGART1\n"
+_FOOTER_SIZE = struct.Struct("<Q")
+
+
+class ArtifactError(Exception):
+    """An artifact file is truncated or not an artifact."""
+
+
+class ArtifactWriter:
+    """
+    Writes records to a temporary file block by block; ``commit`` moves it
+    into place, so readers only ever see whole artifacts.
+
+    Every ``block_records`` records are stored as one zlib-compressed JSON
+    object of columns (a list of values per column), which keeps the keys
+    out of the data and lets similar values compress together.
+    """
+
+    def __init__(self, path: str, columns: Sequence[str], block_records: int = 64, level: int = 6):
+        directory = os.path.dirname(path)
+        self.path = path
+        self.columns = list(columns)
+        self.block_records = block_records
+        self.level = level
+        self.count = 0
+        self._tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+        for attempt in range(2):
+            os.makedirs(directory, exist_ok=True)
+            try:
+                self._file = open(self._tmp_path, "wb")
+                break
+            except FileNotFoundError:
+                # GC removed the directory as an empty one in between
+                if attempt:
+                    raise
+        self._file.write(MAGIC)
+        self._blocks: List[List[int]] = []
+        self._pending: List[Dict[str, Any]] = []
+        self._done = False
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self._pending.append(record)
+        if len(self._pending) >= self.block_records:
+            self._write_block()
+
+    def _write_block(self) -> None:
+        if not self._pending:
+            return
+        block = {column: [record.get(column) for record in self._pending] for column in self.columns}
+        data = zlib.compress(json.dumps(block, separators=(",", ":")).encode("utf-8"), self.level)
+        self._blocks.append([self._file.tell(), len(data), len(self._pending)])
+        self._file.write(data)
+        self.count += len(self._pending)
+        self._pending = []
+
+    def commit(self, meta: Optional[Dict[str, Any]] = None) -> str:
+        """Finish the file and move it into place; returns its path."""
+        self._write_block()
+        footer = json.dumps({
+            "columns": self.columns,
+            "count": self.count,
+            "blocks": self._blocks,
+            "meta": meta or {},
+            "created_at": time.time()
+        }).encode("utf-8")
+        self._file.write(footer)
+        self._file.write(_FOOTER_SIZE.pack(len(footer)))
+        self._file.write(MAGIC)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        self._done = True
+        return self.path
+
+    def abort(self) -> None:
+        """Drop the file unless committed."""
+        if self._done:
+            return
+        self._done = True
+        self._file.close()
+        try:
+            os.unlink(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class Artifact:
+    """
+    A committed artifact, memory-mapped: opening it reads only the footer,
+    and iterating decompresses one block at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < 2 * len(MAGIC) + _FOOTER_SIZE.size:
+                raise ArtifactError(f"Truncated artifact: {path}")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        tail = len(self._map) - len(MAGIC)
+        if self._map[:len(MAGIC)] != MAGIC or self._map[tail:] != MAGIC:
+            self._map.close()
+            raise ArtifactError(f"Not an artifact: {path}")
+        (footer_size,) = _FOOTER_SIZE.unpack(self._map[tail - _FOOTER_SIZE.size:tail])
+        footer_start = tail - _FOOTER_SIZE.size - footer_size
+        footer = json.loads(self._map[footer_start:tail - _FOOTER_SIZE.size])
+        self.columns: List[str] = footer["columns"]
+        self.count: int = footer["count"]
+        self.meta: Dict[str, Any] = footer["meta"]
+        self.created_at: float = footer["created_at"]
+        self._blocks: List[List[int]] = footer["blocks"]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """Every record in order; the mapping is closed once they are all read (or the iterator is)."""
+        try:
+            for offset, length, _ in self._blocks:
+                block = json.loads(zlib.decompress(self._map[offset:offset + length]))
+                values = [block[column] for column in self.columns]
+                for row in zip(*values):
+                    yield dict(zip(self.columns, row))
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if not self._map.closed:
+            self._map.close()
+
+
+class ArtifactStore:
+    """
+    Intermediate extraction results (page text and tables, transcripts),
+    kept apart from the vectors so re-chunking, re-embedding or
+    re-ingesting a file does not parse or transcribe it again.
+
+    Artifacts are keyed by the content hash of the uploaded file, a kind
+    ("pages", "transcript") and the version of the extractor that made
+    them, which folds in every setting that changes its output; a new
+    extractor version simply misses. Files live under
+    ``<root>/<hash[:2]>/<hash>/<kind>.<version digest>.art`` and their
+    modification time records their last use.
+    """
+
+    def __init__(self, root: str, block_records: int = 64):
+        self.root = root
+        self.block_records = block_records
+        os.makedirs(root, exist_ok=True)
+
+    def _directory(self, content_hash: str) -> str:
+        return os.path.join(self.root, content_hash[:2], content_hash)
+
+    def path(self, content_hash: str, kind: str, version: str) -> str:
+        digest = hashlib.sha1(version.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self._directory(content_hash), f"{kind}.{digest}.art")
+
+    def load(self, content_hash: str, kind: str, version: str) -> Optional[Artifact]:
+        """The artifact, if one was made from this content by this extractor version."""
+        path = self.path(content_hash, kind, version)
+        try:
+            artifact = Artifact(path)
+        except FileNotFoundError:
+            return None
+        except (ArtifactError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable artifact {path}: {e}")
+            return None
+        if artifact.meta.get("version") != version:
+            artifact.close()
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # Collected meanwhile; the mapping stays readable
+        return artifact
+
+    def writer(self, content_hash: str, kind: str, version: str, columns: Sequence[str]) -> ArtifactWriter:
+        return ArtifactWriter(self.path(content_hash, kind, version), columns, block_records=self.block_records)
+
+    def recorded(
+        self,
+        records: Iterable[Dict[str, Any]],
+        content_hash: str,
+        kind: str,
+        version: str,
+        columns: Sequence[str],
+        meta: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Pass ``records`` through, saving them as an artifact once the last
+        one has gone by; nothing is saved if they are not all consumed.
+        """
+        writer = self.writer(content_hash, kind, version, columns)
+        try:
+            for record in records:
+                writer.append(record)
+                yield record
+            writer.commit(dict(meta or {}, version=version))
+        finally:
+            writer.abort()
+
+    def save(
+        self,
+        records: Iterable[Dict[str, Any]],
+        content_hash: str,
+        kind: str,
+        version: str,
+        columns: Sequence[str],
+        meta: Optional[Dict[str, Any]] = None
+    ) -> None:
+        for _ in self.recorded(records, content_hash, kind, version, columns, meta):
+            pass
+
+    def _files(self) -> Iterator[os.DirEntry]:
+        for prefix in os.scandir(self.root):
+            if not prefix.is_dir():
+                continue
+            for directory in os.scandir(prefix.path):
+                if directory.is_dir():
+                    yield from os.scandir(directory.path)
+
+    def stats(self) -> Dict[str, Any]:
+        files = total = 0
+        for entry in self._files():
+            if entry.name.endswith(".art"):
+                files += 1
+                total += entry.stat().st_size
+        return {"root": self.root, "artifacts": files, "mb": round(total / 2 ** 20, 2)}
+
+    def gc(self, referenced: Set[str], grace_seconds: float = 86400, max_bytes: int = 0) -> Dict[str, Any]:
+        """
+        Reclaim space.
+
+        Deleted, once unused for ``grace_seconds``: artifacts of content
+        no registered file has any more, artifacts superseded by a more
+        recently used version of the same kind, and temporary files of
+        writes that never finished. Then, with ``max_bytes``, the least
+        recently used artifacts until the rest fit.
+
+        Returns:
+            Counts of artifacts ``deleted`` and ``kept`` and the ``freed_mb``
+        """
+        cutoff = time.time() - grace_seconds
+        newest: Dict[tuple, float] = {}
+        entries = []
+        for entry in self._files():
+            stat = entry.stat()
+            content_hash = os.path.basename(os.path.dirname(entry.path))
+            kind = entry.name.split(".", 1)[0]
+            entries.append((entry.path, content_hash, kind, stat.st_mtime, stat.st_size))
+            if entry.name.endswith(".art"):
+                key = (content_hash, kind)
+                newest[key] = max(newest.get(key, 0.0), stat.st_mtime)
+
+        deleted = freed = 0
+        kept = []
+        for path, content_hash, kind, mtime, size in entries:
+            garbage = (
+                not path.endswith(".art")
+                or content_hash not in referenced
+                or mtime < newest[(content_hash, kind)]
+            )
+            if garbage and mtime < cutoff:
+                deleted, freed = deleted + self._unlink(path), freed + size
+            elif path.endswith(".art"):
+                kept.append((mtime, path, size))
+
+        if max_bytes > 0:
+            total = sum(size for _, _, size in kept)
+            kept.sort()
+            while kept and total > max_bytes:
+                _, path, size = kept.pop(0)
+                deleted, freed, total = deleted + self._unlink(path), freed + size, total - size
+
+        self._remove_empty_directories()
+        if deleted:
+            logger.info(f"Artifact GC deleted {deleted} file(s), {freed / 2 ** 20:.1f} MB")
+        return {"deleted": deleted, "kept": len(kept), "freed_mb": round(freed / 2 ** 20, 2)}
+
+    @staticmethod
+    def _unlink(path: str) -> int:
+        try:
+            os.unlink(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+    def _remove_empty_directories(self) -> None:
+        for prefix in os.scandir(self.root):
+            if not prefix.is_dir():
+                continue
+            for directory in os.scandir(prefix.path):
+                try:
+                    os.rmdir(directory.path)
+                except OSError:
+                    pass  # Not empty, or a writer just created it
+            try:
+                os.rmdir(prefix.path)
+            except OSError:
+                pass
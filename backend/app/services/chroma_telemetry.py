@@ -0,0 +1,16 @@
+"""
+Chroma product telemetry that sends nothing.
+
+Chroma's default client batches usage events in a plain dict from every
+calling thread; under concurrent queries the batching raced and the
+query failed with a KeyError. Only imported by Chroma, through the
+client settings in ``vector_store``.
+"""
+from chromadb.telemetry.product import ProductTelemetryClient, ProductTelemetryEvent
+from overrides import override
+
+
+class NoProductTelemetry(ProductTelemetryClient):
+    @override
+    def capture(self, event: ProductTelemetryEvent) -> None:
+        pass
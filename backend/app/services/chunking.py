@@ -0,0 +1,274 @@
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.services.video_processor import format_timestamp
+
+TEXT = "text"
+HEADING = "heading"
+TABLE = "table"
+FRAME = "frame"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+_NUMBERED_HEADING_RE = re.compile(r"^(\d+(\.\d+)*\.?|[IVX]+\.|[A-Z]\.)\s+\S")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate token count: words and punctuation marks.
+
+    Close enough to WordPiece/BPE counts for budgeting without loading a
+    tokenizer; pass a real tokenizer's counter to ``Chunker`` for exact
+    budgets.
+    """
+    return len(_TOKEN_RE.findall(text))
+
+
+def split_sentences(text: str) -> List[str]:
+    text = re.sub(r"\s+", " ", text).strip()
+    if not text:
+        return []
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()]
+
+
+def is_heading(line: str) -> bool:
+    """Short line without terminal punctuation that is numbered, Title Case or ALL CAPS."""
+    line = line.strip()
+    words = line.split()
+    if not words or len(words) > 12 or len(line) > 90 or line[-1] in ".,;:!?":
+        return False
+    if _NUMBERED_HEADING_RE.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) < 3:
+        return False
+    if line.isupper():
+        return True
+    capitalized = sum(1 for w in words if w[0].isupper())
+    return len(words) >= 2 and capitalized == len(words)
+
+
+def pdf_units(pages: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Turn extracted pages (see ``pdf_processor.extract_page_range``) into layout units.
+
+    Page bodies become heading and text units; each pdfplumber table
+    becomes one table unit. Body lines that only repeat a table row are
+    dropped, since pdfplumber also returns table text inside the page text.
+    """
+    for page in pages:
+        provenance = {"page": page["page"]}
+        tables = page.get("tables") or []
+        table_lines = {
+            " ".join(str(cell) for cell in row if cell not in (None, ""))
+            for table in tables for row in table
+        }
+        text_lines = []
+        for line in (page.get("body", page["text"]) or "").splitlines():
+            if not line.strip() or line.strip() in table_lines:
+                continue
+            if is_heading(line):
+                if text_lines:
+                    yield {"kind": TEXT, "text": " ".join(text_lines), "provenance": provenance}
+                    text_lines = []
+                yield {"kind": HEADING, "text": line.strip(), "provenance": provenance}
+            else:
+                text_lines.append(line.strip())
+        if text_lines:
+            yield {"kind": TEXT, "text": " ".join(text_lines), "provenance": provenance}
+        for table in tables:
+            rows = [" | ".join("" if cell is None else str(cell) for cell in row) for row in table]
+            yield {"kind": TABLE, "rows": rows, "text": "\n".join(rows), "provenance": provenance}
+
+
+def transcript_units(segments: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for segment in segments:
+        yield {
+            "kind": TEXT,
+            "text": segment["text"],
+            "provenance": {"start": segment["start"], "end": segment["end"]}
+        }
+
+
+def frame_units(keyframes: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Text read off video keyframes (see ``video_processor.iter_keyframes``), one unit per keyframe."""
+    for keyframe in keyframes:
+        lines = [line.strip() for line in keyframe["text"].splitlines() if line.strip()]
+        if lines:
+            yield {
+                "kind": FRAME,
+                "rows": lines,
+                "text": "\n".join(lines),
+                "provenance": {"start": keyframe["start"], "end": keyframe["end"]}
+            }
+
+
+def _merge_provenance(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    merged: Dict[str, Any] = {}
+    pages = [p["page"] for p in items if "page" in p]
+    if pages:
+        merged["page"] = min(pages)
+        merged["page_end"] = max(pages)
+    starts = [p["start"] for p in items if "start" in p]
+    if starts:
+        merged["start"] = min(starts)
+        merged["end"] = max(p["end"] for p in items if "end" in p)
+    return merged
+
+
+class Chunker:
+    """
+    Streaming, token-budgeted chunker.
+
+    Sentences are packed into chunks of at most ``max_tokens``, counting
+    the section heading each chunk is prefixed with; each chunk repeats up
+    to ``overlap_tokens`` of trailing sentences from the previous one,
+    less if the next sentence would not fit otherwise. Headings close the
+    current chunk and are carried as the ``section`` of the chunks that
+    follow; tables and video frames are chunked on their own by whole rows
+    (lines). Only the current chunk is ever buffered, so documents of any
+    size stream through.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 200,
+        overlap_tokens: int = 40,
+        token_counter: Callable[[str], int] = count_tokens
+    ):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count = token_counter
+
+    def _budget(self, section: Optional[str]) -> int:
+        """Tokens left for the body once the section heading is prefixed."""
+        return max(self.max_tokens - (self.count(section) if section else 0), 1)
+
+    def _split_long(self, sentence: str, n_tokens: int, budget: int) -> List[Tuple[str, int]]:
+        if n_tokens <= budget:
+            return [(sentence, n_tokens)]
+        words = sentence.split()
+        pieces, current, current_tokens = [], [], 0
+        for word in words:
+            word_tokens = self.count(word)
+            if current and current_tokens + word_tokens > budget:
+                pieces.append((" ".join(current), current_tokens))
+                current, current_tokens = [], 0
+            current.append(word)
+            current_tokens += word_tokens
+        if current:
+            pieces.append((" ".join(current), current_tokens))
+        return pieces
+
+    def _emit(self, parts: List[Tuple[str, int, Dict[str, Any]]], section: Optional[str], kind: str,
+              joiner: str = " ") -> Dict[str, Any]:
+        body = joiner.join(text for text, _, _ in parts)
+        text = f"{section}\n{body}" if section else body
+        chunk = {
+            "text": text,
+            "tokens": sum(n for _, n, _ in parts) + (self.count(section) if section else 0),
+            "chunk_type": kind,
+            "provenance": _merge_provenance([p for _, _, p in parts])
+        }
+        if section:
+            chunk["section"] = section
+        return chunk
+
+    def _tail(self, parts: List[Tuple[str, int, Dict[str, Any]]]) -> List[Tuple[str, int, Dict[str, Any]]]:
+        tail, tokens = [], 0
+        for part in reversed(parts):
+            if tokens + part[1] > self.overlap_tokens:
+                break
+            tail.insert(0, part)
+            tokens += part[1]
+        # Never carry the whole chunk over, or nothing new would be emitted
+        return tail if len(tail) < len(parts) else tail[1:]
+
+    def chunk_units(self, units: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Yield chunks (text, tokens, chunk_type, provenance, section) from layout units."""
+        parts: List[Tuple[str, int, Dict[str, Any]]] = []
+        tokens = 0
+        section = None
+        budget = self._budget(section)
+
+        for unit in units:
+            kind = unit.get("kind", TEXT)
+            if kind in (HEADING, TABLE, FRAME):
+                if parts:
+                    yield self._emit(parts, section, TEXT)
+                parts, tokens = [], 0
+            if kind == HEADING:
+                section = unit["text"]
+                budget = self._budget(section)
+                continue
+            if kind in (TABLE, FRAME):
+                yield from self._chunk_table(unit, section, kind)
+                continue
+
+            for sentence in split_sentences(unit["text"]):
+                for piece, n in self._split_long(sentence, self.count(sentence), budget):
+                    if parts and tokens + n > budget:
+                        yield self._emit(parts, section, TEXT)
+                        parts = self._tail(parts)
+                        tokens = sum(p[1] for p in parts)
+                        # Shorten the overlap until the new sentence fits
+                        while parts and tokens + n > budget:
+                            tokens -= parts.pop(0)[1]
+                    parts.append((piece, n, unit["provenance"]))
+                    tokens += n
+
+        if parts:
+            yield self._emit(parts, section, TEXT)
+
+    def _chunk_table(self, unit: Dict[str, Any], section: Optional[str], kind: str = TABLE) -> Iterator[Dict[str, Any]]:
+        rows = unit.get("rows") or unit["text"].splitlines()
+        budget = self._budget(section)
+        parts, tokens = [], 0
+        for row in rows:
+            for piece, n in self._split_long(row, self.count(row), budget):
+                if parts and tokens + n > budget:
+                    yield self._emit(parts, section, kind, joiner="\n")
+                    parts, tokens = [], 0
+                parts.append((piece, n, unit["provenance"]))
+                tokens += n
+        if parts:
+            yield self._emit(parts, section, kind, joiner="\n")
+
+
+def chunk_documents(
+    chunks: Iterable[Dict[str, Any]],
+    filename: str,
+    file_id: str,
+    doc_type: str,
+    ingested_at: Optional[int] = None
+):
+    """
+    Turn chunks into vector store rows carrying their page or time provenance.
+
+    ``ingested_at`` (epoch seconds) is stored for date-range filters.
+
+    Returns:
+        Tuple of (documents, metadatas)
+    """
+    documents = []
+    metadatas = []
+    for chunk in chunks:
+        metadata = {
+            "source": filename,
+            "type": doc_type,
+            "file_id": file_id,
+            "chunk_type": chunk["chunk_type"],
+            "tokens": chunk["tokens"]
+        }
+        if ingested_at is not None:
+            metadata["ingested_at"] = ingested_at
+        metadata.update(chunk["provenance"])
+        if "start" in metadata:
+            metadata["timestamp"] = format_timestamp(metadata["start"], metadata["end"])
+        if chunk.get("section"):
+            metadata["section"] = chunk["section"]
+        documents.append(chunk["text"])
+        metadatas.append(metadata)
+    return documents, metadatas
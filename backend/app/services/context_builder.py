@@ -0,0 +1,260 @@
+import math
+import re
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from app.services.chunking import count_tokens, split_sentences
+from app.services.video_processor import format_timestamp
+
+_WORD_RE = re.compile(r"\w+")
+
+_QUESTION_STOPWORDS = frozenset(
+    "a an and are be can do does for from how in is it of on or the to was what when where which who why with".split()
+)
+
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def citation_label(citation: Dict[str, Any]) -> str:
+    """Human-readable location, e.g. ``manual.pdf, p. 3-4`` or ``talk.mp4, 00:01:00 - 00:01:30``."""
+    if "page" in citation:
+        pages = str(citation["page"])
+        if citation.get("page_end", citation["page"]) != citation["page"]:
+            pages = f"{citation['page']}-{citation['page_end']}"
+        return f"{citation['source']}, p. {pages}"
+    if "start" in citation:
+        return f"{citation['source']}, {format_timestamp(citation['start'], citation['end'])}"
+    return citation["source"]
+
+
+class _Sentence:
+    __slots__ = ("text", "words", "key")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.words = _words(text)
+        self.key = " ".join(self.words)
+
+
+def _split(text: str, metadata: Dict[str, Any]) -> Tuple[Optional[str], List[_Sentence]]:
+    """Sentences of a chunk, without the section heading the chunker prefixes."""
+    section = metadata.get("section")
+    if section and text.startswith(section + "\n"):
+        text = text[len(section) + 1:]
+    else:
+        section = None
+    return section, [s for s in map(_Sentence, split_sentences(text)) if s.key]
+
+
+class _Block:
+    """Retrieved chunks from one stretch of one file, merged into a single passage."""
+
+    def __init__(self, metadata: Dict[str, Any]):
+        self.type = metadata.get("type")
+        self.file_id = metadata.get("file_id")
+        self.source = metadata.get("source", "")
+        self.page = metadata.get("page")
+        self.page_end = metadata.get("page_end", self.page)
+        self.start = metadata.get("start")
+        self.end = metadata.get("end", self.start)
+        self.section: Optional[str] = None
+        self.members: List[Tuple[float, str, List[_Sentence]]] = []
+
+    def touches(self, metadata: Dict[str, Any], gap_seconds: float) -> bool:
+        if metadata.get("file_id") != self.file_id or metadata.get("type") != self.type:
+            return False
+        if self.page is not None and metadata.get("page") is not None:
+            page_end = metadata.get("page_end", metadata["page"])
+            return metadata["page"] <= self.page_end + 1 and page_end >= self.page - 1
+        if self.start is not None and metadata.get("start") is not None:
+            end = metadata.get("end", metadata["start"])
+            return metadata["start"] <= self.end + gap_seconds and end >= self.start - gap_seconds
+        return False
+
+    def add(self, chunk_id: str, metadata: Dict[str, Any], section: Optional[str], sentences: List[_Sentence]) -> None:
+        position = metadata.get("page") if metadata.get("page") is not None else metadata.get("start") or 0.0
+        self.members.append((float(position), chunk_id, sentences))
+        self.section = self.section or section
+        if metadata.get("page") is not None and self.page is not None:
+            self.page = min(self.page, metadata["page"])
+            self.page_end = max(self.page_end, metadata.get("page_end", metadata["page"]))
+        if metadata.get("start") is not None and self.start is not None:
+            self.start = min(self.start, metadata["start"])
+            self.end = max(self.end, metadata.get("end", metadata["start"]))
+
+    def sentences(self) -> List[_Sentence]:
+        """Sentences of the members in document order, without the repeats from chunk overlap."""
+        seen: Set[str] = set()
+        out = []
+        for _, _, sentences in sorted(self.members, key=lambda m: m[0]):
+            for sentence in sentences:
+                if sentence.key not in seen:
+                    seen.add(sentence.key)
+                    out.append(sentence)
+        return out
+
+    def citation(self, number: int) -> Dict[str, Any]:
+        citation = {
+            "citation": number,
+            "type": self.type,
+            "source": self.source,
+            "file_id": self.file_id,
+            "chunk_ids": [chunk_id for _, chunk_id, _ in sorted(self.members, key=lambda m: m[0])]
+        }
+        if self.page is not None:
+            citation["page"] = self.page
+            citation["page_end"] = self.page_end
+        if self.start is not None:
+            citation["start"] = self.start
+            citation["end"] = self.end
+            citation["timestamp"] = format_timestamp(self.start, self.end)
+        return citation
+
+    def header(self, number: int) -> str:
+        header = f"[{number}] {citation_label(self.citation(number))}"
+        return f"{header} ({self.section})" if self.section else header
+
+
+class ContextBuilder:
+    """
+    Pack retrieved chunks into a prompt context under a token budget.
+
+    Candidates arrive best first and are split into sentences once. A
+    chunk is dropped as a near-duplicate when at least
+    ``duplicate_threshold`` of its sentences are already in better-ranked
+    chunks. Chunks from the same or adjacent pages, or overlapping time
+    ranges, of one file are merged into a single block with repeated
+    overlap sentences removed.
+
+    The budget is spent in two passes over the blocks in rank order:
+    first each block gets all of its text if it fits, otherwise its
+    sentences that share terms with the question (best first); then the
+    remainder is filled with the sentences nearest to those already
+    picked. Sentences keep their document order, and every block is
+    labelled ``[n]`` with its page or timestamp range so answers can cite
+    it.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 1500,
+        duplicate_threshold: float = 0.8,
+        merge_gap_seconds: float = 5.0,
+        token_counter: Callable[[str], int] = count_tokens
+    ):
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.merge_gap_seconds = merge_gap_seconds
+        self.count = token_counter
+
+    def _blocks(self, ids, documents, metadatas) -> List[_Block]:
+        blocks: List[_Block] = []
+        seen: Set[str] = set()
+        for chunk_id, text, metadata in zip(ids, documents, metadatas):
+            metadata = metadata or {}
+            section, sentences = _split(text, metadata)
+            keys = {s.key for s in sentences}
+            if not keys or len(keys & seen) >= self.duplicate_threshold * len(keys):
+                continue
+            seen |= keys
+            block = next((b for b in blocks if b.touches(metadata, self.merge_gap_seconds)), None)
+            if block is None:
+                block = _Block(metadata)
+                blocks.append(block)
+            block.add(chunk_id, metadata, section, sentences)
+        return blocks
+
+    @staticmethod
+    def _relevance(question: str, sentences: List[List[_Sentence]]) -> List[List[float]]:
+        """idf-weighted overlap of each sentence with the question terms."""
+        terms = {t for t in _words(question) if t not in _QUESTION_STOPWORDS}
+        matched = [[terms.intersection(s.words) for s in block] for block in sentences]
+        n = sum(len(block) for block in matched) or 1
+        df = Counter(t for block in matched for hits in block for t in hits)
+        idf = {t: math.log(1 + n / (1 + df[t])) for t in terms}
+        return [[sum(idf[t] for t in hits) for hits in block] for block in matched]
+
+    def build(
+        self,
+        question: str,
+        ids: Sequence[str],
+        documents: Sequence[str],
+        metadatas: Sequence[Dict[str, Any]],
+        max_tokens: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict with the ``context`` text, its ``citations`` (one per
+            block, with page or time range, contributing chunk ids and the
+            packed passage ``text``), ``tokens`` used, the ``input_tokens``
+            of the raw candidates and the ``chunk_ids`` that made it into
+            the context
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        blocks = self._blocks(ids, documents, metadatas)
+        block_sentences = [block.sentences() for block in blocks]
+        relevance = self._relevance(question, block_sentences)
+        costs = [[self.count(s.text) for s in sentences] for sentences in block_sentences]
+        # "[n]" costs the same for any n, so the final numbering is not needed yet
+        header_costs = [self.count(block.header(0)) + 1 for block in blocks]
+        # Skipped sentences are marked with " ... " in the passage
+        gap_cost = self.count(" ... ")
+        chosen: List[Set[int]] = [set() for _ in blocks]
+        used = 0
+
+        def take(b: int, order) -> None:
+            nonlocal used
+            for i in order:
+                if not chosen[b]:
+                    cost = costs[b][i] + header_costs[b]
+                elif i - 1 in chosen[b] or i + 1 in chosen[b]:
+                    cost = costs[b][i]
+                else:
+                    cost = costs[b][i] + gap_cost
+                if used + cost <= budget:
+                    chosen[b].add(i)
+                    used += cost
+
+        for b, scores in enumerate(relevance):
+            whole = header_costs[b] + sum(costs[b])
+            if used + whole <= budget:
+                chosen[b] = set(range(len(scores)))
+                used += whole
+            else:
+                take(b, sorted((i for i, score in enumerate(scores) if score > 0), key=lambda i: -scores[i]))
+        for b, scores in enumerate(relevance):
+            if len(chosen[b]) < len(scores):
+                rest = [i for i in range(len(scores)) if i not in chosen[b]]
+                if chosen[b]:
+                    rest.sort(key=lambda i: min(abs(i - c) for c in chosen[b]))
+                take(b, rest)
+
+        parts: List[str] = []
+        citations: List[Dict[str, Any]] = []
+        used_ids: List[str] = []
+        for block, sentences, picked in zip(blocks, block_sentences, chosen):
+            if not picked:
+                continue
+            number = len(citations) + 1
+            citation = block.citation(number)
+            passage: List[str] = []
+            previous = None
+            for i in sorted(picked):
+                if previous is not None:
+                    passage.append(" " if i == previous + 1 else " ... ")
+                passage.append(sentences[i].text)
+                previous = i
+            citation["text"] = "".join(passage)
+            parts.extend((block.header(number), "\n", citation["text"], "\n\n"))
+            citations.append(citation)
+            used_ids.extend(citation["chunk_ids"])
+
+        return {
+            "context": "".join(parts),
+            "citations": citations,
+            "tokens": used,
+            "input_tokens": sum(self.count(text) for text in documents),
+            "chunk_ids": used_ids
+        }
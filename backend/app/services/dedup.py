@@ -0,0 +1,357 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1 << 20
+
+# Metadata keys that describe where a chunk came from rather than what it is
+REF_KEYS = ("file_id", "source", "page", "timestamp", "start", "end", "ingested_at")
+# Ref keys that say when rather than where; re-ingesting a file changes them,
+# so they are left out when telling sources apart
+REF_TIME_KEYS = ("ingested_at",)
+
+# Chroma metadata is scalar-only, so membership of a chunk in each file it
+# was seen in is stored as one boolean key per file for ``where`` filters
+FILE_FLAG_PREFIX = "in_file_"
+
+# Files uploaded without a tenant, including everything stored before tenants existed
+DEFAULT_TENANT = "default"
+
+
+def hash_file(path: str, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """Stream a file through sha256 without reading it into memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_id_for(file_hash: str) -> str:
+    return file_hash[:32]
+
+
+def tenant_hash(file_hash: str, tenant: str) -> str:
+    """
+    Registry key of a file's content within a tenant.
+
+    The same bytes uploaded by two tenants are two files; the default
+    tenant keeps the plain content hash its existing files are stored under.
+    """
+    if tenant == DEFAULT_TENANT:
+        return file_hash
+    return hashlib.sha256(f"{tenant}:{file_hash}".encode("utf-8")).hexdigest()
+
+
+def chunk_id(text: str) -> str:
+    """Content-derived id, so identical chunks from any file map to one vector."""
+    return "chunk_" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class FileRegistry:
+    """
+    Maps the content hash of every uploaded file to its file_id, ingest
+    job, tenant and shard. ``file_hash`` is the tenant-scoped key (see
+    ``tenant_hash``); ``content_hash`` is the hash of the bytes alone,
+    which extraction artifacts are stored under.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_hash TEXT PRIMARY KEY, file_id TEXT NOT NULL, filename TEXT, "
+            "kind TEXT, job_id TEXT, created_at TEXT)"
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(files)")}
+        if "tenant" not in columns:
+            self._conn.execute(f"ALTER TABLE files ADD COLUMN tenant TEXT NOT NULL DEFAULT '{DEFAULT_TENANT}'")
+        if "shard" not in columns:
+            # Files stored before sharding live in the default tenant's original collection
+            self._conn.execute("ALTER TABLE files ADD COLUMN shard TEXT")
+            self._conn.execute("UPDATE files SET shard = tenant WHERE shard IS NULL")
+        if "content_hash" not in columns:
+            # The default tenant's key is the content hash; other tenants' files get theirs when next ingested
+            self._conn.execute("ALTER TABLE files ADD COLUMN content_hash TEXT")
+            self._conn.execute("UPDATE files SET content_hash = file_hash WHERE tenant = ?", (DEFAULT_TENANT,))
+        self._conn.commit()
+
+    def get(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM files WHERE file_hash = ?", (file_hash,)).fetchone()
+        return dict(row) if row else None
+
+    def get_by_file_id(self, file_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        return dict(row) if row else None
+
+    def files(self, tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Every registered file, or one tenant's."""
+        with self._lock:
+            if tenant is None:
+                rows = self._conn.execute("SELECT * FROM files").fetchall()
+            else:
+                rows = self._conn.execute("SELECT * FROM files WHERE tenant = ?", (tenant,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def file_ids_named(self, filenames: List[str], tenant: str) -> List[str]:
+        """Ids of a tenant's files uploaded under any of ``filenames``."""
+        placeholders = ", ".join("?" * len(filenames))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT file_id FROM files WHERE tenant = ? AND filename IN ({placeholders})",
+                (tenant, *filenames)
+            ).fetchall()
+        return [row["file_id"] for row in rows]
+
+    def shards(self, tenant: Optional[str] = None) -> List[str]:
+        """Shards holding any file, or any of one tenant's files."""
+        with self._lock:
+            if tenant is None:
+                rows = self._conn.execute("SELECT DISTINCT shard FROM files WHERE shard IS NOT NULL").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT DISTINCT shard FROM files WHERE tenant = ? AND shard IS NOT NULL", (tenant,)
+                ).fetchall()
+        return [row["shard"] for row in rows]
+
+    def claim(
+        self,
+        file_hash: str,
+        filename: str,
+        kind: str,
+        tenant: str = DEFAULT_TENANT,
+        shard: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        job_id: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Atomically register a file hash unless it is already known.
+
+        ``file_hash`` is the tenant-scoped hash from ``tenant_hash`` and
+        ``content_hash`` the hash of the bytes; ``shard`` is where a new
+        file's chunks will be stored and ``job_id`` the job that will
+        ingest it, recorded with the claim so no other upload of the same
+        content queues one.
+
+        Returns:
+            Tuple of (record, created); ``created`` is False when the same
+            content was uploaded before
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO files (file_hash, file_id, filename, kind, job_id, created_at, tenant, shard, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_hash, file_id_for(file_hash), filename, kind, job_id, datetime.now().isoformat(), tenant, shard or tenant, content_hash)
+            )
+            self._conn.commit()
+            row = self._conn.execute("SELECT * FROM files WHERE file_hash = ?", (file_hash,)).fetchone()
+        return dict(row), cursor.rowcount == 1
+
+    def replace_job(self, file_hash: str, previous: Optional[str], job_id: str) -> bool:
+        """
+        Record ``job_id`` for a file whose job ``previous`` failed or was
+        lost, unless another upload replaced it first.
+
+        Returns:
+            Whether ``job_id`` was recorded, i.e. the caller is to queue it
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE files SET job_id = ? WHERE file_hash = ? AND job_id IS ?", (job_id, file_hash, previous)
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def set_shard(self, file_hash: str, shard: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE files SET shard = ? WHERE file_hash = ?", (shard, file_hash))
+            self._conn.commit()
+
+    def set_content_hash(self, file_id: str, content_hash: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE files SET content_hash = ? WHERE file_id = ?", (content_hash, file_id))
+            self._conn.commit()
+
+    def content_hashes(self) -> Set[str]:
+        """Content hashes of every registered file, i.e. the artifacts still needed."""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT content_hash FROM files WHERE content_hash IS NOT NULL").fetchall()
+        return {row["content_hash"] for row in rows}
+
+    def remove(self, file_hash: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE file_hash = ?", (file_hash,))
+            self._conn.commit()
+
+
+def _ref(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: metadata[key] for key in REF_KEYS if key in metadata}
+
+
+def _source(ref: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in ref.items() if key not in REF_TIME_KEYS}
+
+
+def same_sources(a: List[Dict[str, Any]], b: List[Dict[str, Any]]) -> bool:
+    """Whether two ref lists name the same sources, whenever each was ingested."""
+    return [_source(ref) for ref in a] == [_source(ref) for ref in b]
+
+
+def file_flag(file_id: str) -> str:
+    return FILE_FLAG_PREFIX + file_id
+
+
+def with_file_flags(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    flagged = dict(metadata)
+    for file_id in file_ids(metadata):
+        flagged[file_flag(file_id)] = True
+    return flagged
+
+
+def get_refs(metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """All sources a stored chunk was seen in, including the primary one."""
+    refs = metadata.get("refs")
+    if refs:
+        return json.loads(refs)
+    return [_ref(metadata)]
+
+
+def file_metadata(metadata: Dict[str, Any], file_id: str) -> Dict[str, Any]:
+    """A stored chunk's metadata as ``file_id`` alone would have written it."""
+    own = {
+        key: value for key, value in metadata.items()
+        if key not in REF_KEYS and key not in ("refs", "file_count") and not key.startswith(FILE_FLAG_PREFIX)
+    }
+    for ref in get_refs(metadata):
+        if ref.get("file_id") == file_id:
+            own.update(ref)
+    return own
+
+
+def file_ids(metadata: Dict[str, Any]) -> List[str]:
+    """Every file a stored chunk was seen in."""
+    return sorted({ref["file_id"] for ref in get_refs(metadata) if "file_id" in ref})
+
+
+def filter_values(metadata: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Filterable values of a chunk, as indexed by ``lexical_index.BM25Index``."""
+    values = {"file_id": file_ids(metadata)}
+    if "type" in metadata:
+        values["type"] = [metadata["type"]]
+    return values
+
+
+def merge_metadata(existing: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Add ``new``'s source to ``existing``.
+
+    The primary source fields of the first file to contribute the chunk
+    are kept; every contributing source is listed in the JSON-encoded
+    ``refs`` field (Chroma metadata values must be scalars). A source seen
+    before keeps the time it was first ingested, so ingesting a file again
+    adds nothing.
+    """
+    refs = get_refs(existing)
+    sources = [_source(ref) for ref in refs]
+    for ref in get_refs(new):
+        if _source(ref) not in sources:
+            refs.append(ref)
+            sources.append(_source(ref))
+    merged = dict(existing)
+    merged["refs"] = json.dumps(refs)
+    merged["file_count"] = len({ref.get("file_id") for ref in refs})
+    return with_file_flags(merged)
+
+
+def remove_file(metadata: Dict[str, Any], file_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Drop ``file_id`` from a stored chunk's sources.
+
+    When it was the primary source, the next remaining source is promoted.
+    Its membership flag is set to False, since Chroma updates cannot remove
+    metadata keys.
+
+    Returns:
+        The updated metadata, or None when no other source is left
+    """
+    refs = [ref for ref in get_refs(metadata) if ref.get("file_id") != file_id]
+    if not refs:
+        return None
+    updated = dict(metadata)
+    if metadata.get("file_id") == file_id:
+        updated.update(refs[0])
+    updated["refs"] = json.dumps(refs)
+    updated["file_count"] = len({ref.get("file_id") for ref in refs})
+    updated[file_flag(file_id)] = False
+    return updated
+
+
+def upsert_chunks(
+    collection,
+    documents: List[str],
+    metadatas: List[Dict[str, Any]],
+    lexical_index=None
+) -> int:
+    """
+    Store chunks under content-derived ids, sharing vectors between duplicates.
+
+    Chunks whose text is already stored are not embedded again; their
+    source is merged into the existing entry's metadata instead. When a
+    ``lexical_index`` is given, new chunks and chunks whose sources
+    changed are (re-)indexed in it as well.
+
+    Returns:
+        Number of chunks that were newly embedded
+    """
+    batch: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    for text, metadata in zip(documents, metadatas):
+        cid = chunk_id(text)
+        if cid in batch:
+            batch[cid] = (text, merge_metadata(batch[cid][1], metadata))
+        else:
+            batch[cid] = (text, with_file_flags(metadata))
+    if not batch:
+        return 0
+
+    ids = list(batch)
+    existing = collection.get(ids=ids, include=["metadatas"])
+    stored = dict(zip(existing["ids"], existing["metadatas"]))
+
+    new_ids, update_ids, update_metadatas = [], [], []
+    for cid in ids:
+        if cid in stored:
+            merged = merge_metadata(stored[cid] or {}, batch[cid][1])
+            if not same_sources(get_refs(merged), get_refs(stored[cid] or {})):
+                update_ids.append(cid)
+                update_metadatas.append(merged)
+        else:
+            new_ids.append(cid)
+
+    if new_ids:
+        collection.add(
+            ids=new_ids,
+            documents=[batch[cid][0] for cid in new_ids],
+            metadatas=[batch[cid][1] for cid in new_ids]
+        )
+    if update_ids:
+        collection.update(ids=update_ids, metadatas=update_metadatas)
+    if lexical_index is not None:
+        lexical_index.add_many(
+            [(cid, batch[cid][0], filter_values(batch[cid][1])) for cid in new_ids] +
+            [(cid, batch[cid][0], filter_values(metadata)) for cid, metadata in zip(update_ids, update_metadatas)]
+        )
+    return len(new_ids)
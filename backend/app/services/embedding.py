@@ -1,40 +1,325 @@
-import requests
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
 import numpy as np
-from typing import List, Dict, Any
-from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 
-class DeepSeekEmbeddingFunction(EmbeddingFunction):
-    def __init__(self, api_key: str):
+from app.core import telemetry
+
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class EmbeddingError(Exception):
+    """Raised when embeddings cannot be produced; never papered over with fake vectors."""
+
+
+class EmbeddingCache:
+    """
+    Persistent, LRU-bounded embedding cache keyed by a hash of model and text.
+
+    Vectors are stored as float32 blobs in a SQLite file, so re-ingesting
+    the same (or overlapping) content costs no embedding calls, even
+    across restarts. Reads only note which entries they used; that
+    recency is written with the next ``put_many`` (before anything is
+    evicted), or by a read once ``touch_interval`` seconds have passed or
+    ``max_touched`` entries are pending, so cache hits cost no commits.
+    """
+
+    def __init__(self, path: str, max_entries: int = 500_000, touch_interval: float = 60.0, max_touched: int = 10_000):
+        """
+        Initialize the cache.
+
+        Args:
+            path: SQLite file to store vectors in
+            max_entries: Least recently used entries are evicted beyond this
+            touch_interval: Longest time the recency of cache hits is held in memory, in seconds
+            max_touched: Most cache hits whose recency is held in memory
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.max_touched = max_touched
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> when it was last read, not yet written
+        self._touched: Dict[str, int] = {}
+        self._flushed_at = time.monotonic()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """Return cached vectors for whichever keys are present, marking them recently used."""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        now = time.time_ns()
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                    self._touched[key] = now
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+            if len(self._touched) >= self.max_touched or time.monotonic() - self._flushed_at >= self.touch_interval:
+                if self._write_touched():
+                    self._conn.commit()
+        return found
+
+    def _write_touched(self) -> bool:
+        """Write the recency of the hits since the last write; the caller holds the lock and commits."""
+        touched, self._touched = self._touched, {}
+        self._flushed_at = time.monotonic()
+        if touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in touched.items()]
+            )
+        return bool(touched)
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time_ns()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            # Entries read since the last write are not the least recently used
+            self._write_touched()
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                excess = self._count - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (excess,)
+                )
+                self._count -= excess
+            self._conn.commit()
+
+    def flush(self) -> None:
+        """Write the recency of cache hits still held in memory."""
+        with self._lock:
+            if self._write_touched():
+                self._conn.commit()
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": self._count, "hits": self.hits, "misses": self.misses}
+
+
+class CachedBatchingEmbeddingFunction:
+    """
+    Shared front end for embedding functions.
+
+    Deduplicates the input, serves what it can from the cache, and sends
+    the remaining texts to ``embed_batch`` in batches of ``batch_size``.
+    Subclasses only implement ``embed_batch``.
+
+    Chroma only needs ``__call__(self, input)``; not subclassing its
+    ``EmbeddingFunction`` keeps chromadb out of the import path.
+    """
+
+    model_name = ""
+
+    def __init__(self, cache: Optional[EmbeddingCache] = None, batch_size: int = 64):
+        self.cache = cache
+        self.batch_size = batch_size
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def embed_batches(self, batches: List[List[str]]) -> List[List[List[float]]]:
+        return [self.embed_batch(batch) for batch in batches]
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        with telemetry.span("embed", texts=len(input)):
+            return self._embed(list(input))
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.key(self.model_name, text) for text in texts]
+        vectors = self.cache.get_many(keys) if self.cache is not None else {}
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+
+        if missing:
+            missing_keys = list(missing)
+            batches = [
+                [missing[key] for key in missing_keys[start:start + self.batch_size]]
+                for start in range(0, len(missing_keys), self.batch_size)
+            ]
+            computed = [vector for batch in self.embed_batches(batches) for vector in batch]
+            if len(computed) != len(missing_keys):
+                raise EmbeddingError(
+                    f"Expected {len(missing_keys)} embeddings, got {len(computed)}"
+                )
+            new_vectors = dict(zip(missing_keys, computed))
+            if self.cache is not None:
+                self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+
+class DeepSeekEmbeddingFunction(CachedBatchingEmbeddingFunction):
+    def __init__(
+        self,
+        api_key: str,
+        api_url: str = "https://api.deepseek.com/v1/embeddings",  # Verify actual endpoint
+        model_name: str = "text-embedding",
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 64,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 10.0,
+        timeout: float = 30
+    ):
+        super().__init__(cache=cache, batch_size=batch_size)
         self.api_key = api_key
-        self.api_url = "https://api.deepseek.com/v1/embeddings"  # Verify actual endpoint
-        
-    def __call__(self, input: Documents) -> Embeddings:
-        headers = {
+        self.api_url = api_url
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Longest wait before a retry, whatever Retry-After asks for
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        # Imported here: requests is slow to import and only this API client needs it
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._retry_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+        # One keep-alive session, with a connection pool sized for the concurrency limit
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
-        }
-        
-        embeddings = []
-        for text in input:
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json={"input": text, "model": "text-embedding"}
-            )
-            
-            if response.status_code == 200:
-                embedding = response.json()["data"][0]["embedding"]
-                embeddings.append(embedding)
-            else:
-                # Fallback to random embeddings if API fails
-                embeddings.append(np.random.rand(384).tolist())
-        
-        return embeddings
-
-class LocalEmbeddingFunction(EmbeddingFunction):
-    def __init__(self):
-        from sentence_transformers import SentenceTransformer
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')  # Small local model
-        
-    def __call__(self, input: Documents) -> Embeddings:
-        return self.model.encode(input).tolist()
\ No newline at end of file
+        })
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+
+    def _retry_delay(self, attempt: int, response: Optional["requests.Response"]) -> float:
+        delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    pass
+        return min(max(delay, 0.0), self.max_backoff)
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        last_error = ""
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.post(
+                    self.api_url,
+                    json={"input": texts, "model": self.model_name},
+                    timeout=self.timeout
+                )
+                if response.status_code == 200:
+                    data = sorted(response.json()["data"], key=lambda item: item.get("index", 0))
+                    return [item["embedding"] for item in data]
+                last_error = f"HTTP {response.status_code}: {response.text[:200]}"
+                if response.status_code not in RETRY_STATUS_CODES:
+                    break
+            except self._retry_errors as e:
+                last_error = str(e)
+            except (KeyError, ValueError) as e:
+                raise EmbeddingError(f"Invalid response format from embedding API: {str(e)}")
+
+            if attempt < self.max_retries:
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"Embedding request failed ({last_error}); retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+        raise EmbeddingError(f"Embedding request failed: {last_error}")
+
+    def embed_batches(self, batches: List[List[str]]) -> List[List[List[float]]]:
+        if len(batches) == 1:
+            return [self.embed_batch(batches[0])]
+        return list(self._executor.map(self.embed_batch, batches))
+
+
+class LocalEmbeddingFunction(CachedBatchingEmbeddingFunction):
+    """Local sentence-transformers model, loaded on first use (or ``load()``)."""
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",  # Small local model
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 64
+    ):
+        super().__init__(cache=cache, batch_size=batch_size)
+        self.model_name = model_name
+        self.model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    def load(self) -> None:
+        with self._load_lock:
+            if self.model is None:
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(self.model_name)
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        self.load()
+        return self.model.encode(texts, batch_size=self.batch_size).tolist()
+
+    def embed_batches(self, batches: List[List[str]]) -> List[List[List[float]]]:
+        # The model batches internally; one encode call avoids per-batch overhead
+        flat = [text for batch in batches for text in batch]
+        vectors = self.embed_batch(flat)
+        out, start = [], 0
+        for batch in batches:
+            out.append(vectors[start:start + len(batch)])
+            start += len(batch)
+        return out
@@ -0,0 +1,498 @@
+"""
+Local embedding server: one process owns the model and embeds for every
+API worker over a Unix socket.
+
+Concurrent requests are gathered into micro-batches: the first queued
+request opens a batch, which closes after ``max_wait_ms`` or once it
+holds ``max_batch`` texts, and the whole batch goes through the model in
+one call. Under load, requests arriving while the model is busy queue up
+and form the next batch, so per-request latency stays close to one model
+call instead of growing with the number of callers.
+
+Wire format, both directions: a 4-byte big-endian length and a JSON
+header, then ``header["bytes"]`` raw bytes. Requests are
+``{"op": "embed", "texts": [...]}`` or ``{"op": "stats"}``; embeddings
+come back as ``{"rows", "dim"}`` followed by the row-major float32
+matrix, which the client wraps with ``np.frombuffer`` without parsing or
+copying it.
+
+Run it on its own with:
+    python -m app.services.embedding_server --socket data/embedding.sock --model all-MiniLM-L6-v2
+"""
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.embedding import CachedBatchingEmbeddingFunction, EmbeddingCache, EmbeddingError
+
+logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct("!I")
+# Where ``python -m app.services.embedding_server`` resolves from
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+Encoder = Callable[[List[str]], np.ndarray]
+
+
+def sentence_transformer_encoder(model_name: str, batch_size: int = 64) -> Encoder:
+    """Load a sentence-transformers model and return its batch encode function."""
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name)
+    return partial(model.encode, batch_size=batch_size, convert_to_numpy=True)
+
+
+def _header(header: Dict[str, Any]) -> bytes:
+    data = json.dumps(header).encode("utf-8")
+    return _LENGTH.pack(len(data)) + data
+
+
+class _Request:
+    __slots__ = ("texts", "future", "queued_at")
+
+    def __init__(self, texts: List[str], future: asyncio.Future, queued_at: float):
+        self.texts = texts
+        self.future = future
+        self.queued_at = queued_at
+
+
+class EmbeddingServer:
+    """
+    Micro-batching front end for one encoder.
+
+    ``load_encoder`` runs in a worker thread once the socket is bound, so
+    clients can connect (and ask for stats) while the model loads; embed
+    requests wait until it is ready.
+    """
+
+    def __init__(
+        self,
+        load_encoder: Callable[[], Encoder],
+        model_name: str = "",
+        max_batch: int = 64,
+        max_wait_ms: float = 5.0
+    ):
+        self.load_encoder = load_encoder
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.encode: Optional[Encoder] = None
+        self.load_error: Optional[str] = None
+        self._ready: Optional[asyncio.Event] = None
+        # One thread: the model already uses every core for a batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+        self._queue: Optional[asyncio.Queue] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self._carry: Optional[_Request] = None
+        self._queued_texts = 0
+        self._in_flight = 0
+        self._requests = 0
+        self._batches = 0
+        self._texts = 0
+        self._max_batch_seen = 0
+        self._histogram: Dict[int, int] = {}
+        self._encode_seconds = 0.0
+        self._wait_seconds = 0.0
+        self._last_encode_ms = 0.0
+
+    # Batching
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        request = _Request(texts, loop.create_future(), loop.time())
+        self._queued_texts += len(texts)
+        await self._queue.put(request)
+        return await request.future
+
+    async def _next_batch(self) -> List[_Request]:
+        loop = asyncio.get_running_loop()
+        first = self._carry or await self._queue.get()
+        self._carry = None
+        batch, size = [first], len(first.texts)
+        deadline = loop.time() + self.max_wait
+        while size < self.max_batch:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                request = self._queue.get_nowait()
+            if size + len(request.texts) > self.max_batch:
+                # Opens the next batch; a request is never split
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            texts = [text for request in batch for text in request.texts]
+            self._queued_texts -= len(texts)
+            self._in_flight = len(texts)
+            started = loop.time()
+            try:
+                vectors = await loop.run_in_executor(self._executor, self._encode_batch, texts)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(EmbeddingError(str(e)))
+                continue
+            finally:
+                self._in_flight = 0
+            elapsed = loop.time() - started
+            self._record(batch, len(texts), started, elapsed)
+            offset = 0
+            for request in batch:
+                rows = vectors[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+                if not request.future.done():
+                    request.future.set_result(rows)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        vectors = np.ascontiguousarray(self.encode(texts), dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise EmbeddingError(f"Encoder returned shape {vectors.shape} for {len(texts)} texts")
+        return vectors
+
+    def _record(self, batch: List[_Request], size: int, started: float, elapsed: float) -> None:
+        self._requests += len(batch)
+        self._batches += 1
+        self._texts += size
+        self._max_batch_seen = max(self._max_batch_seen, size)
+        bucket = 1 << max(size - 1, 0).bit_length()
+        self._histogram[bucket] = self._histogram.get(bucket, 0) + 1
+        self._encode_seconds += elapsed
+        self._last_encode_ms = elapsed * 1000
+        self._wait_seconds += sum(started - request.queued_at for request in batch)
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self._batches or 1
+        return {
+            "model": self.model_name,
+            "ready": self.encode is not None,
+            "load_error": self.load_error,
+            "queue_depth": self._queue.qsize() + (self._carry is not None) if self._queue else 0,
+            "queued_texts": self._queued_texts,
+            "in_flight": self._in_flight,
+            "requests": self._requests,
+            "batches": self._batches,
+            "texts": self._texts,
+            "batch_size": {
+                "mean": round(self._texts / batches, 2),
+                "max": self._max_batch_seen,
+                # Batches by size, bucketed up to the next power of two
+                "histogram": {f"<={bucket}": count for bucket, count in sorted(self._histogram.items())}
+            },
+            "encode_ms": {"mean": round(self._encode_seconds * 1000 / batches, 2), "last": round(self._last_encode_ms, 2)},
+            "queue_wait_ms": round(self._wait_seconds * 1000 / max(self._requests, 1), 2)
+        }
+
+    # Connections
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    length = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+                except asyncio.IncompleteReadError:
+                    break
+                request = json.loads(await reader.readexactly(length))
+                op = request.get("op")
+                if op == "embed":
+                    try:
+                        if self.encode is None:
+                            await self._ready.wait()
+                        if self.load_error:
+                            raise EmbeddingError(f"Model failed to load: {self.load_error}")
+                        vectors = await self.embed(list(request["texts"]))
+                        payload = memoryview(vectors).cast("B")
+                        writer.write(_header({"rows": vectors.shape[0], "dim": vectors.shape[1], "bytes": len(payload)}))
+                        writer.write(payload)
+                    except Exception as e:
+                        writer.write(_header({"error": str(e), "bytes": 0}))
+                elif op == "stats":
+                    writer.write(_header(dict(self.stats(), bytes=0)))
+                else:
+                    writer.write(_header({"error": f"Unknown op: {op}", "bytes": 0}))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logger.debug(f"Embedding client dropped: {e}")
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _load(self) -> None:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            self.encode = await loop.run_in_executor(self._executor, self.load_encoder)
+            logger.info(f"Embedding model {self.model_name} loaded in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            self.load_error = str(e)
+            logger.error(f"Could not load embedding model {self.model_name}: {e}")
+        self._ready.set()
+
+    async def serve(self, socket_path: str) -> None:
+        """Serve on ``socket_path`` until SIGTERM or SIGINT."""
+        self._queue = asyncio.Queue()
+        self._ready = asyncio.Event()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=socket_path)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        tasks = [asyncio.ensure_future(self._load()), asyncio.ensure_future(self._batch_loop())]
+        logger.info(f"Embedding server listening on {socket_path}")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            for task in tasks:
+                task.cancel()
+            # Closing the connections ends their handlers at the next read
+            handlers = list(self._connections)
+            for writer in self._connections.values():
+                writer.close()
+            if handlers:
+                await asyncio.wait(handlers, timeout=5)
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self._executor.shutdown(wait=False)
+
+
+def serve(socket_path: str, load_encoder: Callable[[], Encoder], model_name: str = "", max_batch: int = 64, max_wait_ms: float = 5.0) -> None:
+    """Process entry point; ``load_encoder`` must be picklable to run under multiprocessing."""
+    server = EmbeddingServer(load_encoder, model_name=model_name, max_batch=max_batch, max_wait_ms=max_wait_ms)
+    asyncio.run(server.serve(socket_path))
+
+
+def _answers(socket_path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+        except OSError:
+            return False
+
+
+def ensure_server(
+    socket_path: str,
+    model_name: str,
+    max_batch: int = 64,
+    max_wait_ms: float = 5.0,
+    start_timeout: float = 30.0
+) -> Optional[subprocess.Popen]:
+    """
+    Start a server process at ``socket_path`` unless one already answers.
+
+    Workers race for a lock file next to the socket, so with several API
+    workers exactly one starts the server and the rest connect to it.
+    Returns the process when this call started it.
+    """
+    directory = os.path.dirname(socket_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{socket_path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if _answers(socket_path):
+            return None
+        process = subprocess.Popen(
+            [
+                sys.executable, "-m", "app.services.embedding_server",
+                "--socket", socket_path, "--model", model_name,
+                "--max-batch", str(max_batch), "--max-wait-ms", str(max_wait_ms)
+            ],
+            cwd=_BACKEND_DIR
+        )
+        # The socket is bound before the model loads, so this is quick
+        deadline = time.monotonic() + start_timeout
+        while not _answers(socket_path):
+            if process.poll() is not None:
+                raise EmbeddingError(f"Embedding server exited with code {process.returncode}")
+            if time.monotonic() > deadline:
+                process.terminate()
+                raise EmbeddingError(f"Embedding server did not start within {start_timeout:.0f}s")
+            time.sleep(0.05)
+        logger.info(f"Started embedding server (pid {process.pid}) on {socket_path}")
+        return process
+
+
+class RemoteEmbeddingFunction(CachedBatchingEmbeddingFunction):
+    """
+    Embeds through an ``EmbeddingServer``; the cache stays in this process.
+
+    Every calling thread keeps its own connection, so concurrent requests
+    reach the server at once and share its batches. With ``spawn`` (e.g.
+    a partial of ``ensure_server``), a missing server is started on first
+    use or after it went away.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        model_name: str,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 64,
+        spawn: Optional[Callable[[], Optional[subprocess.Popen]]] = None,
+        load_timeout: float = 300.0
+    ):
+        super().__init__(cache=cache, batch_size=batch_size)
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.spawn = spawn
+        self.load_timeout = load_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self._local = threading.local()
+        self._sockets: List[socket.socket] = []
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            if self.spawn is None:
+                raise EmbeddingError(f"No embedding server on {self.socket_path}")
+            with self._lock:
+                process = self.spawn()
+                if process is not None:
+                    self.process = process
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+        with self._lock:
+            self._sockets.append(sock)
+        return sock
+
+    def _drop_connection(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            with self._lock:
+                if sock in self._sockets:
+                    self._sockets.remove(sock)
+            sock.close()
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket, size: int) -> bytearray:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            n = sock.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionError("Embedding server closed the connection")
+            received += n
+        return buffer
+
+    def _call(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytearray]:
+        data = _header(request)
+        # One retry on a fresh connection: the server may have restarted
+        for attempt in range(2):
+            try:
+                if getattr(self._local, "sock", None) is None:
+                    self._local.sock = self._connect()
+                sock = self._local.sock
+                sock.sendall(data)
+                length = _LENGTH.unpack(self._recv_exactly(sock, _LENGTH.size))[0]
+                header = json.loads(bytes(self._recv_exactly(sock, length)))
+                payload = self._recv_exactly(sock, header["bytes"]) if header["bytes"] else bytearray()
+                break
+            except (ConnectionError, OSError) as e:
+                self._drop_connection()
+                if attempt:
+                    raise EmbeddingError(f"Embedding server unreachable: {e}")
+        if header.get("error"):
+            raise EmbeddingError(header["error"])
+        return header, payload
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """Embeddings as a (texts, dim) float32 view on the received bytes."""
+        header, payload = self._call({"op": "embed", "texts": texts})
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["rows"], header["dim"])
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        # Chroma and the cache take lists
+        return self.embed_array(texts).tolist()
+
+    def stats(self) -> Dict[str, Any]:
+        """The server's queue depth, batch sizes and timings."""
+        header, _ = self._call({"op": "stats"})
+        header.pop("bytes", None)
+        return header
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def load(self) -> None:
+        """Wait until the server (started if need be) has its model loaded."""
+        deadline = time.monotonic() + self.load_timeout
+        while True:
+            stats = self.stats()
+            if stats["load_error"]:
+                raise EmbeddingError(f"Embedding server could not load {self.model_name}: {stats['load_error']}")
+            if stats["ready"]:
+                self._ready = True
+                return
+            if time.monotonic() > deadline:
+                raise EmbeddingError(f"Embedding model not loaded after {self.load_timeout:.0f}s")
+            time.sleep(0.2)
+
+    def close(self) -> None:
+        """Close the connections, and stop the server if this process started it."""
+        with self._lock:
+            sockets, self._sockets = self._sockets, []
+        for sock in sockets:
+            sock.close()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+            self.process = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local embedding server with dynamic micro-batching")
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    serve(
+        args.socket,
+        partial(sentence_transformer_encoder, args.model, args.max_batch),
+        model_name=args.model,
+        max_batch=args.max_batch,
+        max_wait_ms=args.max_wait_ms
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import ExitStack
+from functools import partial
+from itertools import chain
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, List, Optional, Tuple
+
+from app.core import telemetry
+from app.services import chunking, dedup, ocr, pdf_processor, video_processor
+from app.services.jobs import UNFINISHED_STATES, JobContext, JobQueue
+from app.services.reindex import Throttle, reindex_vectors
+
+if TYPE_CHECKING:
+    from app.core.container import Services
+
+logger = logging.getLogger(__name__)
+
+
+def _store_chunks(services: "Services", ctx: JobContext, chunks, doc_type: str, progress=dict) -> dict:
+    """
+    Store a stream of chunks in fixed-size batches as they are produced.
+
+    Batches go through the vector store's write buffer, where they
+    coalesce with other jobs' writes; the buffer is flushed before the job
+    completes so the file is searchable once the job reports done.
+
+    ``progress`` is called after every batch and returns extra counters
+    (pages or seconds done) to report alongside the chunk counts. Before
+    each batch the job gives way to queries for up to ``INGEST_YIELD_MS``,
+    as both need the embedding model.
+    """
+    payload = ctx.payload
+    # Jobs queued before sharding have no shard and belong to the default tenant
+    store = services.shard_router.store(payload.get("shard") or dedup.DEFAULT_TENANT)
+    ingested_at = int(time.time())
+    stored = 0
+    admission = services.admission
+    throttle = Throttle(0, busy=lambda: admission.busy("query"), max_pause=services.settings.INGEST_YIELD_MS / 1000)
+    for batch in pdf_processor.iter_batches(chunks, services.settings.INGEST_BATCH_SIZE):
+        throttle.wait(len(batch))
+        documents, metadatas = chunking.chunk_documents(
+            batch, payload["filename"], payload["file_id"], doc_type, ingested_at=ingested_at
+        )
+        store.write(documents, metadatas)
+        stored += len(documents)
+        ctx.update(stage="embedding", chunks_done=stored, **progress())
+    ctx.update(stage="storing", chunks_total=stored)
+    store.flush()
+    services.answer_cache.invalidate_file(payload["file_id"])
+    return {"file_id": payload["file_id"], "chunks": stored}
+
+
+def _content_hash(services: "Services", payload: dict) -> str:
+    """Hash of the file's bytes; jobs queued before it was in the payload hash the file now."""
+    content_hash = payload.get("content_hash")
+    if content_hash is None:
+        content_hash = dedup.hash_file(payload["file_path"])
+        services.file_registry.set_content_hash(payload["file_id"], content_hash)
+    return content_hash
+
+
+def ingest_pdf(services: "Services", ctx: JobContext) -> dict:
+    settings = services.settings
+    payload = ctx.payload
+    content_hash = _content_hash(services, payload)
+    version = pdf_processor.extractor_version()
+    ctx.update(stage="extracting")
+
+    # Pages extracted from the same bytes by the same extractor are read back
+    # instead of parsing the PDF again
+    artifact = services.artifacts.load(content_hash, "pages", version)
+    if artifact is not None:
+        total_pages = artifact.meta.get("pages", len(artifact))
+        pages = telemetry.TimedIterator(pdf_processor.stored_pages(artifact.records()))
+    else:
+        total_pages = ctx.run_cpu(pdf_processor.page_count, payload["file_path"])
+        # Pages stream back from the worker processes in document order and are
+        # chunked and stored as they arrive, so only a few ranges are ever in memory.
+        pages = telemetry.TimedIterator(services.artifacts.recorded(
+            pdf_processor.iter_pages(
+                payload["file_path"],
+                executor=ctx.process_pool,
+                pages_per_task=settings.PDF_PAGES_PER_TASK,
+                max_in_flight=settings.INGEST_PROCESSES * 2,
+                total_pages=total_pages,
+                ordered=True
+            ),
+            content_hash,
+            "pages",
+            version,
+            pdf_processor.PAGE_COLUMNS,
+            meta={"pages": total_pages}
+        ))
+    ctx.update(pages_total=total_pages, pages_done=0, chunks_done=0)
+    seen = {"pages_done": 0}
+
+    def counted(pages):
+        for page in pages:
+            seen["pages_done"] = page["page"]
+            yield page
+
+    # Parsing, chunking and storing interleave; the time spent waiting for
+    # pages and for chunks is added up and reported once the file is done
+    chunks = telemetry.TimedIterator(services.chunker.chunk_units(chunking.pdf_units(counted(pages))))
+    result = _store_chunks(services, ctx, chunks, "pdf", progress=lambda: dict(seen))
+    telemetry.record("artifact_read" if artifact is not None else "pdf_parse", pages.seconds, pages=total_pages)
+    telemetry.record("chunk", chunks.seconds - pages.seconds, chunks=result["chunks"])
+    ctx.update(pages_done=total_pages)
+    return dict(result, pages=total_pages, reused_extraction=artifact is not None)
+
+
+class _Prefetch:
+    """
+    Produces the items of an iterator on a thread of its own, so they are
+    ready by the time the job gets to them. ``seconds`` is the time spent
+    producing them; ``close`` stops the thread early.
+    """
+
+    _DONE = object()
+
+    def __init__(self, iterable: Iterable[Any], name: str):
+        self.seconds = 0.0
+        self._items: "queue.Queue[Tuple[Any, Optional[BaseException]]]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(iterable,), name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self, iterable: Iterable[Any]) -> None:
+        items = telemetry.TimedIterator(iterable)
+        try:
+            for item in items:
+                if self._stop.is_set():
+                    break
+                self._items.put((item, None))
+            self._items.put((self._DONE, None))
+        except BaseException as e:
+            self._items.put((self._DONE, e))
+        finally:
+            # A generator stopped early cleans up (an unfinished artifact) now
+            getattr(iterable, "close", lambda: None)()
+            self.seconds = items.seconds
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            item, error = self._items.get()
+            if error is not None:
+                raise error
+            if item is self._DONE:
+                return
+            yield item
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def ingest_video(services: "Services", ctx: JobContext) -> dict:
+    """
+    Index a video's transcript, then the text shown on its keyframes;
+    both chunk kinds carry the ``start``/``end`` seconds they come from.
+    Keyframes are read on a thread of their own while the audio is
+    transcribed, sharing the job queue's process pool.
+    """
+    payload = ctx.payload
+    content_hash = _content_hash(services, payload)
+    with ExitStack() as cleanup:
+        segments, transcript_reused = _transcript(services, ctx, content_hash, cleanup)
+        segments = telemetry.TimedIterator(segments)
+        keyframes, keyframes_reused = _keyframes(services, ctx, content_hash) or (None, None)
+        if keyframes is not None:
+            keyframes = _Prefetch(keyframes, name=f"keyframes-{ctx.job_id}")
+            cleanup.callback(keyframes.close)
+        seen = {"seconds_done": 0.0}
+
+        def counted(segments):
+            for segment in segments:
+                seen["seconds_done"] = segment["end"]
+                yield segment
+
+        def counted_frames(keyframes):
+            ctx.update(stage="reading_frames")
+            seen["keyframes_done"] = 0
+            for keyframe in keyframes:
+                seen["keyframes_done"] += 1
+                yield keyframe
+
+        ctx.update(stage="transcribing", chunks_done=0)
+        # Waiting for keyframes still being read counts as chunking
+        chunks = telemetry.TimedIterator(services.chunker.chunk_units(chain(
+            chunking.transcript_units(counted(segments)),
+            chunking.frame_units(counted_frames(keyframes)) if keyframes is not None else ()
+        )))
+        result = _store_chunks(services, ctx, chunks, "video", progress=lambda: dict(seen))
+    telemetry.record("artifact_read" if transcript_reused else "transcribe", segments.seconds, audio_seconds=seen["seconds_done"])
+    if keyframes is not None:
+        telemetry.record("artifact_read" if keyframes_reused else "frame_ocr", keyframes.seconds, keyframes=seen["keyframes_done"])
+    telemetry.record("chunk", chunks.seconds - segments.seconds, chunks=result["chunks"])
+    return dict(
+        result,
+        keyframes=seen.get("keyframes_done", 0),
+        reused_extraction=transcript_reused and keyframes_reused is not False
+    )
+
+
+def _transcript(services: "Services", ctx: JobContext, content_hash: str, cleanup: ExitStack) -> Tuple[Iterator[dict], bool]:
+    """
+    Transcript segments of the video: from a stored transcript of the
+    same bytes (skipping audio extraction and transcription), or
+    transcribed now and stored as they go by.
+
+    Returns:
+        The segments, and whether they were stored before
+    """
+    settings = services.settings
+    payload = ctx.payload
+    version = video_processor.transcript_version(
+        settings.TRANSCRIBE_BACKEND, settings.WHISPER_MODEL, settings.TRANSCRIBE_WINDOW_SECONDS
+    )
+    artifact = services.artifacts.load(content_hash, "transcript", version)
+    if artifact is not None:
+        return artifact.records(), True
+
+    ctx.update(stage="extracting_audio")
+    with telemetry.span("audio_extract"):
+        audio_path = ctx.run_cpu(video_processor.extract_audio, payload["file_path"])
+    if audio_path is None:
+        services.artifacts.save([], content_hash, "transcript", version, video_processor.SEGMENT_COLUMNS)
+        return iter(()), False
+    cleanup.callback(os.unlink, audio_path)
+    segments = services.artifacts.recorded(
+        video_processor.iter_transcript(
+            audio_path,
+            executor=ctx.process_pool,
+            backend=settings.TRANSCRIBE_BACKEND,
+            model_name=settings.WHISPER_MODEL,
+            window_seconds=settings.TRANSCRIBE_WINDOW_SECONDS,
+            max_in_flight=settings.INGEST_PROCESSES * 2
+        ),
+        content_hash,
+        "transcript",
+        version,
+        video_processor.SEGMENT_COLUMNS
+    )
+    return segments, False
+
+
+def _keyframes(services: "Services", ctx: JobContext, content_hash: str) -> Optional[Tuple[Iterator[dict], bool]]:
+    """
+    Text on the video's keyframes (see ``video_processor.iter_keyframes``),
+    stored or read now.
+
+    Returns:
+        The keyframes, and whether they were stored before; None when
+        ``VIDEO_FRAMES_PER_MINUTE`` is 0 or the OCR backend cannot be loaded
+    """
+    settings = services.settings
+    if settings.VIDEO_FRAMES_PER_MINUTE <= 0:
+        return None
+    version = video_processor.keyframe_version(
+        settings.OCR_BACKEND, settings.OCR_LANGUAGE, settings.VIDEO_FRAMES_PER_MINUTE, settings.VIDEO_FRAME_HASH_DISTANCE
+    )
+    artifact = services.artifacts.load(content_hash, "keyframes", version)
+    if artifact is not None:
+        return artifact.records(), True
+    try:
+        ocr.get_backend(settings.OCR_BACKEND, settings.OCR_LANGUAGE)
+    except (ImportError, OSError) as e:
+        logger.warning(f"Indexing the audio of {ctx.payload['filename']} only; OCR backend {settings.OCR_BACKEND} unavailable: {e}")
+        return None
+    keyframes = services.artifacts.recorded(
+        video_processor.iter_keyframes(
+            ctx.payload["file_path"],
+            executor=ctx.process_pool,
+            backend=settings.OCR_BACKEND,
+            language=settings.OCR_LANGUAGE,
+            frames_per_minute=settings.VIDEO_FRAMES_PER_MINUTE,
+            max_hash_distance=settings.VIDEO_FRAME_HASH_DISTANCE,
+            max_in_flight=settings.INGEST_PROCESSES * 2
+        ),
+        content_hash,
+        "keyframes",
+        version,
+        video_processor.KEYFRAME_COLUMNS
+    )
+    return keyframes, False
+
+
+def backfill_lexical_index(services: "Services", ctx: JobContext) -> dict:
+    """Index chunks stored before the lexical index existed."""
+    vector_store = services.vector_store
+    lexical_index = services.lexical_index
+    ctx.update(stage="indexing", chunks_total=vector_store.count(), chunks_done=0)
+    done = 0
+    for ids, documents, metadatas in vector_store.iter_documents():
+        lexical_index.add_many(
+            (cid, doc, dedup.filter_values(metadata or {}))
+            for cid, doc, metadata in zip(ids, documents, metadatas)
+        )
+        done += len(ids)
+        ctx.update(chunks_done=done)
+    lexical_index.compact()
+    return {"chunks": done}
+
+
+def train_vector_compression(services: "Services", ctx: JobContext) -> dict:
+    """Retrain the compressed scan codes of every shard."""
+    payload = ctx.payload
+    shard_router = services.shard_router
+    shards = shard_router.all_shards()
+    ctx.update(stage="training", shards_total=len(shards), shards_done=0)
+    layouts = {}
+    for shard in shards:
+        store = shard_router.store(shard)
+        if store.count() == 0 and payload["kind"] not in ("none", None):
+            continue
+        layouts[shard] = store.train_compression(
+            payload["kind"],
+            pca_dim=payload.get("pca_dim"),
+            pq_subvectors=payload.get("pq_subvectors") or services.settings.VECTOR_PQ_SUBVECTORS,
+            sample_size=payload.get("sample_size") or services.settings.VECTOR_COMPRESSION_SAMPLE
+        )
+        ctx.update(shards_done=len(layouts))
+    return {"shards": layouts}
+
+
+def misplaced_files(services: "Services") -> List[Tuple[dict, str]]:
+    """Registered files whose shard is not where the current placement puts them, with their target shard."""
+    moves = []
+    for record in services.file_registry.files():
+        target = services.shard_router.place(record["tenant"], record["file_id"])
+        if record["shard"] != target:
+            moves.append((record, target))
+    return moves
+
+
+def rebalance_shards(services: "Services", ctx: JobContext) -> dict:
+    """
+    Move files to the shards the current ``VECTOR_SHARDS`` placement puts them in.
+
+    A file is copied into its new shard before it is dropped from the old
+    one, so queries (which search both while the registry lists both) keep
+    finding it. Its chunks are re-embedded from the embedding cache.
+    Files still being ingested are left for the next run.
+    """
+    shard_router = services.shard_router
+    moves = misplaced_files(services)
+    ctx.update(stage="moving", files_total=len(moves), files_done=0, chunks_moved=0)
+    moved = skipped = chunks = 0
+    for record, target in moves:
+        job = services.job_queue.get(record["job_id"]) if record["job_id"] else None
+        if job is not None and job["status"] in UNFINISHED_STATES:
+            skipped += 1
+            continue
+        source = shard_router.store(record["shard"])
+        found = source.collection.get(
+            where={dedup.file_flag(record["file_id"]): True},
+            include=["documents", "metadatas"]
+        )
+        shard_router.store(target).upsert(
+            found["documents"],
+            [dedup.file_metadata(metadata or {}, record["file_id"]) for metadata in found["metadatas"]]
+        )
+        services.file_registry.set_shard(record["file_hash"], target)
+        source.delete_file(record["file_id"])
+        moved += 1
+        chunks += len(found["ids"])
+        ctx.update(files_done=moved, chunks_moved=chunks)
+    return {"files_moved": moved, "files_skipped": skipped, "chunks_moved": chunks}
+
+
+def collect_artifacts(services: "Services", ctx: JobContext) -> dict:
+    """Delete extraction artifacts no registered file needs any more (see ``ArtifactStore.gc``)."""
+    settings = services.settings
+    ctx.update(stage="collecting")
+    return services.artifacts.gc(
+        services.file_registry.content_hashes(),
+        grace_seconds=ctx.payload.get("grace_hours", settings.ARTIFACT_GC_GRACE_HOURS) * 3600,
+        max_bytes=int(settings.ARTIFACT_MAX_MB * 2 ** 20)
+    )
+
+
+JOBS = {
+    "pdf": ingest_pdf,
+    "video": ingest_video,
+    "lexical_backfill": backfill_lexical_index,
+    "vector_compression": train_vector_compression,
+    "shard_rebalance": rebalance_shards,
+    "reindex": reindex_vectors,
+    "artifact_gc": collect_artifacts
+}
+
+
+def _traced(kind: str, handler, services: "Services", ctx: JobContext) -> dict:
+    """Run a job inside a trace, logged when the job is slower than ``TRACE_SLOW_MS``."""
+    pipeline = "ingest" if kind in ("pdf", "video") else "maintenance"
+    with telemetry.trace(pipeline, slow_ms=services.settings.TRACE_SLOW_MS, job=kind, job_id=ctx.job_id):
+        with telemetry.span("total"):
+            return handler(services, ctx)
+
+
+def register_jobs(job_queue: JobQueue, services: "Services") -> None:
+    for kind, handler in JOBS.items():
+        job_queue.register(kind, partial(_traced, kind, handler, services))
@@ -0,0 +1,277 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+UNFINISHED_STATES = (QUEUED, RUNNING)
+
+
+def new_job_id() -> str:
+    return str(uuid.uuid4())
+
+
+def _timestamp(iso: Optional[str]) -> float:
+    try:
+        return datetime.fromisoformat(iso).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class JobStore:
+    """File-backed store that keeps one JSON document per job."""
+
+    def __init__(self, directory: str):
+        """
+        Initialize the job store.
+
+        Args:
+            directory: Directory holding the job state files
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def save(self, job: Dict[str, Any]) -> None:
+        """Write a job record atomically so a crash never leaves a torn file."""
+        path = self._path(job["job_id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def delete(self, job_id: str) -> None:
+        try:
+            os.unlink(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        jobs = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    jobs.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.error(f"Skipping unreadable job file {name}: {str(e)}")
+        return jobs
+
+
+class JobContext:
+    """Handle passed to job handlers for reading the payload and reporting progress."""
+
+    def __init__(self, queue: "JobQueue", job_id: str, payload: Dict[str, Any]):
+        self._queue = queue
+        self.job_id = job_id
+        self.payload = payload
+
+    def update(self, stage: Optional[str] = None, **progress: Any) -> None:
+        """Record the current stage and any progress counters (pages_done, chunks_total, ...)."""
+        self._queue._update(self.job_id, stage=stage, progress=progress)
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        """Shared process pool, for handlers that stream results from several tasks."""
+        return self._queue.process_pool
+
+    def run_cpu(self, fn: Callable, *args: Any) -> Any:
+        """Run a picklable, CPU-bound function on the shared process pool and wait for it."""
+        return self._queue.process_pool.submit(fn, *args).result()
+
+
+class JobQueue:
+    """
+    Bounded background queue for ingestion work.
+
+    Each job runs on a small thread pool; handlers push CPU-heavy work
+    (parsing, transcription) onto a shared process pool via
+    ``JobContext.run_cpu`` so the API event loop is never blocked.
+
+    Finished jobs are kept, in memory and on disk, for
+    ``retention_seconds`` and at most ``max_finished`` of them (0 for no
+    limit); older ones are forgotten, oldest first.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        max_workers: int = 2,
+        max_processes: int = 2,
+        retention_seconds: float = 0,
+        max_finished: int = 0
+    ):
+        self.store = store
+        self.max_processes = max_processes
+        self.retention_seconds = retention_seconds
+        self.max_finished = max_finished
+        self._handlers: Dict[str, Callable[[JobContext], Dict[str, Any]]] = {}
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # Finished jobs by when they finished (time.time()), oldest first
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        # (kind, status) of finished jobs forgotten since start, for ``counts``
+        self._forgotten: Counter = Counter()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        # Created on first use so importing the app does not fork workers
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.max_processes)
+            return self._process_pool
+
+    def register(self, kind: str, handler: Callable[[JobContext], Dict[str, Any]]) -> None:
+        """Register the handler that runs jobs of the given kind."""
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, payload: Dict[str, Any], job_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Queue a new job.
+
+        Args:
+            kind: Registered job kind, e.g. "pdf" or "video"
+            payload: JSON-serializable arguments for the handler
+            job_id: Id recorded elsewhere before the job was queued
+                (see ``new_job_id``); a new one by default
+
+        Returns:
+            The new job record
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+
+        now = datetime.now().isoformat()
+        job = {
+            "job_id": job_id or new_job_id(),
+            "kind": kind,
+            "status": QUEUED,
+            "stage": QUEUED,
+            "progress": {},
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with self._lock:
+            self._jobs[job["job_id"]] = job
+            self.store.save(job)
+        self._executor.submit(self._run, job["job_id"])
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return json.loads(json.dumps(job))
+        return self.store.load(job_id)
+
+    def counts(self) -> Dict[Tuple[str, str], int]:
+        """Jobs submitted or resumed by this process, by (kind, status)."""
+        with self._lock:
+            return dict(Counter((job["kind"], job["status"]) for job in self._jobs.values()) + self._forgotten)
+
+    def resume(self) -> int:
+        """
+        Re-queue jobs that were queued or running when the process stopped.
+
+        Returns:
+            Number of jobs resumed
+        """
+        resumed = 0
+        finished = []
+        for job in self.store.load_all():
+            if job.get("status") not in UNFINISHED_STATES:
+                finished.append((_timestamp(job.get("updated_at")), job["job_id"]))
+                continue
+            if job.get("kind") not in self._handlers:
+                logger.warning(f"Cannot resume job {job['job_id']}: unknown kind {job.get('kind')}")
+                continue
+            job["status"] = QUEUED
+            job["stage"] = QUEUED
+            job["updated_at"] = datetime.now().isoformat()
+            with self._lock:
+                self._jobs[job["job_id"]] = job
+                self.store.save(job)
+            self._executor.submit(self._run, job["job_id"])
+            resumed += 1
+        with self._lock:
+            for finished_at, job_id in sorted(finished):
+                self._finished[job_id] = finished_at
+            self._forget_finished()
+        if resumed:
+            logger.info(f"Resumed {resumed} unfinished ingestion job(s)")
+        return resumed
+
+    def _forget_finished(self) -> None:
+        """Drop finished jobs past the retention limits; the caller holds the lock."""
+        expired = time.time() - self.retention_seconds if self.retention_seconds else None
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            too_many = self.max_finished and len(self._finished) > self.max_finished
+            if not too_many and (expired is None or finished_at >= expired):
+                break
+            del self._finished[job_id]
+            job = self._jobs.pop(job_id, None)
+            if job is not None:
+                self._forgotten[(job["kind"], job["status"])] += 1
+            self.store.delete(job_id)
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _update(self, job_id: str, **changes: Any) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            progress = changes.pop("progress", None)
+            if progress:
+                job["progress"].update(progress)
+            for key, value in changes.items():
+                if value is not None:
+                    job[key] = value
+            job["updated_at"] = datetime.now().isoformat()
+            self.store.save(job)
+
+    def _run(self, job_id: str) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            handler = self._handlers[job["kind"]]
+            payload = job["payload"]
+
+        self._update(job_id, status=RUNNING, stage="starting")
+        try:
+            result = handler(JobContext(self, job_id, payload))
+            self._update(job_id, status=COMPLETED, stage=COMPLETED, result=result or {})
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            self._update(job_id, status=FAILED, stage=FAILED, error=str(e))
+        with self._lock:
+            self._finished[job_id] = time.time()
+            self._forget_finished()
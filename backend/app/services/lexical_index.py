@@ -0,0 +1,384 @@
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+# Part numbers, error codes, versions: keep the whole identifier as one extra token
+_IDENT_RE = re.compile(r"\b\w+(?:[-./:]\w+)+")
+
+# Filter values live in the same postings as words, under a prefix no token can produce
+FILTER_PREFIX = "\x00"
+
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower()
+    return _WORD_RE.findall(text) + _IDENT_RE.findall(text)
+
+
+def filter_term(field: str, value: str) -> str:
+    return f"{FILTER_PREFIX}{field}={value}"
+
+
+class BM25Index:
+    """
+    Incremental, persistent BM25 inverted index.
+
+    Postings are kept as compact int32 doc / uint16 tf arrays. The last
+    snapshot is stored as CSR arrays that are memory-mapped on load, and
+    documents added since are held in small in-memory deltas that are
+    merged into a term's postings the first time that term is queried.
+    Every change is appended to a log that is replayed on start-up, and
+    ``compact`` folds log and deletions into a fresh snapshot.
+
+    Deleted documents are tombstoned; like Lucene, they still count
+    towards document frequencies until the next compaction.
+
+    Filterable metadata (type, file_id) is indexed as reserved terms, so
+    filters are applied with the same postings machinery as words.
+    """
+
+    def __init__(self, directory: str, k1: float = 1.2, b: float = 0.75, compact_every: int = 50_000):
+        """
+        Initialize the index, loading any snapshot and replaying the log.
+
+        Args:
+            directory: Directory holding the snapshot files and the log
+            k1: BM25 term-frequency saturation
+            b: BM25 length normalization
+            compact_every: Logged operations after which ``compact`` runs
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+
+        self._ids: List[Optional[str]] = []
+        self._lookup: Dict[str, int] = {}
+        self._lengths = array("I")
+        self._alive = bytearray()
+        self._live_count = 0
+        self._live_length = 0
+
+        # Snapshot postings (CSR, memory-mapped) plus per-term deltas
+        self._terms: Dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._base_docs = np.zeros(0, dtype=np.int32)
+        self._base_tfs = np.zeros(0, dtype=np.uint16)
+        self._pending: Dict[str, Tuple[array, array]] = {}
+        self._merged: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+        self._generation = 0
+        self._log_ops = 0
+        self._load()
+        self._log = open(self._path("log.jsonl"), "a")
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    # Persistence
+
+    def _snapshot_dir(self, generation: int) -> str:
+        return self._path(f"snapshot.{generation}")
+
+    def _load(self) -> None:
+        try:
+            with open(self._path("CURRENT")) as f:
+                self._generation = int(f.read().strip())
+        except FileNotFoundError:
+            self._generation = 0
+        if self._generation:
+            snapshot = self._snapshot_dir(self._generation)
+            with open(os.path.join(snapshot, "ids.json")) as f:
+                self._ids = json.load(f)
+            with open(os.path.join(snapshot, "terms.json")) as f:
+                self._terms = {term: i for i, term in enumerate(json.load(f))}
+            self._lookup = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            lengths = np.load(os.path.join(snapshot, "lengths.npy"))
+            self._lengths = array("I", lengths.astype(np.uint32).tobytes())
+            self._alive = bytearray(b"\x01" * len(self._ids))
+            self._live_count = len(self._ids)
+            self._live_length = int(lengths.sum())
+            self._offsets = np.load(os.path.join(snapshot, "offsets.npy"), mmap_mode="r")
+            self._base_docs = np.load(os.path.join(snapshot, "docs.npy"), mmap_mode="r")
+            self._base_tfs = np.load(os.path.join(snapshot, "tfs.npy"), mmap_mode="r")
+
+        log_path = self._path("log.jsonl")
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write
+                        logger.warning("Ignoring unreadable lexical index log entry")
+                        continue
+                    if op["op"] == "add":
+                        self._add(op["id"], Counter(op["terms"]), op["length"])
+                    elif op["op"] == "delete":
+                        self._delete(op["ids"])
+                    self._log_ops += 1
+
+    def _write_log(self, op: dict) -> None:
+        self._log.write(json.dumps(op) + "\n")
+        self._log_ops += 1
+
+    def flush(self) -> None:
+        with self._lock:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    def compact(self) -> None:
+        """Write a new snapshot without tombstones and truncate the log."""
+        with self._lock:
+            remap = np.full(len(self._ids), -1, dtype=np.int64)
+            alive = np.frombuffer(bytes(self._alive), dtype=np.uint8).astype(bool)
+            remap[alive] = np.arange(int(alive.sum()))
+
+            terms, offsets, doc_parts, tf_parts = [], [0], [], []
+            all_terms = set(self._terms) | set(self._pending) | set(self._merged)
+            for term in sorted(all_terms):
+                docs, tfs = self._postings(term)
+                keep = alive[docs] if len(docs) else np.zeros(0, dtype=bool)
+                if not keep.any():
+                    continue
+                terms.append(term)
+                doc_parts.append(remap[docs[keep]].astype(np.int32))
+                tf_parts.append(tfs[keep])
+                offsets.append(offsets[-1] + int(keep.sum()))
+
+            ids = [doc_id for doc_id, a in zip(self._ids, alive) if a]
+            lengths = np.frombuffer(self._lengths.tobytes(), dtype=np.uint32)[alive]
+            docs = np.concatenate(doc_parts) if doc_parts else np.zeros(0, dtype=np.int32)
+            tfs = np.concatenate(tf_parts) if tf_parts else np.zeros(0, dtype=np.uint16)
+
+            # Each snapshot goes to a new directory and CURRENT is switched
+            # atomically, so a crash never leaves a half-written snapshot and
+            # files still memory-mapped by readers are never truncated
+            generation = self._generation + 1
+            snapshot = self._snapshot_dir(generation)
+            os.makedirs(snapshot, exist_ok=True)
+            np.save(os.path.join(snapshot, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+            np.save(os.path.join(snapshot, "docs.npy"), docs)
+            np.save(os.path.join(snapshot, "tfs.npy"), tfs)
+            np.save(os.path.join(snapshot, "lengths.npy"), lengths)
+            with open(os.path.join(snapshot, "ids.json"), "w") as f:
+                json.dump(ids, f)
+            with open(os.path.join(snapshot, "terms.json"), "w") as f:
+                json.dump(terms, f)
+            tmp_path = self._path("CURRENT.tmp")
+            with open(tmp_path, "w") as f:
+                f.write(str(generation))
+            os.replace(tmp_path, self._path("CURRENT"))
+            if self._generation:
+                shutil.rmtree(self._snapshot_dir(self._generation), ignore_errors=True)
+
+            self._log.close()
+            self._log = open(self._path("log.jsonl"), "w")
+            self._log_ops = 0
+
+            self._ids, self._lookup = [], {}
+            self._lengths, self._alive = array("I"), bytearray()
+            self._live_count = self._live_length = 0
+            self._pending, self._merged = {}, {}
+            self._load()
+
+    # Updates
+
+    def _add(self, doc_id: str, terms: Counter, length: int) -> None:
+        if doc_id in self._lookup:
+            self._delete([doc_id])
+        internal = len(self._ids)
+        self._ids.append(doc_id)
+        self._lookup[doc_id] = internal
+        self._lengths.append(length)
+        self._alive.append(1)
+        self._live_count += 1
+        self._live_length += length
+        pending = self._pending
+        for term, tf in terms.items():
+            postings = pending.get(term)
+            if postings is None:
+                postings = pending[term] = (array("i"), array("H"))
+            postings[0].append(internal)
+            postings[1].append(min(tf, 65535))
+
+    def _delete(self, doc_ids: Iterable[str]) -> int:
+        removed = 0
+        for doc_id in doc_ids:
+            internal = self._lookup.pop(doc_id, None)
+            if internal is None:
+                continue
+            self._ids[internal] = None
+            self._alive[internal] = 0
+            self._live_count -= 1
+            self._live_length -= self._lengths[internal]
+            removed += 1
+        return removed
+
+    def add(self, doc_id: str, text: str, filters: Optional[Dict[str, Sequence[str]]] = None) -> None:
+        """
+        Index (or re-index) a document.
+
+        Args:
+            doc_id: External id, e.g. the chunk id in the vector store
+            text: Document text
+            filters: Filterable values, e.g. {"type": ["pdf"], "file_id": [...]}
+        """
+        self.add_many([(doc_id, text, filters)])
+
+    def add_many(self, docs: Iterable[Tuple[str, str, Optional[Dict[str, Sequence[str]]]]]) -> None:
+        with self._lock:
+            for doc_id, text, filters in docs:
+                tokens = tokenize(text)
+                terms = Counter(tokens)
+                for field, values in (filters or {}).items():
+                    for value in values:
+                        terms[filter_term(field, value)] = 1
+                self._add(doc_id, terms, len(tokens))
+                self._write_log({"op": "add", "id": doc_id, "terms": terms, "length": len(tokens)})
+            self._log.flush()
+            if self._log_ops >= self.compact_every:
+                self.compact()
+
+    def delete(self, doc_ids: Iterable[str]) -> int:
+        with self._lock:
+            doc_ids = list(doc_ids)
+            removed = self._delete(doc_ids)
+            if removed:
+                self._write_log({"op": "delete", "ids": doc_ids})
+                self._log.flush()
+            return removed
+
+    def doc_ids_for(self, field: str, value: str) -> List[str]:
+        """External ids of live documents carrying a filter value."""
+        with self._lock:
+            docs, _ = self._postings(filter_term(field, value))
+            return [self._ids[d] for d in docs if self._alive[d]]
+
+    # Queries
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        merged = self._merged.get(term)
+        pending = self._pending.pop(term, None)
+        if merged is None:
+            index = self._terms.get(term)
+            if index is None:
+                merged = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16))
+            else:
+                start, end = self._offsets[index], self._offsets[index + 1]
+                merged = (np.asarray(self._base_docs[start:end]), np.asarray(self._base_tfs[start:end]))
+        if pending is not None:
+            merged = (
+                np.concatenate([merged[0], np.frombuffer(pending[0], dtype=np.int32)]),
+                np.concatenate([merged[1], np.frombuffer(pending[1], dtype=np.uint16)])
+            )
+        if pending is not None or term in self._merged:
+            self._merged[term] = merged
+        return merged
+
+    def _allowed(self, filters: Dict[str, Sequence[str]]) -> Optional[np.ndarray]:
+        allowed = None
+        for field, values in filters.items():
+            if not values:
+                continue
+            docs = np.unique(np.concatenate(
+                [self._postings(filter_term(field, value))[0] for value in values]
+            ))
+            allowed = docs if allowed is None else np.intersect1d(allowed, docs, assume_unique=True)
+        return allowed
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        filters: Optional[Dict[str, Sequence[str]]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Score documents against ``query`` with BM25.
+
+        Args:
+            query: Free text; identifiers like ``ERR-4821`` also match whole
+            k: Number of results
+            filters: Only documents matching any value of every given field
+
+        Returns:
+            List of (doc_id, score), best first
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            if not terms or self._live_count == 0:
+                return []
+            # Document frequencies include tombstones until compaction, so the
+            # document count used for idf must include them too
+            n_docs = len(self._ids)
+            avg_length = self._live_length / self._live_count
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+            alive = np.frombuffer(self._alive, dtype=np.uint8)
+            allowed = self._allowed(filters) if filters else None
+            if allowed is not None and len(allowed) == 0:
+                return []
+
+            doc_parts, score_parts = [], []
+            for term in terms:
+                docs, tfs = self._postings(term)
+                if len(docs) == 0:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                tf = tfs.astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avg_length)
+                doc_parts.append(docs)
+                score_parts.append(idf * tf * (self.k1 + 1) / (tf + norm))
+            if not doc_parts:
+                return []
+
+            docs = np.concatenate(doc_parts)
+            scores = np.concatenate(score_parts)
+            keep = alive[docs].astype(bool)
+            if allowed is not None:
+                keep &= np.isin(docs, allowed)
+            docs, scores = docs[keep], scores[keep]
+            if len(docs) == 0:
+                return []
+
+            unique, inverse = np.unique(docs, return_inverse=True)
+            totals = np.bincount(inverse, weights=scores)
+            if len(totals) > k:
+                top = np.argpartition(-totals, k)[:k]
+            else:
+                top = np.arange(len(totals))
+            top = top[np.argsort(-totals[top])]
+            return [(self._ids[unique[i]], float(totals[i])) for i in top]
+
+    def __len__(self) -> int:
+        return self._live_count
+
+    def close(self) -> None:
+        with self._lock:
+            self._log.close()
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Merge ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in.
+
+    Returns:
+        List of (id, fused score), best first
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
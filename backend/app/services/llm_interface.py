@@ -1,49 +1,248 @@
-import os
-import requests
-from dotenv import load_dotenv
-from typing import Optional
+import asyncio
+import json
+import logging
+import random
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Optional
+
+from app.core import telemetry
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+class LLMError(Exception):
+    """Raised when the LLM API cannot produce a completion."""
+
+
+class StreamInterrupted(LLMError):
+    """A streamed completion ended before the API's ``[DONE]`` marker."""
 
-load_dotenv()
 
 class LLMInterface:
-    def __init__(self):
-        self.api_key = os.getenv("DEEPSEEK_API_KEY")
-        self.base_url = "https://api.deepseek.com/v1/chat/completions"
-        
-    def generate_response(self, prompt: str) -> str:
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 2000
-            }
-            
-            response = requests.post(
-                self.base_url,
-                headers=headers,
-                json=payload,
-                timeout=30
+    """
+    Async client for an OpenAI-compatible chat completions API.
+
+    One pooled ``httpx.AsyncClient`` is shared by all requests, a
+    semaphore caps concurrent upstream calls, and transient failures are
+    retried with exponential backoff and jitter, waiting no longer than
+    ``max_backoff`` even when the API asks for more with Retry-After.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        timeout: Optional[float] = None,
+        connect_timeout: float = 5.0,
+        backoff: float = 0.5,
+        max_backoff: Optional[float] = None
+    ):
+        self.api_key = api_key or settings.DEEPSEEK_API_KEY
+        self.base_url = base_url or settings.LLM_API_URL
+        self.model = model or settings.LLM_MODEL
+        self.max_concurrency = max_concurrency or settings.LLM_MAX_CONCURRENCY
+        self.max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+        # Imported here, not at startup: httpx is slow to import and only needed once a question is asked
+        import httpx
+        self.timeout = httpx.Timeout(timeout or settings.LLM_TIMEOUT, connect=connect_timeout)
+        self._retry_errors = (httpx.TransportError, httpx.TimeoutException)
+        self.backoff = backoff
+        self.max_backoff = settings.LLM_MAX_BACKOFF if max_backoff is None else max_backoff
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Calls holding / waiting for a concurrency slot, for /metrics
+        self.in_flight = 0
+        self.waiting = 0
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        # Created lazily inside the running event loop
+        if self._client is None or self._client.is_closed:
+            import httpx
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                ),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                }
             )
-            response.raise_for_status()
-            
-            return response.json()["choices"][0]["message"]["content"]
-            
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"API request failed: {str(e)}")
-        except KeyError:
-            raise Exception("Invalid response format from LLM API")
-
-# Singleton instance
-llm_interface = LLMInterface()
-
-def generate_response(prompt: str) -> str:
-    return llm_interface.generate_response(prompt)
\ No newline at end of file
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncIterator[None]:
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def build_payload(
+        self,
+        prompt: str,
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+        max_tokens: int = 2000,
+        temperature: float = 0.7,
+        stream: bool = False
+    ) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream
+        }
+
+    async def _sleep_before_retry(self, attempt: int, response: Optional["httpx.Response"], error: str) -> None:
+        delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+        if response is not None and response.headers.get("Retry-After"):
+            try:
+                delay = float(response.headers["Retry-After"])
+            except ValueError:
+                pass
+        delay = min(max(delay, 0.0), self.max_backoff)
+        logger.warning(f"LLM request failed ({error}); retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def generate_response(self, prompt: str, **options: Any) -> str:
+        """Return the full completion for ``prompt``."""
+        payload = self.build_payload(prompt, **options)
+        async with self._slot():
+            for attempt in range(self.max_retries + 1):
+                response = None
+                try:
+                    response = await self.client.post(self.base_url, json=payload)
+                    if response.status_code == 200:
+                        data = response.json()
+                        content = data["choices"][0]["message"]["content"]
+                        _count_usage(data.get("usage"))
+                        return content
+                    error = f"HTTP {response.status_code}: {response.text[:200]}"
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        raise LLMError(f"API request failed: {error}")
+                except self._retry_errors as e:
+                    error = str(e) or type(e).__name__
+                except (KeyError, IndexError, ValueError):
+                    raise LLMError("Invalid response format from LLM API")
+
+                if attempt < self.max_retries:
+                    await self._sleep_before_retry(attempt, response, error)
+            raise LLMError(f"API request failed: {error}")
+
+    async def stream_response(self, prompt: str, **options: Any) -> AsyncIterator[str]:
+        """
+        Yield completion tokens as the server sends them (server-sent events).
+
+        Retries only happen before the first token; once output has been
+        yielded a failure is raised to the caller. A stream that ends
+        without the ``[DONE]`` marker was cut short and raises
+        ``StreamInterrupted``, so a truncated answer is never taken for a
+        whole one.
+        """
+        payload = self.build_payload(prompt, stream=True, **options)
+        started = False
+        usage: Dict[str, Any] = {}
+        async with self._slot():
+            for attempt in range(self.max_retries + 1):
+                response = None
+                try:
+                    async with self.client.stream("POST", self.base_url, json=payload) as response:
+                        if response.status_code != 200:
+                            body = (await response.aread()).decode("utf-8", "replace")
+                            error = f"HTTP {response.status_code}: {body[:200]}"
+                            if response.status_code not in RETRY_STATUS_CODES:
+                                raise LLMError(f"API request failed: {error}")
+                        else:
+                            deltas = 0
+                            try:
+                                async for token in _iter_sse_tokens(response, usage):
+                                    started = True
+                                    deltas += 1
+                                    yield token
+                            finally:
+                                # Without a usage block each delta counts as one completion token
+                                _count_usage(usage or {"completion_tokens": deltas})
+                            return
+                except self._retry_errors as e:
+                    error = str(e) or type(e).__name__
+                    if started:
+                        raise StreamInterrupted(f"Stream interrupted: {error}")
+                except StreamInterrupted as e:
+                    error = str(e)
+                    if started:
+                        raise
+
+                if attempt < self.max_retries:
+                    await self._sleep_before_retry(attempt, response, error)
+            raise LLMError(f"API request failed: {error}")
+
+
+def _count_usage(usage: Optional[Dict[str, Any]]) -> None:
+    for kind in ("prompt", "completion"):
+        tokens = (usage or {}).get(f"{kind}_tokens")
+        if tokens:
+            telemetry.LLM_TOKENS.labels(kind).inc(tokens)
+
+
+async def _iter_sse_tokens(response: "httpx.Response", usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    """
+    Yield content deltas; a ``usage`` block, if the API sends one, is copied into ``usage``.
+
+    Raises:
+        StreamInterrupted: The body ended before ``[DONE]``
+    """
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            chunk = json.loads(data)
+            if chunk.get("usage"):
+                if usage is not None:
+                    usage.update(chunk["usage"])
+                # The usage block may come in a final chunk of its own
+                if not chunk.get("choices"):
+                    continue
+            choice = chunk["choices"][0]
+        except (ValueError, KeyError, IndexError, AttributeError):
+            raise LLMError("Invalid stream chunk from LLM API")
+        token = choice.get("delta", {}).get("content")
+        if token:
+            yield token
+    raise StreamInterrupted("Stream interrupted: the response ended before [DONE]")
@@ -0,0 +1,979 @@
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.quantization import Compressor
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+# Rows scored per matrix product, bounding the memory of a scan
+SCAN_ROWS = 32768
+
+_COMPARISONS = {"$gt", "$gte", "$lt", "$lte"}
+
+
+def _same(value: Any, target: Any) -> bool:
+    # True == 1 in Python, but not in a metadata filter
+    return isinstance(value, bool) == isinstance(target, bool) and value == target
+
+
+def _compare(value: Any, op: str, target: Any) -> bool:
+    if op == "$eq":
+        return _same(value, target)
+    if op == "$ne":
+        return not _same(value, target)
+    if op == "$in":
+        return any(_same(value, t) for t in target)
+    if op == "$nin":
+        return not any(_same(value, t) for t in target)
+    if op in _COMPARISONS:
+        numeric = all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (value, target))
+        if not numeric and not (isinstance(value, str) and isinstance(target, str)):
+            return False
+        if op == "$gt":
+            return value > target
+        if op == "$gte":
+            return value >= target
+        if op == "$lt":
+            return value < target
+        return value <= target
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def _mapped(path: str) -> np.ndarray:
+    # A plain ndarray view: np.memmap's __getitem__ is slow for small reads
+    return np.load(path, mmap_mode="r").view(np.ndarray)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class MmapCollection:
+    """
+    In-process vector collection over memory-mapped files.
+
+    Implements the part of Chroma's ``Collection`` API that the vector
+    store uses (``add``, ``upsert``, ``update``, ``get``, ``delete``,
+    ``query``, ``count``) with cosine distance, so it can stand in for a
+    Chroma collection behind ``VectorStore``.
+
+    Vectors are normalized and stored row by row in a memory-mapped file,
+    as float32, float16 or int8 with a per-row scale. Nothing is read
+    into RAM at start-up beyond the ids: the OS pages vectors in as
+    queries touch them.
+
+    Metadata of the last snapshot is kept columnar: per key a dictionary
+    of distinct values, and (row, value code) pairs sorted by key, so a
+    filter is evaluated once per distinct value rather than once per row.
+    Rows written since are held in memory and in an operation log that is
+    replayed on start-up, like ``BM25Index``; ``compact`` folds them and
+    deletions into a new snapshot, on a background thread once
+    ``compact_every`` operations are logged.
+
+    Search is exact, vectorized brute force until the collection reaches
+    ``ivf_threshold`` rows; from the next compaction on an IVF index
+    (spherical k-means lists, each stored as one contiguous run of the
+    vector file) narrows each query to its ``nprobe`` closest lists plus
+    the rows added since. Filtered queries that leave fewer
+    than the requested results in the probed lists fall back to an exact
+    scan of the matching rows.
+
+    With compression trained (``train_compression``), scans read compact
+    int8 or product-quantized codes held in memory instead of the vector
+    file, and only the best ``rescore_factor * k`` candidates per query
+    are rescored exactly from the stored vectors, so the vector file
+    stays mostly on disk.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        name: str = "rag_docs",
+        embedding_function=None,
+        metadata: Optional[Dict[str, Any]] = None,
+        dtype: str = "float32",
+        ivf_threshold: int = 50_000,
+        nprobe: int = 16,
+        compact_every: int = 20_000,
+        rescore_factor: int = 10
+    ):
+        """
+        Open (or create) a collection.
+
+        Args:
+            directory: Directory holding one sub-directory per collection
+            name: Collection name
+            embedding_function: Embeds documents added without embeddings
+                and query texts
+            metadata: Collection metadata, kept from creation on
+            dtype: Vector storage type: float32, float16 or int8; fixed
+                once the collection exists
+            ivf_threshold: Live rows from which compaction builds an IVF
+                index
+            nprobe: IVF lists scanned per query
+            compact_every: Logged operations after which ``compact`` runs
+            rescore_factor: With compression, candidates rescored exactly
+                per requested result
+        """
+        self.name = name
+        self.directory = os.path.join(directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+        self.embedding_function = embedding_function
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.compact_every = compact_every
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        # Held for a whole compaction, which only takes ``_lock`` to start and to swap
+        self._compact_lock = threading.Lock()
+        self._compaction: Optional[threading.Thread] = None
+
+        info_path = self._path("info.json")
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                info = json.load(f)
+        else:
+            if dtype not in DTYPES:
+                raise ValueError(f"Unknown vector dtype: {dtype}")
+            info = {"dtype": dtype, "dim": None, "metadata": metadata or {}}
+            self._write_info(info)
+        self._info = info
+        self.metadata = info["metadata"]
+        self.dtype = DTYPES[info["dtype"]]
+
+        self._compressor: Optional[Compressor] = None
+        if os.path.exists(self._path("compressor.npz")):
+            self._compressor = Compressor.load(self._path("compressor.npz"))
+        self._load()
+        self._log = open(self._path("log.jsonl"), "a")
+
+    def _path(self, *names: str) -> str:
+        return os.path.join(self.directory, *names)
+
+    def _write_info(self, info: Dict[str, Any]) -> None:
+        tmp_path = self._path("info.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp_path, self._path("info.json"))
+
+    # Persistence
+
+    def _snapshot_dir(self, generation: int) -> str:
+        return self._path(f"snapshot.{generation}")
+
+    def _load(self) -> None:
+        try:
+            with open(self._path("CURRENT")) as f:
+                self._generation = int(f.read().strip())
+        except FileNotFoundError:
+            self._generation = 0
+        snapshot = self._snapshot_dir(self._generation)
+        os.makedirs(snapshot, exist_ok=True)
+
+        self._ids: List[Optional[str]] = []
+        self._lookup: Dict[str, int] = {}
+        self._alive = bytearray()
+        self._live_count = 0
+        # Rows written since the snapshot: documents and current metadata
+        self._documents: Dict[int, str] = {}
+        self._metadatas: Dict[int, Dict[str, Any]] = {}
+
+        # Snapshot columns: key -> distinct values, and (key, row, code)
+        # triples sorted by key, plus a by-row permutation of them
+        self._keys: List[str] = []
+        self._key_index: Dict[str, int] = {}
+        self._values: List[List[Any]] = []
+        self._key_offsets = np.zeros(1, dtype=np.int64)
+        self._meta_keys = np.zeros(0, dtype=np.int32)
+        self._meta_rows = np.zeros(0, dtype=np.int32)
+        self._meta_codes = np.zeros(0, dtype=np.int32)
+        self._row_order = np.zeros(0, dtype=np.int64)
+        self._row_offsets = np.zeros(1, dtype=np.int64)
+        self._doc_bytes = np.zeros(0, dtype=np.uint8)
+        self._doc_offsets = np.zeros(1, dtype=np.int64)
+        self._snapshot_rows = 0
+
+        # IVF lists over the snapshot rows, which are stored list by list
+        self._centroids: Optional[np.ndarray] = None
+        self._list_offsets: Optional[np.ndarray] = None
+
+        ids_path = os.path.join(snapshot, "ids.json")
+        if os.path.exists(ids_path):
+            with open(ids_path) as f:
+                self._ids = json.load(f)
+            self._lookup = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            self._alive = bytearray(b"\x01" * len(self._ids))
+            self._live_count = self._snapshot_rows = len(self._ids)
+            with open(os.path.join(snapshot, "columns.json")) as f:
+                columns = json.load(f)
+            self._keys = [column["key"] for column in columns]
+            self._key_index = {key: i for i, key in enumerate(self._keys)}
+            self._values = [column["values"] for column in columns]
+            for name in ("key_offsets", "meta_keys", "meta_rows", "meta_codes", "row_order", "row_offsets", "doc_offsets"):
+                setattr(self, f"_{name}", _mapped(os.path.join(snapshot, f"{name}.npy")))
+            if os.path.getsize(os.path.join(snapshot, "documents.bin")):
+                self._doc_bytes = np.memmap(os.path.join(snapshot, "documents.bin"), dtype=np.uint8, mode="r").view(np.ndarray)
+            if os.path.exists(os.path.join(snapshot, "centroids.npy")):
+                self._centroids = np.load(os.path.join(snapshot, "centroids.npy"))
+                self._list_offsets = np.load(os.path.join(snapshot, "list_offsets.npy"))
+
+        self._vector_file: Optional[np.memmap] = None
+        self._scale_file: Optional[np.memmap] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        if self._info["dim"]:
+            self._open_vectors(len(self._ids))
+
+        self._log_ops = 0
+        log_path = self._path("log.jsonl")
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write
+                        logger.warning("Ignoring unreadable vector collection log entry")
+                        continue
+                    if op["op"] == "add":
+                        self._put(op["row"], op["id"], op["document"], op["metadata"])
+                    elif op["op"] == "update":
+                        self._metadatas[op["row"]] = op["metadata"]
+                    elif op["op"] == "delete":
+                        self._delete_rows(op["rows"])
+                    self._log_ops += 1
+
+        # Codes of every row, in memory; rows missing from the saved codes
+        # (logged after training) are encoded from the vector file
+        self._codes: Optional[np.ndarray] = None
+        if self._compressor is not None:
+            codes_path = os.path.join(snapshot, "codes.npy")
+            codes = np.load(codes_path)[:len(self._ids)] if os.path.exists(codes_path) else None
+            self._codes = self._encode_rows(np.arange(0 if codes is None else len(codes), len(self._ids)), codes)
+
+    def _open_vectors(self, rows: int) -> None:
+        """Map the vector file, growing it to hold at least ``rows`` rows."""
+        snapshot = self._snapshot_dir(self._generation)
+        dim = self._info["dim"]
+        path = os.path.join(snapshot, "vectors.bin")
+        itemsize = np.dtype(self.dtype).itemsize
+        capacity = os.path.getsize(path) // (dim * itemsize) if os.path.exists(path) else 0
+        if capacity < max(rows, 1):
+            capacity = max(1024, rows, 2 * capacity)
+            with open(path, "ab") as f:
+                f.truncate(capacity * dim * itemsize)
+            if self.dtype == np.int8:
+                with open(os.path.join(snapshot, "scales.bin"), "ab") as f:
+                    f.truncate(capacity * 4)
+        if self._vectors is not None and self._vectors.shape[0] == capacity:
+            return
+        self._flush_vectors()
+        self._vector_file = np.memmap(path, dtype=self.dtype, mode="r+", shape=(capacity, dim))
+        self._vectors = self._vector_file.view(np.ndarray)
+        if self.dtype == np.int8:
+            self._scale_file = np.memmap(os.path.join(snapshot, "scales.bin"), dtype=np.float32, mode="r+", shape=(capacity,))
+            self._scales = self._scale_file.view(np.ndarray)
+        self._advise_vectors()
+
+    def _advise_vectors(self) -> None:
+        # With codes in memory the vector file is only read row by row to
+        # rescore, and readahead would pull most of it into the page cache
+        if not hasattr(mmap, "MADV_RANDOM"):
+            return
+        advice = mmap.MADV_RANDOM if self._compressor is not None else mmap.MADV_NORMAL
+        for mapped in (self._vector_file, self._scale_file):
+            if mapped is not None:
+                mapped._mmap.madvise(advice)
+
+    def _flush_vectors(self) -> None:
+        for mapped in (self._vector_file, self._scale_file):
+            if mapped is not None:
+                mapped.flush()
+
+    def _encode_rows(self, rows: np.ndarray, codes: Optional[np.ndarray] = None, compressor: Optional[Compressor] = None) -> np.ndarray:
+        """Append the codes of ``rows`` (read from the vector file) to ``codes``."""
+        compressor = compressor or self._compressor
+        parts = [] if codes is None else [codes]
+        for start in range(0, len(rows), SCAN_ROWS):
+            parts.append(compressor.encode(self._vector_rows(rows[start:start + SCAN_ROWS])))
+        if not parts:
+            return compressor.encode(np.zeros((0, compressor.dim), dtype=np.float32))
+        return np.concatenate(parts)
+
+    def _save_codes(self, snapshot: str, codes: np.ndarray) -> None:
+        tmp_path = os.path.join(snapshot, "codes.npy.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, codes)
+        os.replace(tmp_path, os.path.join(snapshot, "codes.npy"))
+
+    def _write_log(self, op: dict) -> None:
+        self._log.write(json.dumps(op) + "\n")
+        self._log_ops += 1
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_vectors()
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    def compact(self) -> None:
+        """
+        Write a new snapshot without deleted rows, (re)build the IVF index and truncate the log.
+
+        The snapshot is built from the rows as they are when compaction
+        starts, without holding the lock, so queries and writes carry on;
+        writes made meanwhile are renumbered and logged against the new
+        snapshot when it is swapped in.
+        """
+        with self._compact_lock:
+            with self._lock:
+                self._log.flush()
+                state = {
+                    "alive": np.frombuffer(bytes(self._alive), dtype=np.uint8).astype(bool),
+                    "ids": list(self._ids),
+                    "documents": dict(self._documents),
+                    "metadatas": dict(self._metadatas),
+                    "dim": self._info["dim"],
+                    "vectors": self._vectors,
+                    "scales": self._scales,
+                    "compressor": self._compressor,
+                    "codes": self._codes,
+                    "log_size": os.path.getsize(self._path("log.jsonl"))
+                }
+            generation = self._generation + 1
+            rows = self._write_snapshot(self._snapshot_dir(generation), state)
+            with self._lock:
+                self._swap_snapshot(generation, rows, state)
+
+    def _write_snapshot(self, snapshot: str, state: Dict[str, Any]) -> np.ndarray:
+        """
+        Write the snapshot of the rows alive in ``state``.
+
+        Only reads what no write changes: ``state``, the current snapshot's
+        files and the vector rows that existed when ``state`` was taken.
+
+        Returns:
+            The old row of each new row
+        """
+        alive, old_ids = state["alive"], state["ids"]
+        rows = np.flatnonzero(alive)
+        centroids = None
+        if state["dim"] and len(rows) >= self.ivf_threshold:
+            # Write the snapshot list by list, so that probing a list
+            # reads one contiguous run of the vector file
+            centroids, assign = self._train_ivf(rows)
+            rows = rows[np.argsort(assign, kind="stable")]
+            list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))])
+        shutil.rmtree(snapshot, ignore_errors=True)
+        os.makedirs(snapshot)
+
+        ids = [old_ids[r] for r in rows]
+        remap = np.full(len(old_ids), -1, dtype=np.int64)
+        remap[rows] = np.arange(len(rows))
+
+        documents = bytearray()
+        doc_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        for new_row, row in enumerate(rows.tolist()):
+            document = state["documents"].get(row)
+            if document is None:
+                documents += self._doc_bytes[self._doc_offsets[row]:self._doc_offsets[row + 1]].tobytes()
+            else:
+                documents += document.encode("utf-8")
+            doc_offsets[new_row + 1] = len(documents)
+
+        # Snapshot rows that were not rewritten keep their column
+        # entries as they are; rewritten rows are re-encoded
+        values = [list(v) for v in self._values]
+        codes = [{(type(value).__name__, value): code for code, value in enumerate(v)} for v in values]
+        key_index = dict(self._key_index)
+        keys = list(self._keys)
+        rewritten = np.zeros(len(old_ids), dtype=bool)
+        rewritten[list(state["metadatas"])] = True
+        kept = alive[:self._snapshot_rows] & ~rewritten[:self._snapshot_rows]
+        select = kept[self._meta_rows] if len(self._meta_rows) else np.zeros(0, dtype=bool)
+        key_parts = [np.asarray(self._meta_keys)[select].astype(np.int64)]
+        row_parts = [remap[np.asarray(self._meta_rows)[select]]]
+        code_parts = [np.asarray(self._meta_codes)[select].astype(np.int64)]
+        extra = []
+        for row, metadata in state["metadatas"].items():
+            if not alive[row]:
+                continue
+            for key, value in metadata.items():
+                if key not in key_index:
+                    key_index[key] = len(keys)
+                    keys.append(key)
+                    values.append([])
+                    codes.append({})
+                index = key_index[key]
+                code = codes[index].get((type(value).__name__, value))
+                if code is None:
+                    code = codes[index][(type(value).__name__, value)] = len(values[index])
+                    values[index].append(value)
+                extra.append((index, remap[row], code))
+        if extra:
+            extra = np.asarray(extra, dtype=np.int64)
+            key_parts.append(extra[:, 0])
+            row_parts.append(extra[:, 1])
+            code_parts.append(extra[:, 2])
+
+        # Drop keys no live row uses any more, and sort keys by name
+        meta_keys = np.concatenate(key_parts)
+        used = np.unique(meta_keys)
+        order = sorted(used.tolist(), key=lambda i: keys[i])
+        new_index = np.full(len(keys), -1, dtype=np.int64)
+        new_index[order] = np.arange(len(order))
+        meta_keys = new_index[meta_keys]
+        meta_rows = np.concatenate(row_parts)
+        meta_codes = np.concatenate(code_parts)
+        sort = np.lexsort((meta_rows, meta_keys))
+        meta_keys, meta_rows, meta_codes = (a[sort].astype(np.int32) for a in (meta_keys, meta_rows, meta_codes))
+        key_offsets = np.searchsorted(meta_keys, np.arange(len(order) + 1)).astype(np.int64)
+        row_order = np.argsort(meta_rows, kind="stable").astype(np.int64)
+        row_offsets = np.searchsorted(meta_rows[row_order], np.arange(len(rows) + 1)).astype(np.int64)
+        columns = [{"key": keys[i], "values": values[i]} for i in order]
+
+        with open(os.path.join(snapshot, "ids.json"), "w") as f:
+            json.dump(ids, f)
+        with open(os.path.join(snapshot, "columns.json"), "w") as f:
+            json.dump(columns, f)
+        with open(os.path.join(snapshot, "documents.bin"), "wb") as f:
+            f.write(documents)
+        for name, array in (
+            ("key_offsets", key_offsets), ("meta_keys", meta_keys), ("meta_rows", meta_rows),
+            ("meta_codes", meta_codes), ("row_order", row_order), ("row_offsets", row_offsets),
+            ("doc_offsets", doc_offsets)
+        ):
+            np.save(os.path.join(snapshot, f"{name}.npy"), array)
+
+        if state["dim"]:
+            vectors = np.memmap(
+                os.path.join(snapshot, "vectors.bin"), dtype=self.dtype, mode="w+", shape=(max(len(rows), 1), state["dim"])
+            )
+            scales = None
+            if self.dtype == np.int8:
+                scales = np.memmap(os.path.join(snapshot, "scales.bin"), dtype=np.float32, mode="w+", shape=(max(len(rows), 1),))
+            for start in range(0, len(rows), SCAN_ROWS):
+                block = rows[start:start + SCAN_ROWS]
+                vectors[start:start + len(block)] = state["vectors"][block]
+                if scales is not None:
+                    scales[start:start + len(block)] = state["scales"][block]
+            vectors.flush()
+            del vectors
+            if scales is not None:
+                scales.flush()
+                del scales
+        if state["codes"] is not None:
+            self._save_codes(snapshot, state["codes"][rows])
+        if centroids is not None:
+            np.save(os.path.join(snapshot, "centroids.npy"), centroids)
+            np.save(os.path.join(snapshot, "list_offsets.npy"), list_offsets.astype(np.int64))
+        return rows
+
+    def _swap_snapshot(self, generation: int, rows: np.ndarray, state: Dict[str, Any]) -> None:
+        """Carry writes made since ``state`` over to the new snapshot and switch to it."""
+        snapshot = self._snapshot_dir(generation)
+        old_rows, new_rows = len(state["ids"]), len(rows)
+        remap = np.full(old_rows, -1, dtype=np.int64)
+        remap[rows] = np.arange(new_rows)
+
+        def renumber(row: int) -> int:
+            # Rows added meanwhile follow the snapshot rows in order
+            return int(remap[row]) if row < old_rows else new_rows + row - old_rows
+
+        self._log.flush()
+        ops = []
+        with open(self._path("log.jsonl")) as f:
+            f.seek(state["log_size"])
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    continue
+                if op["op"] == "delete":
+                    op["rows"] = [renumber(row) for row in op["rows"]]
+                else:
+                    op["row"] = renumber(op["row"])
+                ops.append(op)
+
+        # Vectors of rows added meanwhile
+        added = len(self._ids) - old_rows
+        if added and self._info["dim"]:
+            dim = self._info["dim"]
+            for name, dtype, shape, source in (
+                ("vectors.bin", self.dtype, (dim,), self._vectors),
+                ("scales.bin", np.float32, (), self._scales)
+            ):
+                if source is None:
+                    continue
+                path = os.path.join(snapshot, name)
+                size = (new_rows + added) * int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+                with open(path, "ab") as f:
+                    if f.tell() < size:
+                        f.truncate(size)
+                mapped = np.memmap(path, dtype=dtype, mode="r+", shape=(new_rows + added, *shape))
+                mapped[new_rows:] = source[old_rows:old_rows + added]
+                mapped.flush()
+                del mapped
+        if self._compressor is not state["compressor"] and os.path.exists(os.path.join(snapshot, "codes.npy")):
+            # Compression was retrained or dropped meanwhile: re-encode on load
+            os.unlink(os.path.join(snapshot, "codes.npy"))
+
+        tmp_log = self._path("log.jsonl.tmp")
+        with open(tmp_log, "w") as f:
+            for op in ops:
+                f.write(json.dumps(op) + "\n")
+
+        # Each snapshot goes to a new directory and CURRENT is switched
+        # atomically, so a crash never leaves a half-written snapshot
+        tmp_path = self._path("CURRENT.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(generation))
+        os.replace(tmp_path, self._path("CURRENT"))
+        previous = self._snapshot_dir(self._generation)
+
+        self._log.close()
+        os.replace(tmp_log, self._path("log.jsonl"))
+        self._flush_vectors()
+        self._vector_file = self._scale_file = self._vectors = self._scales = None
+        self._load()
+        self._log = open(self._path("log.jsonl"), "a")
+        shutil.rmtree(previous, ignore_errors=True)
+
+    def _train_ivf(self, rows: np.ndarray, iterations: int = 10, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Spherical k-means over a sample of ``rows``.
+
+        Returns:
+            Tuple of (centroids, list of every row in ``rows``)
+        """
+        n_lists = int(min(4096, max(16, math.sqrt(len(rows)))))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(rows, size=min(len(rows), max(n_lists * 32, 10_000), 131_072), replace=False))
+        train = self._vector_rows(sample)
+        centroids = train[rng.choice(len(train), size=n_lists, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            counts = np.bincount(assign, minlength=n_lists)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            empty = counts == 0
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(train[np.argsort(assign, kind="stable")], starts[~empty], axis=0)
+            sums[empty] = train[rng.choice(len(train), size=int(empty.sum()), replace=False)]
+            centroids = _normalize(sums)
+
+        assign = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), SCAN_ROWS):
+            assign[start:start + SCAN_ROWS] = np.argmax(self._vector_rows(rows[start:start + SCAN_ROWS]) @ centroids.T, axis=1)
+        logger.info(f"Built IVF index with {n_lists} lists over {len(rows)} vectors")
+        return centroids.astype(np.float32), assign
+
+    # Compression
+
+    def train_compression(
+        self,
+        kind: Optional[str],
+        pca_dim: Optional[int] = None,
+        pq_subvectors: int = 48,
+        sample_size: int = 65536,
+        seed: int = 0
+    ) -> Dict[str, Any]:
+        """
+        (Re)train the compressed codes used to scan, or drop them.
+
+        Trains on a sample of the live vectors and encodes every row
+        without holding the lock, so queries and writes carry on; rows
+        written meanwhile are encoded before the new codes are swapped in.
+
+        Args:
+            kind: "int8", "pq", or None / "none" to search the stored
+                vectors directly again
+            pca_dim: Project to this many dimensions first
+            pq_subvectors: Bytes per vector for "pq"
+            sample_size: Vectors to train on
+
+        Returns:
+            ``describe()`` of the collection afterwards
+        """
+        if kind in (None, "none"):
+            with self._lock:
+                self._compressor = self._codes = None
+                self._advise_vectors()
+                if os.path.exists(self._path("compressor.npz")):
+                    os.unlink(self._path("compressor.npz"))
+            return self.describe()
+
+        with self._lock:
+            live = np.flatnonzero(np.frombuffer(self._alive, dtype=np.uint8))
+            generation, n_rows = self._generation, len(self._ids)
+        if not len(live):
+            raise ValueError("The collection is empty; nothing to train compression on")
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(live, size=min(len(live), sample_size), replace=False))
+        compressor = Compressor(kind, pca_dim, pq_subvectors).fit(self._vector_rows(sample), seed=seed)
+        codes = self._encode_rows(np.arange(n_rows), compressor=compressor)
+
+        with self._lock:
+            if self._generation != generation:
+                # A compaction renumbered the rows meanwhile
+                codes = self._encode_rows(np.arange(len(self._ids)), compressor=compressor)
+            else:
+                codes = self._encode_rows(np.arange(n_rows, len(self._ids)), codes, compressor=compressor)
+            self._save_codes(self._snapshot_dir(self._generation), codes)
+            compressor.save(self._path("compressor.npz"))
+            self._compressor, self._codes = compressor, codes
+            self._advise_vectors()
+        logger.info(f"Trained {kind} compression over {len(sample)} vectors ({compressor.code_bytes} bytes per vector)")
+        return self.describe()
+
+    def describe(self) -> Dict[str, Any]:
+        """Storage layout and the memory it takes."""
+        with self._lock:
+            dim = self._info["dim"] or 0
+            vector_bytes = dim * np.dtype(self.dtype).itemsize + (4 if self._scales is not None else 0)
+            scan_bytes = self._compressor.code_bytes if self._compressor is not None else vector_bytes
+            return {
+                "rows": self._live_count,
+                "dim": dim,
+                "dtype": self._info["dtype"],
+                "ivf_lists": len(self._centroids) if self._centroids is not None else 0,
+                "compression": self._compressor.describe() if self._compressor is not None else None,
+                "rescore_factor": self.rescore_factor if self._compressor is not None else None,
+                "vector_bytes": vector_bytes,
+                # What a full scan keeps resident: codes, or the whole vector file
+                "scan_bytes_per_vector": scan_bytes,
+                "scan_mb_per_million": round(scan_bytes * 1e6 / 2 ** 20, 1),
+                "scan_mb": round(scan_bytes * self._live_count / 2 ** 20, 1)
+            }
+
+    # Rows
+
+    def _document(self, row: int) -> str:
+        document = self._documents.get(row)
+        if document is None and row < self._snapshot_rows:
+            start, end = self._doc_offsets[row], self._doc_offsets[row + 1]
+            document = bytes(self._doc_bytes[start:end]).decode("utf-8")
+        return document
+
+    def _metadata(self, row: int) -> Dict[str, Any]:
+        metadata = self._metadatas.get(row)
+        if metadata is not None:
+            return dict(metadata)
+        metadata = {}
+        if row < self._snapshot_rows:
+            for entry in self._row_order[self._row_offsets[row]:self._row_offsets[row + 1]]:
+                key = int(self._meta_keys[entry])
+                metadata[self._keys[key]] = self._values[key][int(self._meta_codes[entry])]
+        return metadata
+
+    def _put(self, row: int, doc_id: str, document: str, metadata: Dict[str, Any]) -> None:
+        while len(self._ids) <= row:
+            self._ids.append(None)
+            self._alive.append(0)
+        self._ids[row] = doc_id
+        self._lookup[doc_id] = row
+        self._alive[row] = 1
+        self._live_count += 1
+        self._documents[row] = document
+        self._metadatas[row] = metadata
+
+    def _delete_rows(self, rows: Sequence[int]) -> None:
+        for row in rows:
+            if row < len(self._alive) and self._alive[row]:
+                self._alive[row] = 0
+                self._live_count -= 1
+                self._lookup.pop(self._ids[row], None)
+                self._documents.pop(row, None)
+                self._metadatas.pop(row, None)
+
+    def _vector_rows(self, rows: np.ndarray) -> np.ndarray:
+        block = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[rows][:, None]
+        return block
+
+    def _embed(self, documents: Sequence[str], embeddings) -> np.ndarray:
+        if embeddings is None:
+            if self.embedding_function is None:
+                raise ValueError("No embeddings given and no embedding function set")
+            embeddings = self.embedding_function(list(documents))
+        return np.asarray(embeddings, dtype=np.float32).reshape(len(documents), -1)
+
+    def _append(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Dict[str, Any]], vectors: np.ndarray) -> None:
+        if not self._info["dim"]:
+            self._info["dim"] = int(vectors.shape[1])
+            self._write_info(self._info)
+        elif vectors.shape[1] != self._info["dim"]:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimensionality {self._info['dim']}")
+        vectors = _normalize(vectors)
+        start = len(self._ids)
+        self._open_vectors(start + len(ids))
+        if self.dtype == np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self._vectors[start:start + len(ids)] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self._scales[start:start + len(ids)] = scales
+        else:
+            self._vectors[start:start + len(ids)] = vectors.astype(self.dtype)
+        if self._codes is not None:
+            codes = self._compressor.encode(vectors)
+            if len(self._codes) < start + len(ids):
+                grown = np.zeros((max(2 * len(self._codes), start + len(ids)), codes.shape[1]), dtype=codes.dtype)
+                grown[:len(self._codes)] = self._codes
+                self._codes = grown
+            self._codes[start:start + len(ids)] = codes
+        # Vectors are in the mapped file before the log says the rows exist
+        for offset, (doc_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+            metadata = dict(metadata or {})
+            self._put(start + offset, doc_id, document, metadata)
+            self._write_log({"op": "add", "row": start + offset, "id": doc_id, "document": document, "metadata": metadata})
+
+    def _maybe_compact(self) -> None:
+        self._log.flush()
+        if self._log_ops >= self.compact_every and not (self._compaction and self._compaction.is_alive()):
+            self._compaction = threading.Thread(target=self._compact_in_background, name=f"compact-{self.name}", daemon=True)
+            self._compaction.start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            logger.exception(f"Compaction of vector collection {self.name} failed")
+
+    # Collection API
+
+    def add(self, ids: Sequence[str], documents: Sequence[str], metadatas: Optional[Sequence[Dict[str, Any]]] = None, embeddings=None) -> None:
+        """Add new rows; ids that already exist are skipped, as in Chroma."""
+        metadatas = metadatas or [{}] * len(ids)
+        with self._lock:
+            keep = [i for i, doc_id in enumerate(ids) if doc_id not in self._lookup]
+            if len(keep) < len(ids):
+                logger.warning(f"Skipping {len(ids) - len(keep)} existing id(s) on add")
+            if not keep:
+                return
+            vectors = self._embed([documents[i] for i in keep], None if embeddings is None else [embeddings[i] for i in keep])
+            self._append([ids[i] for i in keep], [documents[i] for i in keep], [metadatas[i] for i in keep], vectors)
+            self._maybe_compact()
+
+    def upsert(self, ids: Sequence[str], documents: Sequence[str], metadatas: Optional[Sequence[Dict[str, Any]]] = None, embeddings=None) -> None:
+        metadatas = metadatas or [{}] * len(ids)
+        with self._lock:
+            vectors = self._embed(documents, embeddings)
+            replaced = [self._lookup[doc_id] for doc_id in ids if doc_id in self._lookup]
+            if replaced:
+                self._delete_rows(replaced)
+                self._write_log({"op": "delete", "rows": replaced})
+            self._append(ids, documents, metadatas, vectors)
+            self._maybe_compact()
+
+    def update(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        """Merge new metadata keys into existing rows, as Chroma does."""
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                row = self._lookup.get(doc_id)
+                if row is None:
+                    continue
+                merged = self._metadata(row)
+                merged.update(metadata or {})
+                self._metadatas[row] = merged
+                self._write_log({"op": "update", "row": row, "metadata": merged})
+            self._maybe_compact()
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            rows = self._rows(ids, where)
+            if len(rows):
+                rows = rows.tolist()
+                self._delete_rows(rows)
+                self._write_log({"op": "delete", "rows": rows})
+                self._maybe_compact()
+
+    def count(self) -> int:
+        return self._live_count
+
+    def _rows(self, ids: Optional[Sequence[str]], where: Optional[Dict[str, Any]]) -> np.ndarray:
+        if ids is not None:
+            rows = np.array([self._lookup[doc_id] for doc_id in ids if doc_id in self._lookup], dtype=np.int64)
+            if where:
+                rows = rows[self._mask(where)[rows]]
+            return rows
+        return np.flatnonzero(self._mask(where))
+
+    def get(
+        self,
+        ids: Optional[Sequence[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Sequence[str] = ("metadatas", "documents")
+    ) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._rows(ids, where)
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            return self._result(rows.tolist(), include)
+
+    def _result(self, rows: List[int], include: Sequence[str]) -> Dict[str, Any]:
+        result = {
+            "ids": [self._ids[row] for row in rows],
+            "documents": [self._document(row) for row in rows] if "documents" in include else None,
+            "metadatas": [self._metadata(row) for row in rows] if "metadatas" in include else None,
+            "embeddings": None
+        }
+        if "embeddings" in include:
+            result["embeddings"] = self._vector_rows(np.asarray(rows, dtype=np.int64)).tolist() if rows else []
+        return result
+
+    # Filters
+
+    def _mask(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        if not where:
+            return alive
+        return self._where(where, len(alive)) & alive
+
+    def _where(self, where: Dict[str, Any], n: int) -> np.ndarray:
+        mask = np.ones(n, dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._where(clause, n)
+            elif key == "$or":
+                union = np.zeros(n, dtype=bool)
+                for clause in condition:
+                    union |= self._where(clause, n)
+                mask &= union
+            elif isinstance(condition, dict):
+                for op, target in condition.items():
+                    mask &= self._leaf(key, op, target, n)
+            else:
+                mask &= self._leaf(key, "$eq", condition, n)
+        return mask
+
+    def _leaf(self, key: str, op: str, target: Any, n: int) -> np.ndarray:
+        mask = np.zeros(n, dtype=bool)
+        index = self._key_index.get(key)
+        if index is not None:
+            codes = [code for code, value in enumerate(self._values[index]) if _compare(value, op, target)]
+            if codes:
+                start, end = self._key_offsets[index], self._key_offsets[index + 1]
+                mask[self._meta_rows[start:end][np.isin(self._meta_codes[start:end], codes)]] = True
+        # Rows written since the snapshot shadow their snapshot columns
+        for row, metadata in self._metadatas.items():
+            mask[row] = key in metadata and _compare(metadata[key], op, target)
+        return mask
+
+    # Search
+
+    def _top(self, queries: np.ndarray, rows: Optional[np.ndarray], k: int, score) -> Tuple[np.ndarray, np.ndarray]:
+        """Top k of ``score(index)`` over ``rows`` (every row when None), block by block."""
+        n = len(self._ids) if rows is None else len(rows)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, n, SCAN_ROWS):
+            if rows is None:
+                # Contiguous slices of the mapped file when nothing is masked out
+                index = slice(start, min(start + SCAN_ROWS, n))
+                block_rows = np.arange(index.start, index.stop)
+            else:
+                index = block_rows = rows[start:start + SCAN_ROWS]
+            scores = score(index)
+            best_rows = np.concatenate([best_rows, np.broadcast_to(block_rows, scores.shape)], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def _scan(self, queries: np.ndarray, rows: Optional[np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top k by cosine similarity over ``rows`` for all queries at once."""
+        if self._codes is None:
+            return self._top(queries, rows, k, lambda index: queries @ self._vector_rows(index).T)
+
+        # Compressed scan, then exact rescoring of the best candidates
+        compressor, codes = self._compressor, self._codes
+        prepared = compressor.prepare(queries)
+        candidates, _ = self._top(queries, rows, max(k, k * self.rescore_factor), lambda index: compressor.scores(prepared, codes[index]))
+        best_rows, best_scores = [], []
+        for query, rows in zip(queries, candidates):
+            scores = self._vector_rows(rows) @ query
+            top = np.argsort(-scores)[:k]
+            best_rows.append(rows[top])
+            best_scores.append(scores[top])
+        return np.array(best_rows), np.array(best_scores)
+
+    def _probe(self, query: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """Rows in the query's ``nprobe`` closest IVF lists, plus every row added since, that pass ``mask``."""
+        lists = np.argsort(-(self._centroids @ query))[:self.nprobe]
+        parts = [np.arange(self._list_offsets[i], self._list_offsets[i + 1]) for i in lists]
+        parts.append(np.arange(self._snapshot_rows, len(self._ids)))
+        rows = np.concatenate(parts)
+        return rows[mask[rows]]
+
+    def query(
+        self,
+        query_embeddings=None,
+        query_texts: Optional[Sequence[str]] = None,
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        include: Sequence[str] = ("metadatas", "documents", "distances")
+    ) -> Dict[str, Any]:
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(list(query_texts))
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        with self._lock:
+            result = {key: [] for key in ("ids", "documents", "metadatas", "distances")}
+            result["embeddings"] = None
+            if self._live_count == 0 or not self._info["dim"]:
+                for key in ("ids", "documents", "metadatas", "distances"):
+                    result[key] = [[] for _ in queries]
+                return result
+            mask = self._mask(where)
+            k = int(min(n_results, mask.sum()))
+            if k <= 0:
+                for key in ("ids", "documents", "metadatas", "distances"):
+                    result[key] = [[] for _ in queries]
+                return result
+
+            if self._centroids is None:
+                # Contiguous slices of the mapped file when nothing is masked out
+                rows, scores = self._scan(queries, None if mask.all() else np.flatnonzero(mask), k)
+                hits = list(zip(rows, scores))
+            else:
+                hits = []
+                for query in queries:
+                    candidates = self._probe(query, mask)
+                    if len(candidates) < k:
+                        candidates = np.flatnonzero(mask)
+                    rows, scores = self._scan(query[None, :], candidates, k)
+                    hits.append((rows[0], scores[0]))
+
+            for rows, scores in hits:
+                rows = rows.tolist()
+                part = self._result(rows, include)
+                result["ids"].append(part["ids"])
+                result["documents"].append(part["documents"])
+                result["metadatas"].append(part["metadatas"])
+                result["distances"].append((1 - np.asarray(scores, dtype=np.float64)).tolist())
+            return result
+
+    def close(self) -> None:
+        if self._compaction is not None:
+            self._compaction.join()
+        with self._lock:
+            self.flush()
+            self._log.close()
@@ -0,0 +1,75 @@
+import logging
+from typing import Dict, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class OCRBackend:
+    """
+    Text recognizer used by visual indexing of videos.
+
+    Backends receive one RGB frame as a uint8 array of shape
+    (height, width, 3) and return the text shown on it.
+    """
+
+    name = "base"
+
+    def recognize(self, frame: np.ndarray) -> str:
+        raise NotImplementedError
+
+
+class TesseractBackend(OCRBackend):
+    """Local Tesseract through pytesseract; ``language`` is a Tesseract language code such as "eng"."""
+
+    name = "tesseract"
+
+    def __init__(self, language: str = "eng"):
+        import pytesseract
+        self._pytesseract = pytesseract
+        self.language = language or "eng"
+        # Fails here, not on the first frame, when the binary is missing
+        pytesseract.get_tesseract_version()
+
+    def recognize(self, frame: np.ndarray) -> str:
+        from PIL import Image
+        return self._pytesseract.image_to_string(Image.fromarray(frame), lang=self.language).strip()
+
+
+class StubBackend(OCRBackend):
+    """Deterministic backend for tests and benchmarks; describes the frame's brightness."""
+
+    name = "stub"
+
+    def __init__(self, language: str = ""):
+        pass
+
+    def recognize(self, frame: np.ndarray) -> str:
+        if frame.size == 0:
+            return ""
+        return f"frame brightness {float(frame.mean()):.1f} contrast {float(frame.std()):.1f}"
+
+
+BACKENDS = {
+    TesseractBackend.name: TesseractBackend,
+    StubBackend.name: StubBackend,
+}
+
+# One backend instance per (name, language) in each worker process
+_loaded: Dict[Tuple[str, str], OCRBackend] = {}
+
+
+def get_backend(name: str, language: str = "") -> OCRBackend:
+    key = (name, language)
+    if key not in _loaded:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown OCR backend '{name}'")
+        logger.info(f"Loading OCR backend {name} {language}".rstrip())
+        _loaded[key] = BACKENDS[name](language)
+    return _loaded[key]
+
+
+def recognize_frame(backend_name: str, language: str, frame: np.ndarray) -> str:
+    """Text on one frame; runs on a worker process."""
+    return get_backend(backend_name, language).recognize(frame)
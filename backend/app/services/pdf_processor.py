@@ -1,48 +1,192 @@
-import pdfplumber
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from importlib import metadata
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Bump when what _extract_page returns changes, so stored page artifacts are not reused
+EXTRACTOR_VERSION = 1
+# What a page artifact keeps; ``text`` is rebuilt from the body and tables
+PAGE_COLUMNS = ("page", "body", "tables")
+
+def extractor_version() -> str:
+    """Version of page extraction, including pdfplumber's."""
+    try:
+        library = metadata.version("pdfplumber")
+    except metadata.PackageNotFoundError:
+        library = "unknown"
+    return f"pdfplumber-{library}/{EXTRACTOR_VERSION}"
+
+def page_text(body: str, tables: List[List[List[Any]]]) -> str:
+    """The body followed by the tables rendered as pipe-separated rows."""
+    table_texts = []
+
+    for table in tables:
+        for row in table:
+            table_texts.append(" | ".join(str(cell) for cell in row))
+
+    full_text = body
+    if table_texts:
+        full_text += "\n\nTables:\n" + "\n".join(table_texts)
+    return full_text
+
+def _extract_page(page, page_number: int) -> Dict[str, Any]:
+    """
+    Extract a page's body text and tables.
+
+    ``text`` is the body followed by the tables (see ``page_text``);
+    ``body`` and ``tables`` keep the two apart for layout-aware chunking.
+    """
+    body = page.extract_text() or ""
+    tables = page.extract_tables()
+    return {"page": page_number, "text": page_text(body, tables), "body": body, "tables": tables}
+
+def stored_pages(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Pages read back from a page artifact, as ``extract_page_range`` returns them."""
+    for record in records:
+        yield dict(record, text=page_text(record["body"], record["tables"]))
+
+def page_count(file_path: str) -> int:
+    import pdfplumber
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """
+    Extract pages ``start`` (inclusive) to ``end`` (exclusive), zero-based.
+
+    Each worker opens its own handle on the file, and page caches are
+    released as soon as a page is done so memory stays bounded by the
+    range size rather than the document size.
+
+    Returns:
+        List of {"page": <1-based page number>, "text", "body", "tables"},
+        one per page including pages without text
+    """
+    # Imported here so the API process never pays for it, only the workers
+    import pdfplumber
+
+    pages = []
+    with pdfplumber.open(file_path) as pdf:
+        for page_num in range(start, min(end, len(pdf.pages))):
+            page = pdf.pages[page_num]
+            pages.append(_extract_page(page, page_num + 1))
+            page.close()
+    return pages
+
+def iter_pages(
+    file_path: str,
+    executor: Optional[Executor] = None,
+    pages_per_task: int = 16,
+    max_in_flight: int = 4,
+    total_pages: Optional[int] = None,
+    ordered: bool = False
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield extracted pages as worker processes finish their page ranges.
+
+    Pages are yielded in completion order unless ``ordered`` is set, in
+    which case a range is held back until every earlier range has been
+    yielded. Either way at most ``max_in_flight`` ranges are outstanding
+    at once so a huge document never has all of its text in memory.
+
+    Args:
+        file_path: Path to the PDF
+        executor: Pool to run ranges on; extraction is serial if omitted
+        pages_per_task: Number of pages handed to a worker at a time
+        max_in_flight: Maximum number of ranges submitted but not yet consumed
+        total_pages: Page count, if the caller already knows it
+        ordered: Yield pages in document order (needed for chunks that span pages)
+    """
+    if total_pages is None:
+        total_pages = page_count(file_path)
+    ranges = iter(
+        (start, min(start + pages_per_task, total_pages))
+        for start in range(0, total_pages, pages_per_task)
+    )
+
+    if executor is None:
+        for start, end in ranges:
+            yield from extract_page_range(file_path, start, end)
+        return
+
+    if ordered:
+        queue = deque()
+        try:
+            for start, end in ranges:
+                queue.append(executor.submit(extract_page_range, file_path, start, end))
+                if len(queue) >= max_in_flight:
+                    yield from queue.popleft().result()
+            while queue:
+                yield from queue.popleft().result()
+        finally:
+            for future in queue:
+                future.cancel()
+        return
+
+    pending = set()
+    try:
+        for start, end in ranges:
+            pending.add(executor.submit(extract_page_range, file_path, start, end))
+            if len(pending) < max_in_flight:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """Group an iterable into lists of at most ``batch_size`` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def page_documents(pages: List[Dict[str, Any]], filename: str, file_id: str):
+    """
+    Turn extracted pages into vector store rows, skipping empty pages.
+
+    Returns:
+        Tuple of (documents, metadatas, ids)
+    """
+    documents = []
+    metadatas = []
+    ids = []
+    for page in pages:
+        if not page["text"].strip():
+            continue
+        documents.append(page["text"])
+        metadatas.append({
+            "source": filename,
+            "page": page["page"],
+            "type": "pdf",
+            "file_id": file_id
+        })
+        ids.append(f"{file_id}_page_{page['page']}")
+    return documents, metadatas, ids
 
 def process_pdf(file_path: str, filename: str, file_id: str):
+    """
+    Extract page text and tables from a PDF in a single pass.
+
+    This is the serial path; ingestion uses ``iter_pages`` with a
+    process pool instead.
+
+    Returns:
+        Tuple of (documents, metadatas, ids)
+    """
     try:
-        documents = []
-        metadatas = []
-        ids = []
-        
-        with pdfplumber.open(file_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                # Extract text
-                text = page.extract_text()
-                
-                # Extract tables
-                tables = page.extract_tables()
-                table_texts = []
-                
-                for table in tables:
-                    for row in table:
-                        table_texts.append(" | ".join(str(cell) for cell in row))
-                
-                full_text = text
-                if table_texts:
-                    full_text += "\n\nTables:\n" + "\n".join(table_texts)
-                
-                if full_text.strip():
-                    doc_id = f"{file_id}_page_{page_num + 1}"
-                    documents.append(full_text)
-                    metadatas.append({
-                        "source": filename,
-                        "page": page_num + 1,
-                        "type": "pdf",
-                        "file_id": file_id
-                    })
-                    ids.append(doc_id)
-        
-        if documents:
-            collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-        
-        return True
-    
+        return page_documents(list(iter_pages(file_path)), filename, file_id)
+
     except Exception as e:
         print(f"Error processing PDF: {str(e)}")
-        return False
\ No newline at end of file
+        raise
@@ -0,0 +1,173 @@
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+KINDS = ("int8", "pq")
+
+# Centroids per product-quantization sub-space: one byte per code
+PQ_CENTROIDS = 256
+# Training points per PQ centroid; more only slows k-means down
+PQ_POINTS_PER_CENTROID = 64
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Euclidean k-means; returns the centroids."""
+    centroids = data[rng.choice(len(data), size=k, replace=len(data) < k)].copy()
+    for _ in range(iterations):
+        distances = (centroids ** 2).sum(axis=1) - 2 * data @ centroids.T
+        assign = np.argmin(distances, axis=1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        order = np.argsort(assign, kind="stable")
+        filled = counts > 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums[filled] = np.add.reduceat(data[order], starts[filled], axis=0)
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random points
+        centroids[~filled] = data[rng.choice(len(data), size=int((~filled).sum()))]
+    return centroids
+
+
+class Compressor:
+    """
+    Lossy codes for unit vectors that still rank by inner product.
+
+    An optional PCA projection (``pca_dim``) is followed by either
+    per-dimension scalar int8 quantization (``int8``, one byte per
+    dimension) or product quantization (``pq``, one byte per sub-vector,
+    ``pq_subvectors`` bytes per vector). Scores from ``scores`` differ
+    from the true inner product by a per-query constant plus the
+    quantization error, so they rank candidates but are not distances:
+    the collection rescores the best of them with the stored vectors.
+    """
+
+    def __init__(self, kind: str, pca_dim: Optional[int] = None, pq_subvectors: int = 48):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown compression: {kind}. Available: {', '.join(KINDS)}")
+        self.kind = kind
+        self.pca_dim = pca_dim or None
+        self.pq_subvectors = pq_subvectors
+        self.dim: Optional[int] = None
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+        self.low: Optional[np.ndarray] = None
+        self.step: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None
+
+    @property
+    def code_bytes(self) -> int:
+        if self.kind == "pq":
+            return self.pq_subvectors
+        return self.pca_dim or self.dim
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "pca_dim": self.pca_dim,
+            "pq_subvectors": self.pq_subvectors if self.kind == "pq" else None,
+            "dim": self.dim,
+            "code_bytes": self.code_bytes
+        }
+
+    # Training
+
+    def fit(self, vectors: np.ndarray, iterations: int = 15, seed: int = 0) -> "Compressor":
+        """Learn the projection and codebooks from a sample of (normalized) vectors."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.dim = vectors.shape[1]
+        rng = np.random.default_rng(seed)
+        if self.pca_dim:
+            if self.pca_dim >= self.dim:
+                raise ValueError(f"pca_dim must be below the embedding dimension {self.dim}")
+            self.mean = vectors.mean(axis=0)
+            _, _, vt = np.linalg.svd(vectors - self.mean, full_matrices=False)
+            self.components = vt[:self.pca_dim].astype(np.float32)
+        projected = self._project(vectors)
+
+        if self.kind == "int8":
+            self.low = projected.min(axis=0)
+            self.step = np.maximum(projected.max(axis=0) - self.low, 1e-12) / 255
+        else:
+            width = projected.shape[1]
+            if width % self.pq_subvectors:
+                raise ValueError(f"pq_subvectors must divide the {'PCA' if self.pca_dim else 'embedding'} dimension {width}")
+            sub = width // self.pq_subvectors
+            limit = PQ_CENTROIDS * PQ_POINTS_PER_CENTROID
+            if len(projected) > limit:
+                projected = projected[rng.choice(len(projected), size=limit, replace=False)]
+            self.codebooks = np.stack([
+                _kmeans(projected[:, j * sub:(j + 1) * sub], PQ_CENTROIDS, iterations, rng)
+                for j in range(self.pq_subvectors)
+            ]).astype(np.float32)
+        return self
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        if self.components is None:
+            return vectors
+        return (vectors - self.mean) @ self.components.T
+
+    # Encoding and scoring
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        projected = self._project(np.asarray(vectors, dtype=np.float32))
+        if self.kind == "int8":
+            codes = np.round((projected - self.low) / self.step) - 128
+            return np.clip(codes, -128, 127).astype(np.int8)
+        m, _, sub = self.codebooks.shape
+        codes = np.empty((len(projected), m), dtype=np.uint8)
+        for j in range(m):
+            part = projected[:, j * sub:(j + 1) * sub]
+            codebook = self.codebooks[j]
+            codes[:, j] = np.argmin((codebook ** 2).sum(axis=1) - 2 * part @ codebook.T, axis=1)
+        return codes
+
+    def prepare(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Per-query tables for ``scores``.
+
+        The mean is not subtracted from queries: q.(v - mean) differs from
+        q.v by a constant per query, which does not change the ranking.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.components is not None:
+            queries = queries @ self.components.T
+        if self.kind == "int8":
+            return queries * self.step
+        m, k, sub = self.codebooks.shape
+        tables = np.einsum("qms,mks->qmk", queries.reshape(len(queries), m, sub), self.codebooks)
+        return tables.reshape(len(queries), m * k)
+
+    def scores(self, prepared: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Ranking scores, shape (queries, rows)."""
+        if self.kind == "int8":
+            return prepared @ codes.astype(np.float32).T
+        m = codes.shape[1]
+        # Index of each code in the flattened (sub-space, centroid) table
+        index = codes.astype(np.intp) + np.arange(m) * PQ_CENTROIDS
+        return np.stack([table[index].sum(axis=1) for table in prepared])
+
+    # Persistence
+
+    def save(self, path: str) -> None:
+        arrays = {
+            name: getattr(self, name)
+            for name in ("mean", "components", "low", "step", "codebooks")
+            if getattr(self, name) is not None
+        }
+        params = json.dumps({"kind": self.kind, "pca_dim": self.pca_dim, "pq_subvectors": self.pq_subvectors, "dim": self.dim})
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, params=np.array(params), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Compressor":
+        with np.load(path) as data:
+            params = json.loads(str(data["params"]))
+            compressor = cls(params["kind"], params["pca_dim"], params["pq_subvectors"])
+            compressor.dim = params["dim"]
+            for name in ("mean", "components", "low", "step", "codebooks"):
+                if name in data:
+                    setattr(compressor, name, data[name])
+        return compressor
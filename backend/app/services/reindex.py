@@ -0,0 +1,303 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set
+
+from app.services.jobs import JobContext
+from app.services.shards import IndexVersion
+from app.services.vector_store import VectorStore
+
+if TYPE_CHECKING:
+    from app.core.container import Services
+
+logger = logging.getLogger(__name__)
+
+# The model vectors were embedded with before the index alias recorded it
+LEGACY_EMBEDDING_MODEL = "deepseek-ai/deepseek-embedding"
+
+
+class IndexAlias:
+    """
+    Which vector index generation queries are served from.
+
+    Every generation is one set of shard collections embedded with one
+    model; the alias records its number, model and dimension, plus the
+    generations replaced but not yet dropped. It is a small JSON file
+    replaced atomically, so after a crash it names either the old or the
+    new generation, never a mix.
+    """
+
+    def __init__(self, path: str, model: str):
+        """
+        Args:
+            path: JSON file holding the alias
+            model: Embedding model of generation 0, when the file does
+                not exist yet
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._state = json.load(f)
+        else:
+            self._state = {"generation": 0, "model": model, "dimension": None, "retired": []}
+            self._save()
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def generation(self) -> int:
+        return self._state["generation"]
+
+    @property
+    def model(self) -> str:
+        return self._state["model"]
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._state["dimension"]
+
+    @property
+    def retired(self) -> List[int]:
+        """Generations replaced whose collections are still to be dropped."""
+        return list(self._state["retired"])
+
+    def index(self, embedding_function) -> IndexVersion:
+        return IndexVersion(self.generation, self.model, embedding_function, self.dimension)
+
+    def set_dimension(self, dimension: int) -> None:
+        with self._lock:
+            self._state["dimension"] = dimension
+            self._save()
+
+    def swap(self, index: IndexVersion) -> None:
+        """Point the alias at ``index``; the generation it replaces is retired."""
+        with self._lock:
+            retired = self._state["retired"] + [self._state["generation"]]
+            self._state = dict(index.to_dict(), retired=retired)
+            self._save()
+
+    def dropped(self, generation: int) -> None:
+        with self._lock:
+            self._state["retired"] = [g for g in self._state["retired"] if g != generation]
+            self._save()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._state)
+
+
+class Throttle:
+    """
+    Paces a background job so live queries keep their latency: at most
+    ``rate`` items per second (0 for no limit), and before each batch a
+    pause of up to ``max_pause`` seconds while ``busy()`` says queries
+    are running.
+    """
+
+    def __init__(self, rate: float, busy: Optional[Callable[[], bool]] = None, max_pause: float = 1.0):
+        self.rate = rate
+        self.busy = busy
+        self.max_pause = max_pause
+        self._due = time.monotonic()
+
+    def wait(self, items: int) -> None:
+        if self.busy is not None:
+            deadline = time.monotonic() + self.max_pause
+            while self.busy() and time.monotonic() < deadline:
+                time.sleep(0.01)
+        if self.rate > 0:
+            now = time.monotonic()
+            if self._due > now:
+                time.sleep(self._due - now)
+            self._due = max(self._due, now) + items / self.rate
+
+
+def copy_rows(shadow: VectorStore, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embedding_function) -> int:
+    """
+    Write rows into ``shadow`` where it lacks them or holds an older
+    version, embedding them with ``embedding_function`` (which the
+    embedding cache makes cheap for rows copied before).
+
+    Returns:
+        Number of rows written
+    """
+    stored = shadow.collection.get(ids=ids, include=["documents", "metadatas"])
+    current = {cid: (doc, metadata or {}) for cid, doc, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])}
+    changed = [i for i, cid in enumerate(ids) if current.get(cid) != (documents[i], metadatas[i] or {})]
+    if not changed:
+        return 0
+    texts = [documents[i] for i in changed]
+    shadow.collection.upsert(
+        ids=[ids[i] for i in changed],
+        documents=texts,
+        metadatas=[metadatas[i] for i in changed],
+        embeddings=embedding_function(texts)
+    )
+    return len(changed)
+
+
+def sync_ids(active: VectorStore, shadow: VectorStore, ids: Iterable[str], embedding_function, batch_size: int) -> int:
+    """Make ``shadow`` agree with ``active`` on the given ids: copy what changed, drop what is gone."""
+    ids = list(ids)
+    written = 0
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        found = active.collection.get(ids=batch, include=["documents", "metadatas"])
+        if found["ids"]:
+            written += copy_rows(shadow, found["ids"], found["documents"], found["metadatas"], embedding_function)
+        gone = set(batch) - set(found["ids"])
+        if gone:
+            stale = shadow.collection.get(ids=list(gone), include=[])["ids"]
+            if stale:
+                shadow.collection.delete(ids=stale)
+                written += len(stale)
+    return written
+
+
+def all_ids(store: VectorStore, page_size: int) -> Set[str]:
+    ids: Set[str] = set()
+    offset = 0
+    while True:
+        page = store.collection.get(limit=page_size, offset=offset, include=[])
+        if not page["ids"]:
+            return ids
+        ids.update(page["ids"])
+        offset += len(page["ids"])
+
+
+def reindex_vectors(services: "Services", ctx: JobContext) -> dict:
+    """
+    Re-embed every shard into a new index generation with ``payload["model"]``
+    and switch queries over to it.
+
+    The stored chunk texts and metadata are copied into shadow collections,
+    throttled (see ``Throttle``) while queries keep being answered from the
+    current generation. Writes made meanwhile are tracked and copied over
+    in catch-up rounds; the last round runs with writes paused, and then
+    every shard is promoted at once and the alias swapped. The replaced
+    collections are dropped ``REINDEX_RETIRE_SECONDS`` later, once the
+    queries still running on them are done, without holding the job's
+    worker meanwhile.
+
+    A job for the model already served only drops retired collections,
+    e.g. when a restart interrupted that step.
+    """
+    settings = services.settings
+    router = services.shard_router
+    alias = services.index_alias
+    model = ctx.payload.get("model") or settings.EMBEDDING_MODEL
+    batch_size = settings.REINDEX_BATCH_SIZE
+    if alias.model == model:
+        ctx.update(stage="retiring")
+        dropped = _drop_retired(services, {})
+        return {"index": alias.to_dict(), "chunks": 0, "dropped": dropped}
+
+    target = IndexVersion(alias.generation + 1, model, services.embedding_function_for(model))
+    target.dimension = len(target.embedding_function(["dimension probe"])[0])
+    throttle = Throttle(
+        settings.REINDEX_MAX_CHUNKS_PER_S,
+        busy=lambda: services.built("retriever") and services.retriever.in_flight > 0,
+        max_pause=settings.REINDEX_MAX_PAUSE_MS / 1000
+    )
+    started = time.monotonic()
+    shadows: Dict[str, VectorStore] = {}
+    progress = {"chunks_total": 0, "chunks_done": 0, "chunks_written": 0}
+
+    def copy_shard(shard: str) -> None:
+        # Everything the shard holds now, and what changes while it is copied
+        active = router.store(shard)
+        active.track_changes()
+        shadow = shadows[shard] = services.open_shadow(shard, target)
+        progress["chunks_total"] += active.count()
+        ctx.update(stage="embedding", shards_done=len(shadows) - 1, **progress)
+        for ids, documents, metadatas in active.iter_documents(page_size=batch_size):
+            throttle.wait(len(ids))
+            progress["chunks_written"] += copy_rows(shadow, ids, documents, metadatas, target.embedding_function)
+            progress["chunks_done"] += len(ids)
+            ctx.update(**progress)
+        # Paging misses rows when others are deleted meanwhile
+        active_ids, shadow_ids = all_ids(active, batch_size), all_ids(shadow, batch_size)
+        progress["chunks_written"] += sync_ids(active, shadow, active_ids ^ shadow_ids, target.embedding_function, batch_size)
+
+    def catch_up(stores: Dict[str, VectorStore], locked: bool = False) -> int:
+        changed = 0
+        for shard, store in stores.items():
+            ids = store.take_changes(locked=locked)
+            changed += len(ids)
+            if not locked:
+                throttle.wait(len(ids))
+            progress["chunks_written"] += sync_ids(store, shadows[shard], ids, target.embedding_function, batch_size)
+        return changed
+
+    try:
+        for shard in router.all_shards():
+            copy_shard(shard)
+        # Keep the last round, run with writes paused, short
+        ctx.update(stage="catching_up", shards_done=len(shadows), **progress)
+        for _ in range(10):
+            copied = {shard: store for shard, store in router.open_stores().items() if shard in shadows}
+            if catch_up(copied) < batch_size:
+                break
+        while True:
+            # Shards first opened during the copy have to be copied as well
+            for shard in set(router.open_stores()) - set(shadows):
+                copy_shard(shard)
+            with router.paused_writes() as stores:
+                if set(stores) - set(shadows):
+                    continue
+                catch_up(stores, locked=True)
+                replaced = {store.collection.name: store.collection for store in stores.values()}
+                if router.promote(target, {shard: shadows[shard].collection for shard in stores}):
+                    alias.swap(target)
+                    break
+    except BaseException:
+        for store in router.open_stores().values():
+            store.stop_tracking()
+        raise
+
+    previous = services.use_embedding_function(target.embedding_function)
+    if services.built("answer_cache"):
+        services.answer_cache.clear()
+    generation = target.generation - 1
+
+    def retire() -> None:
+        if previous is not None and previous is not target.embedding_function and hasattr(previous, "close"):
+            previous.close()
+        _drop_retired(services, replaced, generations=[generation])
+
+    services.later(settings.REINDEX_RETIRE_SECONDS, retire)
+    return {
+        "index": alias.to_dict(),
+        "chunks": progress["chunks_done"],
+        "chunks_written": progress["chunks_written"],
+        "seconds": round(time.monotonic() - started, 1),
+        "retiring": generation
+    }
+
+
+def _drop_retired(services: "Services", replaced: Dict[str, Any], generations: Optional[List[int]] = None) -> List[str]:
+    """
+    Drop the collections of retired generations (only ``generations``, if
+    given); ``replaced`` has the ones still open, by name.
+    """
+    router = services.shard_router
+    dropped = []
+    for generation in services.index_alias.retired:
+        if generations is not None and generation not in generations:
+            continue
+        for shard in router.all_shards():
+            name = services.collection_name(shard, generation)
+            router.store(shard).drop_collection(name, replaced.get(name))
+            dropped.append(name)
+        services.index_alias.dropped(generation)
+        logger.info(f"Dropped the collections of vector index generation {generation}")
+    return dropped
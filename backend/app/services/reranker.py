@@ -0,0 +1,276 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.services.answer_cache import normalize_question
+from app.services.chunking import count_tokens
+from app.services.lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class Reranker:
+    """Scores (query, passage) pairs; higher is more relevant."""
+
+    name = "base"
+    # Whether a passage's score is independent of the other candidates,
+    # which is what makes per-(query, chunk) caching and batching valid
+    pairwise = True
+
+    @property
+    def ready(self) -> bool:
+        return True
+
+    def load(self) -> None:
+        pass
+
+    def score(self, query: str, passages: List[str]) -> List[float]:
+        raise NotImplementedError
+
+
+class LexicalReranker(Reranker):
+    """
+    Cheap fallback: idf-weighted coverage of the query terms.
+
+    Document frequencies come from the candidate set itself, so no corpus
+    statistics are needed and scoring is a single pass over the passages.
+    """
+
+    name = "lexical"
+    pairwise = False
+
+    def score(self, query: str, passages: List[str]) -> List[float]:
+        terms = set(tokenize(query))
+        if not terms:
+            return [0.0] * len(passages)
+        passage_terms = [Counter(tokenize(p)) for p in passages]
+        n = len(passages)
+        idf = {
+            term: math.log(1 + (n + 1) / (1 + sum(1 for counts in passage_terms if term in counts)))
+            for term in terms
+        }
+        total = sum(idf.values())
+        scores = []
+        for counts in passage_terms:
+            covered = sum(weight for term, weight in idf.items() if term in counts)
+            # Coverage dominates; frequency breaks ties between equal coverage
+            frequency = sum(math.log1p(counts[term]) for term in terms)
+            scores.append(covered / total + 0.01 * frequency)
+        return scores
+
+
+class CrossEncoderReranker(Reranker):
+    """Local sentence-transformers cross-encoder, loaded on first use."""
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size: int = 16):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    def load(self) -> None:
+        with self._load_lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+                self.model = CrossEncoder(self.model_name, device="cpu")
+
+    def score(self, query: str, passages: List[str]) -> List[float]:
+        self.load()
+        pairs = [(query, passage) for passage in passages]
+        return [float(s) for s in self.model.predict(pairs, batch_size=self.batch_size)]
+
+
+RERANKERS = {
+    "cross-encoder": CrossEncoderReranker,
+    "lexical": LexicalReranker
+}
+
+
+class RerankStage:
+    """
+    Rerank over-fetched candidates and keep the best under a token budget.
+
+    Scores are cached per (query hash, chunk id) and computed in batches.
+    The cost per passage of the primary reranker is tracked as a moving
+    average; when scoring the uncached candidates is expected to exceed
+    ``latency_budget_ms`` (or the model is still loading, or fails), the
+    lexical fallback is used instead so the request stays within its SLA.
+    """
+
+    def __init__(
+        self,
+        reranker: Optional[Reranker] = None,
+        fallback: Optional[Reranker] = None,
+        batch_size: int = 16,
+        cache_size: int = 100_000,
+        latency_budget_ms: float = 300
+    ):
+        self.reranker = reranker
+        self.fallback = fallback or LexicalReranker()
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.latency_budget = latency_budget_ms / 1000
+        self._cache: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._seconds_per_passage: Optional[float] = None
+        self._timed_calls = 0
+        # Score cache lookups by pairwise rerankers
+        self.hits = 0
+        self.misses = 0
+        self._loading = False
+
+    @staticmethod
+    def query_hash(query: str) -> str:
+        return hashlib.sha256(normalize_question(query).encode("utf-8")).hexdigest()[:16]
+
+    def _start_loading(self) -> None:
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+
+        threading.Thread(target=self.warm_up, name="reranker-load", daemon=True).start()
+
+    def warm_up(self) -> None:
+        """Load the primary reranker now; on failure the lexical fallback takes over."""
+        reranker = self.reranker
+        if reranker is None:
+            return
+        try:
+            reranker.load()
+        except Exception as e:
+            logger.warning(f"Could not load reranker {reranker.name}, using lexical fallback: {e}")
+            self.reranker = None
+
+    def _choose(self, n_uncached: int) -> Reranker:
+        if self.reranker is None:
+            return self.fallback
+        if not self.reranker.ready:
+            self._start_loading()
+            return self.fallback
+        if self._seconds_per_passage is not None and n_uncached * self._seconds_per_passage > self.latency_budget:
+            return self.fallback
+        return self.reranker
+
+    def _lookup(self, reranker: Reranker, qhash: str, ids: Sequence[str]) -> Tuple[List[Optional[float]], List[int]]:
+        """Cached scores (None where missing) and the indices still to score."""
+        if not reranker.pairwise:
+            return [None] * len(ids), list(range(len(ids)))
+        scores, uncached = [], []
+        for i, cid in enumerate(ids):
+            key = (reranker.name, qhash, cid)
+            score = self._cache.get(key)
+            if score is None:
+                uncached.append(i)
+            else:
+                self._cache.move_to_end(key)
+            scores.append(score)
+        return scores, uncached
+
+    def _score(self, reranker: Reranker, query: str, passages: List[str]) -> List[float]:
+        if not reranker.pairwise:
+            return reranker.score(query, passages)
+        scores: List[float] = []
+        for start in range(0, len(passages), self.batch_size):
+            scores.extend(reranker.score(query, passages[start:start + self.batch_size]))
+        return scores
+
+    def rerank(
+        self,
+        query: str,
+        ids: Sequence[str],
+        documents: Sequence[str],
+        k: int,
+        max_tokens: Optional[int] = None
+    ) -> Tuple[List[int], Dict[str, Any]]:
+        """
+        Rank candidates and select the top ``k`` that fit ``max_tokens``.
+
+        Returns:
+            Tuple of (indices into ``ids`` best first, stats dict with the
+            reranker used, cache hits and scored count)
+        """
+        qhash = self.query_hash(query)
+        with self._lock:
+            reranker = self._choose(len(self._lookup(self.reranker, qhash, ids)[1]) if self.reranker else 0)
+            scores, uncached = self._lookup(reranker, qhash, ids)
+            if reranker.pairwise:
+                self.hits += len(ids) - len(uncached)
+                self.misses += len(uncached)
+
+        if uncached:
+            started = time.perf_counter()
+            try:
+                fresh = self._score(reranker, query, [documents[i] for i in uncached])
+            except Exception as e:
+                if reranker is self.fallback:
+                    raise
+                logger.warning(f"Reranker {reranker.name} failed, using lexical fallback: {e}")
+                reranker = self.fallback
+                with self._lock:
+                    scores, uncached = self._lookup(reranker, qhash, ids)
+                fresh = self._score(reranker, query, [documents[i] for i in uncached])
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                if reranker is self.reranker and reranker is not self.fallback:
+                    self._timed_calls += 1
+                    # The first call pays for model warm-up and would skew the estimate
+                    if self._timed_calls > 1:
+                        per_passage = elapsed / len(uncached)
+                        self._seconds_per_passage = per_passage if self._seconds_per_passage is None else (
+                            0.8 * self._seconds_per_passage + 0.2 * per_passage
+                        )
+                for i, score in zip(uncached, fresh):
+                    scores[i] = score
+                    if reranker.pairwise:
+                        self._cache[(reranker.name, qhash, ids[i])] = score
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        # Stable sort keeps the fused retrieval order between equal scores
+        order = sorted(range(len(ids)), key=lambda i: -scores[i])
+        selected, tokens = [], 0
+        for i in order:
+            if len(selected) >= k:
+                break
+            n = count_tokens(documents[i])
+            if max_tokens is not None and selected and tokens + n > max_tokens:
+                continue
+            selected.append(i)
+            tokens += n
+        return selected, {
+            "reranker": reranker.name,
+            "candidates": len(ids),
+            "scored": len(uncached),
+            "cache_hits": len(ids) - len(uncached),
+            "context_tokens": tokens
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "reranker": self.reranker.name if self.reranker else self.fallback.name,
+                "ready": bool(self.reranker and self.reranker.ready),
+                "cached_scores": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "ms_per_passage": None if self._seconds_per_passage is None else self._seconds_per_passage * 1000
+            }
+
+
+def get_reranker(name: str, model_name: str, batch_size: int) -> Reranker:
+    if name not in RERANKERS:
+        raise ValueError(f"Unknown reranker '{name}', expected one of {sorted(RERANKERS)}")
+    if name == "cross-encoder":
+        return CrossEncoderReranker(model_name, batch_size=batch_size)
+    return RERANKERS[name]()
@@ -0,0 +1,305 @@
+import json
+import threading
+import time
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.core import telemetry
+from app.services import dedup
+from app.services.context_builder import ContextBuilder
+from app.services.lexical_index import reciprocal_rank_fusion
+from app.services.reranker import RerankStage
+from app.services.shards import ShardRouter
+from app.services.vector_store import StaleIndexError
+
+
+class QueryFilters(BaseModel):
+    type: Optional[str] = None
+    file_ids: Optional[List[str]] = None
+    sources: Optional[List[str]] = None  # Uploaded filenames
+    date_from: Optional[datetime] = None  # Ingestion time range, inclusive
+    date_to: Optional[datetime] = None
+
+
+def chroma_where(filters: Optional[QueryFilters], file_ids: Optional[List[str]] = None) -> Optional[dict]:
+    """Translate query filters (with ``file_ids`` from ``file_scope``) into a Chroma ``where`` clause."""
+    if filters is None:
+        return None
+    clauses = []
+    if filters.type:
+        clauses.append({"type": filters.type})
+    if file_ids:
+        flags = [{dedup.file_flag(file_id): True} for file_id in file_ids]
+        clauses.append(flags[0] if len(flags) == 1 else {"$or": flags})
+    if filters.date_from:
+        clauses.append({"ingested_at": {"$gte": int(filters.date_from.timestamp())}})
+    if filters.date_to:
+        clauses.append({"ingested_at": {"$lte": int(filters.date_to.timestamp())}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def lexical_filters(filters: Optional[QueryFilters], file_ids: Optional[List[str]] = None) -> Optional[dict]:
+    """
+    The part of the filters the lexical index applies itself; date ranges
+    are checked when its hits are fetched from the vector store.
+    """
+    if filters is None:
+        return None
+    values = {}
+    if filters.type:
+        values["type"] = [filters.type]
+    if file_ids:
+        values["file_id"] = file_ids
+    return values or None
+
+
+class Retriever:
+    """
+    Hybrid retrieval: BM25 and vector search fused with reciprocal-rank
+    fusion, then reranked and packed into a cited context.
+
+    Questions are embedded with the embedding function of the index
+    generation the shard router serves.
+    """
+
+    # Attempts at a search that keeps racing index promotions
+    MAX_INDEX_RETRIES = 3
+
+    def __init__(
+        self,
+        shard_router: ShardRouter,
+        file_registry: dedup.FileRegistry,
+        rerank_stage: RerankStage,
+        context_builder: ContextBuilder,
+        lexical_executor: Executor,
+        n_candidates: int = 20,
+        rrf_k: int = 60,
+        rerank_candidates: int = 50
+    ):
+        self.shard_router = shard_router
+        self.file_registry = file_registry
+        self.rerank_stage = rerank_stage
+        self.context_builder = context_builder
+        self.lexical_executor = lexical_executor
+        self.n_candidates = n_candidates
+        self.rrf_k = rrf_k
+        self.rerank_candidates = rerank_candidates
+        # Searches running now, which background re-indexing yields to
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def file_scope(self, filters: Optional[QueryFilters], tenant: str) -> Optional[List[str]]:
+        """
+        Files a query is restricted to by its ``file_ids`` and ``sources``
+        filters, or None when it may see all of its tenant's files. An empty
+        list means nothing matches.
+        """
+        if filters is None:
+            return None
+        scope = None
+        if filters.file_ids:
+            scope = set(filters.file_ids)
+        if filters.sources:
+            named = set(self.file_registry.file_ids_named(filters.sources, tenant))
+            scope = named if scope is None else scope & named
+        return None if scope is None else sorted(scope)
+
+    def hybrid_search_many(
+        self,
+        questions: List[str],
+        n_results: int,
+        filters: Optional[List[Optional[QueryFilters]]] = None,
+        tenants: Optional[List[str]] = None
+    ) -> list:
+        """
+        Run BM25 and vector search in parallel and fuse them with reciprocal-rank fusion.
+
+        All questions are embedded in one call and searched with one
+        multi-vector query per shard and distinct filter; the shards of a
+        tenant are searched concurrently, and the BM25 searches run on the
+        lexical executor meanwhile.
+
+        Returns:
+            Per question, a tuple of (ids, documents, metadatas, question
+            embedding, timings), best first. ``embed_ms`` and ``vector_ms``
+            cover the whole batch.
+        """
+        n_candidates = max(n_results, self.n_candidates)
+        filters = filters or [None] * len(questions)
+        tenants = tenants or [dedup.DEFAULT_TENANT] * len(questions)
+        scopes = [self.file_scope(f, tenant) for f, tenant in zip(filters, tenants)]
+        wheres = [chroma_where(f, scope) for f, scope in zip(filters, scopes)]
+        # Questions whose file filters match no file have nothing to search
+        active = [i for i, scope in enumerate(scopes) if scope is None or scope]
+        timings = [{} for _ in questions]
+
+        # Executor threads do not inherit the request's context
+        current = telemetry.current_trace()
+        pipeline = current.pipeline if current else "query"
+
+        def timed_lexical(i):
+            with telemetry.span("lexical", pipeline) as timed:
+                hits = self.shard_router.lexical_search(
+                    tenants[i], questions[i], n_candidates, lexical_filters(filters[i], scopes[i])
+                )
+            if current is not None:
+                current.add(timed)
+            timings[i]["lexical_ms"] = timed.ms
+            return hits
+
+        with self._in_flight_lock:
+            self.in_flight += 1
+        try:
+            lexical = {i: self.lexical_executor.submit(timed_lexical, i) for i in active}
+            embeddings, vector, embed_ms, vector_ms = self._vector_search(questions, tenants, wheres, active, n_candidates)
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+
+        rows = [{hit["id"]: (hit["text"], hit["metadata"]) for hit in hits} for hits in vector]
+        fused_ids = []
+        for i, hits in enumerate(vector):
+            lexical_ids = [cid for cid, _ in lexical[i].result()] if i in lexical else []
+            fused = reciprocal_rank_fusion([[hit["id"] for hit in hits], lexical_ids], k=self.rrf_k)
+            fused_ids.append([cid for cid, _ in fused])
+
+        # Lexical-only hits are fetched with the question's filter, which drops
+        # ids the lexical index still knows but the store no longer has, and
+        # hits outside a date range the lexical index cannot apply
+        missing: Dict[Tuple[str, str], Tuple[Optional[dict], List[int]]] = {}
+        for i, ids in enumerate(fused_ids):
+            if any(cid not in rows[i] for cid in ids[:n_results]):
+                key = (tenants[i], json.dumps(wheres[i], sort_keys=True))
+                missing.setdefault(key, (wheres[i], []))[1].append(i)
+        for (tenant, _), (where, members) in missing.items():
+            ids = list({cid for i in members for cid in fused_ids[i] if cid not in rows[i]})
+            fetched = self.shard_router.get(tenant, ids, where)
+            for i in members:
+                rows[i].update(fetched)
+
+        results = []
+        for i, (ids, embedding, timing) in enumerate(zip(fused_ids, embeddings, timings)):
+            ids = [cid for cid in ids if cid in rows[i]][:n_results]
+            timing.update(embed_ms=embed_ms, vector_ms=vector_ms)
+            results.append((ids, [rows[i][cid][0] for cid in ids], [rows[i][cid][1] for cid in ids], embedding, timing))
+        return results
+
+    def _vector_search(self, questions, tenants, wheres, active, n_candidates):
+        """
+        Embed the questions and search their shards, both for the index
+        generation being served. A promotion landing in between makes the
+        shards refuse the embeddings, and the search is redone.
+        """
+        for attempt in range(self.MAX_INDEX_RETRIES):
+            index = self.shard_router.index
+            # The embedding function records its own "embed" span
+            started = time.perf_counter()
+            embeddings = index.embedding_function(questions)
+            embed_ms = (time.perf_counter() - started) * 1000
+            try:
+                with telemetry.span("vector_search", shards_queried=len(active)) as search:
+                    vector = [[] for _ in questions]
+                    found = self.shard_router.query_many(
+                        [tenants[i] for i in active],
+                        [embeddings[i] for i in active],
+                        n_results=n_candidates,
+                        wheres=[wheres[i] for i in active],
+                        generation=index.generation
+                    )
+                    for i, hits in zip(active, found):
+                        vector[i] = hits
+            except StaleIndexError:
+                if attempt == self.MAX_INDEX_RETRIES - 1:
+                    raise
+                continue
+            return embeddings, vector, embed_ms, search.ms
+
+    def hybrid_search(self, question: str, n_results: int, filters: Optional[QueryFilters] = None, tenant: str = dedup.DEFAULT_TENANT):
+        """Single-question ``hybrid_search_many``."""
+        return self.hybrid_search_many([question], n_results, [filters], [tenant])[0]
+
+    def _rerank_and_pack(self, question: str, n_results: int, ids, documents, metadatas, embedding, timings: dict) -> dict:
+        with telemetry.span("rerank", candidates=len(ids)) as timed:
+            selected, rerank_stats = self.rerank_stage.rerank(question, ids, documents, n_results)
+        timings["rerank_ms"] = timed.ms
+        ids = [ids[i] for i in selected]
+        documents = [documents[i] for i in selected]
+        metadatas = [metadatas[i] for i in selected]
+
+        with telemetry.span("pack") as timed:
+            packed = self.context_builder.build(question, ids, documents, metadatas)
+        timings["packing_ms"] = timed.ms
+        telemetry.CONTEXT_TOKENS.labels().observe(packed["tokens"])
+
+        by_id = dict(zip(ids, metadatas))
+        sources = []
+        file_ids = set()
+        for citation in packed["citations"]:
+            refs = []
+            for cid in citation["chunk_ids"]:
+                refs.extend(ref for ref in dedup.get_refs(by_id[cid]) if ref not in refs)
+            file_ids.update(ref["file_id"] for ref in refs if "file_id" in ref)
+            source = {
+                key: citation[key]
+                for key in ("citation", "type", "source", "file_id", "page", "page_end", "timestamp")
+                if key in citation
+            }
+            source["content"] = citation["text"][:200] + "..."
+            source["refs"] = refs
+            sources.append(source)
+        return {
+            "context": packed["context"],
+            "sources": sources,
+            "chunk_ids": packed["chunk_ids"],
+            "file_ids": file_ids,
+            "embedding": embedding,
+            "timings": timings,
+            "rerank": dict(rerank_stats, context_tokens=packed["tokens"], candidate_tokens=packed["input_tokens"])
+        }
+
+    def retrieve_contexts(
+        self,
+        questions: List[str],
+        n_results: int = 5,
+        filters: Optional[List[Optional[QueryFilters]]] = None,
+        tenants: Optional[List[str]] = None
+    ) -> List[dict]:
+        """
+        Over-fetch candidates for every question with one batched hybrid
+        search, then rerank them and pack the best ``n_results`` of each into
+        a cited context under the token budget.
+
+        Blocking (it embeds the questions), so async handlers call it in the
+        threadpool.
+
+        Returns:
+            Per question, a dict with the prompt ``context``, response
+            ``sources``, and the retrieved ``chunk_ids``, contributing
+            ``file_ids``, question ``embedding`` and ``tenant`` used as answer
+            cache keys, plus per-stage ``timings`` in milliseconds and ``rerank`` stats
+        """
+        with telemetry.span("retrieve", questions=len(questions)) as timed:
+            searches = self.hybrid_search_many(questions, max(n_results, self.rerank_candidates), filters, tenants)
+        retrieval_ms = timed.ms
+        results = []
+        for i, (question, (ids, documents, metadatas, embedding, timings)) in enumerate(zip(questions, searches)):
+            timings["retrieval_ms"] = retrieval_ms
+            result = self._rerank_and_pack(question, n_results, ids, documents, metadatas, embedding, timings)
+            result["tenant"] = tenants[i] if tenants else dedup.DEFAULT_TENANT
+            results.append(result)
+        return results
+
+    def retrieve_context(
+        self,
+        question: str,
+        n_results: int = 5,
+        filters: Optional[QueryFilters] = None,
+        tenant: str = dedup.DEFAULT_TENANT
+    ) -> dict:
+        """Single-question ``retrieve_contexts``."""
+        return self.retrieve_contexts([question], n_results, [filters], [tenant])[0]
@@ -0,0 +1,250 @@
+import hashlib
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.services.dedup import DEFAULT_TENANT
+from app.services.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Tenant names end up in collection names (at most 63 characters) and paths
+_TENANT_PATTERN = re.compile(r"^[A-Za-z0-9]([A-Za-z0-9_-]{0,38}[A-Za-z0-9])?$")
+
+
+def check_tenant(tenant: Optional[str]) -> str:
+    """The tenant to use for a request; None means the default tenant."""
+    tenant = tenant or DEFAULT_TENANT
+    if not _TENANT_PATTERN.match(tenant):
+        raise ValueError(f"Invalid tenant name: {tenant!r} (at most 40 letters, digits, '_' or '-', starting and ending alphanumeric)")
+    return tenant
+
+
+def shard_names(tenant: str, count: int) -> List[str]:
+    """A tenant's shards: one named after it, or ``tenant.0`` .. ``tenant.{count-1}``."""
+    if count <= 1:
+        return [tenant]
+    return [f"{tenant}.{i}" for i in range(count)]
+
+
+class IndexVersion:
+    """
+    One generation of the vector index: the embedding model its shard
+    collections were built with, and the function that embeds queries
+    for them.
+    """
+
+    def __init__(self, generation: int, model: str, embedding_function=None, dimension: Optional[int] = None):
+        self.generation = generation
+        self.model = model
+        self.embedding_function = embedding_function
+        self.dimension = dimension
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"generation": self.generation, "model": self.model, "dimension": self.dimension}
+
+
+class ShardRouter:
+    """
+    Routes every tenant's chunks to vector store shards of its own.
+
+    Each shard is a separate ``VectorStore`` (its own collection and
+    lexical index), so a query only searches its tenant's rows and a large
+    tenant does not slow down small ones. ``placement`` splits large
+    tenants over several shards; a file lives wholly in one of them,
+    chosen by hashing its id, and queries fan out to all of the tenant's
+    shards concurrently and merge their top k.
+
+    Shards are opened on first use with ``open_shard(name)``.
+    ``known_shards(tenant)`` lists the shards that still hold a tenant's
+    files, so queries keep finding files placed under an earlier
+    ``placement`` until they are rebalanced.
+
+    ``index`` is the generation the shards serve, with the embedding
+    function queries must be embedded with; ``promote`` moves every shard
+    to the next generation at once (see ``reindex``).
+    """
+
+    def __init__(
+        self,
+        open_shard: Callable[[str], VectorStore],
+        placement: Optional[Dict[str, int]] = None,
+        known_shards: Optional[Callable[[Optional[str]], Iterable[str]]] = None,
+        max_workers: int = 8,
+        index: Optional[IndexVersion] = None
+    ):
+        self.open_shard = open_shard
+        self.index = index or IndexVersion(0, "")
+        self.placement = {check_tenant(tenant): int(count) for tenant, count in (placement or {}).items()}
+        self.known_shards = known_shards
+        self._stores: Dict[str, VectorStore] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard")
+
+    # Placement
+
+    def configured(self, tenant: str) -> List[str]:
+        """Shards the current placement puts a tenant's new files in."""
+        return shard_names(tenant, self.placement.get(tenant, 1))
+
+    def place(self, tenant: str, file_id: str) -> str:
+        """Shard for a file: stable for as long as the tenant's shard count is."""
+        shards = self.configured(tenant)
+        return shards[int(hashlib.sha1(file_id.encode("utf-8")).hexdigest()[:8], 16) % len(shards)]
+
+    def shards(self, tenant: str) -> List[str]:
+        """Every shard a query for ``tenant`` has to search."""
+        shards = self.configured(tenant)
+        if self.known_shards is not None:
+            shards += sorted(set(self.known_shards(tenant)) - set(shards))
+        return shards
+
+    def all_shards(self) -> List[str]:
+        """Shards of every configured tenant and every shard holding files."""
+        shards = {shard for tenant in self.placement for shard in self.configured(tenant)}
+        shards.update(self.configured(DEFAULT_TENANT))
+        if self.known_shards is not None:
+            shards.update(self.known_shards(None))
+        return sorted(shards)
+
+    def store(self, shard: str) -> VectorStore:
+        with self._lock:
+            store = self._stores.get(shard)
+            if store is None:
+                store = self._stores[shard] = self.open_shard(shard)
+                logger.info(f"Opened vector store shard {shard}")
+            return store
+
+    def _each(self, shards: Sequence[str], fn: Callable[[str, VectorStore], Any]) -> List[Any]:
+        """``fn(shard, store)`` for every shard, concurrently when there are several."""
+        stores = [self.store(shard) for shard in shards]
+        if len(shards) == 1:
+            return [fn(shards[0], stores[0])]
+        return list(self._executor.map(fn, shards, stores))
+
+    # Search
+
+    def query_many(
+        self,
+        tenants: Sequence[str],
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int = 5,
+        wheres: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+        generation: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        ``VectorStore.query_many`` over each query's tenant shards.
+
+        Queries are grouped per shard, so every shard gets one batched
+        call, and the shards are searched concurrently. Hits are merged by
+        distance; a chunk stored in two shards counts once. With
+        ``generation`` (that of ``index`` when the queries were embedded),
+        ``StaleIndexError`` is raised if a shard has been promoted since.
+        """
+        wheres = wheres or [None] * len(query_embeddings)
+        members: Dict[str, List[int]] = {}
+        for i, tenant in enumerate(tenants):
+            for shard in self.shards(tenant):
+                members.setdefault(shard, []).append(i)
+        shards = list(members)
+
+        def search(shard: str, store: VectorStore) -> List[List[Dict[str, Any]]]:
+            return store.query_many(
+                query_embeddings=[query_embeddings[i] for i in members[shard]],
+                n_results=n_results,
+                wheres=[wheres[i] for i in members[shard]],
+                generation=generation
+            )
+
+        found = self._each(shards, search)
+
+        merged: List[Dict[str, Dict[str, Any]]] = [{} for _ in query_embeddings]
+        for shard, hits_per_query in zip(shards, found):
+            for i, hits in zip(members[shard], hits_per_query):
+                for hit in hits:
+                    best = merged[i].get(hit["id"])
+                    if best is None or hit["distance"] < best["distance"]:
+                        merged[i][hit["id"]] = hit
+        return [sorted(hits.values(), key=lambda hit: hit["distance"])[:n_results] for hits in merged]
+
+    def lexical_search(
+        self,
+        tenant: str,
+        query: str,
+        k: int,
+        filters: Optional[Dict[str, Sequence[str]]] = None
+    ) -> List[Tuple[str, float]]:
+        """BM25 over the tenant's shards, best first."""
+        shards = self.shards(tenant)
+
+        def search(shard: str, store: VectorStore) -> List[Tuple[str, float]]:
+            if store.lexical_index is None:
+                return []
+            return store.lexical_index.search(query, k, filters)
+
+        best: Dict[str, float] = {}
+        for hits in self._each(shards, search):
+            for doc_id, score in hits:
+                best[doc_id] = max(score, best.get(doc_id, score))
+        return sorted(best.items(), key=lambda item: -item[1])[:k]
+
+    def get(self, tenant: str, ids: List[str], where: Optional[Dict[str, Any]] = None) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        """(document, metadata) of the given ids that are in the tenant's shards and match ``where``."""
+        options = {"where": where} if where else {}
+
+        def fetch(shard: str, store: VectorStore) -> Dict[str, Any]:
+            return store.collection.get(ids=ids, include=["documents", "metadatas"], **options)
+
+        rows = {}
+        for found in self._each(self.shards(tenant), fetch):
+            rows.update(zip(found["ids"], zip(found["documents"], found["metadatas"])))
+        return rows
+
+    # Housekeeping
+
+    def open_stores(self) -> Dict[str, VectorStore]:
+        with self._lock:
+            return dict(self._stores)
+
+    @contextmanager
+    def paused_writes(self) -> Iterator[Dict[str, VectorStore]]:
+        """Hold the write lock of every open shard; yields the shards."""
+        stores = self.open_stores()
+        with ExitStack() as locks:
+            for shard in sorted(stores):
+                locks.enter_context(stores[shard].write_lock)
+            yield stores
+
+    def promote(self, index: IndexVersion, collections: Dict[str, Any]) -> bool:
+        """
+        Serve ``index`` from now on, each open shard from its collection
+        in ``collections``, inside ``paused_writes``. Returns False, and
+        changes nothing, when a shard was opened that has no collection
+        there; shards opened later open in the new generation.
+        """
+        with self._lock:
+            if set(self._stores) - set(collections):
+                return False
+            for shard, store in self._stores.items():
+                store.serve(collections[shard], index.generation, index.embedding_function)
+            self.index = index
+        logger.info(f"Serving vector index generation {index.generation} ({index.model})")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "index": self.index.to_dict(),
+            "placement": self.placement,
+            "shards": {shard: store.get_collection_stats() for shard, store in sorted(self.open_stores().items())}
+        }
+
+    def close(self) -> None:
+        """Close every open shard and its lexical index."""
+        for store in self.open_stores().values():
+            store.close()
+            if store.lexical_index is not None:
+                store.lexical_index.close()
+        self._executor.shutdown()
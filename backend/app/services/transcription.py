@@ -0,0 +1,196 @@
+import logging
+import wave
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WHISPER_SAMPLE_RATE = 16000
+
+
+class TranscriptionBackend:
+    """
+    Speech-to-text engine used by the windowed transcription pipeline.
+
+    Backends receive one window of mono float32 samples in [-1, 1] and
+    return segments whose ``start``/``end`` are seconds relative to the
+    start of that window.
+    """
+
+    name = "base"
+
+    def transcribe(self, samples: np.ndarray, sample_rate: int) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class WhisperBackend(TranscriptionBackend):
+    """Local openai-whisper model, loaded once per worker process."""
+
+    name = "whisper"
+
+    def __init__(self, model_name: str = "base"):
+        import whisper
+        self.model = whisper.load_model(model_name)
+
+    def transcribe(self, samples: np.ndarray, sample_rate: int) -> List[Dict[str, Any]]:
+        if sample_rate != WHISPER_SAMPLE_RATE:
+            samples = resample(samples, sample_rate, WHISPER_SAMPLE_RATE)
+        result = self.model.transcribe(samples, fp16=False)
+        return [
+            {"start": float(seg["start"]), "end": float(seg["end"]), "text": seg["text"].strip()}
+            for seg in result.get("segments", [])
+            if seg["text"].strip()
+        ]
+
+
+class GoogleBackend(TranscriptionBackend):
+    """Google Web Speech API through speech_recognition (one segment per window)."""
+
+    name = "google"
+
+    def __init__(self, model_name: str = ""):
+        import speech_recognition as sr
+        self._sr = sr
+        self.recognizer = sr.Recognizer()
+
+    def transcribe(self, samples: np.ndarray, sample_rate: int) -> List[Dict[str, Any]]:
+        pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+        audio_data = self._sr.AudioData(pcm, sample_rate, 2)
+        try:
+            text = self.recognizer.recognize_google(audio_data)
+        except self._sr.UnknownValueError:
+            return []
+        duration = len(samples) / sample_rate
+        return [{"start": 0.0, "end": duration, "text": text}] if text else []
+
+
+class StubBackend(TranscriptionBackend):
+    """Deterministic backend for tests and benchmarks; emits one segment per window."""
+
+    name = "stub"
+
+    def __init__(self, model_name: str = ""):
+        pass
+
+    def transcribe(self, samples: np.ndarray, sample_rate: int) -> List[Dict[str, Any]]:
+        duration = len(samples) / sample_rate
+        if duration == 0:
+            return []
+        rms = float(np.sqrt(np.mean(np.square(samples)))) if len(samples) else 0.0
+        return [{"start": 0.0, "end": duration, "text": f"speech {duration:.2f}s rms {rms:.3f}"}]
+
+
+BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    GoogleBackend.name: GoogleBackend,
+    StubBackend.name: StubBackend,
+}
+
+# One backend instance per (name, model) in each worker process
+_loaded: Dict[Tuple[str, str], TranscriptionBackend] = {}
+
+
+def get_backend(name: str, model_name: str = "") -> TranscriptionBackend:
+    key = (name, model_name)
+    if key not in _loaded:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown transcription backend '{name}'")
+        logger.info(f"Loading transcription backend {name} {model_name}".rstrip())
+        _loaded[key] = BACKENDS[name](model_name)
+    return _loaded[key]
+
+
+def resample(samples: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """Linear-interpolation resample; adequate for speech models."""
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    n_out = int(round(len(samples) * dst_rate / src_rate))
+    positions = np.linspace(0, len(samples) - 1, n_out)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def read_frames(wav_path: str, start_frame: int, n_frames: int) -> Tuple[np.ndarray, int]:
+    """
+    Read a slice of a 16-bit PCM WAV file as mono float32 samples.
+
+    Only the requested frames are read, so a long recording is never
+    loaded into memory as a whole.
+    """
+    with wave.open(wav_path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError("Expected 16-bit PCM audio")
+        channels = wf.getnchannels()
+        sample_rate = wf.getframerate()
+        wf.setpos(start_frame)
+        raw = wf.readframes(n_frames)
+    samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, sample_rate
+
+
+def plan_windows(
+    wav_path: str,
+    window_seconds: float = 30.0,
+    search_seconds: float = 2.0,
+    block_ms: int = 20
+) -> List[Tuple[int, int]]:
+    """
+    Split a WAV file into consecutive (start_frame, end_frame) windows.
+
+    Each boundary is moved back to the quietest ``block_ms`` block within
+    the last ``search_seconds`` of its window, so cuts tend to fall in
+    pauses instead of mid-word. Windows are contiguous and cover the file.
+    """
+    with wave.open(wav_path, "rb") as wf:
+        sample_rate = wf.getframerate()
+        total = wf.getnframes()
+
+    window = max(1, int(window_seconds * sample_rate))
+    search = min(int(search_seconds * sample_rate), window // 2)
+    block = max(1, int(sample_rate * block_ms / 1000))
+
+    windows = []
+    start = 0
+    while start < total:
+        end = start + window
+        if end >= total:
+            windows.append((start, total))
+            break
+        if search >= block:
+            samples, _ = read_frames(wav_path, end - search, search)
+            n_blocks = len(samples) // block
+            if n_blocks:
+                energy = np.square(samples[:n_blocks * block]).reshape(n_blocks, block).mean(axis=1)
+                end = end - search + int(np.argmin(energy)) * block + block // 2
+        windows.append((start, end))
+        start = end
+    return windows
+
+
+def transcribe_window(
+    backend_name: str,
+    model_name: str,
+    wav_path: str,
+    start_frame: int,
+    end_frame: int
+) -> List[Dict[str, Any]]:
+    """
+    Transcribe one window; runs on a worker process.
+
+    Returns:
+        Segments with ``start``/``end`` in seconds from the start of the file
+    """
+    samples, sample_rate = read_frames(wav_path, start_frame, end_frame - start_frame)
+    offset = start_frame / sample_rate
+    window_end = end_frame / sample_rate
+    backend = get_backend(backend_name, model_name)
+    return [
+        {
+            "start": round(offset + seg["start"], 3),
+            "end": round(min(offset + seg["end"], window_end), 3),
+            "text": seg["text"]
+        }
+        for seg in backend.transcribe(samples, sample_rate)
+    ]
@@ -0,0 +1,399 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# Enough leading bytes to recognise every supported container
+SNIFF_BYTES = 16
+
+EXTENSIONS = {"pdf": "pdf", "video": "mp4"}
+
+# Room in a multipart body for boundaries, part headers and small form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Longest gap between sweeps for stale resumable upload sessions, in seconds
+SWEEP_INTERVAL = 3600
+
+
+class UploadError(Exception):
+    """Upload rejected; ``status_code`` is the HTTP status to answer with."""
+
+    status_code = 400
+
+
+class UnsupportedFileType(UploadError):
+    status_code = 415
+
+
+class UploadTooLarge(UploadError):
+    status_code = 413
+
+
+class UploadConflict(UploadError):
+    status_code = 409
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """
+    Identify a file from its leading bytes instead of trusting its name.
+
+    Returns:
+        "pdf", "video" (ISO base media: mp4/mov/m4v) or None
+    """
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if len(head) >= 8 and head[4:8] == b"ftyp":
+        return "video"
+    return None
+
+
+def check_type(head: bytes, expected_kind: str) -> None:
+    kind = sniff_type(head)
+    if kind != expected_kind:
+        raise UnsupportedFileType(
+            f"Expected a {expected_kind} file, got {kind or 'an unrecognised format'}"
+        )
+
+
+def check_content_length(content_length: Optional[str], max_bytes: int) -> None:
+    """Reject a multipart upload whose declared length cannot fit under ``max_bytes``, before reading it."""
+    try:
+        length = int(content_length) if content_length is not None else None
+    except ValueError:
+        raise UploadError("Invalid Content-Length")
+    if length is not None and length > max_bytes + MULTIPART_OVERHEAD:
+        raise UploadTooLarge(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+
+
+class MultipartFile:
+    """
+    The file in a multipart/form-data request body, parsed as the body
+    arrives rather than spooled to a temporary file first.
+
+    ``chunks()`` yields the bytes of the first file part named ``field``
+    and reads the body to its end; the other (small) form fields are in
+    ``fields`` once it is done.
+    """
+
+    def __init__(self, content_type: str, body: AsyncIterator[bytes], field: str = "file", max_field_bytes: int = 4096):
+        media_type, params = parse_options_header(content_type)
+        if media_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadError("Expected a multipart/form-data body")
+        self.field = field
+        self.max_field_bytes = max_field_bytes
+        self.filename: Optional[str] = None
+        self.fields: Dict[str, str] = {}
+        self._body = body
+        self._file_data: List[bytes] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        # "file", a form field's name, or None for a part that is ignored
+        self._part: Optional[str] = None
+        self._value = bytearray()
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": lambda data, start, end: self._add_header_name(data[start:end]),
+            "on_header_value": lambda data, start, end: self._add_header_value(data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished
+        })
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+        self._part = None
+        self._value = bytearray()
+
+    def _add_header_name(self, data: bytes) -> None:
+        self._header_name += data
+
+    def _add_header_value(self, data: bytes) -> None:
+        self._header_value += data
+
+    def _on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            if name == self.field and self.filename is None:
+                self.filename = options[b"filename"].decode("utf-8", "replace")
+                self._part = "file"
+        elif name:
+            self._part = name
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._part == "file":
+            self._file_data.append(data[start:end])
+        elif self._part is not None:
+            self._value.extend(data[start:end])
+            if len(self._value) > self.max_field_bytes:
+                raise UploadError(f"Form field '{self._part}' is too long")
+
+    def _on_part_end(self) -> None:
+        if self._part not in (None, "file"):
+            self.fields[self._part] = self._value.decode("utf-8", "replace")
+        self._part = None
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._body:
+                self._parser.write(chunk)
+                data, self._file_data = self._file_data, []
+                for piece in data:
+                    yield piece
+            self._parser.finalize()
+        except FormParserError as e:
+            raise UploadError(f"Malformed multipart body: {e}")
+        if self.filename is None:
+            raise UploadError(f"No '{self.field}' file in the form")
+
+
+async def stream_to_disk(
+    chunks: AsyncIterator[bytes],
+    directory: str,
+    expected_kind: str,
+    max_bytes: int
+) -> Tuple[str, str, int]:
+    """
+    Write an upload to a temporary file chunk by chunk.
+
+    The type is checked on the first bytes and the size limit on every
+    chunk, so bad uploads are rejected as soon as possible and nothing is
+    ever held in memory beyond one chunk.
+
+    Returns:
+        Tuple of (temporary path, sha256 hex digest, size in bytes)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                    if len(head) >= SNIFF_BYTES:
+                        check_type(head, expected_kind)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+                digest.update(chunk)
+                f.write(chunk)
+        if len(head) < SNIFF_BYTES:
+            check_type(head, expected_kind)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+class ResumableUploads:
+    """
+    Chunked uploads that survive dropped connections.
+
+    A session is a ``.part`` file plus a small JSON sidecar under
+    ``directory``. Clients append chunks at the current offset and, after
+    a failure, ask for the offset and continue from there. Writers lock
+    the ``.part`` file, so chunks of one upload are written one at a time
+    even across worker processes; a chunk sent while another is being
+    written is refused with 409. Sessions untouched for ``ttl_seconds``
+    are swept away (0 keeps them).
+    """
+
+    def __init__(self, directory: str, max_bytes: Dict[str, int], ttl_seconds: float = 0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._swept_at = 0.0
+
+    def _paths(self, upload_id: str) -> Tuple[str, str]:
+        if not upload_id.replace("-", "").isalnum():
+            raise UploadError("Invalid upload id")
+        base = os.path.join(self.directory, upload_id)
+        return f"{base}.part", f"{base}.json"
+
+    @staticmethod
+    def _lock(f) -> None:
+        """Lock an open ``.part`` file until it is closed, or refuse if another writer holds it."""
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict("Another chunk of this upload is being written")
+
+    def create(self, filename: str, kind: str, size: int, tenant: Optional[str] = None) -> Dict[str, Any]:
+        if kind not in self.max_bytes:
+            raise UnsupportedFileType(f"Unsupported upload kind '{kind}'")
+        if size > self.max_bytes[kind]:
+            raise UploadTooLarge(f"Upload exceeds the {self.max_bytes[kind] // (1024 * 1024)} MB limit")
+        if self.ttl_seconds > 0 and time.monotonic() - self._swept_at > min(self.ttl_seconds, SWEEP_INTERVAL):
+            self.sweep()
+
+        upload_id = str(uuid.uuid4())
+        part_path, meta_path = self._paths(upload_id)
+        session = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "kind": kind,
+            "size": size,
+            "tenant": tenant,
+            "created_at": datetime.now().isoformat()
+        }
+        open(part_path, "wb").close()
+        with open(meta_path, "w") as f:
+            json.dump(session, f)
+        return dict(session, offset=0)
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        part_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                session = json.load(f)
+            session["offset"] = os.path.getsize(part_path)
+        except FileNotFoundError:
+            return None
+        return session
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        Append a chunk at ``offset``, which must equal the bytes received so far.
+
+        A chunk that fails part-way is truncated back to ``offset`` so the
+        client can simply resend it.
+        """
+        session = self.get(upload_id)
+        if session is None:
+            raise UploadError("Unknown upload id")
+
+        part_path, _ = self._paths(upload_id)
+        try:
+            f = open(part_path, "r+b")
+        except FileNotFoundError:
+            raise UploadError("Unknown upload id")
+        with f:
+            self._lock(f)
+            # Read under the lock: a chunk written meanwhile moved the offset
+            session["offset"] = os.fstat(f.fileno()).st_size
+            if offset != session["offset"]:
+                raise UploadConflict(f"Offset mismatch: server has {session['offset']} bytes")
+            written = offset
+            head = f.read(min(offset, SNIFF_BYTES))
+            f.seek(offset)
+            try:
+                async for chunk in chunks:
+                    written += len(chunk)
+                    if written > session["size"]:
+                        raise UploadTooLarge("Chunk extends past the declared upload size")
+                    if len(head) < SNIFF_BYTES:
+                        head += chunk[:SNIFF_BYTES - len(head)]
+                        if len(head) >= SNIFF_BYTES:
+                            check_type(head, session["kind"])
+                    f.write(chunk)
+            except BaseException:
+                f.truncate(offset)
+                raise
+        session["offset"] = written
+        return session
+
+    def complete(self, upload_id: str) -> Tuple[Dict[str, Any], str]:
+        """
+        Finish an upload once every declared byte has arrived.
+
+        Returns:
+            Tuple of (session, path of the assembled file); the caller
+            moves or deletes the file
+        """
+        session = self.get(upload_id)
+        if session is None:
+            raise UploadError("Unknown upload id")
+        part_path, meta_path = self._paths(upload_id)
+        with open(part_path, "rb") as f:
+            self._lock(f)
+            session["offset"] = os.fstat(f.fileno()).st_size
+            if session["offset"] != session["size"]:
+                raise UploadConflict(
+                    f"Upload incomplete: {session['offset']} of {session['size']} bytes received"
+                )
+            check_type(f.read(SNIFF_BYTES), session["kind"])
+            os.unlink(meta_path)
+        return session, part_path
+
+    def discard(self, upload_id: str) -> bool:
+        """
+        Delete a session and the bytes received so far.
+
+        Returns:
+            Whether there was anything to delete
+        """
+        part_path, meta_path = self._paths(upload_id)
+        try:
+            f = open(part_path, "rb")
+        except FileNotFoundError:
+            f = None
+        try:
+            if f is not None:
+                self._lock(f)
+            removed = False
+            for path in (meta_path, part_path):
+                try:
+                    os.unlink(path)
+                    removed = True
+                except FileNotFoundError:
+                    pass
+        finally:
+            if f is not None:
+                f.close()
+        return removed
+
+    def sweep(self, ttl_seconds: Optional[float] = None) -> int:
+        """
+        Discard sessions (and ``.part`` files a crash left without one)
+        untouched for ``ttl_seconds``, ``self.ttl_seconds`` by default.
+
+        Returns:
+            The number of sessions discarded
+        """
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._swept_at = time.monotonic()
+        if ttl_seconds <= 0:
+            return 0
+        cutoff = time.time() - ttl_seconds
+        touched: Dict[str, float] = {}
+        for entry in os.scandir(self.directory):
+            upload_id, extension = os.path.splitext(entry.name)
+            if extension in (".part", ".json"):
+                try:
+                    touched[upload_id] = max(touched.get(upload_id, 0.0), entry.stat().st_mtime)
+                except FileNotFoundError:
+                    continue
+        swept = 0
+        for upload_id, last_touched in touched.items():
+            if last_touched >= cutoff:
+                continue
+            try:
+                if self.discard(upload_id):
+                    swept += 1
+            except UploadError:
+                # A chunk is being written right now, or the name is not an upload id
+                continue
+        if swept:
+            logger.info(f"Swept {swept} stale upload sessions from {self.directory}")
+        return swept
@@ -1,97 +1,577 @@
-import chromadb
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
+import json
 import logging
 import os
+import shutil
+import threading
+import time
+
+from app.core import telemetry
+from app.services import dedup
+from app.services.embedding import EmbeddingError
+from app.services.mmap_store import MmapCollection
 
 logger = logging.getLogger(__name__)
 
+# Used when the backend does not report its own limit
+DEFAULT_MAX_BATCH_SIZE = 5000
+
+BACKENDS = ("chroma", "mmap")
+
+class StaleIndexError(Exception):
+    """A query embedded for one index generation reached a store already serving the next."""
+
+
+class EmbeddingModelMismatch(ValueError):
+    """A collection holds vectors of another embedding model than the one it is opened with."""
+
+
+def _chroma_client(persist_directory: str):
+    # Imported here: chromadb is slow to import and the mmap backend never needs it
+    import chromadb
+    from chromadb.config import Settings as ChromaSettings
+
+    # Chroma persistent client without its usage telemetry (see chroma_telemetry)
+    telemetry_impl = "app.services.chroma_telemetry.NoProductTelemetry"
+    return chromadb.PersistentClient(
+        path=persist_directory,
+        settings=ChromaSettings(
+            anonymized_telemetry=False,
+            chroma_product_telemetry_impl=telemetry_impl,
+            chroma_telemetry_impl=telemetry_impl
+        )
+    )
+
+
 class VectorStore:
-    def __init__(self, persist_directory: str = "./data/vector_db"):
+    def __init__(
+        self,
+        persist_directory: str = "./data/vector_db",
+        collection_name: str = "rag_docs",
+        embedding_function=None,
+        lexical_index=None,
+        batch_size: Optional[int] = None,
+        backend: str = "chroma",
+        backend_options: Optional[Dict[str, Any]] = None,
+        generation: int = 0,
+        dimension: Optional[int] = None,
+        replace_mismatched: bool = False
+    ):
         """
-        Initialize the ChromaDB vector store with persistent storage.
-        
+        Initialize the vector store with persistent storage.
+
         Args:
             persist_directory: Directory to store the vector database
+            collection_name: Collection to use
+            embedding_function: Chroma embedding function for the collection
+            lexical_index: Optional ``BM25Index`` kept in sync with every write
+            batch_size: Rows per write; capped at the client's max batch size
+            backend: "chroma" (Chroma persistent client) or "mmap"
+                (``MmapCollection``, memory-mapped vectors in process)
+            backend_options: Extra ``MmapCollection`` arguments, e.g.
+                dtype, ivf_threshold, nprobe
+            generation: Index generation the collection belongs to; queries
+                embedded for another one are refused (``StaleIndexError``)
+            dimension: Embedding dimension, when known, to tag a new
+                collection with
+            replace_mismatched: Drop and recreate the collection when it is
+                tagged with another embedding model, instead of raising
+                ``EmbeddingModelMismatch``
         """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown vector store backend: {backend}. Available: {', '.join(BACKENDS)}")
         # Create directory if it doesn't exist
         os.makedirs(persist_directory, exist_ok=True)
-        
-        # Initialize Chroma client with persistent storage
-        self.client = chromadb.PersistentClient(path=persist_directory)
-        
-        try:
-            self.collection = self.client.get_or_create_collection(
-                name="rag_docs",
-                metadata={"hnsw:space": "cosine"}  # Using cosine similarity
+        self.persist_directory = persist_directory
+        self.backend = backend
+        self.backend_options = backend_options or {}
+        self.embedding_function = embedding_function
+        self.lexical_index = lexical_index
+        self.client = _chroma_client(persist_directory) if backend == "chroma" else None
+
+        # New collections are tagged with the model (and dimension) of their
+        # vectors; collections created before tagging carry no tag
+        model = getattr(embedding_function, "model_name", "") or None
+        tags = {"embedding_model": model, "embedding_dimension": dimension}
+        tags = {key: value for key, value in tags.items() if value is not None}
+        collection = self._open_collection(collection_name, tags)
+        tagged = (collection.metadata or {}).get("embedding_model")
+        if model is not None and tagged is not None and tagged != model:
+            if not replace_mismatched:
+                raise EmbeddingModelMismatch(
+                    f"Collection {collection_name} holds {tagged} embeddings, not {model}"
+                )
+            logger.warning(f"Replacing collection {collection_name}: it holds {tagged} embeddings, not {model}")
+            self.drop_collection(collection_name, collection)
+            collection = self._open_collection(collection_name, tags)
+
+        # (generation, collection), swapped as one by ``serve``
+        self._serving = (generation, collection)
+        max_batch_size = getattr(self.client, "max_batch_size", None) or DEFAULT_MAX_BATCH_SIZE
+        self.batch_size = min(batch_size or max_batch_size, max_batch_size)
+        self.buffer: Optional["WriteBuffer"] = None
+        self._write_lock = threading.Lock()
+        # Cached so queries don't pay a round trip for it; reset on writes
+        self._count: Optional[int] = None
+        # Ids written since ``track_changes``, while a re-index copies the collection
+        self._changed: Optional[Set[str]] = None
+
+    @property
+    def collection(self):
+        return self._serving[1]
+
+    @property
+    def generation(self) -> int:
+        return self._serving[0]
+
+    def _open_collection(self, collection_name: str, tags: Dict[str, Any]):
+        if self.backend == "mmap":
+            return MmapCollection(
+                self.persist_directory,
+                collection_name,
+                embedding_function=self.embedding_function,
+                metadata={"hnsw:space": "cosine", **tags},
+                **self.backend_options
             )
+
+        options = {"name": collection_name}
+        if self.embedding_function is not None:
+            options["embedding_function"] = self.embedding_function
+        try:
+            try:
+                return self.client.get_collection(**options)
+            except ValueError:
+                # The distance space can only be chosen when the collection
+                # is created; existing collections keep theirs
+                return self.client.create_collection(
+                    metadata={"hnsw:space": "cosine", **tags},  # Using cosine similarity
+                    **options
+                )
         except Exception as e:
             logger.error(f"Collection initialization failed: {str(e)}")
             raise
 
+    def drop_collection(self, collection_name: str, collection=None) -> None:
+        """
+        Delete a collection of this store's database that it no longer
+        serves; ``collection`` is its open handle, if any.
+        """
+        if self.backend == "mmap":
+            if collection is not None:
+                collection.close()
+            shutil.rmtree(os.path.join(self.persist_directory, collection_name), ignore_errors=True)
+            return
+        try:
+            self.client.delete_collection(collection_name)
+        except ValueError:
+            pass  # Already gone
+
+    def serve(self, collection, generation: int, embedding_function) -> None:
+        """
+        Switch to another collection of the same rows, e.g. a re-embedded
+        copy; the caller holds ``write_lock``. Queries already running
+        finish on the previous collection.
+        """
+        self.embedding_function = embedding_function
+        self._serving = (generation, collection)
+        self._count = None
+        self._changed = None
+
+    @property
+    def write_lock(self) -> threading.Lock:
+        """Held by every write; holding it pauses them."""
+        return self._write_lock
+
+    def track_changes(self) -> None:
+        """Start recording the ids of chunks written, for ``take_changes``."""
+        with self._write_lock:
+            self._changed = set()
+
+    def stop_tracking(self) -> None:
+        with self._write_lock:
+            self._changed = None
+
+    def take_changes(self, locked: bool = False) -> Set[str]:
+        """
+        Ids written since tracking started or the last call, which starts
+        over; ``locked`` when the caller already holds ``write_lock``.
+        """
+        if locked:
+            changed, self._changed = self._changed or set(), set()
+            return changed
+        with self._write_lock:
+            return self.take_changes(locked=True)
+
+    def _note_changes(self, ids: Iterable[str]) -> None:
+        if self._changed is not None:
+            self._changed.update(ids)
+
+    def count(self) -> int:
+        count = self._count
+        if count is None:
+            count = self._count = self.collection.count()
+        return count
+
+    def upsert(self, documents: List[str], metadatas: List[Dict[str, Any]]) -> int:
+        """
+        Idempotently store chunks under content-derived ids.
+
+        Rows are written in batches of ``batch_size``; chunks that are
+        already stored are not embedded again, only their sources are
+        merged (see ``dedup.upsert_chunks``), so re-ingesting a file is a
+        no-op.
+
+        Returns:
+            Number of chunks that were newly embedded
+        """
+        embedded = 0
+        with self._write_lock, telemetry.span("upsert", chunks=len(documents)):
+            if self._changed is not None:
+                self._note_changes(dedup.chunk_id(text) for text in documents)
+            for start in range(0, len(documents), self.batch_size):
+                embedded += dedup.upsert_chunks(
+                    self.collection,
+                    documents[start:start + self.batch_size],
+                    metadatas[start:start + self.batch_size],
+                    lexical_index=self.lexical_index
+                )
+            if embedded:
+                self._count = None
+        return embedded
+
     def add_documents(self, documents: List[Dict[str, Any]]) -> bool:
         """
         Add documents to the vector store.
-        
+
         Args:
             documents: List of dictionaries containing 'text' and 'metadata'
-            
+
         Returns:
             bool: True if successful
         """
         try:
-            # Generate unique IDs for each document
-            ids = [f"doc_{i}_{doc.get('metadata', {}).get('page', 0)}" 
-                  for i, doc in enumerate(documents)]
-            
-            texts = [doc["text"] for doc in documents]
-            metadatas = [doc.get("metadata", {}) for doc in documents]
-            
-            self.collection.add(
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
+            self.upsert(
+                [doc["text"] for doc in documents],
+                [doc.get("metadata", {}) for doc in documents]
             )
             return True
         except Exception as e:
             logger.error(f"Document addition failed: {str(e)}")
             raise
 
-    def query(self, query_embedding: List[float], n_results: int = 5) -> List[Dict[str, Any]]:
+    def delete_file(self, file_id: str) -> Dict[str, int]:
+        """
+        Remove everything a file contributed.
+
+        Chunks seen only in this file are deleted; chunks shared with other
+        files stay, with this file dropped from their sources.
+
+        Returns:
+            Dict with the number of chunks ``deleted`` and ``updated``
+        """
+        self.flush()
+        with self._write_lock:
+            found = self.collection.get(
+                where={dedup.file_flag(file_id): True},
+                include=["documents", "metadatas"]
+            )
+            delete_ids, update_ids, update_metadatas, reindex = [], [], [], []
+            for cid, text, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                metadata = dedup.remove_file(metadata or {}, file_id)
+                if metadata is None:
+                    delete_ids.append(cid)
+                else:
+                    update_ids.append(cid)
+                    update_metadatas.append(metadata)
+                    reindex.append((cid, text, dedup.filter_values(metadata)))
+            self._note_changes(found["ids"])
+
+            for start in range(0, len(delete_ids), self.batch_size):
+                self.collection.delete(ids=delete_ids[start:start + self.batch_size])
+            for start in range(0, len(update_ids), self.batch_size):
+                self.collection.update(
+                    ids=update_ids[start:start + self.batch_size],
+                    metadatas=update_metadatas[start:start + self.batch_size]
+                )
+            if self.lexical_index is not None:
+                self.lexical_index.delete(delete_ids)
+                self.lexical_index.add_many(reindex)
+            self._count = None
+        return {"deleted": len(delete_ids), "updated": len(update_ids)}
+
+    def iter_documents(self, page_size: Optional[int] = None) -> Iterator[Tuple[List[str], List[str], List[Dict[str, Any]]]]:
+        """Yield every stored (ids, documents, metadatas) page by page."""
+        page_size = page_size or min(self.batch_size, 1024)
+        offset = 0
+        while True:
+            page = self.collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            if not page["ids"]:
+                return
+            yield page["ids"], page["documents"], page["metadatas"]
+            offset += len(page["ids"])
+
+    def enable_buffer(self, journal_path: str, max_items: int = 1024, max_delay: float = 2.0) -> "WriteBuffer":
+        self.buffer = WriteBuffer(self, journal_path, max_items=max_items, max_delay=max_delay)
+        return self.buffer
+
+    def write(self, documents: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Queue chunks in the write buffer, or upsert them directly without one."""
+        if self.buffer is not None:
+            self.buffer.add(documents, metadatas)
+        else:
+            self.upsert(documents, metadatas)
+
+    def flush(self) -> int:
+        return self.buffer.flush() if self.buffer is not None else 0
+
+    def close(self) -> None:
+        if self.buffer is not None:
+            self.buffer.close()
+        if self.backend == "mmap":
+            self.collection.close()
+
+    def query(self, query_embedding: List[float], n_results: int = 5, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
         Query the vector store for similar documents.
-        
+
         Args:
             query_embedding: The embedding vector to query with
             n_results: Number of results to return
-            
+            where: Optional Chroma metadata filter
+
         Returns:
             List of dictionaries containing matched documents and metadata
         """
+        return self.query_many(query_embeddings=[query_embedding], n_results=n_results, wheres=[where])[0]
+
+    def query_many(
+        self,
+        query_texts: Optional[List[str]] = None,
+        query_embeddings: Optional[List[List[float]]] = None,
+        n_results: int = 5,
+        wheres: Optional[List[Optional[Dict[str, Any]]]] = None,
+        generation: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Run many queries with one embedding call and one Chroma query per distinct filter.
+
+        Args:
+            query_texts: Questions to embed in a single batched call
+            query_embeddings: Pre-computed embeddings instead of texts
+            n_results: Number of results per query
+            wheres: Optional metadata filter per query
+            generation: Index generation ``query_embeddings`` were embedded
+                for; ``StaleIndexError`` if the store has moved on since
+
+        Returns:
+            Per query, a list of dictionaries with the matched id, text,
+            metadata and distance, best first
+        """
+        serving, collection = self._serving
+        if generation is not None and generation != serving:
+            raise StaleIndexError(f"Embedded for index generation {generation}, now serving {serving}")
         try:
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=min(n_results, self.collection.count())
-            )
-            
-            return [
-                {
-                    "text": results["documents"][0][i],
-                    "metadata": results["metadatas"][0][i],
-                    "distance": results["distances"][0][i]
-                }
-                for i in range(len(results["documents"][0]))
-            ]
+            if query_embeddings is None:
+                query_embeddings = self.embedding_function(list(query_texts))
+            n_queries = len(query_embeddings)
+            wheres = wheres or [None] * n_queries
+            n_results = min(n_results, self.count())
+            results: List[List[Dict[str, Any]]] = [[] for _ in range(n_queries)]
+            if n_results <= 0 or n_queries == 0:
+                return results
+
+            # Chroma applies one filter to a whole query call, so queries
+            # are grouped by filter and each group is one multi-vector call
+            groups: Dict[str, List[int]] = {}
+            for i, where in enumerate(wheres):
+                groups.setdefault(json.dumps(where, sort_keys=True), []).append(i)
+            for members in groups.values():
+                where = wheres[members[0]]
+                options = {"where": where} if where else {}
+                found = collection.query(
+                    query_embeddings=[list(query_embeddings[i]) for i in members],
+                    n_results=n_results,
+                    **options
+                )
+                for row, i in enumerate(members):
+                    results[i] = [
+                        {
+                            "id": found["ids"][row][j],
+                            "text": found["documents"][row][j],
+                            "metadata": found["metadatas"][row][j],
+                            "distance": found["distances"][row][j]
+                        }
+                        for j in range(len(found["ids"][row]))
+                    ]
+            return results
         except Exception as e:
             logger.error(f"Vector query failed: {str(e)}")
             raise
 
+    def train_compression(self, kind: Optional[str], **options) -> Dict[str, Any]:
+        """(Re)train compressed scan codes; see ``MmapCollection.train_compression``."""
+        if self.backend != "mmap":
+            raise ValueError("Compression needs the mmap vector store backend")
+        return self.collection.train_compression(kind, **options)
+
     def get_collection_stats(self) -> Dict[str, Any]:
         """Get basic statistics about the collection"""
-        return {
-            "count": self.collection.count(),
+        stats = {
+            "count": self.count(),
             "name": self.collection.name,
-            "metadata": self.collection.metadata
+            "metadata": self.collection.metadata,
+            "generation": self.generation,
+            "backend": self.backend,
+            "batch_size": self.batch_size,
+            "buffered": len(self.buffer) if self.buffer is not None else 0
         }
+        if self.backend == "mmap":
+            stats["storage"] = self.collection.describe()
+        return stats
+
+
+class WriteBuffer:
+    """
+    Write-ahead buffer that coalesces many small writes into few large ones.
+
+    Every ``add`` is appended to a JSON-lines journal before it is
+    acknowledged, then held in memory until ``max_items`` rows are pending
+    or the oldest has waited ``max_delay`` seconds, when everything is
+    upserted in one go. Rows still in the journal after a crash are
+    replayed on start-up.
+
+    When the store rejects a batch, it is split until the rows it rejects
+    on their own are found; those go to a dead-letter journal
+    (``<journal>.rejected``) and the rest are written. If the embedding
+    service fails, or every row of the batch is rejected, the store itself
+    is taken to be down and the whole batch stays pending.
+    """
+
+    def __init__(self, store: VectorStore, journal_path: str, max_items: int = 1024, max_delay: float = 2.0):
+        directory = os.path.dirname(journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.store = store
+        self.journal_path = journal_path
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[Tuple[str, Dict[str, Any]]] = []
+        self._oldest: Optional[float] = None
+
+        if os.path.exists(journal_path):
+            with open(journal_path) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        logger.warning("Ignoring unreadable write buffer journal entry")
+                        continue
+                    self._pending.append((row["document"], row["metadata"]))
+            if self._pending:
+                logger.info(f"Replaying {len(self._pending)} buffered vector store write(s)")
+                self._oldest = time.monotonic()
+        self._journal = open(journal_path, "a")
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="vector-write-buffer", daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, documents: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for text, metadata in zip(documents, metadatas):
+                self._journal.write(json.dumps({"document": text, "metadata": metadata}) + "\n")
+                self._pending.append((text, metadata))
+            self._journal.flush()
+            if self._oldest is None and self._pending:
+                self._oldest = time.monotonic()
+            full = len(self._pending) >= self.max_items
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Upsert everything pending.
+
+        Returns:
+            Number of chunks that were newly embedded
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                self._oldest = None
+            if not rows:
+                return 0
+            try:
+                embedded, rejected = self._upsert(rows)
+                if len(rejected) == len(rows):
+                    raise rejected[0][1]
+            except Exception:
+                with self._lock:
+                    self._pending = rows + self._pending
+                    self._oldest = time.monotonic()
+                raise
+            if rejected:
+                self._reject(rejected)
+            self._rewrite_journal()
+            return embedded
+
+    def _upsert(self, rows: List[Tuple[str, Dict[str, Any]]]) -> Tuple[int, List[Tuple[Tuple[str, Dict[str, Any]], Exception]]]:
+        """
+        Upsert ``rows``, halving the batch on failure to isolate the rows the store rejects.
+
+        Returns:
+            Tuple of (chunks newly embedded, rejected rows with their error)
+        """
+        try:
+            return self.store.upsert([text for text, _ in rows], [metadata for _, metadata in rows]), []
+        except EmbeddingError:
+            raise
+        except Exception as e:
+            if len(rows) == 1:
+                return 0, [(rows[0], e)]
+            middle = len(rows) // 2
+            first, first_rejected = self._upsert(rows[:middle])
+            second, second_rejected = self._upsert(rows[middle:])
+            return first + second, first_rejected + second_rejected
+
+    def _reject(self, rejected: List[Tuple[Tuple[str, Dict[str, Any]], Exception]]) -> None:
+        with open(f"{self.journal_path}.rejected", "a") as f:
+            for (text, metadata), error in rejected:
+                f.write(json.dumps({"document": text, "metadata": metadata, "error": str(error)}, default=str) + "\n")
+        logger.error(
+            f"Vector store rejected {len(rejected)} buffered chunk(s), set aside in {self.journal_path}.rejected: "
+            f"{str(rejected[0][1])}"
+        )
+
+    def _rewrite_journal(self) -> None:
+        # Keep only rows added while the flush was running
+        with self._lock:
+            tmp_path = f"{self.journal_path}.tmp"
+            with open(tmp_path, "w") as f:
+                for text, metadata in self._pending:
+                    f.write(json.dumps({"document": text, "metadata": metadata}) + "\n")
+            self._journal.close()
+            os.replace(tmp_path, self.journal_path)
+            self._journal = open(self.journal_path, "a")
+
+    def _run(self) -> None:
+        while not self._stop.wait(min(self.max_delay / 2, 1.0)):
+            oldest = self._oldest
+            if oldest is not None and time.monotonic() - oldest >= self.max_delay:
+                try:
+                    # Buffered rows come from ingestion jobs
+                    with telemetry.trace("ingest", flush="timer"):
+                        self.flush()
+                except Exception as e:
+                    logger.error(f"Buffered vector store write failed: {str(e)}")
 
-# Initialize singleton instance
-vector_store = VectorStore()
\ No newline at end of file
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        self._journal.close()
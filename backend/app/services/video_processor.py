@@ -1,73 +1,233 @@
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
+import os
+from collections import deque
+from concurrent.futures import Executor
+from tempfile import NamedTemporaryFile
+from typing import Any, Dict, Iterator, List, Optional
 
-def process_video(file_path: str, filename: str, file_id: str):
+import numpy as np
+
+from app.services import ocr, transcription
+
+# Bump when what iter_transcript yields changes, so stored transcripts are not reused
+TRANSCRIPT_VERSION = 1
+SEGMENT_COLUMNS = ("start", "end", "text")
+
+def transcript_version(backend: str, model_name: str, window_seconds: float) -> str:
+    """Version of a transcript: the settings that shape the segments, and this module's."""
+    return f"{backend}:{model_name}/window-{window_seconds:g}/{TRANSCRIPT_VERSION}"
+
+# Bump when what iter_keyframes yields changes, so stored keyframes are not reused
+KEYFRAME_VERSION = 1
+KEYFRAME_COLUMNS = ("start", "end", "text")
+
+def keyframe_version(backend: str, language: str, frames_per_minute: float, hash_distance: int) -> str:
+    """Version of a video's keyframe text: the settings that pick and read the frames, and this module's."""
+    return f"{backend}:{language}/fpm-{frames_per_minute:g}/dhash-{hash_distance}/{KEYFRAME_VERSION}"
+
+def format_timestamp(start: float, end: float) -> str:
+    return f"{int(start // 60):02d}:{int(start % 60):02d}-{int(end // 60):02d}:{int(end % 60):02d}"
+
+def extract_audio(file_path: str, sample_rate: int = transcription.WHISPER_SAMPLE_RATE) -> Optional[str]:
+    """
+    Write a video's audio track to a temporary mono 16-bit WAV file.
+
+    Returns:
+        Path of the WAV file (the caller deletes it), or None if the video
+        has no audio track
+    """
+    from moviepy.editor import VideoFileClip
+
+    video = VideoFileClip(file_path)
     try:
-        # Extract audio
-        video = VideoFileClip(file_path)
-        audio = video.audio
-        
+        if video.audio is None:
+            return None
         with NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
             audio_path = temp_audio.name
-            audio.write_audiofile(audio_path, codec='pcm_s16le')
-        
-        # Load audio file
-        audio_segment = AudioSegment.from_wav(audio_path)
-        
-        # Split audio on silence
-        chunks = split_on_silence(
-            audio_segment,
-            min_silence_len=1000,
-            silence_thresh=-40,
-            keep_silence=500
+        video.audio.write_audiofile(
+            audio_path,
+            fps=sample_rate,
+            codec="pcm_s16le",
+            ffmpeg_params=["-ac", "1"],
+            logger=None
         )
-        
-        recognizer = sr.Recognizer()
-        documents = []
-        metadatas = []
-        ids = []
-        
-        for i, chunk in enumerate(chunks):
-            chunk_path = f"{audio_path}_chunk_{i}.wav"
-            chunk.export(chunk_path, format="wav")
-            
-            with sr.AudioFile(chunk_path) as source:
-                audio_data = recognizer.record(source)
-                try:
-                    text = recognizer.recognize_google(audio_data)
-                    
-                    if text:
-                        # Calculate timestamp
-                        start_time = sum(c.duration_seconds for c in chunks[:i])
-                        end_time = start_time + chunk.duration_seconds
-                        timestamp = f"{int(start_time // 60):02d}:{int(start_time % 60):02d}-{int(end_time // 60):02d}:{int(end_time % 60):02d}"
-                        
-                        doc_id = f"{file_id}_chunk_{i}"
-                        documents.append(text)
-                        metadatas.append({
-                            "source": filename,
-                            "timestamp": timestamp,
-                            "type": "video",
-                            "file_id": file_id
-                        })
-                        ids.append(doc_id)
-                    
-                except sr.UnknownValueError:
-                    continue
-                finally:
-                    os.unlink(chunk_path)
-        
-        if documents:
-            collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-        
-        os.unlink(audio_path)
+        return audio_path
+    finally:
         video.close()
-        return True
-    
+
+def iter_transcript(
+    audio_path: str,
+    executor: Optional[Executor] = None,
+    backend: str = "whisper",
+    model_name: str = "base",
+    window_seconds: float = 30.0,
+    max_in_flight: int = 4
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield transcript segments in time order.
+
+    The audio is cut into windows with exact frame offsets, and the
+    windows are transcribed concurrently on ``executor``. Results are
+    yielded in order as soon as the earliest outstanding window is done,
+    with at most ``max_in_flight`` windows submitted at a time.
+
+    Args:
+        audio_path: 16-bit PCM WAV file
+        executor: Pool to transcribe windows on; serial if omitted
+        backend: Name of a backend in ``transcription.BACKENDS``
+        model_name: Model passed to the backend (e.g. the Whisper size)
+        window_seconds: Nominal window length
+        max_in_flight: Maximum number of windows submitted but not yet yielded
+    """
+    windows = transcription.plan_windows(audio_path, window_seconds)
+
+    if executor is None:
+        for start, end in windows:
+            yield from transcription.transcribe_window(backend, model_name, audio_path, start, end)
+        return
+
+    pending = deque()
+    try:
+        for start, end in windows:
+            pending.append(executor.submit(
+                transcription.transcribe_window, backend, model_name, audio_path, start, end
+            ))
+            if len(pending) >= max_in_flight:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def frame_hash(frame: np.ndarray) -> int:
+    """
+    128-bit difference hash (dHash) of an RGB frame: whether each pixel of
+    a 9x9 grayscale thumbnail is brighter than its right neighbour, and
+    than the one below (slides are often laid out in rows as much as in
+    columns). Frames that look alike differ in few bits, whatever their
+    size or encoding noise.
+    """
+    from PIL import Image
+
+    thumbnail = np.asarray(Image.fromarray(frame).convert("L").resize((9, 9), Image.BILINEAR), dtype=np.int16)
+    bits = np.concatenate([
+        (thumbnail[:8, 1:] > thumbnail[:8, :-1]).flatten(),
+        (thumbnail[1:, :8] > thumbnail[:-1, :8]).flatten()
+    ])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hash_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def iter_keyframes(
+    file_path: str,
+    executor: Optional[Executor] = None,
+    backend: str = "tesseract",
+    language: str = "eng",
+    frames_per_minute: float = 12.0,
+    max_hash_distance: int = 10,
+    max_in_flight: int = 4
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the text shown in a video, one keyframe at a time in time order.
+
+    Frames are decoded as the video is read, at ``frames_per_minute``
+    (the budget for decoding and hashing). A frame within
+    ``max_hash_distance`` bits of the last keyframe's ``frame_hash`` is
+    the same picture (a slide still on screen) and skipped; every other
+    frame is a keyframe and is read by the OCR backend on ``executor``,
+    with at most ``max_in_flight`` frames submitted and not yet yielded.
+
+    Yields:
+        ``start`` (when the keyframe first appears), ``end`` (when the
+        next one does, or the video ends) and its ``text``; keyframes
+        without text are skipped
+    """
+    from moviepy.editor import VideoFileClip
+
+    video = VideoFileClip(file_path, audio=False)
+    pending = deque()
+
+    def read(keyframe):
+        result = keyframe.pop("result")
+        text = result.result() if executor is not None else result
+        return dict(keyframe, text=text) if text else None
+
+    try:
+        duration = float(video.duration)
+        kept = None
+        for t, frame in video.iter_frames(fps=frames_per_minute / 60, with_times=True, dtype="uint8"):
+            fingerprint = frame_hash(frame)
+            if kept is not None and hash_distance(fingerprint, kept) <= max_hash_distance:
+                continue
+            kept = fingerprint
+            start = round(float(t), 3)
+            if pending:
+                pending[-1]["end"] = start
+            if executor is not None:
+                result = executor.submit(ocr.recognize_frame, backend, language, frame)
+            else:
+                result = ocr.recognize_frame(backend, language, frame)
+            pending.append({"start": start, "end": round(duration, 3), "result": result})
+            # The newest keyframe's end is only known once the next one appears
+            while len(pending) > max(max_in_flight, 1):
+                keyframe = read(pending.popleft())
+                if keyframe:
+                    yield keyframe
+        while pending:
+            keyframe = read(pending.popleft())
+            if keyframe:
+                yield keyframe
+    finally:
+        for keyframe in pending:
+            if executor is not None:
+                keyframe["result"].cancel()
+        video.close()
+
+def segment_documents(segments: List[Dict[str, Any]], filename: str, file_id: str):
+    """
+    Turn transcript segments into vector store rows.
+
+    Returns:
+        Tuple of (documents, metadatas, ids)
+    """
+    documents = []
+    metadatas = []
+    ids = []
+    for segment in segments:
+        doc_id = f"{file_id}_chunk_{int(segment['start'] * 1000)}"
+        documents.append(segment["text"])
+        metadatas.append({
+            "source": filename,
+            "timestamp": format_timestamp(segment["start"], segment["end"]),
+            "start": segment["start"],
+            "end": segment["end"],
+            "type": "video",
+            "file_id": file_id
+        })
+        ids.append(doc_id)
+    return documents, metadatas, ids
+
+def process_video(file_path: str, filename: str, file_id: str, backend: str = "whisper", model_name: str = "base"):
+    """
+    Transcribe the audio track of a video into timestamped segments.
+
+    This is the serial path; ingestion runs ``iter_transcript`` on the
+    process pool instead.
+
+    Returns:
+        Tuple of (documents, metadatas, ids)
+    """
+    try:
+        audio_path = extract_audio(file_path)
+        if audio_path is None:
+            return [], [], []
+        try:
+            segments = list(iter_transcript(audio_path, backend=backend, model_name=model_name))
+        finally:
+            os.unlink(audio_path)
+        return segment_documents(segments, filename, file_id)
+
     except Exception as e:
         print(f"Error processing video: {str(e)}")
-        return False
\ No newline at end of file
+        raise
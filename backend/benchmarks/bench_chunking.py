@@ -0,0 +1,74 @@
+"""
+Chunking throughput and retrieval quality on a fixture corpus.
+
+Compares the token-aware chunker with the previous strategies (one
+document per PDF page, fixed 1000-character slices) using an offline
+hashed bag-of-words embedding, and reports chunks/sec, recall@k and the
+average number of context tokens a top-k retrieval would send to the LLM.
+
+Usage (from backend/):
+    python -m benchmarks.bench_chunking --pages 300 --k 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.services import chunking
+from benchmarks.synthetic import hashing_embed, synthetic_pages
+
+
+def page_chunks(pages):
+    return [page["text"] for page in pages if page["text"].strip()]
+
+
+def fixed_chunks(pages, size: int = 1000):
+    text = "\n".join(page["text"] for page in pages)
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def token_chunks(pages, max_tokens: int, overlap: int):
+    chunker = chunking.Chunker(max_tokens=max_tokens, overlap_tokens=overlap)
+    return [chunk["text"] for chunk in chunker.chunk_units(chunking.pdf_units(pages))]
+
+
+def evaluate(name, build, pages, questions, k):
+    start = time.perf_counter()
+    chunks = build(pages)
+    elapsed = time.perf_counter() - start
+
+    chunk_vectors = hashing_embed(chunks)
+    query_vectors = hashing_embed([q["question"] for q in questions])
+    scores = query_vectors @ chunk_vectors.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+
+    hits = 0
+    context_tokens = 0
+    for q, row in zip(questions, top):
+        retrieved = [chunks[i] for i in row]
+        hits += any(q["answer"] in text for text in retrieved)
+        context_tokens += sum(chunking.count_tokens(text) for text in retrieved)
+
+    print(
+        f"{name:<8} {len(chunks):>7} chunks  {len(chunks) / elapsed:>10.0f} chunks/sec  "
+        f"recall@{k} {hits / len(questions):.3f}  context tokens/query {context_tokens / len(questions):.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--overlap", type=int, default=40)
+    args = parser.parse_args()
+
+    pages, questions = synthetic_pages(args.pages)
+    print(f"{len(pages)} pages, {len(questions)} labeled questions")
+    evaluate("page", page_chunks, pages, questions, args.k)
+    evaluate("fixed", fixed_chunks, pages, questions, args.k)
+    evaluate("token", lambda p: token_chunks(p, args.max_tokens, args.overlap), pages, questions, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Memory and recall of compressed vector scans in the mmap backend.
+
+Builds one exact float32 ``MmapCollection`` from clustered synthetic
+vectors, then trains each compression in turn and reports:
+
+- ``bytes/vec`` and ``MB/1M``: what a scan keeps in memory per vector and
+  per million vectors (float32 vectors for ``none``, codes otherwise)
+- ``anon MB`` / ``file MB``: resident memory added by opening the store
+  cold in a fresh process and running the queries; anonymous memory
+  (codes, scratch) is what the box must hold, file-backed pages of the
+  vector file touched by rescoring are cache the OS can drop (the page
+  cache is dropped before each probe when run as root, so they are cold)
+- ``recall@k`` of the compressed scan alone, and after exact rescoring
+  of the best ``rescore_factor * k`` candidates, against the exact top k
+- ``qps@1`` / ``qps@64``: throughput with rescoring, one query and 64
+  queries per call
+- ``train s``: training plus encoding every vector
+
+``--decay`` gives the synthetic vectors a power-law variance spectrum
+under a random rotation: sentence embeddings concentrate their variance
+in few directions, which is what PCA and PQ exploit; 0 keeps the data
+isotropic, the worst case. ``--ivf`` scans IVF lists instead of every
+vector.
+
+Usage (from backend/):
+    python -m benchmarks.bench_compression --n 100000 --dim 384 --decay 0.5
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_vector_backends import dataset
+
+
+def rss_mb():
+    """Anonymous and file-backed resident memory in MB."""
+    usage = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                usage[line.split(":")[0]] = int(line.split()[1]) / 1024
+    return np.array([usage.get("RssAnon", np.nan), usage.get("RssFile", np.nan)])
+
+
+def drop_page_cache() -> None:
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("1")
+    except OSError:
+        pass
+
+
+def skewed(vectors: np.ndarray, decay: float, seed: int = 1) -> np.ndarray:
+    """Scale dimension i by (i + 1) ** -decay, then rotate randomly."""
+    if not decay:
+        return vectors
+    rng = np.random.default_rng(seed)
+    rotation, _ = np.linalg.qr(rng.standard_normal((vectors.shape[1], vectors.shape[1])))
+    scales = (np.arange(1, vectors.shape[1] + 1) ** -decay).astype(np.float32)
+    return ((vectors * scales) @ rotation).astype(np.float32)
+
+
+VARIANTS = {
+    "none": (None, None, None),
+    "int8": ("int8", None, None),
+    "pca128+int8": ("int8", 128, None),
+    "pq96": ("pq", None, 96),
+    "pq48": ("pq", None, 48),
+    "pca192+pq48": ("pq", 192, 48),
+}
+
+
+def probe(directory: str, queries_path: str, k: int, rescore_factor: int, batch: int = 64) -> dict:
+    """Runs in a fresh interpreter, so the store is opened cold."""
+    from app.services.mmap_store import MmapCollection
+    queries = np.load(queries_path)
+    base = rss_mb()
+    collection = MmapCollection(directory, rescore_factor=rescore_factor)
+    started = time.perf_counter()
+    ids = [collection.query(query_embeddings=[q], n_results=k, include=())["ids"][0] for q in queries]
+    qps_single = len(queries) / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch):
+        collection.query(query_embeddings=queries[start:start + batch], n_results=k, include=())
+    qps_batch = len(queries) / (time.perf_counter() - started)
+    anon, file = rss_mb() - base
+    return {"qps@1": qps_single, "qps@64": qps_batch, "anon_mb": anon, "file_mb": file, "ids": ids}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=10)
+    parser.add_argument("--decay", type=float, default=0.5)
+    parser.add_argument("--ivf", action="store_true")
+    parser.add_argument("--variants", default=",".join(VARIANTS))
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    parser.add_argument("--queries-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(probe(args.probe, args.queries_path, args.k, args.rescore_factor)))
+        return
+
+    from app.services.mmap_store import MmapCollection
+
+    vectors, queries = dataset(args.n, args.dim, args.queries)
+    vectors, queries = skewed(vectors, args.decay), skewed(queries, args.decay)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = [set(row) for row in np.argsort(-(q @ normalized.T), axis=1)[:, :args.k].tolist()]
+
+    def recall(ids):
+        return np.mean([len(t & {int(i) for i in row}) / args.k for t, row in zip(truth, ids)])
+
+    root = tempfile.mkdtemp(prefix="bench_compression_")
+    try:
+        queries_path = os.path.join(root, "queries.npy")
+        np.save(queries_path, queries)
+        options = {"ivf_threshold": 0 if args.ivf else 10 ** 12}
+        collection = MmapCollection(root, **options)
+        for start in range(0, args.n, 10000):
+            end = min(start + 10000, args.n)
+            ids = [str(i) for i in range(start, end)]
+            collection.add(ids=ids, documents=ids, metadatas=[{} for _ in ids], embeddings=vectors[start:end])
+        collection.compact()
+
+        print(
+            f"{args.n} vectors x {args.dim}, decay {args.decay}, {'IVF' if args.ivf else 'full'} scan, "
+            f"{args.queries} queries, top {args.k}, rescore x{args.rescore_factor}"
+        )
+        print(
+            f"{'variant':<14}{'bytes/vec':>10}{'MB/1M':>8}{'anon MB':>9}{'file MB':>9}"
+            f"{'scan recall':>13}{'rescored':>10}{'qps@1':>7}{'qps@64':>8}{'train s':>9}"
+        )
+        for name in args.variants.split(","):
+            kind, pca_dim, subvectors = VARIANTS[name]
+            started = time.perf_counter()
+            collection.train_compression(kind, pca_dim=pca_dim, pq_subvectors=subvectors or 48)
+            train_s = time.perf_counter() - started
+            layout = collection.describe()
+
+            # Compressed scan alone: rescoring only re-sorts the k it keeps
+            collection.rescore_factor = 1
+            scan_ids = collection.query(query_embeddings=queries, n_results=args.k, include=())["ids"]
+            # Unmapped, so the pages it read while encoding can be dropped
+            collection.close()
+            del collection
+            gc.collect()
+            drop_page_cache()
+            result = json.loads(subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_compression", "--probe", os.path.join(root), "--queries-path", queries_path,
+                 "--k", str(args.k), "--rescore-factor", str(args.rescore_factor)],
+                capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1])
+            print(
+                f"{name:<14}{layout['scan_bytes_per_vector']:>10}{layout['scan_mb_per_million']:>8.0f}"
+                f"{result['anon_mb']:>9.0f}{result['file_mb']:>9.0f}{recall(scan_ids):>13.3f}{recall(result['ids']):>10.3f}"
+                f"{result['qps@1']:>7.0f}{result['qps@64']:>8.0f}{train_s:>9.1f}"
+            )
+            collection = MmapCollection(root, **options)
+        collection.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Prompt size and answer retention of context packing on a fixture corpus.
+
+Retrieves the top candidates for every labeled question with an offline
+hashed bag-of-words embedding, then compares the previous prompt context
+(every retrieved chunk concatenated in full) with ``ContextBuilder`` at
+several token budgets. Reports prompt tokens per query, tokens saved, the
+share of questions whose answer is still in the context (answer overlap)
+and the packing time per query.
+
+Usage (from backend/):
+    python -m benchmarks.bench_context --pages 200 --k 10
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.services import chunking, dedup
+from app.services.context_builder import ContextBuilder
+from benchmarks.synthetic import hashing_embed, synthetic_pages
+
+
+def raw_context(documents, metadatas) -> str:
+    context = ""
+    for doc, metadata in zip(documents, metadatas):
+        context += f"Source ({metadata['type']} from {metadata['source']}): {doc}\n\n"
+    return context
+
+
+def report(name, contexts, questions, elapsed, baseline_tokens=None):
+    tokens = [chunking.count_tokens(context) for context in contexts]
+    overlap = sum(q["answer"] in context for q, context in zip(questions, contexts)) / len(questions)
+    line = f"{name:<14} prompt tokens/query {np.mean(tokens):>7.0f}  answer overlap {overlap:.3f}"
+    if baseline_tokens is not None:
+        line += f"  saved {1 - np.sum(tokens) / baseline_tokens:>6.1%}"
+    line += f"  {elapsed / len(questions) * 1e6:>8.0f} us/query"
+    print(line)
+    return int(np.sum(tokens))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10, help="candidates handed to the context builder")
+    parser.add_argument("--budgets", default="300,600,1500")
+    args = parser.parse_args()
+
+    pages, questions = synthetic_pages(args.pages)
+    chunker = chunking.Chunker(max_tokens=200, overlap_tokens=40)
+    documents, metadatas = chunking.chunk_documents(
+        chunker.chunk_units(chunking.pdf_units(pages)), "fixture.pdf", "fixture", "pdf"
+    )
+    ids = [dedup.chunk_id(text) for text in documents]
+    print(f"{len(pages)} pages, {len(documents)} chunks, {len(questions)} labeled questions, top {args.k}")
+
+    scores = hashing_embed([q["question"] for q in questions]) @ hashing_embed(documents).T
+    top = np.argsort(-scores, axis=1)[:, :args.k]
+    retrieved = [
+        ([ids[i] for i in row], [documents[i] for i in row], [metadatas[i] for i in row])
+        for row in top
+    ]
+
+    start = time.perf_counter()
+    contexts = [raw_context(docs, metas) for _, docs, metas in retrieved]
+    baseline = report("raw", contexts, questions, time.perf_counter() - start)
+
+    for budget in (int(b) for b in args.budgets.split(",")):
+        builder = ContextBuilder(max_tokens=budget)
+        start = time.perf_counter()
+        contexts = [
+            builder.build(q["question"], chunk_ids, docs, metas)["context"]
+            for q, (chunk_ids, docs, metas) in zip(questions, retrieved)
+        ]
+        report(f"packed@{budget}", contexts, questions, time.perf_counter() - start, baseline)
+
+
+if __name__ == "__main__":
+    main()
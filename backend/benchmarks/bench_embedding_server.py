@@ -0,0 +1,135 @@
+"""
+Query embedding latency under concurrent callers: encoding in the
+request threads vs the micro-batching embedding server.
+
+``--concurrency`` threads each embed ``--requests`` single-question
+requests back to back, and the p50/p95/p99 latency per request is
+reported for every concurrency level:
+
+- ``in-process``: each thread calls the model itself, one text per call
+  (the ``LocalEmbeddingFunction`` path)
+- ``server``: each thread sends its text to an ``EmbeddingServer`` in a
+  separate process over a Unix socket, which batches concurrent requests
+
+The stand-in model is a hashed bag of words through a stack of dense
+layers. Like a transformer on CPU, a call costs about the same whether
+it encodes one text or dozens (the weights are read once per call), so
+batching many callers into one call is what keeps latency flat.
+
+Usage (from backend/):
+    python -m benchmarks.bench_embedding_server --concurrency 1,4,16,64 --requests 50
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from functools import partial
+
+import numpy as np
+
+from app.services.embedding_server import RemoteEmbeddingFunction, serve
+from benchmarks.synthetic import WORDS, hashing_embed
+
+
+def synthetic_encoder(dim: int = 384, hidden: int = 1536, layers: int = 6, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    weights = [rng.standard_normal((hidden, hidden), dtype=np.float32) / np.sqrt(hidden) for _ in range(layers)]
+    head = rng.standard_normal((hidden, dim), dtype=np.float32) / np.sqrt(hidden)
+
+    def encode(texts):
+        x = hashing_embed(list(texts), dim=hidden)
+        for w in weights:
+            x = np.tanh(x @ w)
+        x = x @ head
+        return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+    return encode
+
+
+def questions(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(10)) + f" {i}?" for i in range(n)]
+
+
+def run(concurrency: int, requests: int, embed_one) -> np.ndarray:
+    """Latencies in ms of ``requests`` calls from each of ``concurrency`` threads."""
+    texts = questions(concurrency * requests, seed=concurrency)
+    latencies = [[] for _ in range(concurrency)]
+    start = threading.Barrier(concurrency)
+
+    def worker(i):
+        start.wait()
+        for text in texts[i::concurrency]:
+            started = time.perf_counter()
+            embed_one(text)
+            latencies[i].append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.concatenate([np.array(row) for row in latencies])
+
+
+def report(name: str, concurrency: int, latencies: np.ndarray, elapsed: float) -> None:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(
+        f"{name:<11}{concurrency:>6}{p50:>9.2f}{p95:>9.2f}{p99:>9.2f}"
+        f"{len(latencies) / elapsed:>10.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    encode = synthetic_encoder()
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="bench_embedding_server_"), "embed.sock")
+    server = multiprocessing.get_context("spawn").Process(
+        target=serve,
+        args=(socket_path, partial(synthetic_encoder), "synthetic", args.max_batch, args.max_wait_ms),
+        daemon=True
+    )
+    server.start()
+    client = RemoteEmbeddingFunction(socket_path, "synthetic")
+    deadline = time.monotonic() + 30
+    while not os.path.exists(socket_path):
+        if time.monotonic() > deadline:
+            raise RuntimeError("Embedding server did not start")
+        time.sleep(0.05)
+    client.load()
+
+    # Both paths must produce the same vectors
+    sample = questions(8, seed=99)
+    assert np.allclose(client.embed_array(sample), encode(sample), atol=1e-5)
+
+    print(f"{args.requests} single-question requests per caller, max batch {args.max_batch}, max wait {args.max_wait_ms} ms")
+    print(f"{'':<11}{'users':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>10}")
+    try:
+        for concurrency in levels:
+            for name, embed_one in (
+                ("in-process", lambda text: encode([text])),
+                ("server", lambda text: client.embed_array([text]))
+            ):
+                started = time.perf_counter()
+                latencies = run(concurrency, args.requests, embed_one)
+                report(name, concurrency, latencies, time.perf_counter() - started)
+        stats = client.stats()
+        print(f"server batches: {stats['batches']}, mean size {stats['batch_size']['mean']}, histogram {stats['batch_size']['histogram']}")
+    finally:
+        client.close()
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Pages/sec of the serial PDF path against the parallel page-range engine.
+
+Usage (from backend/):
+    python -m benchmarks.bench_pdf_extraction --pages 200 --workers 4
+    python -m benchmarks.bench_pdf_extraction --pdf path/to/manual.pdf
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services import pdf_processor
+from benchmarks.synthetic import synthetic_pdf
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_serial(path: str) -> float:
+    start = time.perf_counter()
+    documents, _, _ = pdf_processor.process_pdf(path, os.path.basename(path), "bench")
+    elapsed = time.perf_counter() - start
+    print(f"serial:   {len(documents)} pages in {elapsed:.2f}s")
+    return elapsed
+
+
+def bench_parallel(path: str, workers: int, pages_per_task: int, batch_size: int) -> float:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Warm the pool so process start-up is not counted
+        list(pool.map(abs, range(workers)))
+        start = time.perf_counter()
+        stored = 0
+        pages = pdf_processor.iter_pages(path, executor=pool, pages_per_task=pages_per_task, max_in_flight=workers * 2)
+        for batch in pdf_processor.iter_batches(pages, batch_size):
+            documents, _, _ = pdf_processor.page_documents(batch, os.path.basename(path), "bench")
+            stored += len(documents)
+        elapsed = time.perf_counter() - start
+    print(f"parallel: {stored} pages in {elapsed:.2f}s ({workers} workers, {pages_per_task} pages/task)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="Existing PDF to benchmark; a synthetic one is generated if omitted")
+    parser.add_argument("--pages", type=int, default=200, help="Pages in the synthetic PDF")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--pages-per-task", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.pdf
+        if path is None:
+            path = os.path.join(tmp, "synthetic.pdf")
+            synthetic_pdf(path, args.pages)
+        n_pages = pdf_processor.page_count(path)
+
+        serial = bench_serial(path)
+        parallel = bench_parallel(path, args.workers, args.pages_per_task, args.batch_size)
+
+    print(f"serial:   {n_pages / serial:.1f} pages/sec")
+    print(f"parallel: {n_pages / parallel:.1f} pages/sec ({serial / parallel:.2f}x)")
+    print(f"peak RSS (parent): {_peak_rss_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Vector query throughput: one request per question vs batched queries.
+
+Fills an on-disk Chroma store with the chunked fixture corpus and answers
+the labeled questions (repeated up to ``--queries``) three ways, reporting
+queries/sec:
+
+- ``loop``: per question, embed it, count the collection and run a
+  single-vector ``collection.query`` (the old per-request path)
+- ``query``: ``VectorStore.query`` per question (cached count)
+- ``batch/N``: ``VectorStore.query_many`` over N questions at a time, one
+  embedding call and one multi-vector query per batch
+
+The hashed bag-of-words embedding keeps the numbers about the store, not
+the model; a real model gains more from batching.
+
+Usage (from backend/):
+    python -m benchmarks.bench_query_batch --pages 300 --batch 64
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.bench_vector_store import HashingEmbeddingFunction, corpus
+from benchmarks.synthetic import synthetic_pages
+from app.services.vector_store import VectorStore
+
+
+def timed(name, n, fn):
+    start = time.perf_counter()
+    results = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {n:>6} queries  {elapsed:>7.2f}s  {n / elapsed:>8.0f} queries/sec")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--queries", type=int, default=1024)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    documents, metadatas = corpus(args.pages)
+    _, labeled = synthetic_pages(args.pages)
+    questions = [labeled[i % len(labeled)]["question"] for i in range(args.queries)]
+    root = tempfile.mkdtemp(prefix="bench_query_batch_")
+    try:
+        embed = HashingEmbeddingFunction()
+        store = VectorStore(os.path.join(root, "store"), embedding_function=embed)
+        store.upsert(documents, metadatas)
+        print(f"{len(documents)} chunks, top {args.k}")
+
+        def loop():
+            out = []
+            for question in questions:
+                embedding = embed([question])[0]
+                n = min(args.k, store.collection.count())
+                out.append(store.collection.query(query_embeddings=[embedding], n_results=n)["ids"][0])
+            return out
+
+        def single():
+            return [[hit["id"] for hit in store.query(embed([q])[0], args.k)] for q in questions]
+
+        def batched():
+            out = []
+            for start in range(0, len(questions), args.batch):
+                hits = store.query_many(query_texts=questions[start:start + args.batch], n_results=args.k)
+                out.extend([hit["id"] for hit in row] for row in hits)
+            return out
+
+        expected = timed("loop", len(questions), loop)
+        timed("query", len(questions), single)
+        assert timed(f"batch/{args.batch}", len(questions), batched) == expected
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Query latency of a small tenant next to a large one: one shared
+collection filtered by tenant vs a shard per tenant.
+
+Stores ``--large`` vectors for one tenant and ``--small`` for another
+from the clustered synthetic set, then times single queries (p50/p95 ms):
+
+- ``shared``: both tenants in one collection, queries filtered with
+  ``where={"tenant": ...}`` (the pre-sharding layout)
+- ``sharded``: ``ShardRouter`` with one shard per tenant, and the large
+  tenant split over ``--large-shards`` shards searched concurrently
+
+Usage (from backend/):
+    python -m benchmarks.bench_shards --large 200000 --small 2000 --backend mmap
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_vector_backends import dataset
+from app.services.shards import ShardRouter
+from app.services.vector_store import VectorStore
+
+
+def fill(store: VectorStore, vectors: np.ndarray, tenant: str, offset: int = 0, batch: int = 5000) -> None:
+    for start in range(0, len(vectors), batch):
+        end = min(start + batch, len(vectors))
+        ids = [f"{tenant}_{offset + i}" for i in range(start, end)]
+        store.collection.add(
+            ids=ids,
+            documents=ids,
+            metadatas=[{"tenant": tenant} for _ in ids],
+            embeddings=vectors[start:end].tolist()
+        )
+    if store.backend == "mmap":
+        store.collection.compact()
+    store._count = None
+
+
+def latencies(fn, queries: np.ndarray) -> str:
+    times = []
+    for q in queries:
+        started = time.perf_counter()
+        fn(q.tolist())
+        times.append((time.perf_counter() - started) * 1000)
+    return f"p50 {np.percentile(times, 50):7.2f} ms  p95 {np.percentile(times, 95):7.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--large", type=int, default=200000)
+    parser.add_argument("--small", type=int, default=2000)
+    parser.add_argument("--large-shards", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backend", default="mmap")
+    args = parser.parse_args()
+
+    vectors, queries = dataset(args.large + args.small, args.dim, args.queries)
+    large, small = vectors[:args.large], vectors[args.large:]
+    options = {"ivf_threshold": 10 ** 12} if args.backend == "mmap" else None
+    root = tempfile.mkdtemp(prefix="bench_shards_")
+    try:
+        shared = VectorStore(root, collection_name="shared", backend=args.backend, backend_options=options)
+        fill(shared, large, "large")
+        fill(shared, small, "small")
+
+        router = ShardRouter(
+            lambda shard: VectorStore(root, collection_name=f"shard.{shard}", backend=args.backend, backend_options=options),
+            placement={"large": args.large_shards}
+        )
+        parts = np.array_split(np.arange(args.large), args.large_shards)
+        for shard, rows in zip(router.configured("large"), parts):
+            fill(router.store(shard), large[rows], "large", offset=int(rows[0]))
+        fill(router.store("small"), small, "small")
+
+        print(f"{args.large} large-tenant + {args.small} small-tenant vectors x {args.dim}, {args.backend}, top {args.k}")
+        for tenant in ("small", "large"):
+            print(f"{tenant:<6} shared   {latencies(lambda q: shared.query(q, args.k, where={'tenant': tenant}), queries)}")
+            print(f"{tenant:<6} sharded  {latencies(lambda q: router.query_many([tenant], [q], args.k), queries)}")
+        shared.close()
+        router.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
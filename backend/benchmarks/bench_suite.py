@@ -0,0 +1,424 @@
+"""
+End-to-end benchmark of ingestion and querying on a synthetic corpus, offline.
+
+``run`` builds the app on a temporary data directory, with a hashed
+bag-of-words embedding and a stub LLM in place of the models, and
+measures:
+
+- PDF ingestion: ``--pdfs`` synthetic PDFs of ``--pages`` pages (text with
+  planted facts, and tables) uploaded through ``/upload/pdf/`` and
+  ingested by the job queue. Reports pages and chunks per second and the
+  time spent in each pipeline stage, summed over concurrent jobs.
+- Video ingestion: ``--audio-seconds`` of synthetic speech per file run
+  through the video ingest job and transcribed with the stub backend.
+  Video decoding needs moviepy and ffmpeg, so audio extraction is
+  replaced by copying the WAV file and keyframe OCR is off; everything
+  after it is the production path. Also reports how many transcription
+  window cuts land inside a known speech span.
+- Queries: every labeled question sent to ``/query/`` by ``--concurrency``
+  concurrent clients. Reports p50/p95/p99 latency and throughput per
+  level, recall@1, recall@5 and MRR of the cited sources against the
+  page each fact was planted on, and the prompt size.
+- Peak RSS of the process and of its worker processes.
+
+Results go to ``--output`` as JSON. ``compare`` reads two results files
+and exits with status 1 when a metric got worse by more than the
+threshold.
+
+Usage (from backend/):
+    python -m benchmarks.bench_suite run --pdfs 4 --pages 50 --output base.json
+    python -m benchmarks.bench_suite run --pdfs 4 --pages 50 --output new.json
+    python -m benchmarks.bench_suite compare base.json new.json --threshold 0.1
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.core import telemetry
+from app.core.config import Settings
+from app.core.container import Services
+from app.main import create_app
+from app.services import chunking, transcription, video_processor
+from app.services.embedding import CachedBatchingEmbeddingFunction
+from app.services.jobs import UNFINISHED_STATES
+from benchmarks.synthetic import hashing_embed, synthetic_corpus_pdf, synthetic_wav
+
+# Metrics where a larger value is better; for all others smaller is better
+HIGHER_IS_BETTER = ("_per_s", "recall@", "mrr")
+# Retrieval quality is compared in absolute terms, everything else relative
+ABSOLUTE = ("recall@", "mrr")
+
+
+class HashingEmbeddingFunction(CachedBatchingEmbeddingFunction):
+    """Stand-in embedding model; ``delay_ms`` per batch mimics the model's cost."""
+
+    model_name = "bench-hashing"
+
+    def __init__(self, dim: int = 384, delay_ms: float = 0.0, **options: Any):
+        super().__init__(**options)
+        self.dim = dim
+        self.delay = delay_ms / 1000
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if self.delay:
+            time.sleep(self.delay)
+        return hashing_embed(texts, dim=self.dim).tolist()
+
+
+class StubLLM:
+    """Answers after ``delay_ms`` and records prompt sizes; same interface as ``LLMInterface``."""
+
+    def __init__(self, delay_ms: float = 0.0):
+        self.delay = delay_ms / 1000
+        self.prompt_tokens: List[int] = []
+        self.in_flight = 0
+        self.waiting = 0
+
+    async def generate_response(self, prompt: str, **options: Any) -> str:
+        self.prompt_tokens.append(chunking.count_tokens(prompt))
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return "See [1]."
+
+    async def stream_response(self, prompt: str, **options: Any):
+        yield await self.generate_response(prompt, **options)
+
+    async def aclose(self) -> None:
+        pass
+
+
+def bench_settings(root: str, args: argparse.Namespace) -> Settings:
+    settings = Settings()
+    for name, value in {
+        "UPLOAD_DIR": os.path.join(root, "uploads"),
+        "JOBS_DIR": os.path.join(root, "jobs"),
+        "FILE_REGISTRY_PATH": os.path.join(root, "files.sqlite3"),
+        "VECTOR_DB_DIR": os.path.join(root, "vectors"),
+        "VECTOR_WRITE_JOURNAL": os.path.join(root, "vector_writes.jsonl"),
+        "EMBEDDING_CACHE_PATH": os.path.join(root, "embedding_cache.sqlite3"),
+        "LEXICAL_INDEX_DIR": os.path.join(root, "lexical_index"),
+        "VECTOR_INDEX_ALIAS": os.path.join(root, "vector_index.json"),
+        "ARTIFACT_DIR": os.path.join(root, "artifacts"),
+        "PROFILE_DIR": os.path.join(root, "profiles"),
+        "EMBEDDING_SERVER": "",
+        "EMBEDDING_MODEL": HashingEmbeddingFunction.model_name,
+        "VECTOR_BACKEND": args.backend,
+        "VECTOR_SHARDS": {},
+        "RERANKER": args.reranker,
+        "TRANSCRIBE_BACKEND": "stub",
+        "OCR_BACKEND": "stub",
+        "VIDEO_FRAMES_PER_MINUTE": 0,
+        "INGEST_PROCESSES": args.processes,
+        "TRACE_SLOW_MS": float("inf"),
+        "WARMUP": "off"
+    }.items():
+        setattr(settings, name, value)
+    return settings
+
+
+def _peak_rss_kib(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    """Peak RSS of this process and of the largest worker process, live or exited."""
+    # ru_maxrss is in KiB on Linux; it only covers children that have exited
+    workers = [_peak_rss_kib(process.pid) for process in multiprocessing.active_children()]
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "workers": max([resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss, *workers]) / 1024
+    }
+
+
+def stage_seconds(pipeline: str) -> Dict[str, float]:
+    return {
+        stage: total
+        for (name, stage), (_, total) in telemetry.STAGE_SECONDS.totals().items()
+        if name == pipeline
+    }
+
+
+async def wait_for_jobs(client, job_ids: List[str]) -> List[dict]:
+    jobs = []
+    for job_id in job_ids:
+        while True:
+            job = (await client.get(f"/jobs/{job_id}")).json()
+            if job["status"] not in UNFINISHED_STATES:
+                break
+            await asyncio.sleep(0.05)
+        if job["status"] != "completed":
+            raise RuntimeError(f"Ingestion job {job_id} failed: {job.get('error')}")
+        jobs.append(job)
+    return jobs
+
+
+async def ingest_pdfs(client, root: str, args: argparse.Namespace) -> tuple:
+    labeled, paths = [], []
+    for i in range(args.pdfs):
+        path = os.path.join(root, f"manual{i}.pdf")
+        for question in synthetic_corpus_pdf(path, args.pages, seed=args.seed + i):
+            labeled.append(dict(question, source=os.path.basename(path)))
+        paths.append(path)
+
+    before = stage_seconds("ingest")
+    started = time.perf_counter()
+    job_ids = []
+    for path in paths:
+        with open(path, "rb") as f:
+            response = await client.post("/upload/pdf/", files={"file": (os.path.basename(path), f, "application/pdf")})
+        response.raise_for_status()
+        job_ids.append(response.json()["job_id"])
+    jobs = await wait_for_jobs(client, job_ids)
+    elapsed = time.perf_counter() - started
+    after = stage_seconds("ingest")
+
+    chunks = sum(job["result"]["chunks"] for job in jobs)
+    metrics = {
+        "ingest.pdf.seconds": elapsed,
+        "ingest.pdf.pages_per_s": args.pdfs * args.pages / elapsed,
+        "ingest.pdf.chunks_per_s": chunks / elapsed,
+        "ingest.pdf.chunks": chunks
+    }
+    for stage, total in after.items():
+        if stage != "total":
+            metrics[f"ingest.pdf.stage.{stage}_s"] = total - before.get(stage, 0.0)
+    return metrics, labeled
+
+
+def _extract_wav(file_path: str) -> str:
+    """Stands in for ``video_processor.extract_audio``: the benchmark's "videos" are their WAV tracks."""
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as audio:
+        audio_path = audio.name
+    shutil.copyfile(file_path, audio_path)
+    return audio_path
+
+
+async def ingest_audio(client, services: Services, root: str, args: argparse.Namespace) -> dict:
+    paths, cuts, cuts_in_speech = [], 0, 0
+    for i in range(args.audio_files):
+        path = os.path.join(root, f"recording{i}.wav")
+        spans = synthetic_wav(path, args.audio_seconds, seed=args.seed + i)
+        paths.append(path)
+        windows = transcription.plan_windows(path, services.settings.TRANSCRIBE_WINDOW_SECONDS)
+        for _, end in windows[:-1]:
+            cut = end / transcription.WHISPER_SAMPLE_RATE
+            cuts += 1
+            cuts_in_speech += any(start < cut < stop for start, stop in spans)
+
+    before = stage_seconds("ingest")
+    started = time.perf_counter()
+    extract_audio, video_processor.extract_audio = video_processor.extract_audio, _extract_wav
+    try:
+        job_ids = [
+            services.job_queue.submit("video", {"file_path": path, "filename": os.path.basename(path), "file_id": f"recording{i}"})["job_id"]
+            for i, path in enumerate(paths)
+        ]
+        jobs = await wait_for_jobs(client, job_ids)
+    finally:
+        video_processor.extract_audio = extract_audio
+    elapsed = time.perf_counter() - started
+    after = stage_seconds("ingest")
+    metrics = {
+        "ingest.audio.seconds": elapsed,
+        "ingest.audio.audio_seconds_per_s": args.audio_files * args.audio_seconds / elapsed,
+        "ingest.audio.chunks": sum(job["result"]["chunks"] for job in jobs),
+        "ingest.audio.cuts_in_speech": cuts_in_speech / cuts if cuts else 0.0
+    }
+    for stage, total in after.items():
+        if stage in ("audio_extract", "transcribe", "chunk", "embed", "upsert"):
+            metrics[f"ingest.audio.stage.{stage}_s"] = total - before.get(stage, 0.0)
+    return metrics
+
+
+def rank_of(question: dict, sources: List[dict]) -> int:
+    """1-based rank of the first cited source holding the question's page, 0 if none does."""
+    for rank, source in enumerate(sources, start=1):
+        page = source.get("page")
+        if source.get("source") == question["source"] and page is not None:
+            if page <= question["page"] <= source.get("page_end", page):
+                return rank
+    return 0
+
+
+async def run_queries(client, labeled: List[dict], concurrency: int) -> tuple:
+    pending = list(range(len(labeled)))
+    latencies, ranks = [], [0] * len(labeled)
+
+    async def worker():
+        while pending:
+            i = pending.pop()
+            started = time.perf_counter()
+            response = await client.post("/query/", json={"question": labeled[i]["question"]})
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"Query failed: {response.text}")
+            ranks[i] = rank_of(labeled[i], response.json()["sources"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return np.array(latencies), ranks, time.perf_counter() - started
+
+
+async def run_suite(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    root = tempfile.mkdtemp(prefix="bench_suite_")
+    settings = bench_settings(root, args)
+    services = Services(settings)
+    services.__dict__["embedding_function"] = HashingEmbeddingFunction(
+        delay_ms=args.embed_ms, cache=services.embedding_cache, batch_size=settings.EMBEDDING_BATCH_SIZE
+    )
+    llm = services.__dict__["llm"] = StubLLM(delay_ms=args.llm_ms)
+    app = create_app(settings, services)
+    metrics: Dict[str, float] = {}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            pdf_metrics, labeled = await ingest_pdfs(client, root, args)
+            metrics.update(pdf_metrics)
+            if args.audio_files:
+                metrics.update(await ingest_audio(client, services, root, args))
+            rss = peak_rss_mb()
+            metrics["ingest.peak_rss_mb"] = rss["self"]
+            metrics["ingest.peak_worker_rss_mb"] = rss["workers"]
+
+            labeled = labeled[:args.queries] if args.queries else labeled
+            for concurrency in args.concurrency:
+                # Every level starts cold; repeated questions would be answered from the cache
+                services.answer_cache.clear()
+                latencies, ranks, elapsed = await run_queries(client, labeled, concurrency)
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                metrics.update({
+                    f"query.c{concurrency}.p50_ms": p50,
+                    f"query.c{concurrency}.p95_ms": p95,
+                    f"query.c{concurrency}.p99_ms": p99,
+                    f"query.c{concurrency}.queries_per_s": len(latencies) / elapsed
+                })
+            metrics.update({
+                "query.recall@1": sum(rank == 1 for rank in ranks) / len(ranks),
+                "query.recall@5": sum(0 < rank <= 5 for rank in ranks) / len(ranks),
+                "query.mrr": sum(1 / rank for rank in ranks if rank) / len(ranks),
+                "query.prompt_tokens_mean": float(np.mean(llm.prompt_tokens)),
+                "query.peak_rss_mb": peak_rss_mb()["self"]
+            })
+    finally:
+        await services.close()
+        shutil.rmtree(root, ignore_errors=True)
+    return {key: round(float(value), 4) for key, value in metrics.items()}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float, quality_threshold: float) -> List[dict]:
+    """
+    Per metric present in both runs: the change, and whether it is a
+    regression (worse by more than ``threshold`` relative, or
+    ``quality_threshold`` absolute for recall and MRR).
+    """
+    rows = []
+    for name in sorted(set(baseline["metrics"]) & set(current["metrics"])):
+        before, after = baseline["metrics"][name], current["metrics"][name]
+        # Counts describe the workload rather than how well it ran
+        if name.endswith(".chunks"):
+            continue
+        higher_is_better = any(marker in name for marker in HIGHER_IS_BETTER)
+        worse_by = (before - after) if higher_is_better else (after - before)
+        if any(marker in name for marker in ABSOLUTE):
+            regressed = worse_by > quality_threshold
+        else:
+            regressed = before > 0 and worse_by / before > threshold
+        change = (after - before) / before if before else 0.0
+        rows.append({"metric": name, "baseline": before, "current": after, "change": change, "regressed": regressed})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Run the suite and write the results")
+    run.add_argument("--pdfs", type=int, default=4)
+    run.add_argument("--pages", type=int, default=50, help="Pages per PDF")
+    run.add_argument("--audio-files", type=int, default=2)
+    run.add_argument("--audio-seconds", type=float, default=120)
+    run.add_argument("--queries", type=int, default=0, help="Labeled questions to ask; 0 for all")
+    run.add_argument("--concurrency", default="1,8", help="Comma-separated concurrent client counts")
+    run.add_argument("--backend", default="chroma", choices=("chroma", "mmap"))
+    run.add_argument("--reranker", default="lexical", choices=("lexical", "cross-encoder"))
+    run.add_argument("--processes", type=int, default=os.cpu_count() or 2, help="Ingestion worker processes")
+    run.add_argument("--embed-ms", type=float, default=0.0, help="Simulated embedding model time per batch")
+    run.add_argument("--llm-ms", type=float, default=50.0, help="Simulated LLM latency per answer")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output", default="bench_results.json")
+    diff = commands.add_parser("compare", help="Compare two results files")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+    diff.add_argument("--quality-threshold", type=float, default=0.01, help="Absolute drop in recall or MRR counted as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        args.concurrency = [int(level) for level in args.concurrency.split(",")]
+        config = {key: value for key, value in vars(args).items() if key not in ("command", "output")}
+        metrics = asyncio.run(run_suite(args))
+        results = {
+            "created_at": datetime.now().isoformat(),
+            "revision": git_revision(),
+            "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+            "config": config,
+            "metrics": metrics
+        }
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        for name, value in metrics.items():
+            print(f"{name:<42}{value:>14.4f}")
+        print(f"Results written to {args.output}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get("config") != current.get("config"):
+        print("Warning: the runs used different configurations", file=sys.stderr)
+    rows = compare(baseline, current, args.threshold, args.quality_threshold)
+    for row in rows:
+        flag = "REGRESSION" if row["regressed"] else ""
+        print(f"{row['metric']:<42}{row['baseline']:>12.4f}{row['current']:>12.4f}{row['change']:>+9.1%}  {flag}")
+    regressions = [row["metric"] for row in rows if row["regressed"]]
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
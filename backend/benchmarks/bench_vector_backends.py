@@ -0,0 +1,161 @@
+"""
+Chroma vs the memory-mapped backend: start-up, memory, QPS and recall@k.
+
+Builds each backend from the same clustered synthetic vectors (with
+chunk-like metadata), then opens every store in a fresh subprocess and
+reports:
+
+- ``open_ms``: time to open the existing store
+- ``rss_open_mb`` / ``rss_query_mb``: resident memory added by opening
+  the store, and after running the queries
+- ``qps@1`` / ``qps@B``: single-query and batched throughput
+- ``recall@k``: overlap with the exact top k from a NumPy scan
+
+Variants: ``chroma``; ``mmap`` (exact brute force, float32); ``mmap-ivf``
+and ``mmap-ivf-int8`` (IVF index built at compaction).
+
+Usage (from backend/):
+    python -m benchmarks.bench_vector_backends --n 50000 --dim 384
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+VARIANTS = {
+    "chroma": None,
+    "mmap": {"dtype": "float32", "ivf_threshold": 10 ** 12},
+    "mmap-ivf": {"dtype": "float32", "ivf_threshold": 0},
+    "mmap-ivf-int8": {"dtype": "int8", "ivf_threshold": 0},
+}
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def dataset(n: int, dim: int, n_queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(8, n // 250), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    queries = vectors[rng.choice(n, size=n_queries, replace=False)] + 0.3 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    return vectors, queries
+
+
+def metadatas(n: int):
+    return [
+        {"type": "pdf" if i % 4 else "video", "file_id": f"file_{i % 97}", f"in_file_file_{i % 97}": True, "page": i % 300}
+        for i in range(n)
+    ]
+
+
+def open_store(variant: str, directory: str):
+    from app.services.vector_store import VectorStore
+    options = VARIANTS[variant]
+    return VectorStore(directory, backend="chroma" if options is None else "mmap", backend_options=options)
+
+
+def build(variant: str, directory: str, vectors: np.ndarray, batch: int = 5000) -> float:
+    store = open_store(variant, directory)
+    metas = metadatas(len(vectors))
+    started = time.perf_counter()
+    for start in range(0, len(vectors), batch):
+        end = min(start + batch, len(vectors))
+        store.collection.add(
+            ids=[f"chunk_{i}" for i in range(start, end)],
+            documents=[f"passage {i}" for i in range(start, end)],
+            metadatas=metas[start:end],
+            embeddings=vectors[start:end].tolist()
+        )
+    if store.backend == "mmap":
+        store.collection.compact()
+        store.collection.close()
+    return time.perf_counter() - started
+
+
+def probe(variant: str, directory: str, queries_path: str, k: int, batch: int) -> dict:
+    """Runs in a fresh interpreter, so the store is opened cold."""
+    queries = np.load(queries_path)
+    import app.services.vector_store  # noqa: F401  imports are not part of the open cost
+    base = rss_mb()
+    started = time.perf_counter()
+    store = open_store(variant, directory)
+    open_ms = (time.perf_counter() - started) * 1000
+    rss_open = rss_mb() - base
+
+    started = time.perf_counter()
+    single = [[hit["id"] for hit in store.query(q.tolist(), k)] for q in queries]
+    qps_single = len(queries) / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch):
+        store.query_many(query_embeddings=queries[start:start + batch].tolist(), n_results=k)
+    qps_batch = len(queries) / (time.perf_counter() - started)
+    return {
+        "open_ms": open_ms,
+        "rss_open_mb": rss_open,
+        "rss_query_mb": rss_mb() - base,
+        "qps@1": qps_single,
+        f"qps@{batch}": qps_batch,
+        "ids": single,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--variants", default=",".join(VARIANTS))
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    parser.add_argument("--queries-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(probe(args.probe, args.dir, args.queries_path, args.k, args.batch)))
+        return
+
+    vectors, queries = dataset(args.n, args.dim, args.queries)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = np.argsort(-(q @ normalized.T), axis=1)[:, :args.k]
+    truth = [{f"chunk_{i}" for i in row} for row in truth]
+
+    root = tempfile.mkdtemp(prefix="bench_vector_backends_")
+    try:
+        queries_path = os.path.join(root, "queries.npy")
+        np.save(queries_path, queries)
+        print(f"{args.n} vectors x {args.dim}, {args.queries} queries, top {args.k}")
+        print(f"{'variant':<15}{'build s':>9}{'open ms':>9}{'rss open':>10}{'rss query':>10}{'qps@1':>9}{f'qps@{args.batch}':>9}{f'recall@{args.k}':>11}")
+        for variant in args.variants.split(","):
+            directory = os.path.join(root, variant)
+            build_s = build(variant, directory, vectors)
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_vector_backends", "--probe", variant, "--dir", directory,
+                 "--queries-path", queries_path, "--k", str(args.k), "--batch", str(args.batch)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            recall = np.mean([len(t & set(ids)) / args.k for t, ids in zip(truth, result["ids"])])
+            print(
+                f"{variant:<15}{build_s:>9.1f}{result['open_ms']:>9.0f}{result['rss_open_mb']:>9.0f}M"
+                f"{result['rss_query_mb']:>9.0f}M{result['qps@1']:>9.0f}{result[f'qps@{args.batch}']:>9.0f}{recall:>11.3f}"
+            )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Vector store write throughput.
+
+Ingests the chunked fixture corpus into a fresh on-disk Chroma store in
+several ways and reports chunks/sec:
+
+- ``add/64``: plain ``collection.add`` per 64-chunk batch (the old path)
+- ``upsert/64``: ``VectorStore.upsert`` per 64-chunk batch
+- ``buffered/64``: the same batches through the write-ahead buffer
+- ``upsert/all``: one ``VectorStore.upsert`` call, split at the batch size
+- ``re-ingest``: upserting everything again (idempotent, nothing embedded)
+
+The hashed bag-of-words embedding keeps the numbers about the store, not
+the model.
+
+Usage (from backend/):
+    python -m benchmarks.bench_vector_store --pages 300
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from chromadb import EmbeddingFunction
+
+from app.services import chunking, dedup
+from app.services.vector_store import VectorStore
+from benchmarks.synthetic import hashing_embed, synthetic_pages
+
+
+class HashingEmbeddingFunction(EmbeddingFunction):
+    def __call__(self, input):
+        return hashing_embed(list(input), dim=384).tolist()
+
+
+def corpus(n_pages: int):
+    pages, _ = synthetic_pages(n_pages)
+    chunker = chunking.Chunker(max_tokens=200, overlap_tokens=40)
+    return chunking.chunk_documents(chunker.chunk_units(chunking.pdf_units(pages)), "fixture.pdf", "fixture", "pdf")
+
+
+def timed(name, n, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12} {n:>7} chunks  {elapsed:>7.2f}s  {n / elapsed:>9.0f} chunks/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--batch", type=int, default=64)
+    args = parser.parse_args()
+
+    documents, metadatas = corpus(args.pages)
+    n = len(documents)
+    batches = [
+        (documents[i:i + args.batch], metadatas[i:i + args.batch])
+        for i in range(0, n, args.batch)
+    ]
+    root = tempfile.mkdtemp(prefix="bench_vector_store_")
+    try:
+        def fresh(name):
+            return VectorStore(os.path.join(root, name), embedding_function=HashingEmbeddingFunction())
+
+        store = fresh("add")
+
+        def plain_add():
+            for docs, metas in batches:
+                store.collection.add(ids=[dedup.chunk_id(d) for d in docs], documents=docs, metadatas=metas)
+
+        timed(f"add/{args.batch}", n, plain_add)
+
+        store = fresh("upsert")
+        timed(f"upsert/{args.batch}", n, lambda: [store.upsert(docs, metas) for docs, metas in batches])
+
+        store = fresh("buffered")
+        store.enable_buffer(os.path.join(root, "journal.jsonl"), max_items=1024, max_delay=60)
+
+        def buffered():
+            for docs, metas in batches:
+                store.write(docs, metas)
+            store.flush()
+
+        timed(f"buffered/{args.batch}", n, buffered)
+        store.close()
+
+        store = fresh("bulk")
+        timed("upsert/all", n, lambda: store.upsert(documents, metadatas))
+        timed("re-ingest", n, lambda: store.upsert(documents, metadatas))
+        assert store.collection.count() == n
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
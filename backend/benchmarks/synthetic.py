@@ -0,0 +1,223 @@
+"""Synthetic fixtures for the offline benchmarks (no third-party writers needed)."""
+import random
+import wave
+from typing import Dict, List, Optional, Tuple
+
+WORDS = (
+    "system data model query index vector page video audio frame token batch "
+    "cache latency throughput memory process worker pipeline document chunk "
+    "embedding search result answer source table value error code device"
+).split()
+
+
+def sentence(rng: random.Random, n_words: int = 12) -> str:
+    words = [rng.choice(WORDS) for _ in range(n_words)]
+    return " ".join(words).capitalize() + "."
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _page_stream(lines: List[str], table: Optional[List[List[str]]]) -> bytes:
+    ops = ["BT", "/F1 10 Tf", "14 TL", "50 780 Td"]
+    for line in lines:
+        ops.append(f"({_escape(line)}) Tj T*")
+    ops.append("ET")
+
+    if table:
+        # Ruled grid so pdfplumber's line-based table finder picks it up
+        cell_w, cell_h = 120, 18
+        rows, cols = len(table), len(table[0])
+        left, top = 50, 200
+        for r in range(rows + 1):
+            y = top - r * cell_h
+            ops.append(f"{left} {y} m {left + cols * cell_w} {y} l S")
+        for c in range(cols + 1):
+            x = left + c * cell_w
+            ops.append(f"{x} {top} m {x} {top - rows * cell_h} l S")
+        for r, row in enumerate(table):
+            for c, cell in enumerate(row):
+                x = left + c * cell_w + 4
+                y = top - (r + 1) * cell_h + 5
+                ops.append(f"BT /F1 9 Tf {x} {y} Td ({_escape(cell)}) Tj ET")
+    return "\n".join(ops).encode("latin-1")
+
+
+def write_pdf(
+    path: str,
+    pages: List[List[str]],
+    tables: Optional[List[Optional[List[List[str]]]]] = None
+) -> None:
+    """
+    Write a minimal PDF with one text line per entry of each page.
+
+    Args:
+        path: Output file
+        pages: Lines of text for every page
+        tables: Optional per-page table (list of rows) drawn below the text
+    """
+    tables = tables or [None] * len(pages)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for lines, table in zip(pages, tables):
+        stream = _page_stream(lines, table)
+        content_num = len(objects) + 2
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents "
+            + str(content_num).encode() + b" 0 R >>"
+        )
+        page_refs.append(f"{len(objects)} 0 R")
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def synthetic_pdf(path: str, n_pages: int, lines_per_page: int = 40, seed: int = 0, with_tables: bool = True) -> None:
+    """Write an ``n_pages`` PDF of random sentences, with a small table on every fourth page."""
+    rng = random.Random(seed)
+    pages, tables = [], []
+    for page in range(n_pages):
+        pages.append([sentence(rng) for _ in range(lines_per_page)])
+        if with_tables and page % 4 == 0:
+            tables.append([[f"ERR-{page:04d}", "code", str(rng.randint(0, 999))] for _ in range(3)])
+        else:
+            tables.append(None)
+    write_pdf(path, pages, tables)
+
+
+ATTRIBUTES = ("error code", "firmware version", "part number", "rated voltage", "service interval")
+
+
+def synthetic_pages(n_pages: int, facts_per_page: int = 2, sentences_per_page: int = 40, seed: int = 0):
+    """
+    Extracted-page fixtures (same shape as ``pdf_processor.extract_page_range``)
+    with planted facts and a labeled question for each.
+
+    Returns:
+        Tuple of (pages, questions) where each question is
+        {"question", "answer", "page"}
+    """
+    rng = random.Random(seed)
+    pages, questions = [], []
+    for page in range(1, n_pages + 1):
+        lines = [f"Section {page} Overview"]
+        facts = []
+        for i in range(facts_per_page):
+            entity = f"unit {rng.choice('ABCDEFGHJK')}{rng.randint(100, 999)}-{page}{i}"
+            attribute = rng.choice(ATTRIBUTES)
+            value = f"{rng.choice('XYZQRV')}{rng.randint(1000, 9999)}"
+            facts.append(f"The {attribute} of {entity} is {value}.")
+            questions.append({"question": f"What is the {attribute} of {entity}?", "answer": value, "page": page})
+        body = [sentence(rng) for _ in range(sentences_per_page)]
+        for fact in facts:
+            body.insert(rng.randint(0, len(body)), fact)
+        # Wrap prose into ~90 character lines like extracted PDF text
+        text, line = " ".join(body), ""
+        for word in text.split():
+            if len(line) + len(word) > 90:
+                lines.append(line)
+                line = ""
+            line = f"{line} {word}".strip()
+        lines.append(line)
+        body_text = "\n".join(lines)
+        pages.append({"page": page, "text": body_text, "body": body_text, "tables": []})
+    return pages, questions
+
+
+def synthetic_corpus_pdf(path: str, n_pages: int, seed: int = 0, facts_per_page: int = 2) -> List[Dict]:
+    """
+    Write a PDF of ``synthetic_pages`` text (short enough to leave room
+    for a table on every fourth page) and return its labeled questions.
+    """
+    rng = random.Random(seed)
+    pages, questions = synthetic_pages(n_pages, facts_per_page=facts_per_page, sentences_per_page=18, seed=seed)
+    tables = [
+        [[f"ERR-{page['page']:04d}-{row}", "code", str(rng.randint(0, 999))] for row in range(3)]
+        if page["page"] % 4 == 1 else None
+        for page in pages
+    ]
+    write_pdf(path, [page["text"].splitlines() for page in pages], tables)
+    return questions
+
+
+def synthetic_wav(path: str, seconds: float, sample_rate: int = 16000, seed: int = 0) -> List[Tuple[float, float]]:
+    """
+    Write a mono 16-bit WAV of "speech" (1-6 s bursts of modulated tones)
+    separated by short pauses of low noise.
+
+    Returns:
+        The (start, end) seconds of every speech span
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    samples = rng.normal(0, 0.002, total).astype(np.float32)
+    spans = []
+    t = float(rng.uniform(0.2, 1.0))
+    while t < seconds:
+        end = min(seconds, t + float(rng.uniform(1.0, 6.0)))
+        start_frame, end_frame = int(t * sample_rate), int(end * sample_rate)
+        time = np.arange(end_frame - start_frame) / sample_rate
+        pitch = rng.uniform(100, 250)
+        # Syllable-rate amplitude modulation over a couple of harmonics
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(3, 6) * time)
+        voice = np.sin(2 * np.pi * pitch * time) + 0.5 * np.sin(4 * np.pi * pitch * time)
+        samples[start_frame:end_frame] += (0.3 * envelope * voice).astype(np.float32)
+        spans.append((round(t, 3), round(end, 3)))
+        t = end + float(rng.uniform(0.3, 1.5))
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm.tobytes())
+    return spans
+
+
+STOPWORDS = frozenset("a an and are for in is it of on or the to what which who with".split())
+
+
+def hashing_embed(texts: List[str], dim: int = 1024):
+    """
+    Offline stand-in for an embedding model: L2-normalised hashed bag of
+    words with log term frequency and stopwords removed.
+    """
+    import re
+    import zlib
+
+    import numpy as np
+
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    buckets = {}
+    for row, text in enumerate(texts):
+        columns = []
+        for token in re.findall(r"\w+", text.lower()):
+            if token not in STOPWORDS:
+                column = buckets.get(token)
+                if column is None:
+                    column = buckets[token] = zlib.crc32(token.encode()) % dim
+                columns.append(column)
+        np.add.at(vectors[row], columns, 1.0)
+    vectors = np.log1p(vectors)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
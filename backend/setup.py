@@ -14,5 +14,6 @@ setup(
         "whisper",
         "moviepy",
         "python-multipart",
+        "httpx",
     ],
 )
\ No newline at end of file
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import pytest
+
+from app.core.container import Services
+from app.services.jobs import UNFINISHED_STATES
+from benchmarks.bench_suite import HashingEmbeddingFunction, bench_settings
+
+
+@pytest.fixture
+def settings(tmp_path):
+    """Offline settings on a temporary data directory, as the benchmark uses them."""
+    return bench_settings(str(tmp_path), argparse.Namespace(backend="mmap", reranker="lexical", processes=1))
+
+
+def make_services(settings) -> Services:
+    services = Services(settings)
+    services.__dict__["embedding_function"] = HashingEmbeddingFunction(cache=services.embedding_cache)
+    return services
+
+
+@pytest.fixture
+def services(settings):
+    services = make_services(settings)
+    yield services
+    asyncio.run(services.close())
+
+
+def wait_for_job(services: Services, job_id: str, timeout: float = 30.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = services.job_queue.get(job_id)
+        if job["status"] not in UNFINISHED_STATES:
+            return job
+        time.sleep(0.02)
+    raise TimeoutError(f"Job {job_id} still running after {timeout}s")
+
+
+@pytest.fixture
+def client(services):
+    """Calls the app in-process; the test drives it with ``asyncio.run``."""
+    import httpx
+
+    from app.main import create_app
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(services.settings, services)), base_url="http://test")
+
+
+# status, headers, and a body or the chunks to send it in, with (seconds, b"") pauses between
+Reply = Tuple[int, Dict[str, str], Union[bytes, List[Union[bytes, Tuple[float, bytes]]]]]
+
+
+class FakeAPI:
+    """
+    A local OpenAI-compatible HTTP server. Requests are answered with the
+    replies in ``script``, in order, then by ``default(request_json)``;
+    every request body is kept in ``requests``.
+    """
+
+    def __init__(self, default: Optional[Callable[[Dict[str, Any]], Reply]] = None):
+        self.script: List[Reply] = []
+        self.default = default
+        self.requests: List[Dict[str, Any]] = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                api.requests.append(body)
+                status, headers, content = api.script.pop(0) if api.script else api.default(body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if isinstance(content, bytes):
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                    return
+                # Streamed until the connection closes
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for part in content:
+                    if isinstance(part, tuple):
+                        time.sleep(part[0])
+                        continue
+                    self.wfile.write(part)
+                    self.wfile.flush()
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), name="fake-api", daemon=True).start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def json_reply(data: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> Reply:
+    return status, dict({"Content-Type": "application/json"}, **(headers or {})), json.dumps(data).encode()
+
+
+@pytest.fixture
+def fake_api():
+    api = FakeAPI()
+    yield api
+    api.close()
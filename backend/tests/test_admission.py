@@ -0,0 +1,179 @@
+import asyncio
+
+import pytest
+
+from app.services import admission
+from app.services.admission import AdmissionController, PoolLimits, RateLimiter, Rejected, TokenBucket
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def _controller(concurrency: int = 1, queue_size: int = 2, timeout: float = 5.0, **rate_limits) -> AdmissionController:
+    return AdmissionController({"query": PoolLimits(concurrency, queue_size, timeout)}, rate_limits)
+
+
+def test_token_bucket_refills_at_its_rate(clock):
+    bucket = TokenBucket(rate=2.0, burst=2.0)
+
+    assert bucket.take() == 0.0
+    assert bucket.take() == 0.0
+    assert bucket.take() == pytest.approx(0.5)
+
+    clock.now += 0.25
+    assert bucket.take() == pytest.approx(0.25)
+    clock.now += 0.25
+    assert bucket.take() == 0.0
+
+    # Never holds more than the burst
+    clock.now += 60
+    assert bucket.take(2.0) == 0.0
+    assert bucket.take() == pytest.approx(0.5)
+
+
+def test_rate_limited_clients_are_told_when_to_retry(clock):
+    controller = _controller(query=RateLimiter(rate=0.5, burst=1))
+
+    controller.check_rate("query", "key-a")
+    with pytest.raises(Rejected) as rejected:
+        controller.check_rate("query", "key-a")
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after == pytest.approx(2.0)
+    assert rejected.value.retry_after_header == "2"
+    # Other clients have buckets of their own
+    controller.check_rate("query", "key-b")
+    assert controller.stats()["query"]["rejected"] == {"rate_limited": 1}
+
+
+def test_rate_limiter_forgets_the_least_recently_seen_client(clock):
+    limiter = RateLimiter(rate=1.0, burst=1, max_clients=2)
+    limiter.check("a")
+    limiter.check("b")
+    limiter.check("a")
+    limiter.check("c")
+
+    assert len(limiter) == 2
+    # "b" was evicted and starts again with a full bucket, evicting "a" in turn
+    assert limiter.check("b") == 0.0
+    assert limiter.check("c") > 0
+    assert len(limiter) == 2
+
+
+def test_waiters_are_served_by_priority():
+    async def run():
+        controller = _controller(queue_size=3)
+        held = await controller.acquire("query")
+        batch = asyncio.create_task(controller.acquire("query", priority=5))
+        interactive = asyncio.create_task(controller.acquire("query", priority=0))
+        await asyncio.sleep(0)
+
+        controller.release("query", held)
+        started = await interactive
+        batch_waited = not batch.done()
+        controller.release("query", started)
+        controller.release("query", await batch)
+        return batch_waited, controller.stats()["query"]
+
+    batch_waited, stats = asyncio.run(run())
+    assert batch_waited
+    assert (stats["active"], stats["waiting"], stats["admitted"]) == (0, 0, 3)
+
+
+def test_a_full_queue_is_rejected_at_once():
+    async def run():
+        controller = _controller(queue_size=1)
+        await controller.acquire("query")
+        waiting = asyncio.create_task(controller.acquire("query"))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire("query")
+        waiting.cancel()
+        return rejected.value, controller.stats()["query"]
+
+    rejected, stats = asyncio.run(run())
+    assert (rejected.status_code, rejected.reason) == (503, "queue_full")
+    assert stats["rejected"] == {"queue_full": 1}
+
+
+def test_a_wait_expected_to_outlast_the_deadline_is_rejected_at_once():
+    async def run():
+        controller = _controller(timeout=5.0)
+        await controller.acquire("query")
+        controller.pools["query"].hold_seconds = 3.0
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire("query", timeout=1.0)
+        return rejected.value, controller.stats()["query"]
+
+    rejected, stats = asyncio.run(run())
+    assert (rejected.status_code, rejected.reason) == (503, "deadline")
+    assert rejected.retry_after == pytest.approx(3.0)
+    assert stats["waiting"] == 0
+
+
+def test_waiting_past_the_timeout_is_rejected_and_leaves_the_queue():
+    async def run():
+        controller = _controller(timeout=0.05)
+        held = await controller.acquire("query")
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire("query")
+        # The timed out waiter is skipped, not granted the slot
+        controller.release("query", held)
+        return rejected.value, controller.stats()["query"]
+
+    rejected, stats = asyncio.run(run())
+    assert (rejected.status_code, rejected.reason) == (503, "timeout")
+    assert (stats["active"], stats["waiting"], stats["admitted"]) == (0, 0, 1)
+    assert stats["rejected"] == {"timeout": 1}
+
+
+def test_a_cancelled_waiter_leaves_the_queue():
+    async def run():
+        controller = _controller()
+        held = await controller.acquire("query")
+        waiting = asyncio.create_task(controller.acquire("query"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        after_cancel = controller.pools["query"].waiting
+        controller.release("query", held)
+        return after_cancel, controller.stats()["query"]
+
+    after_cancel, stats = asyncio.run(run())
+    assert after_cancel == 0
+    assert (stats["active"], stats["admitted"]) == (0, 1)
+
+
+def test_a_slot_granted_to_a_cancelled_waiter_goes_to_the_next_one():
+    async def run():
+        controller = _controller()
+        held = await controller.acquire("query")
+        first = asyncio.create_task(controller.acquire("query"))
+        second = asyncio.create_task(controller.acquire("query"))
+        await asyncio.sleep(0)
+
+        # The first waiter is cancelled, then granted the slot before it gets to run
+        first.cancel()
+        controller.release("query", held)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        started = await asyncio.wait_for(second, 1)
+        active = controller.pools["query"].active
+        controller.release("query", started)
+        return active, controller.stats()["query"]
+
+    active, stats = asyncio.run(run())
+    assert active == 1
+    assert (stats["active"], stats["waiting"], stats["admitted"]) == (0, 0, 3)
@@ -0,0 +1,22 @@
+from app.services.answer_cache import EXACT, SEMANTIC, AnswerCache
+
+SOURCES = [{"source": "handbook.pdf", "page": 3}]
+
+
+def test_answers_are_not_shared_between_tenants():
+    cache = AnswerCache()
+    cache.put("What is the refund policy?", ["c1", "c2"], "30 days [1]", SOURCES, ["f1"], embedding=[1.0, 0.0], scope="acme")
+
+    assert cache.get("what is the refund policy", ["c2", "c1"], [1.0, 0.0], scope="acme")["tier"] == EXACT
+    # The same passages stored by another tenant have the same chunk ids
+    assert cache.get("What is the refund policy?", ["c1", "c2"], [1.0, 0.0], scope="globex") is None
+    assert cache.get("Refund policy?", ["c1", "c2"], [1.0, 0.01], scope="globex") is None
+    assert cache.get("Refund policy?", ["c1", "c2"], [1.0, 0.01], scope="acme")["tier"] == SEMANTIC
+
+
+def test_invalidating_a_file_drops_its_answers_in_every_scope():
+    cache = AnswerCache()
+    for scope in ("acme", "globex"):
+        cache.put("Who signs off?", ["c1"], "The CFO [1]", SOURCES, ["f1"], scope=scope)
+    assert cache.invalidate_file("f1") == 2
+    assert cache.get("Who signs off?", ["c1"], scope="acme") is None
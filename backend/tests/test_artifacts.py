@@ -0,0 +1,82 @@
+import os
+import time
+
+from app.services.artifacts import ArtifactStore
+
+COLUMNS = ("page", "text")
+HOUR = 3600
+
+
+def _pages(n: int = 150):
+    return [{"page": i + 1, "text": f"Page {i + 1} text."} for i in range(n)]
+
+
+def _save(store: ArtifactStore, content_hash: str, version: str = "v1", kind: str = "pages", age: float = 0.0) -> str:
+    store.save(_pages(), content_hash, kind, version, COLUMNS)
+    path = store.path(content_hash, kind, version)
+    used = time.time() - age
+    os.utime(path, (used, used))
+    return path
+
+
+def test_records_round_trip(tmp_path):
+    store = ArtifactStore(str(tmp_path), block_records=64)
+    _save(store, "a" * 64)
+
+    artifact = store.load("a" * 64, "pages", "v1")
+    assert len(artifact) == 150 and artifact.meta == {"version": "v1"}
+    assert list(artifact.records()) == _pages()
+    # Another extractor version, or other content, misses
+    assert store.load("a" * 64, "pages", "v2") is None
+    assert store.load("b" * 64, "pages", "v1") is None
+
+
+def test_unfinished_or_damaged_artifacts_are_not_loaded(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    records = store.recorded(iter(_pages()), "a" * 64, "pages", "v1", COLUMNS)
+    next(records)
+    records.close()
+    assert store.load("a" * 64, "pages", "v1") is None
+
+    path = _save(store, "b" * 64)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+    assert store.load("b" * 64, "pages", "v1") is None
+
+
+def test_gc_waits_out_the_grace_period(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    live = _save(store, "a" * 64, age=10 * HOUR)
+    superseded = _save(store, "a" * 64, version="v0", age=20 * HOUR)
+    orphan_old = _save(store, "b" * 64, age=10 * HOUR)
+    orphan_new = _save(store, "c" * 64, age=0.5 * HOUR)
+    # A write that never finished
+    writer = store.writer("a" * 64, "transcript", "v1", COLUMNS)
+    writer.append({"page": 1, "text": "partial"})
+    writer._file.flush()
+    stale = time.time() - 10 * HOUR
+    os.utime(writer._tmp_path, (stale, stale))
+
+    result = store.gc({"a" * 64, "c" * 64}, grace_seconds=HOUR)
+
+    assert result["deleted"] == 3
+    assert os.path.exists(live) and os.path.exists(orphan_new)
+    assert not any(os.path.exists(p) for p in (superseded, orphan_old, writer._tmp_path))
+    # Unreferenced, but within the grace period: kept for now
+    assert store.gc({"a" * 64}, grace_seconds=HOUR)["deleted"] == 0
+    assert store.gc({"a" * 64}, grace_seconds=0)["deleted"] == 1
+    assert not os.path.exists(os.path.dirname(orphan_new))
+
+
+def test_gc_drops_least_recently_used_beyond_the_size_cap(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    paths = [_save(store, h * 64, age=age * HOUR) for h, age in (("a", 3), ("b", 1), ("c", 2))]
+    # Room for the two most recently used once "a" is loaded
+    max_bytes = os.path.getsize(paths[0]) + os.path.getsize(paths[1])
+
+    # Loading refreshes last use
+    store.load("a" * 64, "pages", "v1").close()
+    result = store.gc({"a" * 64, "b" * 64, "c" * 64}, grace_seconds=HOUR, max_bytes=max_bytes)
+
+    assert result == dict(result, deleted=1, kept=2)
+    assert [os.path.exists(p) for p in paths] == [True, True, False]
@@ -0,0 +1,79 @@
+import pytest
+
+from app.services import chunking
+from app.services.chunking import Chunker, count_tokens
+
+
+def _sentence(n_tokens: int, word: str) -> str:
+    """A sentence of exactly ``n_tokens`` tokens: words plus the full stop."""
+    return " ".join([word.capitalize()] + [word] * (n_tokens - 2)) + "."
+
+
+def _text(*units):
+    return [{"kind": kind, "text": text, "provenance": {"page": page}} for kind, text, page in units]
+
+
+def test_overlap_shrinks_so_the_next_sentence_fits():
+    chunker = Chunker(max_tokens=50, overlap_tokens=20)
+    text = " ".join([_sentence(30, "alpha"), _sentence(10, "beta"), _sentence(45, "gamma")])
+
+    chunks = list(chunker.chunk_units(_text((chunking.TEXT, text, 1))))
+
+    assert [c["tokens"] for c in chunks] == [40, 45]
+    assert all(count_tokens(c["text"]) <= 50 for c in chunks)
+
+
+def test_overlap_repeats_trailing_sentences():
+    chunker = Chunker(max_tokens=50, overlap_tokens=20)
+    text = " ".join([_sentence(30, "alpha"), _sentence(10, "beta"), _sentence(20, "gamma")])
+
+    first, second = chunker.chunk_units(_text((chunking.TEXT, text, 1)))
+
+    assert second["text"].startswith("Beta")
+    assert second["tokens"] == 30
+    assert first["tokens"] == 40
+
+
+def test_chunks_with_a_heading_stay_within_max_tokens():
+    chunker = Chunker(max_tokens=40, overlap_tokens=10)
+    long_sentence = " ".join(["word"] * 100) + "."
+    units = _text((chunking.HEADING, "Maintenance Schedule Overview", 1),
+                  (chunking.TEXT, long_sentence + " " + _sentence(12, "pump"), 1))
+
+    chunks = list(chunker.chunk_units(units))
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk["section"] == "Maintenance Schedule Overview"
+        assert chunk["text"].startswith("Maintenance Schedule Overview\n")
+        assert chunk["tokens"] == count_tokens(chunk["text"])
+        assert chunk["tokens"] <= 40
+
+
+def test_tables_are_chunked_by_whole_rows_under_the_budget():
+    chunker = Chunker(max_tokens=20, overlap_tokens=5)
+    rows = [f"part {i} | {i * 10} mm | steel" for i in range(12)]
+    units = [
+        {"kind": chunking.HEADING, "text": "Parts List", "provenance": {"page": 3}},
+        {"kind": chunking.TABLE, "rows": rows, "text": "\n".join(rows), "provenance": {"page": 3}},
+    ]
+
+    chunks = list(chunker.chunk_units(units))
+
+    assert all(c["chunk_type"] == chunking.TABLE and c["tokens"] <= 20 for c in chunks)
+    body_rows = [row for c in chunks for row in c["text"].split("\n")[1:]]
+    assert body_rows == rows
+
+
+def test_provenance_spans_the_pages_of_a_chunk():
+    chunker = Chunker(max_tokens=100, overlap_tokens=10)
+    units = _text((chunking.TEXT, _sentence(10, "alpha"), 1), (chunking.TEXT, _sentence(10, "beta"), 2))
+
+    (chunk,) = chunker.chunk_units(units)
+
+    assert chunk["provenance"] == {"page": 1, "page_end": 2}
+
+
+def test_overlap_must_be_smaller_than_the_chunk():
+    with pytest.raises(ValueError):
+        Chunker(max_tokens=20, overlap_tokens=20)
@@ -0,0 +1,92 @@
+from app.services.chunking import count_tokens
+from app.services.context_builder import ContextBuilder
+
+QUESTION = "How often is the pump serviced?"
+
+
+def _page(file_id: str, page: int, **extra):
+    return dict({"source": f"{file_id}.pdf", "file_id": file_id, "type": "pdf", "page": page}, **extra)
+
+
+def _span(start: float, end: float):
+    return {"source": "talk.mp4", "file_id": "talk", "type": "video", "start": start, "end": end}
+
+
+def test_adjacent_pages_merge_into_one_citation_without_overlap_repeats():
+    documents = [
+        "The pump is serviced every six months. Seals are replaced yearly.",
+        "Seals are replaced yearly. Filters are cleaned monthly.",
+        "Pumps ship with a two year warranty.",
+    ]
+    metadatas = [_page("manual", 3), _page("manual", 4), _page("manual", 9)]
+
+    packed = ContextBuilder().build(QUESTION, ["a", "b", "c"], documents, metadatas)
+
+    first, second = packed["citations"]
+    assert (first["citation"], first["page"], first["page_end"], first["chunk_ids"]) == (1, 3, 4, ["a", "b"])
+    assert first["text"].count("Seals are replaced yearly.") == 1
+    assert (second["citation"], second["page"], second["chunk_ids"]) == (2, 9, ["c"])
+    assert packed["context"].startswith("[1] manual.pdf, p. 3-4\n")
+    assert "\n\n[2] manual.pdf, p. 9\n" in packed["context"]
+    assert packed["chunk_ids"] == ["a", "b", "c"]
+
+
+def test_nearby_time_ranges_merge():
+    documents = ["First we open the pump.", "Then we check the seal.", "Finally the pump is serviced."]
+    metadatas = [_span(0, 30), _span(33, 60), _span(300, 330)]
+
+    packed = ContextBuilder(merge_gap_seconds=5).build(QUESTION, ["a", "b", "c"], documents, metadatas)
+
+    first, second = packed["citations"]
+    assert (first["start"], first["end"], first["chunk_ids"]) == (0, 60, ["a", "b"])
+    assert second["chunk_ids"] == ["c"]
+    assert packed["context"].startswith(f"[1] talk.mp4, {first['timestamp']}\n")
+
+
+def test_near_duplicate_chunks_are_dropped():
+    documents = [
+        "The pump is serviced every six months. Seals are replaced yearly.",
+        "The pump is serviced every six months. Seals are replaced yearly.",
+        "Pumps ship with a two year warranty.",
+    ]
+    metadatas = [_page("manual", 3), _page("manual-copy", 3), _page("manual", 9)]
+
+    packed = ContextBuilder().build(QUESTION, ["a", "dup", "c"], documents, metadatas)
+
+    assert packed["chunk_ids"] == ["a", "c"]
+    assert [c["citation"] for c in packed["citations"]] == [1, 2]
+    assert packed["context"].count("serviced every six months") == 1
+
+
+def test_context_stays_within_the_budget():
+    filler = [f"Unrelated sentence number {i} about the fan." for i in range(40)]
+    documents = [
+        " ".join(filler[:20] + ["The pump is serviced every six months."] + filler[20:]),
+        " ".join(["Pumps ship with a two year warranty."] + filler),
+    ]
+    metadatas = [_page("manual", 3), _page("manual", 9)]
+
+    for budget in (20, 60, 150):
+        packed = ContextBuilder(max_tokens=budget).build(QUESTION, ["a", "b"], documents, metadatas)
+        assert packed["tokens"] <= budget
+        assert count_tokens(packed["context"]) <= budget
+        # The sentence that answers the question is picked first
+        assert "The pump is serviced every six months." in packed["context"]
+    assert packed["input_tokens"] == sum(count_tokens(d) for d in documents)
+
+
+def test_section_headings_label_the_block():
+    packed = ContextBuilder().build(
+        QUESTION, ["a"], ["Maintenance\nThe pump is serviced every six months."], [_page("manual", 3, section="Maintenance")]
+    )
+    assert packed["context"].startswith("[1] manual.pdf, p. 3 (Maintenance)\nThe pump is serviced")
+
+
+def test_gaps_between_picked_sentences_count_towards_the_budget():
+    filler = [f"Unrelated sentence number {i} about the fan." for i in range(10)]
+    document = " ".join(["The pump is serviced yearly."] + filler + ["The pump is serviced often."])
+
+    for budget in range(15, 60):
+        packed = ContextBuilder(max_tokens=budget).build(QUESTION, ["a"], [document], [_page("manual", 1)])
+        assert count_tokens(packed["context"]) <= packed["tokens"] <= budget
+    assert " ... " in ContextBuilder(max_tokens=26).build(QUESTION, ["a"], [document], [_page("manual", 1)])["context"]
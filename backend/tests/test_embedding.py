@@ -0,0 +1,124 @@
+import os
+import time
+
+import pytest
+
+from app.services.embedding import DeepSeekEmbeddingFunction, EmbeddingCache, EmbeddingError
+from tests.conftest import json_reply
+
+
+def _vectors(request):
+    # A vector per text that tells which text it was, out of order as some APIs send them
+    data = [{"index": i, "embedding": [float(len(text)), float(i)]} for i, text in enumerate(request["input"])]
+    return json_reply({"data": data[::-1]})
+
+
+def _embedder(fake_api, tmp_path, **options) -> DeepSeekEmbeddingFunction:
+    fake_api.default = _vectors
+    options = dict({"max_retries": 2, "backoff": 0.01, "batch_size": 2}, **options)
+    return DeepSeekEmbeddingFunction(
+        "key",
+        api_url=f"{fake_api.url}/v1/embeddings",
+        model_name="fake-embedding",
+        cache=EmbeddingCache(os.path.join(tmp_path, "embeddings.sqlite3")),
+        **options
+    )
+
+
+def test_texts_are_batched_and_returned_in_order(fake_api, tmp_path):
+    embed = _embedder(fake_api, tmp_path)
+    vectors = embed(["a", "bb", "ccc"])
+    assert [vector[0] for vector in vectors] == [1.0, 2.0, 3.0]
+    assert sorted(len(request["input"]) for request in fake_api.requests) == [1, 2]
+    assert all(request["model"] == "fake-embedding" for request in fake_api.requests)
+
+
+def test_retry_after_is_honoured(fake_api, tmp_path):
+    # The backoff alone would wait seconds; Retry-After asks for a fifth of one
+    embed = _embedder(fake_api, tmp_path, backoff=5)
+    fake_api.script.append(json_reply({"error": "slow down"}, status=429, headers={"Retry-After": "0.2"}))
+    started = time.monotonic()
+    assert embed(["hello"]) == [[5.0, 0.0]]
+    assert 0.2 <= time.monotonic() - started < 2
+    assert len(fake_api.requests) == 2
+
+
+def test_server_errors_are_retried_then_raised(fake_api, tmp_path):
+    embed = _embedder(fake_api, tmp_path)
+    fake_api.script.extend([json_reply({"error": "unavailable"}, status=503)] * 3)
+    with pytest.raises(EmbeddingError, match="HTTP 503"):
+        embed(["hello"])
+    assert len(fake_api.requests) == 3
+
+
+def test_client_errors_are_not_retried(fake_api, tmp_path):
+    embed = _embedder(fake_api, tmp_path)
+    fake_api.script.append(json_reply({"error": "bad model"}, status=400))
+    with pytest.raises(EmbeddingError, match="HTTP 400"):
+        embed(["hello"])
+    assert len(fake_api.requests) == 1
+
+
+def test_cached_texts_cost_no_calls_even_after_a_restart(fake_api, tmp_path):
+    embed = _embedder(fake_api, tmp_path)
+    first = embed(["alpha", "beta", "alpha"])
+    assert [request["input"] for request in fake_api.requests] == [["alpha", "beta"]]
+    assert embed.cache.stats()["misses"] == 2
+
+    assert embed(["beta", "alpha"]) == [first[1], first[0]]
+    assert len(fake_api.requests) == 1
+    assert embed.cache.stats()["hits"] == 2
+
+    # Same cache file, new process: only the new text is sent
+    restarted = _embedder(fake_api, tmp_path)
+    restarted(["alpha", "gamma"])
+    assert [request["input"] for request in fake_api.requests][1:] == [["gamma"]]
+
+
+def test_retry_after_is_capped_at_the_maximum_backoff(fake_api, tmp_path):
+    embed = _embedder(fake_api, tmp_path, max_backoff=0.05)
+    fake_api.script.append(json_reply({"error": "slow down"}, status=429, headers={"Retry-After": "3600"}))
+    started = time.monotonic()
+    assert embed(["hello"]) == [[5.0, 0.0]]
+    assert time.monotonic() - started < 2
+
+
+def _last_used(cache: EmbeddingCache, key: str) -> int:
+    return cache._conn.execute("SELECT last_used FROM embeddings WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_cache_hits_write_their_recency_in_batches(tmp_path):
+    cache = EmbeddingCache(os.path.join(tmp_path, "embeddings.sqlite3"))
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    written = _last_used(cache, "a")
+    changes = cache._conn.total_changes
+
+    assert cache.get_many(["a", "b", "missing"]) == {"a": [1.0], "b": [2.0]}
+    assert cache.get_many(["a"]) == {"a": [1.0]}
+    assert cache._conn.total_changes == changes
+    assert _last_used(cache, "a") == written
+
+    cache.flush()
+    assert _last_used(cache, "a") > written
+    cache.close()
+
+
+def test_recently_read_entries_are_not_evicted(tmp_path):
+    cache = EmbeddingCache(os.path.join(tmp_path, "embeddings.sqlite3"), max_entries=2)
+    cache.put_many({"a": [1.0]})
+    cache.put_many({"b": [2.0]})
+    cache.get_many(["a"])
+
+    # The read of "a" is written before "c" evicts the least recently used
+    cache.put_many({"c": [3.0]})
+    assert sorted(cache.get_many(["a", "b", "c"])) == ["a", "c"]
+    cache.close()
+
+
+def test_cache_hits_are_written_once_the_interval_passes(tmp_path):
+    cache = EmbeddingCache(os.path.join(tmp_path, "embeddings.sqlite3"), touch_interval=0)
+    cache.put_many({"a": [1.0]})
+    written = _last_used(cache, "a")
+    cache.get_many(["a"])
+    assert _last_used(cache, "a") > written
+    cache.close()
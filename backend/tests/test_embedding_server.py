@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from app.services.embedding import EmbeddingError
+from app.services.embedding_server import RemoteEmbeddingFunction, serve
+
+DIM = 8
+
+
+def _encode(texts):
+    if "boom" in texts:
+        raise RuntimeError("encoder blew up")
+    return np.stack([np.random.default_rng(len(text)).normal(size=DIM) for text in texts]).astype(np.float32)
+
+
+def _load_encoder():
+    return _encode
+
+
+def _load_broken_encoder():
+    raise RuntimeError("weights not found")
+
+
+def _start(tmp_path, load_encoder):
+    socket_path = os.path.join(tmp_path, "embed.sock")
+    # Spawned, as in production: the server runs its own event loop and signal handlers
+    process = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(socket_path, load_encoder, "test", 16, 20.0), daemon=True
+    )
+    process.start()
+    deadline = time.monotonic() + 30
+    while not os.path.exists(socket_path):
+        assert time.monotonic() < deadline, "embedding server did not start"
+        time.sleep(0.05)
+    return process, RemoteEmbeddingFunction(socket_path, "test")
+
+
+@pytest.fixture
+def server(tmp_path):
+    process, client = _start(str(tmp_path), _load_encoder)
+    yield client
+    client.close()
+    process.terminate()
+    process.join()
+
+
+def test_embeddings_round_trip(server):
+    server.load()
+    assert server.ready
+    texts = ["a", "bb", "ccc"]
+    assert np.allclose(server.embed_array(texts), _encode(texts))
+    assert np.allclose(server(texts), _encode(texts))
+
+
+def test_concurrent_requests_share_batches(server):
+    server.load()
+    texts = [f"question {'x' * i}" for i in range(32)]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        vectors = list(pool.map(lambda text: server.embed_array([text])[0], texts))
+    assert np.allclose(np.stack(vectors), _encode(texts))
+
+    stats = server.stats()
+    assert stats["requests"] == 32
+    assert stats["batches"] < 32
+    assert stats["batch_size"]["max"] <= 16
+
+
+def test_encoder_errors_reach_the_caller(server):
+    server.load()
+    with pytest.raises(EmbeddingError, match="encoder blew up"):
+        server.embed_array(["fine", "boom"])
+    # The connection and the server carry on
+    assert np.allclose(server.embed_array(["fine"]), _encode(["fine"]))
+
+
+def test_a_model_that_fails_to_load_is_reported(tmp_path):
+    process, client = _start(str(tmp_path), _load_broken_encoder)
+    try:
+        with pytest.raises(EmbeddingError, match="weights not found"):
+            client.load()
+        with pytest.raises(EmbeddingError, match="Model failed to load"):
+            client.embed_array(["text"])
+    finally:
+        client.close()
+        process.terminate()
+        process.join()
+
+
+def test_no_server_and_nothing_to_spawn(tmp_path):
+    client = RemoteEmbeddingFunction(os.path.join(str(tmp_path), "missing.sock"), "test")
+    with pytest.raises(EmbeddingError, match="No embedding server"):
+        client.embed_array(["text"])
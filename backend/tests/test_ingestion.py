@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from app.core import telemetry
+from app.services import video_processor
+from benchmarks.synthetic import synthetic_wav
+from tests.conftest import wait_for_job
+
+
+def _extract_wav(file_path: str) -> str:
+    """The test "videos" are their WAV tracks."""
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as audio:
+        audio_path = audio.name
+    shutil.copyfile(file_path, audio_path)
+    return audio_path
+
+
+def _stage_counts() -> dict:
+    return {key: count for key, (count, _) in telemetry.STAGE_SECONDS.totals().items()}
+
+
+def _ingest_video(services, tmp_path, monkeypatch, seconds: float = 20.0) -> dict:
+    monkeypatch.setattr(video_processor, "extract_audio", _extract_wav)
+    path = os.path.join(tmp_path, "talk.wav")
+    synthetic_wav(path, seconds)
+    job = services.job_queue.submit("video", {"file_path": path, "filename": "talk.mp4", "file_id": "talk"})
+    return wait_for_job(services, job["job_id"])
+
+
+def test_video_transcript_is_indexed_and_timed(services, tmp_path, monkeypatch):
+    before = _stage_counts()
+    job = _ingest_video(services, tmp_path, monkeypatch)
+    assert job["status"] == "completed", job.get("error")
+    assert job["result"]["chunks"] > 0
+    after = _stage_counts()
+    for stage in ("audio_extract", "transcribe", "chunk"):
+        assert after[("ingest", stage)] == before.get(("ingest", stage), 0) + 1
+    assert job["progress"]["seconds_done"] > 0
+
+
+def test_video_without_keyframes_records_no_frame_stages(services, tmp_path, monkeypatch):
+    before = _stage_counts()
+    job = _ingest_video(services, tmp_path, monkeypatch)
+    assert job["status"] == "completed", job.get("error")
+    after = _stage_counts()
+    for stage in ("frame_ocr", "artifact_read"):
+        assert after.get(("ingest", stage), 0) == before.get(("ingest", stage), 0)
+
+
+def test_keyframes_are_read_while_transcribing(services, settings, tmp_path, monkeypatch):
+    settings.VIDEO_FRAMES_PER_MINUTE = 12
+    threads = []
+
+    def iter_keyframes(file_path, **options):
+        threads.append(threading.current_thread().name)
+        yield {"start": 0.0, "end": 10.0, "text": "Quarterly revenue grew by 12 percent"}
+        yield {"start": 10.0, "end": 20.0, "text": "Next steps: hire two engineers"}
+
+    monkeypatch.setattr(video_processor, "iter_keyframes", iter_keyframes)
+    before = _stage_counts()
+    job = _ingest_video(services, tmp_path, monkeypatch)
+    assert job["status"] == "completed", job.get("error")
+    assert job["result"]["keyframes"] == 2
+    assert not job["result"]["reused_extraction"]
+    assert threads == [f"keyframes-{job['job_id']}"]
+    after = _stage_counts()
+    assert after[("ingest", "frame_ocr")] == before.get(("ingest", "frame_ocr"), 0) + 1
+
+    documents = [doc for _, docs, _ in services.vector_store.iter_documents() for doc in docs]
+    assert any("hire two engineers" in doc for doc in documents)
+
+    # The same bytes again: transcript and keyframes come from their artifacts
+    job = _ingest_video(services, tmp_path, monkeypatch)
+    assert job["status"] == "completed", job.get("error")
+    assert job["result"]["reused_extraction"]
+    assert len(threads) == 1
@@ -0,0 +1,45 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from app.services.jobs import COMPLETED, UNFINISHED_STATES, JobQueue, JobStore
+
+
+def _queue(tmp_path, **options) -> JobQueue:
+    queue = JobQueue(JobStore(os.path.join(tmp_path, "jobs")), max_workers=1, max_processes=1, **options)
+    queue.register("echo", lambda ctx: dict(ctx.payload))
+    return queue
+
+
+def _run(queue: JobQueue, n: int) -> list:
+    job_ids = [queue.submit("echo", {"n": i})["job_id"] for i in range(n)]
+    for job_id in job_ids:
+        # An early job may already be forgotten by the time it is polled
+        while (queue.get(job_id) or {}).get("status") in UNFINISHED_STATES:
+            time.sleep(0.01)
+    # The job is forgotten just after it reports done
+    time.sleep(0.05)
+    return job_ids
+
+
+def test_only_the_newest_finished_jobs_are_kept(tmp_path):
+    queue = _queue(tmp_path, max_finished=3)
+    job_ids = _run(queue, 5)
+    assert [queue.get(job_id) for job_id in job_ids[:2]] == [None, None]
+    assert [queue.get(job_id)["result"] for job_id in job_ids[2:]] == [{"n": 2}, {"n": 3}, {"n": 4}]
+    assert sorted(job["job_id"] for job in queue.store.load_all()) == sorted(job_ids[2:])
+    assert queue.counts() == {("echo", COMPLETED): 5}
+    queue.shutdown()
+
+
+def test_expired_jobs_left_on_disk_are_forgotten_on_resume(tmp_path):
+    old = (datetime.now() - timedelta(hours=2)).isoformat()
+    store = JobStore(os.path.join(tmp_path, "jobs"))
+    for job_id, updated_at in (("old", old), ("new", datetime.now().isoformat())):
+        store.save({"job_id": job_id, "kind": "echo", "status": COMPLETED, "updated_at": updated_at})
+
+    queue = _queue(tmp_path, retention_seconds=3600)
+    queue.resume()
+    assert queue.get("old") is None
+    assert queue.get("new")["status"] == COMPLETED
+    queue.shutdown()
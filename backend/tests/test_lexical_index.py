@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from app.services.lexical_index import BM25Index, reciprocal_rank_fusion
+
+DOCS = {
+    "c1": ("The pump must be serviced every six months.", {"type": ["pdf"], "file_id": ["manual"]}),
+    "c2": ("Replace the pump seal when the pressure drops.", {"type": ["pdf"], "file_id": ["manual"]}),
+    "c3": ("Fault ERR-4821 means the inlet pressure is too low.", {"type": ["pdf"], "file_id": ["codes"]}),
+    "c4": ("Fault ERR-4822 on the err display, see code 4821 notes.", {"type": ["pdf"], "file_id": ["codes"]}),
+    "c5": ("In this talk we service the pump live.", {"type": ["video"], "file_id": ["talk"]}),
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25"))
+    index.add_many((doc_id, text, filters) for doc_id, (text, filters) in DOCS.items())
+    yield index
+    index.close()
+
+
+def _ids(hits):
+    return [doc_id for doc_id, _ in hits]
+
+
+def test_identifiers_match_whole(index):
+    assert _ids(index.search("ERR-4821", k=2)) == ["c3", "c4"]
+    assert _ids(index.search("what does err-4821 mean", k=1)) == ["c3"]
+
+
+def test_filters_restrict_results(index):
+    assert set(_ids(index.search("pump", filters={"type": ["pdf"]}))) == {"c1", "c2"}
+    assert _ids(index.search("pump", filters={"type": ["video"]})) == ["c5"]
+    assert set(_ids(index.search("pump", filters={"file_id": ["manual", "talk"], "type": ["video"]}))) == {"c5"}
+    assert index.search("pump", filters={"file_id": ["nothing"]}) == []
+    assert sorted(index.doc_ids_for("file_id", "codes")) == ["c3", "c4"]
+
+
+def test_deleted_documents_are_not_found(index):
+    assert index.delete(["c1", "missing"]) == 1
+    assert "c1" not in _ids(index.search("pump serviced"))
+    assert len(index) == 4
+    assert index.doc_ids_for("file_id", "manual") == ["c2"]
+
+    # Re-adding an id replaces the old text
+    index.add("c2", "Only the impeller is mentioned here.", {"type": ["pdf"], "file_id": ["manual"]})
+    assert "c2" not in _ids(index.search("seal"))
+    assert _ids(index.search("impeller")) == ["c2"]
+    assert len(index) == 4
+
+
+def test_reopening_replays_the_log(tmp_path, index):
+    index.delete(["c2"])
+    index.add("c6", "Seal kits ship with the pump.", {"type": ["pdf"], "file_id": ["parts"]})
+    queries = ["pump seal", "ERR-4821", "service the pump"]
+    before = [index.search(q) for q in queries]
+    index.close()
+
+    reopened = BM25Index(str(tmp_path / "bm25"))
+    assert [reopened.search(q) for q in queries] == before
+    assert len(reopened) == 5
+    reopened.close()
+
+
+def test_compaction_drops_tombstones_and_keeps_results(tmp_path, index):
+    index.delete(["c2", "c4"])
+    queries = ["pump seal", "ERR-4821", "service the pump"]
+    ranked = [_ids(index.search(q)) for q in queries]
+
+    index.compact()
+    assert os.path.getsize(tmp_path / "bm25" / "log.jsonl") == 0
+    assert [_ids(index.search(q)) for q in queries] == ranked
+    assert len(index) == 3
+    # Tombstones no longer count towards document frequencies
+    assert len(index._ids) == 3
+
+    index.add("c7", "The pump seal is covered by the warranty.", {"type": ["pdf"], "file_id": ["warranty"]})
+    index.close()
+    reopened = BM25Index(str(tmp_path / "bm25"))
+    assert _ids(reopened.search("warranty")) == ["c7"]
+    assert reopened.doc_ids_for("file_id", "codes") == ["c3"]
+    assert len(reopened) == 4
+    reopened.close()
+
+
+def test_compaction_runs_once_due(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25"), compact_every=3)
+    index.add_many((doc_id, text, filters) for doc_id, (text, filters) in DOCS.items())
+    assert index._generation == 1
+    assert _ids(index.search("ERR-4821", k=1)) == ["c3"]
+    index.close()
+
+
+def test_reciprocal_rank_fusion_order():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]], k=60)
+    assert [doc_id for doc_id, _ in fused] == ["a", "c", "b", "d"]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused[-1][1] == pytest.approx(1 / 63)
+    # Found by both searches beats first in only one; ties keep first-seen order
+    assert [doc_id for doc_id, _ in reciprocal_rank_fusion([["x", "m"], ["y", "m"]])] == ["m", "x", "y"]
+    assert reciprocal_rank_fusion([]) == []
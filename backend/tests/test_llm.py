@@ -0,0 +1,156 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.services.llm_interface import LLMError, LLMInterface, StreamInterrupted
+from tests.conftest import json_reply
+
+
+def _completion(request):
+    return json_reply({
+        "choices": [{"message": {"content": f"You said: {request['messages'][-1]['content']}"}}],
+        "usage": {"prompt_tokens": 7, "completion_tokens": 3}
+    })
+
+
+def _sse(*tokens, pause: float = 0.0, done: bool = True):
+    parts = []
+    for token in tokens:
+        parts.append(f"data: {json.dumps({'choices': [{'delta': {'content': token}}]})}\n\n".encode())
+        if pause:
+            parts.append((pause, b""))
+    if done:
+        parts.append(b"data: [DONE]\n\n")
+    return 200, {"Content-Type": "text/event-stream"}, parts
+
+
+def _llm(fake_api, **options) -> LLMInterface:
+    fake_api.default = _completion
+    return LLMInterface(
+        api_key="key", base_url=f"{fake_api.url}/v1/chat/completions", model="fake-chat", max_retries=2, backoff=0.01,
+        **options
+    )
+
+
+def _run(llm: LLMInterface, coroutine):
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await llm.aclose()
+    return asyncio.run(run())
+
+
+async def _collect(stream, arrivals=None):
+    tokens = []
+    async for token in stream:
+        tokens.append(token)
+        if arrivals is not None:
+            arrivals.append(time.monotonic())
+    return tokens
+
+
+def test_completion_after_transient_errors(fake_api):
+    llm = _llm(fake_api)
+    fake_api.script.extend([json_reply({}, status=503), json_reply({}, status=429, headers={"Retry-After": "0"})])
+    assert _run(llm, llm.generate_response("ping")) == "You said: ping"
+    assert len(fake_api.requests) == 3
+    assert fake_api.requests[0]["model"] == "fake-chat" and not fake_api.requests[0]["stream"]
+
+
+def test_retry_after_is_capped_at_the_maximum_backoff(fake_api):
+    llm = _llm(fake_api, max_backoff=0.05)
+    fake_api.script.append(json_reply({}, status=429, headers={"Retry-After": "3600"}))
+    started = time.monotonic()
+    assert _run(llm, llm.generate_response("ping")) == "You said: ping"
+    assert time.monotonic() - started < 2
+    assert len(fake_api.requests) == 2
+
+
+def test_client_errors_are_raised_at_once(fake_api):
+    llm = _llm(fake_api)
+    fake_api.script.append(json_reply({"error": "no such model"}, status=404))
+    with pytest.raises(LLMError, match="HTTP 404"):
+        _run(llm, llm.generate_response("ping"))
+    assert len(fake_api.requests) == 1
+
+
+def test_tokens_are_streamed_as_they_arrive(fake_api):
+    llm = _llm(fake_api)
+    fake_api.script.append(_sse("Hel", "lo", " there", pause=0.2))
+    arrivals = []
+    started = time.monotonic()
+    tokens = _run(llm, _collect(llm.stream_response("hi"), arrivals))
+    assert tokens == ["Hel", "lo", " there"]
+    assert fake_api.requests[0]["stream"] is True
+    # The first token is yielded long before the server finishes
+    assert arrivals[0] - started < 0.2 <= arrivals[-1] - arrivals[0]
+
+
+def test_stream_is_retried_before_the_first_token(fake_api):
+    llm = _llm(fake_api)
+    fake_api.script.extend([json_reply({}, status=502), _sse("ok")])
+    assert _run(llm, _collect(llm.stream_response("hi"))) == ["ok"]
+    assert len(fake_api.requests) == 2
+
+
+def test_a_stream_cut_short_after_the_first_token_raises(fake_api):
+    llm = _llm(fake_api)
+    fake_api.script.append(_sse("Two", " ye", done=False))
+    with pytest.raises(StreamInterrupted, match="before \\[DONE\\]"):
+        _run(llm, _collect(llm.stream_response("hi")))
+    assert len(fake_api.requests) == 1
+
+
+def test_a_stream_cut_short_before_the_first_token_is_retried(fake_api):
+    llm = _llm(fake_api)
+    fake_api.script.extend([_sse(done=False), _sse("ok")])
+    assert _run(llm, _collect(llm.stream_response("hi"))) == ["ok"]
+    assert len(fake_api.requests) == 2
+
+
+def test_malformed_stream_chunks_raise(fake_api):
+    llm = _llm(fake_api)
+    fake_api.script.append((200, {"Content-Type": "text/event-stream"}, [b"data: {not json\n\n"]))
+    with pytest.raises(LLMError, match="Invalid stream chunk"):
+        _run(llm, _collect(llm.stream_response("hi")))
+
+
+def test_query_stream_sends_sources_then_tokens(services, client, fake_api):
+    services.__dict__["llm"] = _llm(fake_api)
+    services.vector_store.upsert(
+        ["The warranty covers parts and labour for two years."],
+        [{"source": "warranty.pdf", "file_id": "warranty", "page": 1, "chunk_type": "text"}]
+    )
+    fake_api.script.append(_sse("Two", " years [1]."))
+
+    async def run():
+        async with client.stream("POST", "/query/stream", json={"question": "How long is the warranty?"}) as response:
+            return [line async for line in response.aiter_lines() if line.startswith("event:")]
+
+    events = asyncio.run(run())
+    assert events == ["event: sources", "event: token", "event: token", "event: done"]
+    assert "warranty" in fake_api.requests[0]["messages"][-1]["content"]
+
+
+def test_query_stream_does_not_cache_a_truncated_answer(services, client, fake_api):
+    services.__dict__["llm"] = _llm(fake_api)
+    services.vector_store.upsert(
+        ["The warranty covers parts and labour for two years."],
+        [{"source": "warranty.pdf", "file_id": "warranty", "page": 1, "chunk_type": "text"}]
+    )
+    fake_api.script.extend([_sse("Two", " ye", done=False), _sse("Two", " years [1].")])
+
+    async def ask():
+        async with client.stream("POST", "/query/stream", json={"question": "How long is the warranty?"}) as response:
+            return [line async for line in response.aiter_lines() if line.startswith("event:")]
+
+    async def run():
+        return [await ask(), await ask()]
+
+    truncated, retried = asyncio.run(run())
+    assert truncated == ["event: sources", "event: token", "event: token", "event: error"]
+    assert retried == ["event: sources", "event: token", "event: token", "event: done"]
+    assert len(fake_api.requests) == 2
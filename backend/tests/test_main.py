@@ -0,0 +1,24 @@
+from fastapi.testclient import TestClient
+
+from app.core import telemetry
+from app.main import create_app
+from tests.conftest import make_services
+
+
+def test_lifespan_starts_and_closes_the_services(settings):
+    services = make_services(settings)
+    closed = []
+    close = services.close
+
+    async def recording_close():
+        closed.append(True)
+        await close()
+
+    services.close = recording_close
+    app = create_app(services.settings, services)
+    with TestClient(app) as client:
+        assert "startup_ms" in app.state.timings
+        assert client.get("/status/").json()["status"] == "ok"
+        assert services.metrics in telemetry.REGISTRY._collectors
+    assert closed == [True]
+    assert services.metrics not in telemetry.REGISTRY._collectors
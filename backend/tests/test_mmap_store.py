@@ -0,0 +1,210 @@
+import threading
+
+import numpy as np
+import pytest
+
+from app.services.mmap_store import MmapCollection
+
+DIM = 16
+
+
+def _vectors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def _rows(n: int, start: int = 0):
+    ids = [f"doc-{i}" for i in range(start, start + n)]
+    documents = [f"Document {i}" for i in range(start, start + n)]
+    metadatas = [{"file_id": f"file-{i % 3}", "page": i, f"in_file_file-{i % 3}": True} for i in range(start, start + n)]
+    return ids, documents, metadatas
+
+
+def _contents(collection: MmapCollection):
+    result = collection.get()
+    return sorted(zip(result["ids"], result["documents"], [sorted(m.items()) for m in result["metadatas"]]))
+
+
+def _query(collection: MmapCollection, queries: np.ndarray, k: int = 5, where=None):
+    result = collection.query(query_embeddings=queries, n_results=k, where=where)
+    return result["ids"], np.round(result["distances"], 5).tolist()
+
+
+def _written(tmp_path, **options) -> MmapCollection:
+    collection = MmapCollection(str(tmp_path), **options)
+    vectors = _vectors(40)
+    collection.add(*_rows(30), embeddings=vectors[:30])
+    collection.upsert(*_rows(10, start=25), embeddings=vectors[30:])
+    collection.delete(ids=["doc-3", "doc-27"])
+    collection.update(["doc-5", "doc-30"], [{"page": 500, "reviewed": True}, {"reviewed": False}])
+    return collection
+
+
+def test_reopening_replays_the_log(tmp_path):
+    collection = _written(tmp_path)
+    queries = _vectors(4, seed=1)
+    before = (_contents(collection), _query(collection, queries), collection.count())
+    collection.close()
+
+    reopened = MmapCollection(str(tmp_path))
+    assert (_contents(reopened), _query(reopened, queries), reopened.count()) == before
+    assert reopened.count() == 33
+    assert reopened.get(ids=["doc-5"])["metadatas"] == [{"file_id": "file-2", "page": 500, "in_file_file-2": True, "reviewed": True}]
+    reopened.close()
+
+
+def test_compaction_keeps_ids_documents_and_metadata(tmp_path):
+    collection = _written(tmp_path)
+    queries = _vectors(4, seed=1)
+    before = (_contents(collection), _query(collection, queries))
+
+    collection.compact()
+    assert (_contents(collection), _query(collection, queries)) == before
+
+    # Rows of the snapshot updated or deleted after it, then compacted again
+    collection.update(["doc-7"], [{"page": 700}])
+    collection.delete(ids=["doc-8"])
+    collection.compact()
+    collection.close()
+
+    reopened = MmapCollection(str(tmp_path))
+    assert reopened.get(ids=["doc-7"])["metadatas"][0]["page"] == 700
+    assert reopened.get(ids=["doc-8"])["ids"] == []
+    assert len(_contents(reopened)) == 32
+    reopened.close()
+
+
+def test_writes_during_compaction_are_kept(tmp_path):
+    collection = _written(tmp_path)
+    write_snapshot = collection._write_snapshot
+    queried = []
+
+    def write_snapshot_while_writing(snapshot, state):
+        # Searches are not held up by the compaction
+        search = threading.Thread(target=lambda: queried.append(_query(collection, _vectors(1, seed=2))))
+        search.start()
+        search.join(timeout=5)
+        vectors = _vectors(5, seed=3)
+        collection.upsert(*_rows(5, start=100), embeddings=vectors)
+        collection.upsert(["doc-0"], ["Document 0, revised"], [{"file_id": "file-0", "page": 0}], embeddings=vectors[:1])
+        collection.delete(ids=["doc-101", "doc-4"])
+        collection.update(["doc-6", "doc-102"], [{"page": 600}, {"page": 1020}])
+        return write_snapshot(snapshot, state)
+
+    collection._write_snapshot = write_snapshot_while_writing
+    collection.compact()
+    collection._write_snapshot = write_snapshot
+    assert queried
+
+    expected = _contents(collection)
+    queries = _vectors(4, seed=1)
+    results = _query(collection, queries)
+    assert collection.get(ids=["doc-0"])["documents"] == ["Document 0, revised"]
+    assert collection.get(ids=["doc-101", "doc-4"])["ids"] == []
+    assert collection.get(ids=["doc-6", "doc-102"])["metadatas"][0]["page"] == 600
+    assert collection.get(ids=["doc-102"])["metadatas"][0]["page"] == 1020
+    collection.close()
+
+    reopened = MmapCollection(str(tmp_path))
+    assert _contents(reopened) == expected
+    assert _query(reopened, queries) == results
+    reopened.close()
+
+
+def test_compaction_runs_in_the_background_once_due(tmp_path):
+    collection = MmapCollection(str(tmp_path), compact_every=10)
+    collection.add(*_rows(12), embeddings=_vectors(12))
+    collection._compaction.join()
+    assert collection._generation == 1
+    assert collection.count() == 12
+    collection.close()
+
+
+def test_where_filters(tmp_path):
+    collection = _written(tmp_path)
+    collection.compact()
+    # Written after the snapshot: overrides the snapshot columns of doc-1
+    collection.upsert(["doc-1"], ["Document 1"], [{"file_id": "file-9", "page": 1, "in_file_file-9": True}], embeddings=_vectors(1))
+
+    def ids(where):
+        return sorted(collection.get(where=where)["ids"], key=lambda doc_id: int(doc_id.split("-")[1]))
+
+    assert ids({"page": {"$in": [1, 2, 500]}}) == ["doc-1", "doc-2", "doc-5"]
+    assert ids({"$or": [{"in_file_file-9": True}, {"in_file_file-0": True}]}) == [
+        "doc-0", "doc-1", "doc-6", "doc-9", "doc-12", "doc-15", "doc-18", "doc-21", "doc-24", "doc-30", "doc-33"
+    ]
+    assert "doc-1" not in ids({"file_id": "file-1"})
+    assert ids({"$and": [{"file_id": "file-2"}, {"page": {"$gte": 20}}]}) == ["doc-5", "doc-20", "doc-23", "doc-26", "doc-29", "doc-32"]
+    assert ids({"reviewed": False}) == ["doc-30"]
+    # True is not 1
+    assert ids({"in_file_file-9": 1}) == []
+
+    hits = collection.query(query_embeddings=_vectors(1, seed=1), n_results=50, where={"in_file_file-9": True})
+    assert hits["ids"] == [["doc-1"]]
+    collection.close()
+
+
+def _corpus(n: int = 400, seed: int = 0):
+    # Clustered, so that nearest neighbours are well separated
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(20, DIM))
+    vectors = centers[rng.integers(0, 20, size=n)] + 0.3 * rng.normal(size=(n, DIM))
+    queries = vectors[rng.choice(n, size=10, replace=False)] + 0.05 * rng.normal(size=(10, DIM))
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+def _exact(tmp_path, vectors: np.ndarray) -> MmapCollection:
+    collection = MmapCollection(str(tmp_path / "exact"), ivf_threshold=10 ** 9)
+    collection.add(*_rows(len(vectors)), embeddings=vectors)
+    return collection
+
+
+def test_ivf_search_matches_the_exact_scan(tmp_path):
+    vectors, queries = _corpus()
+    exact = _exact(tmp_path, vectors)
+    collection = MmapCollection(str(tmp_path / "ivf"), ivf_threshold=100, nprobe=4096)
+    collection.add(*_rows(len(vectors)), embeddings=vectors)
+    collection.compact()
+    assert collection.describe()["ivf_lists"] == 20
+    # Rows added after the IVF index was built are searched too
+    collection.add(["late"], ["Late"], [{"page": -1}], embeddings=queries[:1])
+
+    expected_ids, _ = _query(exact, queries)
+    ids, _ = _query(collection, queries)
+    assert ids[0] == ["late"] + expected_ids[0][:4]
+    assert ids[1:] == expected_ids[1:]
+    assert _query(collection, queries, where={"file_id": "file-1"}) == _query(exact, queries, where={"file_id": "file-1"})
+
+    # With too few rows in the probed lists, filtered queries scan every match
+    collection.nprobe = 1
+    assert _query(collection, queries[1:], k=50, where={"file_id": "file-1"})[0] == _query(exact, queries[1:], k=50, where={"file_id": "file-1"})[0]
+    exact.close()
+    collection.close()
+
+
+@pytest.mark.parametrize("options", [{"kind": "int8"}, {"kind": "pq", "pq_subvectors": 8}, {"kind": "int8", "pca_dim": 12}])
+def test_compressed_search_matches_the_exact_scan(tmp_path, options):
+    vectors, queries = _corpus()
+    exact = _exact(tmp_path, vectors)
+    collection = MmapCollection(str(tmp_path / "compressed"), rescore_factor=10)
+    collection.add(*_rows(len(vectors)), embeddings=vectors)
+
+    described = collection.train_compression(**options)
+    assert described["compression"]["kind"] == options["kind"]
+    assert _query(collection, queries) == _query(exact, queries)
+
+    # Rows added after training are encoded too, and the codes survive reopening
+    collection.add(["late"], ["Late"], [{}], embeddings=queries[:1])
+    collection.close()
+    reopened = MmapCollection(str(tmp_path / "compressed"), rescore_factor=10)
+    assert reopened.describe()["compression"]["kind"] == options["kind"]
+    assert _query(reopened, queries[:1], k=1)[0] == [["late"]]
+    exact.close()
+    reopened.close()
+
+
+def test_mismatched_dimensions_are_rejected(tmp_path):
+    collection = MmapCollection(str(tmp_path))
+    collection.add(*_rows(2), embeddings=_vectors(2))
+    with pytest.raises(ValueError):
+        collection.add(["other"], ["Other"], [{}], embeddings=np.ones((1, DIM + 1)))
+    collection.close()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from app.services.quantization import Compressor
+
+
+def _unit_vectors(n: int = 600, dim: int = 32, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("options", [
+    {"kind": "int8"},
+    {"kind": "int8", "pca_dim": 16},
+    {"kind": "pq", "pq_subvectors": 8},
+    {"kind": "pq", "pca_dim": 16, "pq_subvectors": 4}
+])
+def test_save_and_load_round_trip(tmp_path, options):
+    vectors = _unit_vectors()
+    compressor = Compressor(**options).fit(vectors)
+    path = str(tmp_path / "compressor.npz")
+    compressor.save(path)
+
+    loaded = Compressor.load(path)
+    assert loaded.describe() == compressor.describe()
+    codes = compressor.encode(vectors)
+    assert np.array_equal(loaded.encode(vectors), codes)
+    queries = vectors[:3]
+    assert np.allclose(loaded.scores(loaded.prepare(queries), codes), compressor.scores(compressor.prepare(queries), codes))
+
+
+@pytest.mark.parametrize("options, code_bytes", [({"kind": "int8"}, 32), ({"kind": "int8", "pca_dim": 8}, 8), ({"kind": "pq", "pq_subvectors": 4}, 4)])
+def test_codes_take_code_bytes_per_vector(options, code_bytes):
+    compressor = Compressor(**options).fit(_unit_vectors())
+    assert compressor.code_bytes == code_bytes
+    assert compressor.encode(_unit_vectors(5, seed=1)).shape == (5, code_bytes)
+
+
+def test_int8_scores_rank_like_the_inner_product():
+    vectors = _unit_vectors()
+    compressor = Compressor("int8").fit(vectors)
+    queries = _unit_vectors(5, seed=1)
+    scores = compressor.scores(compressor.prepare(queries), compressor.encode(vectors))
+    exact = queries @ vectors.T
+    for approximate, true in zip(scores, exact):
+        assert np.argmax(true) in np.argsort(-approximate)[:5]
+
+
+def test_unknown_kind_is_rejected():
+    with pytest.raises(ValueError, match="Unknown compression"):
+        Compressor("int4")
+
+
+@pytest.mark.parametrize("pca_dim", [32, 64])
+def test_pca_dim_must_be_below_the_dimension(pca_dim):
+    with pytest.raises(ValueError, match="pca_dim"):
+        Compressor("int8", pca_dim=pca_dim).fit(_unit_vectors())
+
+
+@pytest.mark.parametrize("options", [{"pq_subvectors": 5}, {"pca_dim": 12, "pq_subvectors": 8}])
+def test_pq_subvectors_must_divide_the_dimension(options):
+    with pytest.raises(ValueError, match="pq_subvectors"):
+        Compressor("pq", **options).fit(_unit_vectors())
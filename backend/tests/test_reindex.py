@@ -0,0 +1,70 @@
+import asyncio
+import os
+import time
+
+from benchmarks.bench_suite import HashingEmbeddingFunction
+from tests.conftest import make_services, wait_for_job
+
+
+class OtherModel(HashingEmbeddingFunction):
+    model_name = "bench-hashing-small"
+
+
+def _store_chunks(services, count: int = 12) -> None:
+    services.vector_store.upsert(
+        [f"Fact number {i}: the launch code of site {i} is {i * 7919}." for i in range(count)],
+        [{"source": "facts.pdf", "file_id": "facts", "page": i + 1, "chunk_type": "text"} for i in range(count)]
+    )
+
+
+def _reindex(services, dim: int = 128) -> dict:
+    services._embedding_functions[OtherModel.model_name] = OtherModel(dim=dim, cache=services.embedding_cache)
+    job = services.job_queue.submit("reindex", {"model": OtherModel.model_name})
+    return wait_for_job(services, job["job_id"])
+
+
+def test_reindex_swaps_the_alias_and_serves_the_new_model(services):
+    _store_chunks(services)
+    job = _reindex(services)
+    assert job["status"] == "completed", job.get("error")
+    assert job["result"]["chunks"] == 12
+
+    alias = services.index_alias
+    assert (alias.generation, alias.model, alias.dimension) == (1, OtherModel.model_name, 128)
+    assert alias.retired == [0]
+    assert services.embedding_function.model_name == OtherModel.model_name
+    assert services.vector_store.generation == 1
+    assert services.vector_store.count() == 12
+    hits = services.vector_store.query(services.embedding_function(["launch code of site 3"])[0], n_results=3)
+    assert len(hits) == 3
+
+
+def test_replaced_collections_are_dropped_later_without_holding_the_job(services, settings):
+    settings.REINDEX_RETIRE_SECONDS = 0.5
+    _store_chunks(services)
+    old = os.path.join(settings.VECTOR_DB_DIR, services.collection_name("default", 0))
+    assert os.path.isdir(old)
+
+    started = time.monotonic()
+    job = _reindex(services)
+    assert job["status"] == "completed", job.get("error")
+    assert job["result"]["retiring"] == 0
+    assert os.path.isdir(old)
+
+    deadline = started + 10
+    while services.index_alias.retired and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert services.index_alias.retired == []
+    assert not os.path.isdir(old)
+
+
+def test_close_drops_collections_still_waiting_to_be_retired(settings):
+    settings.REINDEX_RETIRE_SECONDS = 3600
+    services = make_services(settings)
+    _store_chunks(services)
+    job = _reindex(services)
+    assert job["status"] == "completed", job.get("error")
+    assert services.index_alias.retired == [0]
+
+    asyncio.run(services.close())
+    assert services.index_alias.retired == []
@@ -0,0 +1,85 @@
+from app.services.chunking import count_tokens
+from app.services.reranker import LexicalReranker, RerankStage, Reranker
+
+QUERY = "how often is the pump serviced"
+DOCUMENTS = [
+    "The warranty covers two years.",
+    "The pump is serviced every six months by a technician.",
+    "Pump housings are cast iron.",
+    "Service the fan yearly.",
+    "How often the pump is serviced depends on the load, see the schedule for how often each pump is serviced.",
+]
+IDS = [f"c{i}" for i in range(len(DOCUMENTS))]
+
+
+class _CountingReranker(Reranker):
+    """Pairwise reranker scoring passages by length, counting what it is asked to score."""
+
+    name = "counting"
+
+    def __init__(self, fail: bool = False):
+        self.scored = []
+        self.fail = fail
+
+    def score(self, query, passages):
+        if self.fail:
+            raise RuntimeError("model crashed")
+        self.scored.extend(passages)
+        return [float(len(p)) for p in passages]
+
+
+def test_over_fetched_candidates_are_cut_to_k():
+    stage = RerankStage(reranker=None)
+    selected, stats = stage.rerank(QUERY, IDS, DOCUMENTS, k=2)
+
+    assert [IDS[i] for i in selected] == ["c4", "c1"]
+    assert stats["reranker"] == "lexical"
+    assert stats["candidates"] == 5
+    assert stats["context_tokens"] == count_tokens(DOCUMENTS[4]) + count_tokens(DOCUMENTS[1])
+
+
+def test_passages_that_overflow_the_token_budget_are_skipped():
+    stage = RerankStage(reranker=None)
+    budget = count_tokens(DOCUMENTS[4]) + count_tokens(DOCUMENTS[2])
+    selected, stats = stage.rerank(QUERY, IDS, DOCUMENTS, k=3, max_tokens=budget)
+
+    # c1 ranks second but no longer fits; the shorter c2 still does
+    assert [IDS[i] for i in selected] == ["c4", "c2"]
+    assert stats["context_tokens"] <= budget
+
+    # The best passage is kept even when it alone is over budget
+    selected, _ = stage.rerank(QUERY, IDS, DOCUMENTS, k=3, max_tokens=1)
+    assert [IDS[i] for i in selected] == ["c4"]
+
+
+def test_pairwise_scores_are_cached_per_query_and_chunk():
+    reranker = _CountingReranker()
+    stage = RerankStage(reranker=reranker, batch_size=2)
+    first, stats = stage.rerank(QUERY, IDS, DOCUMENTS, k=2)
+    assert stats == dict(stats, reranker="counting", scored=5, cache_hits=0)
+
+    # The same question cased and spaced differently, with one new candidate
+    second, stats = stage.rerank("How often is the pump  serviced?", IDS[:3] + ["c9"], DOCUMENTS[:3] + ["New."], k=2)
+    assert stats["cache_hits"] == 3 and stats["scored"] == 1
+    assert reranker.scored[-1] == "New."
+    assert [IDS[i] for i in first] == ["c4", "c1"]
+    assert stage.stats()["hits"] == 3
+
+
+def test_a_failing_reranker_falls_back_to_lexical():
+    stage = RerankStage(reranker=_CountingReranker(fail=True))
+    selected, stats = stage.rerank(QUERY, IDS, DOCUMENTS, k=1)
+    assert stats["reranker"] == LexicalReranker.name
+    assert [IDS[i] for i in selected] == ["c4"]
+
+
+def test_retrieval_over_fetches_before_reranking(services):
+    texts = [f"Section {i}: the valve in bay {i} is checked during the audit." for i in range(30)]
+    texts[17] = "Section 17: the pump is serviced every six months."
+    services.vector_store.upsert(texts, [{"source": "manual.pdf", "file_id": "manual", "page": i + 1} for i in range(30)])
+
+    result = services.retriever.retrieve_context(QUERY, n_results=3)
+
+    assert result["rerank"]["candidates"] == 30
+    assert len(result["chunk_ids"]) <= 3
+    assert "serviced every six months" in result["context"]
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from app.services.ingestion import misplaced_files
+from app.services.shards import ShardRouter, check_tenant, shard_names
+from tests.conftest import wait_for_job
+from tests.test_upload import _pdf, _upload
+
+
+def test_tenant_names_are_checked():
+    assert check_tenant(None) == "default"
+    assert check_tenant("acme-eu_1") == "acme-eu_1"
+    for name in ("x y", "-acme", "acme/../x", "a" * 41, "acme."):
+        with pytest.raises(ValueError):
+            check_tenant(name)
+
+
+def test_files_are_placed_stably_over_the_configured_shards():
+    router = ShardRouter(open_shard=None, placement={"acme": 4})
+    assert router.configured("globex") == ["globex"]
+    assert router.configured("acme") == shard_names("acme", 4) == ["acme.0", "acme.1", "acme.2", "acme.3"]
+    placed = {router.place("acme", f"file-{i}") for i in range(40)}
+    assert placed == set(router.configured("acme"))
+    assert all(router.place("acme", f"file-{i}") == router.place("acme", f"file-{i}") for i in range(40))
+    router.close()
+
+
+def test_rebalancing_moves_files_to_their_placement(settings, services, client, tmp_path):
+    # Read when the shard router is first built
+    settings.VECTOR_SHARDS = {"acme": 1}
+
+    async def upload_all():
+        return [(await _upload(client, _pdf(tmp_path, seed), tenant="acme")).json() for seed in range(3)]
+
+    for uploaded in asyncio.run(upload_all()):
+        assert wait_for_job(services, uploaded["job_id"])["status"] == "completed"
+    router = services.shard_router
+    chunks = router.store("acme").count()
+    assert chunks > 0 and misplaced_files(services) == []
+    assert router.store("default").count() == 0
+    before = router.lexical_search("acme", "ERR-0000", 1000)
+
+    router.placement = {"acme": 3}
+    assert len(misplaced_files(services)) == 3
+    # Until rebalanced, queries still search the shard the files are in
+    assert "acme" in router.shards("acme")
+
+    job = wait_for_job(services, services.job_queue.submit("shard_rebalance", {})["job_id"])
+    assert job["status"] == "completed", job.get("error")
+    assert job["result"]["files_moved"] == 3
+
+    assert misplaced_files(services) == []
+    assert {record["shard"] for record in services.file_registry.files(tenant="acme")} <= {"acme.0", "acme.1", "acme.2"}
+    assert router.shards("acme") == ["acme.0", "acme.1", "acme.2"]
+    assert sum(router.store(shard).count() for shard in router.shards("acme")) == chunks
+    assert router.store("acme").count() == 0
+    # Scores change with each shard's statistics, but the same chunks match
+    after = router.lexical_search("acme", "ERR-0000", 1000)
+    assert before and {doc_id for doc_id, _ in after} == {doc_id for doc_id, _ in before}
+    # Other tenants see none of it
+    assert router.lexical_search("globex", "ERR-0000", 1000) == []
@@ -0,0 +1,136 @@
+import asyncio
+import os
+
+import pytest
+
+from app.services import uploads
+from app.services.jobs import new_job_id
+from benchmarks.synthetic import synthetic_pdf
+from tests.conftest import wait_for_job
+
+
+def _pdf(tmp_path, seed: int = 0) -> bytes:
+    path = os.path.join(tmp_path, f"doc{seed}.pdf")
+    synthetic_pdf(path, 2, seed=seed)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _upload(client, body: bytes, tenant: str = None):
+    data = {"tenant": tenant} if tenant else None
+    return await client.post("/upload/pdf/", files={"file": ("doc.pdf", body, "application/pdf")}, data=data)
+
+
+def test_concurrent_identical_uploads_queue_one_job(services, client, tmp_path):
+    body = _pdf(tmp_path)
+
+    async def upload_twice():
+        return await asyncio.gather(_upload(client, body), _upload(client, body))
+
+    responses = [response.json() for response in asyncio.run(upload_twice())]
+    assert sorted(response["duplicate"] for response in responses) == [False, True]
+    assert len({response["job_id"] for response in responses}) == 1
+    assert len({response["file_id"] for response in responses}) == 1
+    assert wait_for_job(services, responses[0]["job_id"])["status"] == "completed"
+    assert [job["kind"] for job in services.job_queue.store.load_all()] == ["pdf"]
+
+
+def test_a_failed_job_is_retried_by_one_upload_only(services):
+    registry = services.file_registry
+    record, created = registry.claim("h1", "doc.pdf", "pdf", job_id="failed-job")
+    assert created and record["job_id"] == "failed-job"
+    first, second = new_job_id(), new_job_id()
+    assert registry.replace_job("h1", "failed-job", first)
+    assert not registry.replace_job("h1", "failed-job", second)
+    assert registry.get("h1")["job_id"] == first
+
+
+def test_files_can_only_be_deleted_by_their_tenant(services, client, tmp_path):
+    async def run():
+        uploaded = (await _upload(client, _pdf(tmp_path), tenant="acme")).json()
+        wait_for_job(services, uploaded["job_id"])
+        file_id = uploaded["file_id"]
+        return [
+            await client.delete(f"/files/{file_id}"),
+            await client.delete(f"/files/{file_id}", params={"tenant": "globex"}),
+            await client.delete(f"/files/{file_id}", params={"tenant": "acme"})
+        ]
+
+    default, other, owner = asyncio.run(run())
+    assert (default.status_code, other.status_code, owner.status_code) == (404, 404, 200)
+    assert services.file_registry.files(tenant="acme") == []
+
+
+def test_an_aborted_upload_is_deleted(services, client, tmp_path):
+    body = _pdf(tmp_path)
+
+    async def run():
+        session = (await client.post("/uploads/", json={"filename": "doc.pdf", "kind": "pdf", "size": len(body)})).json()
+        upload_id = session["upload_id"]
+        appended = await client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=body[:100])
+        return upload_id, [
+            appended,
+            await client.delete(f"/uploads/{upload_id}"),
+            await client.get(f"/uploads/{upload_id}"),
+            await client.delete(f"/uploads/{upload_id}")
+        ]
+
+    upload_id, responses = asyncio.run(run())
+    assert [response.status_code for response in responses] == [200, 200, 404, 404]
+    assert not any(name.startswith(upload_id) for name in os.listdir(services.resumable_uploads.directory))
+
+
+def test_stale_upload_sessions_are_swept(services):
+    resumable = services.resumable_uploads
+    stale = resumable.create("old.pdf", "pdf", 1000)["upload_id"]
+    fresh = resumable.create("new.pdf", "pdf", 1000)["upload_id"]
+    # A part file whose session was completed by a process that then crashed
+    orphan = os.path.join(resumable.directory, "0d7c1e52.part")
+    open(orphan, "wb").close()
+    long_ago = os.path.getmtime(orphan) - 7200
+    for path in (*resumable._paths(stale), orphan):
+        os.utime(path, (long_ago, long_ago))
+
+    assert resumable.sweep(3600) == 2
+    assert resumable.get(stale) is None
+    assert resumable.get(fresh) is not None
+    assert not os.path.exists(orphan)
+    assert resumable.sweep(0) == 0
+
+
+def test_chunks_of_one_upload_are_written_one_at_a_time(services, tmp_path):
+    resumable = services.resumable_uploads
+    body = _pdf(tmp_path)
+    upload_id = resumable.create("doc.pdf", "pdf", len(body))["upload_id"]
+
+    async def run():
+        sent = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def slow_chunk():
+            yield body[:100]
+            sent.set()
+            await finish.wait()
+            yield body[100:200]
+
+        async def chunk(data):
+            yield data
+
+        first = asyncio.create_task(resumable.append(upload_id, 0, slow_chunk()))
+        await sent.wait()
+        with pytest.raises(uploads.UploadConflict, match="being written"):
+            await resumable.append(upload_id, 0, chunk(body[:100]))
+        with pytest.raises(uploads.UploadConflict):
+            resumable.discard(upload_id)
+        finish.set()
+        offset = (await first)["offset"]
+        with pytest.raises(uploads.UploadConflict, match="Offset mismatch"):
+            await resumable.append(upload_id, 100, chunk(body[100:200]))
+        return offset, await resumable.append(upload_id, 200, chunk(body[200:]))
+
+    offset, session = asyncio.run(run())
+    assert offset == 200
+    assert session["offset"] == len(body)
+    _, part_path = resumable.complete(upload_id)
+    with open(part_path, "rb") as f:
+        assert f.read() == body
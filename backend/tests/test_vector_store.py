@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+from app.services import dedup
+from app.services.embedding import EmbeddingError
+from app.services.vector_store import WriteBuffer
+
+TEXTS = [f"Section {i}: the pump must be serviced every {i + 2} months." for i in range(5)]
+
+
+def _metadatas(file_id: str, ingested_at: str):
+    return [
+        {"source": f"{file_id}.pdf", "file_id": file_id, "page": i + 1, "chunk_type": "text", "ingested_at": ingested_at}
+        for i in range(len(TEXTS))
+    ]
+
+
+def _embedded_texts(services) -> int:
+    return services.embedding_cache.stats()["misses"]
+
+
+def test_reingesting_a_file_changes_nothing(services):
+    store = services.vector_store
+    assert store.upsert(TEXTS, _metadatas("manual", "2024-01-01T00:00:00")) == 5
+    before = {cid: metadata for ids, _, metadatas in store.iter_documents() for cid, metadata in zip(ids, metadatas)}
+    misses = _embedded_texts(services)
+
+    assert store.upsert(TEXTS, _metadatas("manual", "2024-06-01T00:00:00")) == 0
+    after = {cid: metadata for ids, _, metadatas in store.iter_documents() for cid, metadata in zip(ids, metadatas)}
+    assert after == before
+    assert store.count() == 5
+    assert _embedded_texts(services) == misses
+
+
+def test_the_same_text_in_another_file_shares_its_vector(services):
+    store = services.vector_store
+    store.upsert(TEXTS, _metadatas("manual", "2024-01-01T00:00:00"))
+    assert store.upsert(TEXTS[:2], _metadatas("manual-copy", "2024-02-01T00:00:00")[:2]) == 0
+    assert store.count() == 5
+
+    shared = {cid: metadata for ids, _, metadatas in store.iter_documents() for cid, metadata in zip(ids, metadatas)}
+    refs = [dedup.file_ids(shared[dedup.chunk_id(text)]) for text in TEXTS]
+    assert refs[:2] == [["manual", "manual-copy"]] * 2
+    assert refs[2:] == [["manual"]] * 3
+
+
+class _Store:
+    """Upserts into a dict; rejects rows whose metadata is marked bad, or everything when down."""
+
+    def __init__(self):
+        self.rows = {}
+        self.calls = 0
+        self.error = None
+
+    def upsert(self, documents, metadatas):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        if any(metadata.get("bad") for metadata in metadatas):
+            raise ValueError("Expected metadata value to be a str, int, float or bool")
+        self.rows.update(zip(documents, metadatas))
+        return len(documents)
+
+
+def _buffer(tmp_path, store):
+    return WriteBuffer(store, str(tmp_path / "buffer.jsonl"), max_items=10 ** 6, max_delay=3600)
+
+
+def test_rows_the_store_rejects_are_set_aside(tmp_path):
+    store = _Store()
+    buffer = _buffer(tmp_path, store)
+    texts = [f"chunk {i}" for i in range(16)]
+    buffer.add(texts, [{"bad": i in (3, 11)} for i in range(16)])
+
+    assert buffer.flush() == 14
+    assert sorted(store.rows) == sorted(t for i, t in enumerate(texts) if i not in (3, 11))
+    assert len(buffer) == 0
+    with open(tmp_path / "buffer.jsonl.rejected") as f:
+        rejected = [json.loads(line) for line in f]
+    assert [row["document"] for row in rejected] == ["chunk 3", "chunk 11"]
+    assert "metadata value" in rejected[0]["error"]
+
+    # Later writes are not held up, and the rejected rows are not replayed
+    buffer.add(["chunk 16"], [{}])
+    assert buffer.flush() == 1
+    buffer.close()
+    assert len(_buffer(tmp_path, store)) == 0
+
+
+@pytest.mark.parametrize("error", [EmbeddingError("Embedding request failed: HTTP 503"), OSError("disk I/O error")])
+def test_rows_stay_pending_while_the_store_is_down(tmp_path, error):
+    store = _Store()
+    buffer = _buffer(tmp_path, store)
+    buffer.add([f"chunk {i}" for i in range(8)], [{} for _ in range(8)])
+
+    store.error = error
+    with pytest.raises(type(error)):
+        buffer.flush()
+    assert len(buffer) == 8
+    assert not (tmp_path / "buffer.jsonl.rejected").exists()
+    # Embedding failures are not split up; other errors are, until nothing succeeds
+    assert (store.calls == 1) if isinstance(error, EmbeddingError) else (store.calls > 1)
+
+    store.error = None
+    buffer.close()
+    assert len(store.rows) == 8
@@ -1,9 +1,8 @@
 import streamlit as st
 import requests
-import os
+import json
 import time
-from typing import List, Dict
-import tempfile
+from typing import Dict
 
 # Configuration
 BACKEND_URL = "http://localhost:8000"
@@ -11,38 +10,162 @@ BACKEND_URL = "http://localhost:8000"
 st.set_page_config(page_title="Multimodal RAG Application", layout="wide")
 
 def display_source(source: Dict):
+    label = f"[{source['citation']}] " if source.get('citation') else ""
     if source['type'] == "pdf":
+        pages = source['page']
+        if source.get('page_end', pages) != pages:
+            pages = f"{pages}-{source['page_end']}"
         st.markdown(f"""
-        **PDF Source**: {source['source']}  
-        **Page**: {source['page']}  
+        **{label}PDF Source**: {source['source']}  
+        **Page**: {pages}  
         **Preview**: {source['content']}
         """)
     else:
         st.markdown(f"""
-        **Video Source**: {source['source']}  
+        **{label}Video Source**: {source['source']}  
         **Timestamp**: {source['timestamp']}  
         **Preview**: {source['content']}
         """)
 
+JOB_POLL_INTERVAL = 1.0
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_RETRIES = 5
+
+def describe_progress(job: Dict) -> str:
+    progress = job.get("progress", {})
+    parts = [f"Stage: {job.get('stage', 'queued')}"]
+    if "pages_total" in progress:
+        parts.append(f"pages {progress.get('pages_done', 0)}/{progress['pages_total']}")
+    if "chunks_total" in progress:
+        parts.append(f"chunks {progress.get('chunks_done', 0)}/{progress['chunks_total']}")
+    return " | ".join(parts)
+
+def wait_for_job(job_id: str) -> Dict:
+    """Poll the backend until the ingestion job finishes."""
+    status_text = st.empty()
+    progress_bar = st.progress(0)
+    while True:
+        job = requests.get(f"{BACKEND_URL}/jobs/{job_id}").json()
+        progress = job.get("progress", {})
+        if progress.get("pages_total"):
+            done, total = progress.get("pages_done", 0), progress["pages_total"]
+        else:
+            done, total = progress.get("chunks_done", 0), progress.get("chunks_total") or 0
+        if total:
+            progress_bar.progress(min(done / total, 1.0))
+        status_text.text(describe_progress(job))
+        if job.get("status") in ("completed", "failed"):
+            if job["status"] == "completed":
+                progress_bar.progress(1.0)
+            return job
+        time.sleep(JOB_POLL_INTERVAL)
+
+def upload_file(file, endpoint: str) -> Dict:
+    files = {"file": file}
+    response = requests.post(f"{BACKEND_URL}/upload/{endpoint}/", files=files)
+    result = response.json()
+    if "job_id" in result:
+        result["job"] = wait_for_job(result["job_id"])
+    return result
+
+def upload_resumable(file, kind: str) -> Dict:
+    """
+    Send a large file in chunks, resuming from the server's offset after a
+    dropped connection instead of starting over.
+    """
+    session = requests.post(
+        f"{BACKEND_URL}/uploads/",
+        json={"filename": file.name, "kind": kind, "size": file.size}
+    )
+    session.raise_for_status()
+    upload_id = session.json()["upload_id"]
+
+    progress_bar = st.progress(0.0)
+    offset = 0
+    retries = 0
+    while offset < file.size:
+        file.seek(offset)
+        chunk = file.read(UPLOAD_CHUNK_SIZE)
+        try:
+            response = requests.put(
+                f"{BACKEND_URL}/uploads/{upload_id}",
+                params={"offset": offset},
+                data=chunk,
+                headers={"Content-Type": "application/octet-stream"},
+                timeout=120
+            )
+            if response.status_code == 409:
+                offset = requests.get(f"{BACKEND_URL}/uploads/{upload_id}").json()["offset"]
+                continue
+            response.raise_for_status()
+            offset = response.json()["offset"]
+            retries = 0
+        except requests.exceptions.ConnectionError:
+            retries += 1
+            if retries > UPLOAD_MAX_RETRIES:
+                raise
+            time.sleep(2 ** retries)
+            offset = requests.get(f"{BACKEND_URL}/uploads/{upload_id}").json()["offset"]
+        progress_bar.progress(min(offset / file.size, 1.0))
+
+    result = requests.post(f"{BACKEND_URL}/uploads/{upload_id}/complete").json()
+    if "job_id" in result:
+        result["job"] = wait_for_job(result["job_id"])
+    return result
+
 def upload_pdf(file):
     with st.spinner("Processing PDF..."):
-        files = {"file": file}
-        response = requests.post(f"{BACKEND_URL}/upload/pdf/", files=files)
-        return response.json()
+        return upload_file(file, "pdf")
 
 def upload_video(file):
     with st.spinner("Processing Video..."):
-        files = {"file": file}
-        response = requests.post(f"{BACKEND_URL}/upload/video/", files=files)
-        return response.json()
-
-def query_rag(question: str):
-    with st.spinner("Searching for answers..."):
-        response = requests.post(
-            f"{BACKEND_URL}/query/",
-            json={"question": question}
-        )
-        return response.json()
+        return upload_resumable(file, "video")
+
+def show_upload_result(label: str, result: Dict):
+    job = result.get("job", {})
+    if "file_id" not in result:
+        st.error(f"{label} upload rejected: {result.get('detail', result)}")
+    elif job.get("status") == "failed":
+        st.error(f"{label} processing failed: {job.get('error')}")
+    else:
+        st.success(f"{label} processed successfully! File ID: {result['file_id']}")
+
+def iter_sse(response):
+    """Parse a server-sent event stream into (event, data) pairs."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+def stream_query(question: str):
+    """Render the answer token by token as the backend streams it."""
+    with requests.post(
+        f"{BACKEND_URL}/query/stream",
+        json={"question": question},
+        stream=True,
+        timeout=120
+    ) as response:
+        response.raise_for_status()
+        st.subheader("Answer")
+        answer_box = st.empty()
+        answer = ""
+        sources = []
+        for event, data in iter_sse(response):
+            if event == "sources":
+                sources = data
+            elif event == "token":
+                answer += data
+                answer_box.markdown(answer + "▌")
+            elif event == "error":
+                st.error(f"Error: {data}")
+        answer_box.markdown(answer)
+    return sources
 
 def main():
     st.title("Multimodal RAG Application")
@@ -57,14 +180,14 @@ def main():
             pdf_file = st.file_uploader("Choose a PDF file", type="pdf", key="pdf_uploader")
             if pdf_file:
                 result = upload_pdf(pdf_file)
-                st.success(f"PDF processed successfully! File ID: {result['file_id']}")
+                show_upload_result("PDF", result)
         
         with col2:
             st.subheader("Upload Video")
             video_file = st.file_uploader("Choose an MP4 file", type="mp4", key="video_uploader")
             if video_file:
                 result = upload_video(video_file)
-                st.success(f"Video processed successfully! File ID: {result['file_id']}")
+                show_upload_result("Video", result)
     
     # Query section
     st.divider()
@@ -73,13 +196,10 @@ def main():
     question = st.text_input("Enter your question about the uploaded content:")
     
     if question:
-        response = query_rag(question)
-        
-        st.subheader("Answer")
-        st.write(response['answer'])
+        sources = stream_query(question)
         
         st.subheader("Sources")
-        for source in response['sources']:
+        for source in sources:
             display_source(source)
             st.divider()
 